@@ -127,27 +127,20 @@ def archiveFieldsums(dir_path):
 
 
 
-def archiveDetections(captured_path, archived_path, ff_detected, config, extra_files=None):
-    """ Create thumbnails and compress all files with detections and the accompanying files in one archive.
+def makeArchiveImages(captured_path, file_list, config):
+    """ Generate the captured and detected thumbnail mosaics and a stack of detections.
 
     Arguments:
         captured_path: [str] Path where the captured files are located.
-        archived_path: [str] Path where the detected files will be archived to.
-        ff_detected: [str] A list of FF files with detections.
+        file_list: [list] A list of files selected for archiving (see selectFiles).
         config: [conf object] Configuration.
 
-    Keyword arguments:
-        extra_files: [list] A list of extra files (with fill paths) which will be be saved to the night 
-            archive.
-
     Return:
-        archive_name: [str] Name of the archive where the files were compressed to.
+        image_files: [list] A list of names of generated images in the captured directory.
 
     """
 
-    # Get the list of files to archive
-    file_list = selectFiles(captured_path, ff_detected)
-
+    image_files = []
     
     log.info('Generating thumbnails...')
 
@@ -161,8 +154,8 @@ def archiveDetections(captured_path, archived_path, ff_detected, config, extra_f
             file_list=sorted(file_list))
 
         # Add the detected mosaic file to the selected list
-        file_list.append(captured_mosaic_file)
-        file_list.append(detected_mosaic_file)
+        image_files.append(captured_mosaic_file)
+        image_files.append(detected_mosaic_file)
 
     except Exception as e:
         log.error('Generating thumbnails failed with error:' + repr(e))
@@ -183,7 +176,7 @@ def archiveDetections(captured_path, archived_path, ff_detected, config, extra_f
 
         # Make a co-added image of all detection. Filter out possible clouds
         stack_path, _ = stackFFs(captured_path, 'jpg', deinterlace=(config.deinterlace_order > 0), subavg=True, \
-            filter_bright=True, file_list=sorted(file_list), mask=mask)
+            filter_bright=True, file_list=sorted(file_list + image_files), mask=mask)
 
         if stack_path is not None:
 
@@ -193,7 +186,7 @@ def archiveDetections(captured_path, archived_path, ff_detected, config, extra_f
             stack_file = os.path.basename(stack_path)
             
             # Add the stack path to the list of files to put in the archive
-            file_list.append(stack_file)
+            image_files.append(stack_file)
 
         else:
             log.info("Stack could not be saved!")
@@ -204,6 +197,38 @@ def archiveDetections(captured_path, archived_path, ff_detected, config, extra_f
         log.error("".join(traceback.format_exception(*sys.exc_info())))
 
 
+    return image_files
+
+
+
+def archiveDetections(captured_path, archived_path, ff_detected, config, extra_files=None, make_images=True):
+    """ Create thumbnails and compress all files with detections and the accompanying files in one archive.
+
+    Arguments:
+        captured_path: [str] Path where the captured files are located.
+        archived_path: [str] Path where the detected files will be archived to.
+        ff_detected: [str] A list of FF files with detections.
+        config: [conf object] Configuration.
+
+    Keyword arguments:
+        extra_files: [list] A list of extra files (with fill paths) which will be be saved to the night 
+            archive.
+        make_images: [bool] Generate thumbnails and the stack of detections. True by default. If False, the
+            images are expected to have been made beforehand by makeArchiveImages, and they are archived as
+            any other image in the captured directory.
+
+    Return:
+        archive_name: [str] Name of the archive where the files were compressed to.
+
+    """
+
+    # Get the list of files to archive
+    file_list = selectFiles(captured_path, ff_detected)
+
+    # Generate thumbnails and the stack
+    if make_images:
+        file_list += makeArchiveImages(captured_path, file_list, config)
+
 
     if file_list:
 
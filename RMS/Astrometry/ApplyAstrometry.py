@@ -36,7 +36,8 @@ import numpy as np
 import scipy.optimize
 
 # from RMS.Formats.Platepar import Platepar
-from RMS.Astrometry.Conversions import date2JD, jd2Date, trueRaDec2ApparentAltAz, J2000_JD
+from RMS.Astrometry.Conversions import date2JDArray, datetimeOffsets2JD, jd2Date, \
+    trueRaDec2ApparentAltAz, J2000_JD
 from RMS.Astrometry.AtmosphericExtinction import atmosphericExtinctionCorrection
 from RMS.Formats.FTPdetectinfo import readFTPdetectinfo, writeFTPdetectinfo
 from RMS.Formats.FFfile import filenameToDatetime
@@ -52,6 +53,10 @@ if sys.version_info.major == 3:
     unicode = str
 
 
+# Number of progressively finer grids on which the vignetting coefficient is searched in the photometry fit
+PHOTOM_VIGNETTING_REFINE_ITERS = 6
+
+
 def correctVignetting(px_sum, radius, vignetting_coeff):
     """ Given a pixel sum, radius from focal plane centre and the vignetting coefficient, correct the pixel
         sum for the vignetting effect.
@@ -88,21 +93,15 @@ def extinctionCorrectionTrueToApparent(catalog_mags, ra_data, dec_data, jd, plat
     ### Compute star elevations above the horizon (epoch of date, true) ###
 
     # Compute elevation above the horizon
-    elevation_data = []
-    for ra, dec in zip(ra_data, dec_data):
-
-        # Compute elevation
-        _, elev = trueRaDec2ApparentAltAz(ra, dec, jd, platepar.lat, platepar.lon)
-
-        if elev < 0:
-            elev = 0
-
-        elevation_data.append(elev)
+    jd_data = np.zeros(len(ra_data)) + jd
+    _, elevation_data = trueRaDec2ApparentAltAz(np.array(ra_data, dtype=np.float64), \
+        np.array(dec_data, dtype=np.float64), jd_data, platepar.lat, platepar.lon)
+    elevation_data[elevation_data < 0] = 0
 
     ### ###
 
     # Correct catalog magnitudes for extinction
-    extinction_correction = atmosphericExtinctionCorrection(np.array(elevation_data), platepar.elev) \
+    extinction_correction = atmosphericExtinctionCorrection(elevation_data, platepar.elev) \
         - atmosphericExtinctionCorrection(90, platepar.elev)
     corrected_catalog_mags = np.array(catalog_mags) + platepar.extinction_scale*extinction_correction
 
@@ -117,7 +116,7 @@ def extinctionCorrectionApparentToTrue(mags, x_data, y_data, jd, platepar):
         mags: [list] A list of apparent magnitudes.
         x_data: [list] A list of pixel columns.
         y_data: [list] A list of pixel rows.
-        jd: [float] Julian date.
+        jd: [float or ndarray] Julian date, or an array with the Julian date of every point.
         platepar: [Platepar object]
     Return:
         corrected_mags: [list] A list of extinction corrected mangitudes.
@@ -126,26 +125,22 @@ def extinctionCorrectionApparentToTrue(mags, x_data, y_data, jd, platepar):
 
     ### Compute star elevations above the horizon (epoch of date, true) ###
 
-    # Compute RA/Dec in J2000
-    _, ra_data, dec_data, _ = xyToRaDecPP(len(x_data)*[jd2Date(jd)], x_data, y_data, len(x_data)*[1], \
-        platepar, extinction_correction=False)
-
-    # Compute elevation above the horizon
-    elevation_data = []
-    for ra, dec in zip(ra_data, dec_data):
+    jd_data = np.zeros(len(x_data)) + jd
 
-        # Compute elevation
-        _, elev = trueRaDec2ApparentAltAz(ra, dec, jd, platepar.lat, platepar.lon)
+    # Compute RA/Dec in J2000 (the time is converted to a date and back only once for every unique time)
+    jd_unique, jd_inverse = np.unique(jd_data, return_inverse=True)
+    time_data = np.array([jd2Date(jd_u) for jd_u in jd_unique]).reshape(-1, 7)[jd_inverse]
+    _, ra_data, dec_data, _ = xyToRaDecPP(time_data, x_data, y_data, np.ones(len(x_data)), platepar, \
+        extinction_correction=False)
 
-        if elev < 0:
-            elev = 0
-
-        elevation_data.append(elev)
+    # Compute elevation above the horizon
+    _, elevation_data = trueRaDec2ApparentAltAz(ra_data, dec_data, jd_data, platepar.lat, platepar.lon)
+    elevation_data[elevation_data < 0] = 0
 
     ### ###
 
     # Correct catalog magnitudes for extinction
-    extinction_correction = atmosphericExtinctionCorrection(np.array(elevation_data), platepar.elev) \
+    extinction_correction = atmosphericExtinctionCorrection(elevation_data, platepar.elev) \
         - atmosphericExtinctionCorrection(90, platepar.elev)
     corrected_mags = np.array(mags) - platepar.extinction_scale*extinction_correction
 
@@ -190,8 +185,36 @@ def photomLineMinimize(params, px_sum, radius, catalog_mags, fixed_vignetting):
 
 
 
+def photometryOffsetL1(px_intens_list, radius_list, catalog_mags, vignetting_coeffs):
+    """ Compute the photometric offset which minimizes the L1 norm of the residuals (i.e. the same function as
+        photomLineMinimize) for every given vignetting coefficient. As the slope is fixed to -2.5, the model
+        is linear in the offset and the L1 optimal offset is simply the median of the residuals with a zero
+        offset. All vignetting coefficients are evaluated at once.
+
+    Arguments:
+        px_intens_list: [ndarray] Sums of pixel intensities.
+        radius_list: [ndarray] Raddia from the focal plane centre (px).
+        catalog_mags: [ndarray] Corresponding catalog magnitudes of stars.
+        vignetting_coeffs: [ndarray] Vignetting coefficients for which the offset will be computed.
+    Return:
+        (photom_offsets, l1_norms):
+            photom_offsets: [ndarray] The L1 optimal photometric offset for every vignetting coefficient.
+            l1_norms: [ndarray] The sum of absolute residuals for every vignetting coefficient.
+    """
+
+    # Residuals with a zero photometric offset, one row for every vignetting coefficient
+    resids = catalog_mags + 2.5*np.log10(correctVignetting(px_intens_list[np.newaxis, :], \
+        radius_list[np.newaxis, :], vignetting_coeffs[:, np.newaxis]))
+
+    photom_offsets = np.median(resids, axis=1)
+    l1_norms = np.sum(np.abs(resids - photom_offsets[:, np.newaxis]), axis=1)
+
+    return photom_offsets, l1_norms
+
+
+
 def photometryFit(px_intens_list, radius_list, catalog_mags, fixed_vignetting=None):
-    """ Fit the photometry on given data.
+    """ Fit the photometry on given data. The L1 norm of the residuals is minimized.
 
     Arguments:
         px_intens_list: [list] A list of sums of pixel intensities.
@@ -209,22 +232,52 @@ def photometryFit(px_intens_list, radius_list, catalog_mags, fixed_vignetting=No
             fit_resid: [float] Magnitude fit residuals.
     """
 
-    # Fit a line to the star data, where only the intercept has to be estimated
-    p0 = [10.0, 0.0]
-    res = scipy.optimize.minimize(photomLineMinimize, p0, args=(np.array(px_intens_list), \
-        np.array(radius_list), np.array(catalog_mags), fixed_vignetting), method='Nelder-Mead')
-    photom_offset, vignetting_coeff = res.x
+    px_intens_list = np.array(px_intens_list, dtype=np.float64)
+    radius_list = np.array(radius_list, dtype=np.float64)
+    catalog_mags = np.array(catalog_mags, dtype=np.float64)
 
-    # Handle the vignetting coeff
-    vignetting_coeff = np.abs(vignetting_coeff)
-    if fixed_vignetting is not None:
+    # Use the initial guess if there are no stars
+    if len(catalog_mags) == 0:
+        photom_offset = 10.0
+        vignetting_coeff = 0.0
+
+    # Only fit the offset if the vignetting coefficient is fixed
+    elif fixed_vignetting is not None:
+        photom_offset = photometryOffsetL1(px_intens_list, radius_list, catalog_mags, \
+            np.array([fixed_vignetting], dtype=np.float64))[0][0]
         vignetting_coeff = fixed_vignetting
 
+    else:
+
+        # Search for the vignetting coefficient on progressively finer grids. The coefficient is limited so
+        #   that the vignetting angle at the largest radius is below 90 degrees
+        radius_max = np.max(radius_list)
+        vign_min = 0.0
+        vign_max = 0.999*(np.pi/2)/radius_max if radius_max > 0 else 0.0
+
+        grid_size = 101
+        for i in range(PHOTOM_VIGNETTING_REFINE_ITERS):
+
+            vignetting_coeffs = np.linspace(vign_min, vign_max, grid_size)
+            photom_offsets, l1_norms = photometryOffsetL1(px_intens_list, radius_list, catalog_mags, \
+                vignetting_coeffs)
+
+            best_index = np.argmin(l1_norms)
+
+            # Refine the grid around the best coefficient
+            vign_step = vignetting_coeffs[1] - vignetting_coeffs[0]
+            vign_min = max(vignetting_coeffs[best_index] - vign_step, 0.0)
+            vign_max = vignetting_coeffs[best_index] + vign_step
+            grid_size = 21
+
+        photom_offset = photom_offsets[best_index]
+        vignetting_coeff = vignetting_coeffs[best_index]
+
+
     photom_params = (photom_offset, vignetting_coeff)
 
     # Calculate the standard deviation
-    fit_resids = np.array(catalog_mags) - photomLine((np.array(px_intens_list), np.array(radius_list)), \
-        *photom_params)
+    fit_resids = catalog_mags - photomLine((px_intens_list, radius_list), *photom_params)
     fit_stddev = np.std(fit_resids)
 
     return photom_params, fit_stddev, fit_resids
@@ -272,6 +325,11 @@ def photometryFitRobust(px_intens_list, radius_list, catalog_mags, fixed_vignett
 
             # Reject all 2 sigma residuals and all larger than 1.0 mag, and re-fit the photometry
             filter_indices = (np.abs(fit_resid) < 2*fit_stddev) & (np.abs(fit_resid) < 1.0)
+
+            # Stop if all stars would be rejected (e.g. a perfect fit on a single star)
+            if not np.any(filter_indices):
+                break
+
             px_intens_list = px_intens_list[filter_indices]
             radius_list = radius_list[filter_indices]
             catalog_mags = catalog_mags[filter_indices]
@@ -477,19 +535,36 @@ def calculateMagnitudes(px_sum_arr, radius_arr, photom_offset, vignetting_coeff)
         magnitude_data: [ndarray] Apparent magnitude.
     """
 
-    magnitude_data = np.zeros_like(px_sum_arr, dtype=np.float64)
+    # Correct vignetting
+    px_sum_corr = correctVignetting(np.array(px_sum_arr, dtype=np.float64), np.array(radius_arr, \
+        dtype=np.float64), vignetting_coeff)
 
-    # Go through all levels of a meteor
-    for i, (px_sum, radius) in enumerate(zip(px_sum_arr, radius_arr)):
+    magnitude_data = -2.5*np.log10(px_sum_corr) + photom_offset
 
-        # Correct vignetting
-        px_sum_corr = correctVignetting(px_sum, radius, vignetting_coeff)
+    return magnitude_data
 
-        # Save magnitude data to the output array
-        magnitude_data[i] = -2.5*np.log10(px_sum_corr) + photom_offset
 
 
-    return magnitude_data
+def _xyToRaDecJDPP(JD_data, X_data, Y_data, level_data, platepar):
+    """ Convert image XY to RA, Dec and compute the apparent magnitudes, for the given Julian dates. See
+        xyToRaDecPP.
+    """
+
+    # Convert x,y to RA/Dec using a fast cython function
+    RA_data, dec_data = cyXYToRADec(JD_data, np.array(X_data, dtype=np.float64), \
+        np.array(Y_data, dtype=np.float64), float(platepar.lat), float(platepar.lon), float(platepar.X_res), \
+        float(platepar.Y_res), float(platepar.Ho), float(platepar.RA_d), float(platepar.dec_d), \
+        float(platepar.pos_angle_ref), float(platepar.F_scale), platepar.x_poly_fwd, platepar.y_poly_fwd, \
+        unicode(platepar.distortion_type), refraction=platepar.refraction, equal_aspect=platepar.equal_aspect,
+        force_distortion_centre=platepar.force_distortion_centre)
+
+    # Compute radiia from image centre
+    radius_arr = np.hypot(np.array(X_data) - platepar.X_res/2, np.array(Y_data) - platepar.Y_res/2)
+
+    # Calculate magnitudes
+    magnitude_data = calculateMagnitudes(level_data, radius_arr, platepar.mag_lev, platepar.vignetting_coeff)
+
+    return RA_data, dec_data, magnitude_data
 
 
 
@@ -516,25 +591,14 @@ def xyToRaDecPP(time_data, X_data, Y_data, level_data, platepar, extinction_corr
 
 
     # Convert time to Julian date
-    JD_data = np.array([date2JD(*time_data_entry) for time_data_entry in time_data], dtype=np.float64)
-
-    # Convert x,y to RA/Dec using a fast cython function
-    RA_data, dec_data = cyXYToRADec(JD_data, np.array(X_data, dtype=np.float64), \
-        np.array(Y_data, dtype=np.float64), float(platepar.lat), float(platepar.lon), float(platepar.X_res), \
-        float(platepar.Y_res), float(platepar.Ho), float(platepar.RA_d), float(platepar.dec_d), \
-        float(platepar.pos_angle_ref), float(platepar.F_scale), platepar.x_poly_fwd, platepar.y_poly_fwd, \
-        unicode(platepar.distortion_type), refraction=platepar.refraction, equal_aspect=platepar.equal_aspect,
-        force_distortion_centre=platepar.force_distortion_centre)
-
-    # Compute radiia from image centre
-    radius_arr = np.hypot(np.array(X_data) - platepar.X_res/2, np.array(Y_data) - platepar.Y_res/2)
+    JD_data = date2JDArray(time_data)
 
-    # Calculate magnitudes
-    magnitude_data = calculateMagnitudes(level_data, radius_arr, platepar.mag_lev, platepar.vignetting_coeff)
+    # Convert x,y to RA/Dec and compute the apparent magnitudes
+    RA_data, dec_data, magnitude_data = _xyToRaDecJDPP(JD_data, X_data, Y_data, level_data, platepar)
 
 
     # Extinction correction
-    if extinction_correction:
+    if extinction_correction and len(JD_data):
         magnitude_data = extinctionCorrectionApparentToTrue(magnitude_data, X_data, Y_data, JD_data[0], \
             platepar)
 
@@ -545,13 +609,16 @@ def xyToRaDecPP(time_data, X_data, Y_data, level_data, platepar, extinction_corr
 
 
 
-def raDecToXYPP(RA_data, dec_data, jd, platepar):
+def raDecToXYPP(RA_data, dec_data, jd, platepar, apparent=False):
     """ Converts RA, Dec to image coordinates, but the platepar is given instead of individual parameters.
     Arguments:
         RA: [ndarray] Array of right ascensions (degrees).
         dec: [ndarray] Array of declinations (degrees).
         jd: [float] Julian date.
         platepar: [Platepar structure] Astrometry parameters.
+    Keyword arguments:
+        apparent: [bool] The coordinates are already corrected for refraction, see 
+            eqRefractionTrueToApparent_vect. False by default.
     Return:
         (x, y): [tuple of ndarrays] Image X and Y coordinates.
     """
@@ -561,7 +628,8 @@ def raDecToXYPP(RA_data, dec_data, jd, platepar):
         float(platepar.X_res), float(platepar.Y_res), float(platepar.Ho), float(platepar.RA_d), \
         float(platepar.dec_d), float(platepar.pos_angle_ref), platepar.F_scale, platepar.x_poly_rev, \
         platepar.y_poly_rev, unicode(platepar.distortion_type), refraction=platepar.refraction, \
-        equal_aspect=platepar.equal_aspect, force_distortion_centre=platepar.force_distortion_centre)
+        equal_aspect=platepar.equal_aspect, force_distortion_centre=platepar.force_distortion_centre, \
+        apparent=apparent)
 
     return X_data, Y_data
 
@@ -583,69 +651,85 @@ def applyPlateparToCentroids(ff_name, fps, meteor_meas, platepar, add_calstatus=
         alt_data, level_data, magnitudes]
     """
 
+    return applyPlateparToCentroidsBatch([[ff_name, fps, meteor_meas]], platepar, \
+        add_calstatus=add_calstatus)[0]
 
-    meteor_meas = np.array(meteor_meas)
 
-    # Add a line which is indicating the calibration status
-    if add_calstatus:
-        meteor_meas = np.c_[np.ones((meteor_meas.shape[0], 1)), meteor_meas]
 
+def applyPlateparToCentroidsBatch(centroid_list, platepar, add_calstatus=False):
+    """ Compute the astrometry and photometry of many meteors with the same platepar at once. The centroids 
+        of all meteors are concatenated and projected in a few vectorized calls, and the results are split 
+        back per meteor. The results are identical to calling applyPlateparToCentroids on every meteor.
 
-    # Remove all entries where levels are equal to or smaller than 0, unless all are zero
-    level_data = meteor_meas[:, 8]
-    if np.any(level_data):
-        meteor_meas = meteor_meas[level_data > 0, :]
+    Arguments:
+        centroid_list: [list] A list of [ff_name, fps, meteor_meas] entries, see applyPlateparToCentroids.
+        platepar: [Platepar instance] Platepar which will be used for astrometry and photometry.
+    Keyword arguments:
+        add_calstatus: [bool] Add a column with calibration status at the beginning. False by default.
+    Return:
+        meteor_picks_list: [list] A list of meteor_picks arrays (see applyPlateparToCentroids), one for every
+            entry in centroid_list.
+    """
 
-    # Extract frame number, x, y, intensity
-    frames = meteor_meas[:, 1]
-    X_data = meteor_meas[:, 2]
-    Y_data = meteor_meas[:, 3]
-    level_data = meteor_meas[:, 8]
+    if len(centroid_list) == 0:
+        return []
 
-    # Get the beginning time of the FF file
-    time_beg = filenameToDatetime(ff_name)
 
-    # Calculate time data of every point
-    time_data = []
-    for frame_n in frames:
-        t = time_beg + datetime.timedelta(seconds=frame_n/fps)
-        time_data.append([t.year, t.month, t.day, t.hour, t.minute, t.second, int(t.microsecond/1000)])
+    meas_list = []
+    jd_list = []
 
+    for ff_name, fps, meteor_meas in centroid_list:
 
+        meteor_meas = np.array(meteor_meas)
 
-    # Convert image cooredinates to RA and Dec, and do the photometry
-    JD_data, RA_data, dec_data, magnitudes = xyToRaDecPP(np.array(time_data), X_data, Y_data, \
-        level_data, platepar)
+        # Add a line which is indicating the calibration status
+        if add_calstatus:
+            meteor_meas = np.c_[np.ones((meteor_meas.shape[0], 1)), meteor_meas]
+
+
+        # Remove all entries where levels are equal to or smaller than 0, unless all are zero
+        level_data = meteor_meas[:, 8]
+        if np.any(level_data):
+            meteor_meas = meteor_meas[level_data > 0, :]
 
+        meas_list.append(meteor_meas)
 
-    # Compute azimuth and altitude of centroids
-    az_data = np.zeros_like(RA_data)
-    alt_data = np.zeros_like(RA_data)
+        # Calculate the time of every point from the beginning time of the FF file, truncated to milliseconds
+        jd_list.append(datetimeOffsets2JD(filenameToDatetime(ff_name), meteor_meas[:, 1]/fps, \
+            truncate_ms=True))
+
+
+    # Concatenate the centroids of all meteors
+    meteor_meas = np.concatenate(meas_list)
+    JD_data = np.concatenate(jd_list)
+
+    # Extract frame number, x, y, intensity
+    frames = meteor_meas[:, 1]
+    X_data = meteor_meas[:, 2]
+    Y_data = meteor_meas[:, 3]
+    level_data = meteor_meas[:, 8]
 
-    for i in range(len(az_data)):
 
-        jd = JD_data[i]
-        ra_tmp = RA_data[i]
-        dec_tmp = dec_data[i]
+    # Convert image cooredinates to RA and Dec, and do the photometry
+    RA_data, dec_data, magnitudes = _xyToRaDecJDPP(JD_data, X_data, Y_data, level_data, platepar)
 
-        # Alt and az are kept in the J2000 epoch, which is the CAMS standard!
-        az_tmp, alt_tmp = trueRaDec2ApparentAltAz(ra_tmp, dec_tmp, jd, platepar.lat, platepar.lon)
+    # Apply the extinction correction, computed for the time of the first point of every meteor
+    meteor_lengths = [len(meas) for meas in meas_list]
+    jd_first = np.repeat([jd_data[0] for jd_data in jd_list], meteor_lengths)
+    magnitudes = extinctionCorrectionApparentToTrue(magnitudes, X_data, Y_data, jd_first, platepar)
 
-        az_data[i] = az_tmp
-        alt_data[i] = alt_tmp
 
+    # Compute azimuth and altitude of centroids. Alt and az are kept in the J2000 epoch, which is the CAMS 
+    #   standard!
+    az_data, alt_data = trueRaDec2ApparentAltAz(RA_data, dec_data, JD_data, platepar.lat, platepar.lon)
 
-    # print(ff_name, cam_code, meteor_No, fps)
-    # print(X_data, Y_data)
-    # print(RA_data, dec_data)
-    # print('------------------------------------------')
 
     # Construct the meteor measurements array
     meteor_picks = np.c_[frames, X_data, Y_data, RA_data, dec_data, az_data, alt_data, level_data, \
         magnitudes]
 
-
-    return meteor_picks
+    # Split the measurements per meteor
+    return np.split(meteor_picks, np.cumsum(meteor_lengths)[:-1])
 
 
 
@@ -673,13 +757,6 @@ def applyAstrometryFTPdetectinfo(dir_path, ftp_detectinfo_file, platepar_file, U
         print('The astrometry was not computed!')
         return None
 
-    # Save a copy of the uncalibrated FTPdetectinfo
-    ftp_detectinfo_copy = "".join(ftp_detectinfo_file.split('.')[:-1]) + "_uncalibrated.txt"
-
-    # Back up the original FTPdetectinfo, only if a backup does not exist already
-    if not os.path.isfile(os.path.join(dir_path, ftp_detectinfo_copy)):
-        shutil.copy2(os.path.join(dir_path, ftp_detectinfo_file), os.path.join(dir_path, ftp_detectinfo_copy))
-
     # Load platepar from file if not given
     if platepar is None:
 
@@ -688,35 +765,87 @@ def applyAstrometryFTPdetectinfo(dir_path, ftp_detectinfo_file, platepar_file, U
         platepar.read(os.path.join(dir_path, platepar_file), use_flat=None)
 
 
-    # Load the FTPdetectinfo file
-    meteor_data = readFTPdetectinfo(dir_path, ftp_detectinfo_file)
+    applyAstrometryFTPdetectinfoBatch([os.path.join(dir_path, ftp_detectinfo_file)], platepar)
+
+
+
+def applyAstrometryFTPdetectinfoBatch(ftpdetectinfo_paths, platepar):
+    """ Apply the same platepar to many FTPdetectinfo files at once (e.g. when reprocessing an archive). The 
+        centroids from all files are projected together using applyPlateparToCentroidsBatch and the results
+        are written back to every FTPdetectinfo file, as applyAstrometryFTPdetectinfo does for a single file.
+
+    Arguments:
+        ftpdetectinfo_paths: [list] A list of full paths to FTPdetectinfo files.
+        platepar: [Platepar obj] Loaded platepar which will be applied to all files.
+
+    Return:
+        None
+    """
+
+    ftpdetectinfo_list = []
+    centroid_list = []
 
-    # List for final meteor data
-    meteor_list = []
+    for ftpdetectinfo_path in ftpdetectinfo_paths:
 
-    # Go through every meteor
-    for meteor in meteor_data:
+        dir_path, ftp_detectinfo_file = os.path.split(ftpdetectinfo_path)
 
-        ff_name, cam_code, meteor_No, n_segments, fps, hnr, mle, binn, px_fm, rho, phi, meteor_meas = meteor
+        # If the FTPdetectinfo file does not exist, skip it
+        if not os.path.isfile(ftpdetectinfo_path):
+            print('The given FTPdetectinfo file does not exist:', ftpdetectinfo_path)
+            print('The astrometry was not computed!')
+            continue
 
-        # Apply the platepar to the given centroids
-        meteor_picks = applyPlateparToCentroids(ff_name, fps, meteor_meas, platepar)
+        # Save a copy of the uncalibrated FTPdetectinfo
+        ftp_detectinfo_copy = "".join(ftp_detectinfo_file.split('.')[:-1]) + "_uncalibrated.txt"
 
-        # Add the calculated values to the final list
-        meteor_list.append([ff_name, meteor_No, rho, phi, meteor_picks])
+        # Back up the original FTPdetectinfo, only if a backup does not exist already
+        if not os.path.isfile(os.path.join(dir_path, ftp_detectinfo_copy)):
+            shutil.copy2(ftpdetectinfo_path, os.path.join(dir_path, ftp_detectinfo_copy))
 
 
-    # Calibration string to be written to the FTPdetectinfo file
+        # Load the FTPdetectinfo file
+        meteor_data = readFTPdetectinfo(dir_path, ftp_detectinfo_file)
+
+        ftpdetectinfo_list.append([dir_path, ftp_detectinfo_file, meteor_data])
+
+        # Collect the centroids of all meteors
+        for meteor in meteor_data:
+
+            ff_name, cam_code, meteor_No, n_segments, fps, hnr, mle, binn, px_fm, rho, phi, meteor_meas = meteor
+
+            centroid_list.append([ff_name, fps, meteor_meas])
+
+
+    # Apply the platepar to the centroids of all meteors at once
+    meteor_picks_list = applyPlateparToCentroidsBatch(centroid_list, platepar)
+
+
+    # Calibration string to be written to the FTPdetectinfo files
     calib_str = 'Calibrated with RMS on: ' + str(datetime.datetime.utcnow()) + ' UTC'
 
-    # If no meteors were detected, set dummpy parameters
-    if len(meteor_list) == 0:
-        cam_code = ''
-        fps = 0
+    # Save the updated FTPdetectinfo files
+    meteor_index = 0
+    for dir_path, ftp_detectinfo_file, meteor_data in ftpdetectinfo_list:
+
+        # List for final meteor data
+        meteor_list = []
+
+        for meteor in meteor_data:
+
+            ff_name, cam_code, meteor_No, n_segments, fps, hnr, mle, binn, px_fm, rho, phi, meteor_meas = meteor
+
+            # Add the calculated values to the final list
+            meteor_list.append([ff_name, meteor_No, rho, phi, meteor_picks_list[meteor_index]])
+            meteor_index += 1
+
+
+        # If no meteors were detected, set dummpy parameters
+        if len(meteor_list) == 0:
+            cam_code = ''
+            fps = 0
 
-    # Save the updated FTPdetectinfo
-    writeFTPdetectinfo(meteor_list, dir_path, ftp_detectinfo_file, dir_path, cam_code, fps, 
-        calibration=calib_str, celestial_coords_given=True)
+        writeFTPdetectinfo(meteor_list, dir_path, ftp_detectinfo_file, dir_path, cam_code, fps, 
+            calibration=calib_str, celestial_coords_given=True)
 
 
 
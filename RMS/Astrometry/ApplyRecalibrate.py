@@ -8,6 +8,8 @@ import os
 import sys
 import copy
 import argparse
+import base64
+import multiprocessing
 import json
 import datetime
 import shutil
@@ -15,12 +17,12 @@ import shutil
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import numpy as np
-import scipy.optimize
 
 from RMS.Astrometry import CheckFit
 from RMS.Astrometry.ApplyAstrometry import applyAstrometryFTPdetectinfo, applyPlateparToCentroids, \
-    rotationWrtHorizon, photometryFitRobust, extinctionCorrectionTrueToApparent
-from RMS.Astrometry.Conversions import date2JD, raDec2AltAz
+    rotationWrtHorizon, photometryFitRobust, extinctionCorrectionTrueToApparent, xyToRaDecPP, raDecToXYPP, \
+    computeFOVSize
+from RMS.Astrometry.Conversions import date2JD, jd2Date, raDec2AltAz
 from RMS.Astrometry.FFTalign import alignPlatepar
 import RMS.ConfigReader as cr
 from RMS.Formats import CALSTARS
@@ -29,13 +31,25 @@ from RMS.Formats import FTPdetectinfo
 from RMS.Formats import Platepar
 from RMS.Formats import StarCatalog
 from RMS.Math import angularSeparation
+from RMS.Routines.Image import binImage
 import Utils.RMS2UFO
 
+# Import Cython functions
+import pyximport
+pyximport.install(setup_args={'include_dirs':[np.get_include()]})
+from RMS.Astrometry.CyFunctions import subsetCatalog
+
 
 # Neighbourhood size around individual FFs with detections which will be takes for recalibration
 #   A size of e.g. 3 means that an FF before, the FF with the detection, an an FF after will be taken
 RECALIBRATE_NEIGHBOURHOOD_SIZE = 3
 
+# Binning factor of the avepixel thumbnail stored with the matched stars for the calibration report
+MATCHED_STARS_THUMBNAIL_BIN = 4
+
+# Catalog stars in the shared memory of the parallel recalibration workers
+RECALIBRATION_CATALOG = None
+
 
 def recalibrateFF(config, working_platepar, jd, star_dict_ff, catalog_stars, max_match_radius=None,
         force_platepar_save=False):
@@ -55,10 +69,15 @@ def recalibrateFF(config, working_platepar, jd, star_dict_ff, catalog_stars, max
     Return:
         result: [?] A Platepar instance if refinement is successful, None if it failed.
         min_match_radius: [float] Minimum radius that successfuly matched the stars (pixels).
+        matched: [tuple] (match_radius, image_stars, matched_catalog_stars, distances) of the stars matched
+            with the final platepar and used for the photometry fit, None if the refinement failed.
     """
 
     working_platepar = copy.deepcopy(working_platepar)
 
+    # Catalog subset around the image which will be reused during the fit
+    context = CheckFit.MatchStarsContext(catalog_stars)
+
     # A list of matching radiuses to try
     min_radius = 0.5
     max_radius = 10
@@ -74,7 +93,7 @@ def recalibrateFF(config, working_platepar, jd, star_dict_ff, catalog_stars, max
 
     # Match the stars and calculate the residuals
     n_matched, avg_dist, cost, _ = CheckFit.matchStarsResiduals(config, working_platepar, catalog_stars, \
-        star_dict_ff, min_radius, ret_nmatch=True)
+        star_dict_ff, min_radius, ret_nmatch=True, context=context)
 
 
     print('Initally match stars with {:.1f} px: {:d}/{:d}'.format(min_radius, n_matched, \
@@ -108,7 +127,7 @@ def recalibrateFF(config, working_platepar, jd, star_dict_ff, catalog_stars, max
 
         # If the platepar is good and the radius is below a pixel, don't recalibrate anymore
         if (match_radius < 1.0) and CheckFit.checkFitGoodness(config, working_platepar, catalog_stars, \
-            star_dict_ff, match_radius, verbose=True):
+            star_dict_ff, match_radius, verbose=True, context=context):
             print('The fit is good enough!')
             break
 
@@ -116,7 +135,7 @@ def recalibrateFF(config, working_platepar, jd, star_dict_ff, catalog_stars, max
 
         # If there are no matched stars, give up
         n_matched, _, _, _ = CheckFit.matchStarsResiduals(config, working_platepar, catalog_stars, \
-            star_dict_ff, match_radius, ret_nmatch=True, verbose=False)
+            star_dict_ff, match_radius, ret_nmatch=True, verbose=False, context=context)
 
         if n_matched == 0:
             print('No stars matched, stopping the fit!')
@@ -127,17 +146,8 @@ def recalibrateFF(config, working_platepar, jd, star_dict_ff, catalog_stars, max
 
         ### Recalibrate the platepar just on these stars, use the default platepar for initial params ###
 
-        # Init initial parameters
-        p0 = [working_platepar.RA_d, working_platepar.dec_d, working_platepar.pos_angle_ref, \
-            working_platepar.F_scale]
-
-        # Compute the minimization tolerance
-        fatol, xatol_ang = CheckFit.computeMinimizationTolerances(config, working_platepar, \
-            len(star_dict_ff))
-
-        res = scipy.optimize.minimize(CheckFit._calcImageResidualsAstro, p0, args=(config, \
-            working_platepar, catalog_stars, star_dict_ff, match_radius), \
-            method='Nelder-Mead', options={'fatol': fatol, 'xatol': xatol_ang})
+        res = CheckFit.refineAstrometry(config, working_platepar, catalog_stars, star_dict_ff, match_radius, \
+            context=context)
 
 
         ###
@@ -152,7 +162,8 @@ def recalibrateFF(config, working_platepar, jd, star_dict_ff, catalog_stars, max
         temp_platepar.F_scale = F_scale_ref
 
         n_matched, _, _, matched_stars = CheckFit.matchStarsResiduals(config, temp_platepar, catalog_stars, \
-            star_dict_ff, match_radius, ret_nmatch=True, verbose=False)
+            star_dict_ff, match_radius, ret_nmatch=True, verbose=False, context=context)
+        matched_radius = match_radius
 
 
         # If the fit was not successful, stop further fitting on this FF file
@@ -190,13 +201,13 @@ def recalibrateFF(config, working_platepar, jd, star_dict_ff, catalog_stars, max
 
     # If the platepar is good, store it
     if CheckFit.checkFitGoodness(config, working_platepar, catalog_stars, star_dict_ff, \
-        goodnes_check_radius) or force_platepar_save:
+        goodnes_check_radius, context=context) or force_platepar_save:
 
 
         ### PHOTOMETRY FIT ###
 
         # Get a list of matched image and catalog stars
-        image_stars, matched_catalog_stars, _ = matched_stars[jd]
+        image_stars, matched_catalog_stars, distances = matched_stars[jd]
         star_intensities = image_stars[:, 2]
         ra_catalog, dec_catalog, catalog_mags = matched_catalog_stars.T
 
@@ -239,116 +250,47 @@ def recalibrateFF(config, working_platepar, jd, star_dict_ff, catalog_stars, max
         # Store the platepar to the list of recalibrated platepars
         result = working_platepar
 
+        # Keep the matched stars for the calibration report
+        matched = (matched_radius, image_stars, matched_catalog_stars, distances)
+
 
     # Otherwise, indicate that the refinement was not successful
     else:
         print('Not using the refined platepar...')
         result = None
+        matched = None
 
 
-    return result, min_match_radius
+    return result, min_match_radius, matched
 
 
 
 
-def recalibrateIndividualFFsAndApplyAstrometry(dir_path, ftpdetectinfo_path, calstars_list, config, platepar,
-    generate_plot=True):
-    """ Recalibrate FF files with detections and apply the recalibrated platepar to those detections.
+def recalibrateFFList(config, platepar, ff_names, calstars, catalog_stars):
+    """ Recalibrate the platepar on the given FF files one after another. Every FF file starts from the last
+        successfully recalibrated platepar, or from the given platepar for the first file.
+
     Arguments:
-        dir_path: [str] Path where the FTPdetectinfo file is.
-        ftpdetectinfo_path: [str] Name of the FTPdetectinfo file.
-        calstars_list: [list] A list of entries [[ff_name, star_coordinates], ...].
         config: [Config instance]
         platepar: [Platepar instance] Initial platepar.
-    Keyword arguments:
-        generate_plot: [bool] Generate the calibration variation plot. True by default.
+        ff_names: [list] Sorted names of FF files to recalibrate.
+        calstars: [dict] Stars on every FF file, the keys are FF file names.
+        catalog_stars: [ndarray] A numpy array of catalog stars.
+
     Return:
-        recalibrated_platepars: [dict] A dictionary where the keys are FF file names and values are
-            recalibrated platepar instances for every FF file.
+        (recalibrated_platepars, matched_stars):
+            recalibrated_platepars: [dict] A dictionary where the keys are FF file names and values are
+                recalibrated platepar instances for every FF file.
+            matched_stars: [dict] Stars matched with the recalibrated platepars (see recalibrateFF), the
+                keys are FF file names. Only successfully recalibrated FF files are included.
     """
 
-    # Use a copy of the config file
-    config = copy.deepcopy(config)
-
-    # If the given file does not exits, return nothing
-    if not os.path.isfile(ftpdetectinfo_path):
-        print('ERROR! The FTPdetectinfo file does not exist: {:s}'.format(ftpdetectinfo_path))
-        print('    The recalibration on every file was not done!')
-
-        return {}
-
-
-    # Read the FTPdetectinfo data
-    cam_code, fps, meteor_list = FTPdetectinfo.readFTPdetectinfo(*os.path.split(ftpdetectinfo_path), \
-        ret_input_format=True)
-
-    # Convert the list of stars to a per FF name dictionary
-    calstars = {ff_file: star_data for ff_file, star_data in calstars_list}
-
-
-    ### Add neighboring FF files for more robust photometry estimation ###
-
-    ff_processing_list = []
-
-    # Make a list of sorted FF files in CALSTARS
-    calstars_ffs = sorted([ff_file for ff_file in calstars])
-
-    # Go through the list of FF files with detections and add neighboring FFs
-    for meteor_entry in meteor_list:
-
-        ff_name = meteor_entry[0]
-
-        if ff_name in calstars_ffs:
-
-            # Find the index of the given FF file in the list of calstars
-            ff_indx = calstars_ffs.index(ff_name)
-
-            # Add neighbours to the processing list
-            for k in range(-(RECALIBRATE_NEIGHBOURHOOD_SIZE//2), RECALIBRATE_NEIGHBOURHOOD_SIZE//2 + 1):
-
-                k_indx = ff_indx + k
-
-                if (k_indx > 0) and (k_indx < len(calstars_ffs)):
-
-                    ff_name_tmp = calstars_ffs[k_indx]
-                    if ff_name_tmp not in ff_processing_list:
-                        ff_processing_list.append(ff_name_tmp)
-
-
-    # Sort the processing list of FF files
-    ff_processing_list = sorted(ff_processing_list)
-
-
-    ### ###
-
-
-    # Globally increase catalog limiting magnitude
-    config.catalog_mag_limit += 1
-
-    # Load catalog stars (overwrite the mag band ratios if specific catalog is used)
-    star_catalog_status = StarCatalog.readStarCatalog(config.star_catalog_path,\
-        config.star_catalog_file, lim_mag=config.catalog_mag_limit, \
-        mag_band_ratios=config.star_catalog_band_ratios)
-
-    if not star_catalog_status:
-        print("Could not load the star catalog!")
-        print(os.path.join(config.star_catalog_path, config.star_catalog_file))
-        return {}
-
-    catalog_stars, _, config.star_catalog_band_ratios = star_catalog_status
-
-
-    # Update the platepar coordinates from the config file
-    platepar.lat = config.latitude
-    platepar.lon = config.longitude
-    platepar.elev = config.elevation
-
-
     prev_platepar = copy.deepcopy(platepar)
 
-    # Go through all FF files with detections, recalibrate and apply astrometry
+    # Go through all FF files, recalibrate them and keep the platepars and the matched stars
     recalibrated_platepars = {}
-    for ff_name in ff_processing_list:
+    matched_stars = {}
+    for ff_name in ff_names:
 
         working_platepar = copy.deepcopy(prev_platepar)
 
@@ -372,7 +314,8 @@ def recalibrateIndividualFFsAndApplyAstrometry(dir_path, ftpdetectinfo_path, cal
         star_dict_ff = {jd: calstars[ff_name]}
 
         # Recalibrate the platepar using star matching
-        result, min_match_radius = recalibrateFF(config, working_platepar, jd, star_dict_ff, catalog_stars)
+        result, min_match_radius, matched = recalibrateFF(config, working_platepar, jd, star_dict_ff, \
+            catalog_stars)
 
 
         # If the recalibration failed, try using FFT alignment
@@ -389,7 +332,7 @@ def recalibrateIndividualFFsAndApplyAstrometry(dir_path, ftpdetectinfo_path, cal
                 show_plot=False)
 
             # Try to recalibrate after FFT alignment
-            result, _ = recalibrateFF(config, test_platepar, jd, star_dict_ff, catalog_stars)
+            result, _, matched = recalibrateFF(config, test_platepar, jd, star_dict_ff, catalog_stars)
 
 
             # If the FFT alignment failed, align the original platepar using the smallest radius that matched
@@ -397,7 +340,7 @@ def recalibrateIndividualFFsAndApplyAstrometry(dir_path, ftpdetectinfo_path, cal
             if (result is None) and (min_match_radius is not None):
                 print()
                 print("Using the old platepar with the minimum match radius of: {:.2f}".format(min_match_radius))
-                result, _ = recalibrateFF(config, working_platepar, jd, star_dict_ff, catalog_stars,
+                result, _, matched = recalibrateFF(config, working_platepar, jd, star_dict_ff, catalog_stars,
                     max_match_radius=min_match_radius, force_platepar_save=True)
 
                 if result is not None:
@@ -429,6 +372,9 @@ def recalibrateIndividualFFsAndApplyAstrometry(dir_path, ftpdetectinfo_path, cal
             recalibrated_platepars[ff_name] = working_platepar
             prev_platepar = working_platepar
 
+            if matched is not None:
+                matched_stars[ff_name] = matched
+
         else:
 
             print('Recalibration of {:s} failed, using the previous platepar...'.format(ff_name))
@@ -441,6 +387,416 @@ def recalibrateIndividualFFsAndApplyAstrometry(dir_path, ftpdetectinfo_path, cal
             recalibrated_platepars[ff_name] = prev_platepar_tmp
 
 
+    return recalibrated_platepars, matched_stars
+
+
+
+
+def _initRecalibrationWorker(shared_catalog, catalog_shape):
+    """ Wrap the catalog in the shared memory into a numpy array, without copying it. """
+
+    global RECALIBRATION_CATALOG
+
+    RECALIBRATION_CATALOG = np.ctypeslib.as_array(shared_catalog).reshape(catalog_shape)
+
+
+
+def _recalibrateFFListWorker(args):
+    """ Recalibrate a group of FF files in a worker process, using the shared catalog. """
+
+    config, platepar, ff_names, calstars = args
+
+    return recalibrateFFList(config, platepar, ff_names, calstars, RECALIBRATION_CATALOG)
+
+
+
+def recalibrationGroups(ff_names, calstars_ffs, max_size):
+    """ Split the sorted list of FF files into groups of consecutive FF files in CALSTARS, so that the FF 
+        files inside every group can be recalibrated one after another and the groups independently.
+
+    Arguments:
+        ff_names: [list] Sorted names of FF files to recalibrate.
+        calstars_ffs: [list] Sorted names of all FF files in CALSTARS.
+        max_size: [int] Maximum number of FF files in a group. Longer runs of consecutive files are split.
+
+    Return:
+        groups: [list] A list of lists of FF file names.
+    """
+
+    calstars_indices = {ff_name: i for i, ff_name in enumerate(calstars_ffs)}
+
+    groups = []
+    prev_indx = None
+    for ff_name in ff_names:
+
+        ff_indx = calstars_indices.get(ff_name)
+
+        # Start a new group at a gap in the FF files or if the group is full
+        if (not groups) or (ff_indx is None) or (prev_indx is None) or (ff_indx - prev_indx > 1) \
+            or (len(groups[-1]) >= max_size):
+
+            groups.append([])
+
+        groups[-1].append(ff_name)
+        prev_indx = ff_indx
+
+
+    return groups
+
+
+
+def recalibrateFFListParallel(config, platepar, ff_names, calstars, calstars_ffs, catalog_stars):
+    """ Recalibrate the platepar on the given FF files in a pool of worker processes. The FF files are split
+        into groups of neighbouring files, every group starts from the given (nightly) platepar and its 
+        FF files are seeded from the previous solved neighbour. The catalog is put into shared memory once,
+        and not sent to every worker.
+
+    Arguments:
+        config: [Config instance]
+        platepar: [Platepar instance] Initial platepar.
+        ff_names: [list] Sorted names of FF files to recalibrate.
+        calstars: [dict] Stars on every FF file, the keys are FF file names.
+        calstars_ffs: [list] Sorted names of all FF files in CALSTARS.
+        catalog_stars: [ndarray] A numpy array of catalog stars.
+
+    Return:
+        (recalibrated_platepars, matched_stars): See recalibrateFFList.
+    """
+
+    cores = config.recalibration_cores
+    if cores <= 0:
+        cores = max(multiprocessing.cpu_count() + cores, 1)
+
+
+    # Split the FF files so that all workers get a few groups
+    max_size = max(RECALIBRATE_NEIGHBOURHOOD_SIZE, int(np.ceil(len(ff_names)/(2.0*cores))))
+    groups = recalibrationGroups(ff_names, calstars_ffs, max_size)
+
+    print('Recalibrating {:d} FF files in {:d} groups on {:d} cores...'.format(len(ff_names), len(groups), \
+        cores))
+
+
+    # Copy the catalog into shared memory
+    catalog_stars = np.ascontiguousarray(catalog_stars, dtype=np.float64)
+    shared_catalog = multiprocessing.RawArray('d', catalog_stars.size)
+    np.ctypeslib.as_array(shared_catalog)[:] = catalog_stars.ravel()
+
+
+    # Send only the stars of the FF files in the group to the workers
+    jobs = [(config, platepar, group, {ff_name: calstars[ff_name] for ff_name in group \
+        if ff_name in calstars}) for group in groups]
+
+    recalibrated_platepars = {}
+    matched_stars = {}
+
+    pool = multiprocessing.Pool(processes=cores, initializer=_initRecalibrationWorker, \
+        initargs=(shared_catalog, catalog_stars.shape))
+
+    try:
+        for group_platepars, group_matched_stars in pool.imap_unordered(_recalibrateFFListWorker, jobs):
+            recalibrated_platepars.update(group_platepars)
+            matched_stars.update(group_matched_stars)
+
+    finally:
+        pool.close()
+        pool.join()
+
+
+    return recalibrated_platepars, matched_stars
+
+
+
+
+def catalogStarsOnImage(catalog_stars, platepar, jd, lim_mag):
+    """ Compute image coordinates of catalog stars which are inside the image.
+
+    Arguments:
+        catalog_stars: [ndarray] An array of catalog stars (ra, dec, mag).
+        platepar: [Platepar instance]
+        jd: [float] Julian date of the image.
+        lim_mag: [float] Limiting magnitude of the stars.
+    Return:
+        catalog_image: [ndarray] An array of (x, y, mag) of catalog stars inside the image.
+    """
+
+    # Estimate RA,dec of the centre of the FOV
+    _, RA_c, dec_c, _ = xyToRaDecPP([jd2Date(jd)], [platepar.X_res/2], [platepar.Y_res/2], [1],
+        platepar)
+
+    RA_c = RA_c[0]
+    dec_c = dec_c[0]
+
+    fov_radius = np.hypot(*computeFOVSize(platepar))
+
+    # Get stars from the catalog around the defined center in a given radius
+    _, extracted_catalog = subsetCatalog(catalog_stars, RA_c, dec_c, jd, platepar.lat, platepar.lon, \
+        fov_radius, lim_mag)
+    ra_catalog, dec_catalog, mag_catalog = extracted_catalog.T
+
+    # Compute image positions of all catalog stars that should be on the image
+    x_catalog, y_catalog = raDecToXYPP(ra_catalog, dec_catalog, jd, platepar)
+
+    # Filter all catalog stars outside the image
+    temp_arr = np.c_[x_catalog, y_catalog, mag_catalog]
+    temp_arr = temp_arr[temp_arr[:, 0] >= 0]
+    temp_arr = temp_arr[temp_arr[:, 0] <= platepar.X_res]
+    temp_arr = temp_arr[temp_arr[:, 1] >= 0]
+    temp_arr = temp_arr[temp_arr[:, 1] <= platepar.Y_res]
+
+    return temp_arr
+
+
+
+def matchedStarsThumbnail(dir_path, ff_name, bin_factor=MATCHED_STARS_THUMBNAIL_BIN):
+    """ Make a binned thumbnail of the avepixel of the given FF file, which can be stored as JSON.
+
+    Arguments:
+        dir_path: [str] Path to the directory with the FF file.
+        ff_name: [str] Name of the FF file.
+    Keyword arguments:
+        bin_factor: [int] Binning factor of the thumbnail. MATCHED_STARS_THUMBNAIL_BIN by default.
+    Return:
+        thumbnail: [dict] The binning factor, the shape and the data type of the thumbnail, and the base64
+            encoded image data. None if the FF file cannot be read.
+    """
+
+    if not os.path.isfile(os.path.join(dir_path, ff_name)):
+        return None
+
+    ff = FFfile.read(dir_path, ff_name)
+
+    if ff is None:
+        return None
+
+    # Crop the image to a multiple of the binning factor, as the binning function requires it
+    img = ff.avepixel
+    img_h, img_w = img.shape
+    img = img[:img_h - img_h%bin_factor, :img_w - img_w%bin_factor]
+
+    img = np.ascontiguousarray(binImage(img, bin_factor, method='avg'))
+
+    return {
+        'bin_factor': bin_factor,
+        'shape': list(img.shape),
+        'dtype': str(img.dtype),
+        'data': base64.b64encode(img.tobytes()).decode('ascii')
+        }
+
+
+
+def thumbnailImage(thumbnail):
+    """ Decode the thumbnail made by matchedStarsThumbnail into an image. 
+    
+    Arguments:
+        thumbnail: [dict] Output of matchedStarsThumbnail.
+    Return:
+        img: [ndarray] Binned avepixel image.
+    """
+
+    return np.frombuffer(base64.b64decode(thumbnail['data']), dtype=thumbnail['dtype'])\
+        .reshape(thumbnail['shape'])
+
+
+
+def collectMatchedStars(config, dir_path, recalibrated_platepars, matched_stars, calstars, catalog_stars, \
+    mag_band_str, lim_mag):
+    """ Collect the stars matched during recalibration and everything else which is needed to generate the 
+        calibration report, so the report doesn't have to reload the catalog, the CALSTARS file, the 
+        platepars and the FF file, and match the stars again.
+
+    Arguments:
+        config: [Config instance]
+        dir_path: [str] Path to the night directory with FF files.
+        recalibrated_platepars: [dict] Recalibrated Platepar instances, the keys are FF file names.
+        matched_stars: [dict] Stars matched during recalibration, the keys are FF file names (see 
+            recalibrateFFList).
+        calstars: [dict] Stars on every FF file, the keys are FF file names.
+        catalog_stars: [ndarray] An array of catalog stars (ra, dec, mag) used for recalibration.
+        mag_band_str: [str] Description of the catalog magnitude band.
+        lim_mag: [float] Limiting magnitude of the catalog stars used for recalibration.
+    Return:
+        matched_data: [dict] Matched image stars, catalog stars, distances and the match radius for every 
+            recalibrated FF file ('matched'), and the name, platepar, detected stars, catalog stars on the 
+            image and the avepixel thumbnail of the FF file with the most stars, which is shown in the 
+            report.
+    """
+
+    matched = {}
+    for ff_name in sorted(matched_stars):
+
+        match_radius, image_stars, matched_catalog_stars, distances = matched_stars[ff_name]
+
+        matched[ff_name] = {
+            'jd': date2JD(*FFfile.getMiddleTimeFF(ff_name, config.fps, ret_milliseconds=True)),
+            'match_radius': match_radius,
+            'image_stars': np.array(image_stars).tolist(),
+            'catalog_stars': np.array(matched_catalog_stars).tolist(),
+            'distances': np.array(distances).tolist()
+            }
+
+
+    matched_data = {
+        'lim_mag': lim_mag,
+        'mag_band_str': mag_band_str,
+        'matched': matched,
+        'ff_name': None
+        }
+
+
+    # Show the FF file with the most stars in the report
+    if not matched:
+        return matched_data
+
+    ff_name = max(sorted(matched), key=lambda ff: len(calstars[ff]))
+    platepar = recalibrated_platepars[ff_name]
+    report_matched = matched[ff_name]
+
+    # Plot catalog stars to the limiting magnitude of the faintest matched star + 1 mag
+    if len(report_matched['distances']) > 2:
+        faintest_mag = np.max(np.array(report_matched['catalog_stars'])[:, 2]) + 1
+
+    else:
+        faintest_mag = lim_mag
+
+
+    matched_data['ff_name'] = ff_name
+    matched_data['platepar'] = json.loads(platepar.jsonStr())
+    matched_data['star_list'] = np.array(calstars[ff_name]).tolist()
+    matched_data['faintest_mag'] = faintest_mag
+    matched_data['catalog_image'] = catalogStarsOnImage(catalog_stars, platepar, report_matched['jd'], \
+        faintest_mag).tolist()
+    matched_data['thumbnail'] = matchedStarsThumbnail(dir_path, ff_name)
+
+
+    return matched_data
+
+
+
+def saveMatchedStars(dir_path, file_name, matched_data):
+    """ Save the output of collectMatchedStars to a JSON file. """
+
+    with open(os.path.join(dir_path, file_name), 'w') as f:
+        json.dump(matched_data, f)
+
+
+
+def loadMatchedStars(dir_path, file_name):
+    """ Load the matched stars saved by saveMatchedStars. None is returned if the file does not exist. """
+
+    file_path = os.path.join(dir_path, file_name)
+
+    if not os.path.isfile(file_path):
+        return None
+
+    with open(file_path) as f:
+        return json.load(f)
+
+
+
+def recalibrateIndividualFFsAndApplyAstrometry(dir_path, ftpdetectinfo_path, calstars_list, config, platepar,
+    generate_plot=True):
+    """ Recalibrate FF files with detections and apply the recalibrated platepar to those detections.
+    Arguments:
+        dir_path: [str] Path where the FTPdetectinfo file is.
+        ftpdetectinfo_path: [str] Name of the FTPdetectinfo file.
+        calstars_list: [list] A list of entries [[ff_name, star_coordinates], ...].
+        config: [Config instance]
+        platepar: [Platepar instance] Initial platepar.
+    Keyword arguments:
+        generate_plot: [bool] Generate the calibration variation plot. True by default.
+    Return:
+        recalibrated_platepars: [dict] A dictionary where the keys are FF file names and values are
+            recalibrated platepar instances for every FF file.
+    """
+
+    # Use a copy of the config file
+    config = copy.deepcopy(config)
+
+    # If the given file does not exits, return nothing
+    if not os.path.isfile(ftpdetectinfo_path):
+        print('ERROR! The FTPdetectinfo file does not exist: {:s}'.format(ftpdetectinfo_path))
+        print('    The recalibration on every file was not done!')
+
+        return {}
+
+
+    # Read the FTPdetectinfo data
+    cam_code, fps, meteor_list = FTPdetectinfo.readFTPdetectinfo(*os.path.split(ftpdetectinfo_path), \
+        ret_input_format=True)
+
+    # Convert the list of stars to a per FF name dictionary
+    calstars = {ff_file: star_data for ff_file, star_data in calstars_list}
+
+
+    ### Add neighboring FF files for more robust photometry estimation ###
+
+    ff_processing_list = []
+
+    # Make a list of sorted FF files in CALSTARS
+    calstars_ffs = sorted([ff_file for ff_file in calstars])
+
+    # Go through the list of FF files with detections and add neighboring FFs
+    for meteor_entry in meteor_list:
+
+        ff_name = meteor_entry[0]
+
+        if ff_name in calstars_ffs:
+
+            # Find the index of the given FF file in the list of calstars
+            ff_indx = calstars_ffs.index(ff_name)
+
+            # Add neighbours to the processing list
+            for k in range(-(RECALIBRATE_NEIGHBOURHOOD_SIZE//2), RECALIBRATE_NEIGHBOURHOOD_SIZE//2 + 1):
+
+                k_indx = ff_indx + k
+
+                if (k_indx > 0) and (k_indx < len(calstars_ffs)):
+
+                    ff_name_tmp = calstars_ffs[k_indx]
+                    if ff_name_tmp not in ff_processing_list:
+                        ff_processing_list.append(ff_name_tmp)
+
+
+    # Sort the processing list of FF files
+    ff_processing_list = sorted(ff_processing_list)
+
+
+    ### ###
+
+
+    # Globally increase catalog limiting magnitude
+    config.catalog_mag_limit += 1
+
+    # Load catalog stars (overwrite the mag band ratios if specific catalog is used)
+    star_catalog_status = StarCatalog.readStarCatalog(config.star_catalog_path,\
+        config.star_catalog_file, lim_mag=config.catalog_mag_limit, \
+        mag_band_ratios=config.star_catalog_band_ratios)
+
+    if not star_catalog_status:
+        print("Could not load the star catalog!")
+        print(os.path.join(config.star_catalog_path, config.star_catalog_file))
+        return {}
+
+    catalog_stars, mag_band_str, config.star_catalog_band_ratios = star_catalog_status
+
+
+    # Update the platepar coordinates from the config file
+    platepar.lat = config.latitude
+    platepar.lon = config.longitude
+    platepar.elev = config.elevation
+
+
+    # Recalibrate FF files one after another, each starting from the previous recalibrated platepar
+    if config.recalibration_cores == 1:
+        recalibrated_platepars, matched_stars = recalibrateFFList(config, platepar, ff_processing_list, \
+            calstars, catalog_stars)
+
+    # Recalibrate groups of neighbouring FF files in parallel
+    else:
+        recalibrated_platepars, matched_stars = recalibrateFFListParallel(config, platepar, \
+            ff_processing_list, calstars, calstars_ffs, catalog_stars)
+
+
 
     ### Average out photometric offsets within the given neighbourhood size ###
 
@@ -514,6 +870,12 @@ def recalibrateIndividualFFsAndApplyAstrometry(dir_path, ftpdetectinfo_path, cal
     ### ###
 
 
+    # Store the stars matched during recalibration, so the calibration report can be made from them
+    matched_data = collectMatchedStars(config, dir_path, recalibrated_platepars, matched_stars, calstars, \
+        catalog_stars, mag_band_str, config.catalog_mag_limit)
+    saveMatchedStars(dir_path, config.matched_stars_name, matched_data)
+
+
 
     # If no platepars were recalibrated, use the single platepar recalibration procedure
     if len(recalibrated_platepars) == 0:
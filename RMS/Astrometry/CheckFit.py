@@ -6,9 +6,11 @@ from __future__ import print_function, division, absolute_import
 
 import os
 import sys
-import copy
+import json
 import shutil
 import random
+import traceback
+import weakref
 import argparse
 
 import numpy as np
@@ -23,13 +25,49 @@ from RMS.Formats import FFfile
 from RMS.Astrometry.ApplyAstrometry import raDecToXYPP, xyToRaDecPP, rotationWrtHorizon
 from RMS.Astrometry.Conversions import date2JD, jd2Date, raDec2AltAz
 from RMS.Astrometry.FFTalign import alignPlatepar
+from RMS.Astrometry.PlateSolve import plateSolveCalstars
 from RMS.Math import angularSeparation
 
 
 # Import Cython functions
 import pyximport
 pyximport.install(setup_args={'include_dirs':[np.get_include()]})
-from RMS.Astrometry.CyFunctions import matchStars, subsetCatalog
+from RMS.Astrometry.CyFunctions import matchStars, subsetCatalog, eqRefractionTrueToApparent_vect, \
+    buildCatalogTiles
+
+
+# Sky tile indices of the loaded catalogs, the keys are the IDs of the catalog arrays
+CATALOG_TILES = {}
+
+# Match radius used to validate the platepar with the stars matched in the last full ACF run (px)
+ACF_INCREMENTAL_RADIUS = 1.5
+
+# Minimum number of matched stars per image in the validation, as a fraction of the number from the last 
+#   full ACF run
+ACF_INCREMENTAL_MIN_MATCH_FRACTION = 0.5
+
+
+def catalogTiles(catalog_stars):
+    """ Return the sky tile index of the given catalog for subsetCatalog. The index is built only once for
+        every catalog array and it is dropped when the array is deleted.
+
+    Arguments:
+        catalog_stars: [ndarray] An array of (ra, dec, mag) of catalog stars, sorted by descending declination.
+
+    Return:
+        tiles: [tuple] Sky tile index, see CyFunctions.buildCatalogTiles.
+    """
+
+    key = id(catalog_stars)
+
+    entry = CATALOG_TILES.get(key)
+    if (entry is not None) and (entry[0]() is catalog_stars):
+        return entry[1]
+
+    tiles = buildCatalogTiles(catalog_stars)
+    CATALOG_TILES[key] = (weakref.ref(catalog_stars, lambda _, key=key: CATALOG_TILES.pop(key, None)), tiles)
+
+    return tiles
 
 
 def computeMinimizationTolerances(config, platepar, star_dict_len):
@@ -47,9 +85,105 @@ def computeMinimizationTolerances(config, platepar, star_dict_len):
 
 
 
+class MatchStarsContext(object):
+    def __init__(self, catalog_stars, padding=0.2):
+        """ Catalog stars around the FOV centre of every image, kept between the calls of 
+            matchStarsResiduals during the fit. The optimizer evaluates hundreds of platepars which point 
+            almost in the same direction, so the catalog is subset only once per image with a padded radius 
+            and corrected for refraction, and only the stars inside the FOV are taken from that subset 
+            on every evaluation. The subset is recomputed when the FOV moves outside the padding.
+
+        Arguments:
+            catalog_stars: [ndarray] An array of catalog stars (ra, dec, mag).
+
+        Keyword arguments:
+            padding: [float] The cached subsets are taken with a radius which is larger than the FOV radius 
+                by this fraction. 0.2 by default.
+        """
+
+        self.catalog_stars = catalog_stars
+        self.padding = padding
+
+        # Cached subsets, the keys are JDs of every image
+        self.subsets = {}
+
+
+    def catalogSubset(self, jd, ra_c, dec_c, fov_radius, lim_mag, platepar):
+        """ Return the catalog stars inside the given FOV and their coordinates corrected for refraction.
+            The selected stars are identical to the ones subsetCatalog would return on the whole catalog.
+
+        Arguments:
+            jd: [float] Julian date of the image.
+            ra_c: [float] RA of the FOV centre (deg).
+            dec_c: [float] Declination of the FOV centre (deg).
+            fov_radius: [float] FOV radius (deg).
+            lim_mag: [float] Limiting magnitude.
+            platepar: [Platepar structure] Astrometry parameters.
+
+        Return:
+            (extracted_catalog, ra_catalog, dec_catalog):
+                - extracted_catalog: [ndarray] Catalog stars (ra, dec, mag) inside the FOV.
+                - ra_catalog: [ndarray] RA of the extracted stars, corrected for refraction if it is 
+                    enabled in the platepar (deg).
+                - dec_catalog: [ndarray] Declination of the extracted stars, corrected for refraction if it 
+                    is enabled in the platepar (deg).
+        """
+
+        subset = self.subsets.get(jd)
+
+        # Check that the FOV is inside the cached subset, and that it was computed with the same parameters
+        if subset is not None:
+
+            ra_s, dec_s, radius_s, lim_mag_s, lat_s, lon_s, refraction_s = subset[:7]
+
+            # Angular distance between the FOV centre and the centre of the subset (clipped, as the centres
+            #   are often identical)
+            cos_dist = np.sin(np.radians(dec_c))*np.sin(np.radians(dec_s)) \
+                + np.cos(np.radians(dec_c))*np.cos(np.radians(dec_s))*np.cos(np.radians(ra_c - ra_s))
+            centre_dist = np.degrees(np.arccos(np.clip(cos_dist, -1.0, 1.0)))
+
+            if (centre_dist + fov_radius > radius_s) or (lim_mag != lim_mag_s) or (platepar.lat != lat_s) \
+                or (platepar.lon != lon_s) or (platepar.refraction != refraction_s):
+
+                subset = None
+
+
+        # Subset the whole catalog with a padded radius
+        if subset is None:
+
+            radius_s = (1.0 + self.padding)*fov_radius
+
+            _, cached_catalog = subsetCatalog(self.catalog_stars, ra_c, dec_c, jd, platepar.lat, \
+                platepar.lon, radius_s, lim_mag, tiles=catalogTiles(self.catalog_stars))
+
+            ra_cached = np.ascontiguousarray(cached_catalog[:, 0])
+            dec_cached = np.ascontiguousarray(cached_catalog[:, 1])
+
+            # Correct the catalog stars for refraction only once
+            if platepar.refraction:
+                ra_cached, dec_cached = eqRefractionTrueToApparent_vect(ra_cached, dec_cached, jd, \
+                    platepar.lat, platepar.lon)
+
+            subset = [ra_c, dec_c, radius_s, lim_mag, platepar.lat, platepar.lon, platepar.refraction, \
+                cached_catalog, ra_cached, dec_cached]
+
+            self.subsets[jd] = subset
+
+
+        cached_catalog, ra_cached, dec_cached = subset[7:]
+
+        # Take the stars inside the FOV from the cached subset. The subset keeps the order of the catalog and
+        #   all stars in it pass the elevation filter, so the result is the same as for the whole catalog
+        filtered_indices, extracted_catalog = subsetCatalog(cached_catalog, ra_c, dec_c, jd, platepar.lat, \
+            platepar.lon, fov_radius, lim_mag)
+
+        return extracted_catalog, ra_cached[filtered_indices], dec_cached[filtered_indices]
+
+
+
 
 def matchStarsResiduals(config, platepar, catalog_stars, star_dict, match_radius, ret_nmatch=False, \
-    sky_coords=False, lim_mag=None, verbose=False):
+    sky_coords=False, lim_mag=None, verbose=False, context=None):
     """ Match the image and catalog stars with the given astrometry solution and estimate the residuals
         between them.
 
@@ -68,6 +202,8 @@ def matchStarsResiduals(config, platepar, catalog_stars, star_dict, match_radius
             function, not image coordinates.
         lim_mag: [float] Override the limiting magnitude from config. None by default.
         verbose: [bool] Print results. True by default.
+        context: [MatchStarsContext] Catalog subsets cached between the calls during the fit. None by
+            default, in which case the whole catalog is subset on every call.
     Return:
         cost: [float] The cost function which weights the number of matched stars and the average deviation.
     """
@@ -103,18 +239,29 @@ def matchStarsResiduals(config, platepar, catalog_stars, star_dict, match_radius
         RA_c = RA_c[0]
         dec_c = dec_c[0]
 
-        # Get stars from the catalog around the defined center in a given radius
-        _, extracted_catalog = subsetCatalog(catalog_stars, RA_c, dec_c, jd, platepar.lat, platepar.lon, \
-            fov_radius, lim_mag)
-        ra_catalog, dec_catalog, mag_catalog = extracted_catalog.T
-
-
         # Extract stars for the given Julian date
         stars_list = star_dict[jd]
         stars_list = np.array(stars_list)
 
-        # Convert all catalog stars to image coordinates
-        cat_x_array, cat_y_array = raDecToXYPP(ra_catalog, dec_catalog, jd, platepar)
+        # Take the catalog stars from the cached subset, their coordinates are already corrected for 
+        #   refraction
+        if context is not None:
+
+            extracted_catalog, ra_catalog, dec_catalog = context.catalogSubset(jd, RA_c, dec_c, fov_radius, \
+                lim_mag, platepar)
+
+            # Convert all catalog stars to image coordinates
+            cat_x_array, cat_y_array = raDecToXYPP(ra_catalog, dec_catalog, jd, platepar, apparent=True)
+
+        else:
+
+            # Get stars from the catalog around the defined center in a given radius
+            _, extracted_catalog = subsetCatalog(catalog_stars, RA_c, dec_c, jd, platepar.lat, platepar.lon, \
+                fov_radius, lim_mag, tiles=catalogTiles(catalog_stars))
+            ra_catalog, dec_catalog, mag_catalog = extracted_catalog.T
+
+            # Convert all catalog stars to image coordinates
+            cat_x_array, cat_y_array = raDecToXYPP(ra_catalog, dec_catalog, jd, platepar)
 
         # Take only those stars which are within the FOV
         x_indices = np.argwhere((cat_x_array >= 0) & (cat_x_array < platepar.X_res))
@@ -265,7 +412,7 @@ def matchStarsResiduals(config, platepar, catalog_stars, star_dict, match_radius
 
 
 
-def checkFitGoodness(config, platepar, catalog_stars, star_dict, match_radius, verbose=False):
+def checkFitGoodness(config, platepar, catalog_stars, star_dict, match_radius, verbose=False, context=None):
     """ Checks if the platepar is 'good enough', given the extracted star positions. Returns True if the
         fit is deemed good, False otherwise. The goodness of fit is determined by 2 criteria: the average
         star residual (in pixels) has to be below a certain threshold, and an average number of matched stars
@@ -280,6 +427,7 @@ def checkFitGoodness(config, platepar, catalog_stars, star_dict, match_radius, v
         match_radius: [float] Maximum radius for star matching (pixels).
     Keyword arguments:
         verbose: [bool] If True, fit status will be printed on the screen. False by default.
+        context: [MatchStarsContext] Catalog subsets cached between the calls. None by default.
     Return:
         [bool] True if the platepar is good, False otherwise.
     """
@@ -290,7 +438,7 @@ def checkFitGoodness(config, platepar, catalog_stars, star_dict, match_radius, v
 
     # Match the stars and calculate the residuals
     n_matched, avg_dist, cost, matched_stars = matchStarsResiduals(config, platepar, catalog_stars, \
-        star_dict, match_radius, ret_nmatch=True, verbose=verbose)
+        star_dict, match_radius, ret_nmatch=True, verbose=verbose, context=context)
 
 
 
@@ -348,37 +496,175 @@ def checkFitGoodness(config, platepar, catalog_stars, star_dict, match_radius, v
 
 
 
-def _calcImageResidualsAstro(params, config, platepar, catalog_stars, star_dict, match_radius):
+def _calcImageResidualsAstro(params, config, platepar, catalog_stars, star_dict, match_radius, context=None):
     """ Calculates the differences between the stars on the image and catalog stars in image coordinates with
         the given astrometrical solution.
     Arguments:
         params: [list] Fit parameters - reference RA, Dec, position angle, and scale.
         config: [Config]
-        platepar: [Platepar]
+        platepar: [Platepar or PlateparView] If a PlateparView is given, it is used as a scratch platepar and
+            the fitting parameters are set to it.
         catalog_stars: [list] List of (ra, dec, mag) entries (angles in degrees).
         star_dict: [dict] Dictionary which contains the JD, and a list of (X, Y, bg_intens, intens) of the
             stars on the image.
         match_radius: [float] Star match radius (px).
+    Keyword arguments:
+        context: [MatchStarsContext] Catalog subsets cached between the calls. None by default.
     Return:
         [float] The average pixel residual (difference between image and catalog positions) normalized
             by the square root of the total number of matched stars.
     """
 
 
-    # Make a copy of the platepar
-    pp = copy.deepcopy(platepar)
+    # Use a scratch view of the platepar, so the whole platepar doesn't have to be copied
+    if not isinstance(platepar, Platepar.PlateparView):
+        platepar = Platepar.PlateparView(platepar)
 
-    # Extract fitting parameters
-    ra_ref, dec_ref, pos_angle_ref, F_scale = params
-
-    # Set the fitting parameters to the platepar clone
-    pp.RA_d = ra_ref
-    pp.dec_d = dec_ref
-    pp.pos_angle_ref = pos_angle_ref
-    pp.F_scale = F_scale
+    # Set the fitting parameters
+    platepar.setParams(params)
 
     # Match stars and calculate image residuals
-    return matchStarsResiduals(config, pp, catalog_stars, star_dict, match_radius, verbose=False)
+    return matchStarsResiduals(config, platepar, catalog_stars, star_dict, match_radius, verbose=False, \
+        context=context)
+
+
+
+def _calcMatchedStarsResidualsAstro(params, platepar, matched_stars):
+    """ Calculates the residual vector between the matched image and catalog stars in image coordinates, 
+        with the given astrometrical solution.
+
+    Arguments:
+        params: [list] Fit parameters - reference RA, Dec, position angle, and scale.
+        platepar: [PlateparView] A scratch platepar view which will be modified.
+        matched_stars: [dict] Matched stars, as returned by matchStarsResiduals.
+    Return:
+        [ndarray] X and Y differences between the catalog and image stars of all images (px).
+    """
+
+    # Set the fitting parameters to the platepar
+    platepar.setParams(params)
+
+    residuals = []
+    for jd in matched_stars:
+
+        matched_img_stars, matched_cat_stars, _ = matched_stars[jd]
+
+        # Project the matched catalog stars to the image
+        cat_x, cat_y = raDecToXYPP(matched_cat_stars[:, 0], matched_cat_stars[:, 1], jd, platepar)
+
+        residuals.append(cat_x - matched_img_stars[:, 1])
+        residuals.append(cat_y - matched_img_stars[:, 0])
+
+
+    return np.concatenate(residuals)
+
+
+
+def fitAstrometryLeastSquares(config, platepar, catalog_stars, star_dict, match_radius, context=None, \
+    max_rematch=5):
+    """ Fit the reference RA, Dec, position angle and scale by least squares on the matched stars. The 
+        stars are matched with the initial platepar, the parameters are fitted to the residual vector of
+        the matched pairs using a Jacobian estimated by finite differences, and the stars are matched again
+        with the new parameters, until the matched stars don't change anymore.
+
+    Arguments:
+        config: [Config]
+        platepar: [Platepar] Initial astrometry parameters, it will not be modified.
+        catalog_stars: [ndarray] An array of catalog stars (ra, dec, mag).
+        star_dict: [dict] Dictionary which contains the JD, and a list of (X, Y, bg_intens, intens) of the
+            stars on the image.
+        match_radius: [float] Star match radius (px).
+
+    Keyword arguments:
+        context: [MatchStarsContext] Catalog subsets cached between the calls. None by default.
+        max_rematch: [int] Maximum number of star matching and fitting iterations. 5 by default.
+
+    Return:
+        res: [OptimizeResult] Result of the last fit, the fitted parameters are in res.x. res.nfev is the
+            total number of evaluations of all fits.
+    """
+
+    pp = Platepar.PlateparView(platepar)
+
+    params = np.array(pp.params)
+
+    res = None
+    nfev = 0
+    prev_matched = None
+    for _ in range(max_rematch):
+
+        # Match the stars with the current parameters
+        n_matched, _, _, matched_stars = matchStarsResiduals(config, pp, catalog_stars, star_dict, \
+            match_radius, ret_nmatch=True, verbose=False, context=context)
+
+        if n_matched == 0:
+            break
+
+        # Stop if the same stars were matched as in the previous iteration
+        matched_ids = {jd: matched_stars[jd][1][:, :2].tobytes() for jd in matched_stars}
+        if matched_ids == prev_matched:
+            break
+
+        prev_matched = matched_ids
+
+        # Fit the parameters on the matched stars
+        res = scipy.optimize.least_squares(_calcMatchedStarsResidualsAstro, params, args=(pp, matched_stars), \
+            x_scale='jac')
+
+        nfev += res.nfev
+        params = res.x
+
+        # Set the fitted parameters to the platepar for the next matching
+        pp.setParams(params)
+
+
+    # Return a failed result if no stars were matched
+    if res is None:
+        res = scipy.optimize.OptimizeResult(x=params, success=False, nfev=nfev, \
+            message='No stars were matched!')
+
+    res.nfev = nfev
+
+    return res
+
+
+
+def refineAstrometry(config, platepar, catalog_stars, star_dict, match_radius, context=None):
+    """ Refine the reference RA, Dec, position angle and scale of the platepar by matching the image and 
+        catalog stars with the given radius. The fit method is chosen by config.astrometry_fit_method.
+
+    Arguments:
+        config: [Config]
+        platepar: [Platepar] Initial astrometry parameters, it will not be modified.
+        catalog_stars: [ndarray] An array of catalog stars (ra, dec, mag).
+        star_dict: [dict] Dictionary which contains the JD, and a list of (X, Y, bg_intens, intens) of the
+            stars on the image.
+        match_radius: [float] Star match radius (px).
+
+    Keyword arguments:
+        context: [MatchStarsContext] Catalog subsets cached between the calls. None by default.
+
+    Return:
+        res: [OptimizeResult] The fitted parameters are in res.x and res.success tells if the fit converged.
+    """
+
+    if config.astrometry_fit_method == 'least-squares':
+        return fitAstrometryLeastSquares(config, platepar, catalog_stars, star_dict, match_radius, \
+            context=context)
+
+
+    # Initial parameters for the astrometric fit
+    p0 = [platepar.RA_d, platepar.dec_d, platepar.pos_angle_ref, platepar.F_scale]
+
+    # Compute the minimization tolerance
+    fatol, xatol_ang = computeMinimizationTolerances(config, platepar, len(star_dict))
+
+    # Fit the astrometric parameters on a scratch view of the platepar
+    res = scipy.optimize.minimize(_calcImageResidualsAstro, p0, args=(config, Platepar.PlateparView(platepar), \
+        catalog_stars, star_dict, match_radius, context), method='Nelder-Mead', \
+        options={'fatol': fatol, 'xatol': xatol_ang})
+
+    return res
 
 
 
@@ -425,7 +711,147 @@ def starListToDict(config, calstars_list, max_ffs=None):
 
 
 
-def autoCheckFit(config, platepar, calstars_list, _fft_refinement=False):
+def plateparFingerprint(platepar):
+    """ Return the astrometry parameters of the platepar, which are stored with the ACF state so it is
+        used only with the platepar it was computed for.
+
+    Arguments:
+        platepar: [Platepar structure] Astrometry parameters.
+
+    Return:
+        [dict] Platepar parameters which can be saved to JSON.
+    """
+
+    fingerprint = {key: float(getattr(platepar, key)) for key in ['lat', 'lon', 'X_res', 'Y_res', 'JD', 'Ho', \
+        'RA_d', 'dec_d', 'pos_angle_ref', 'F_scale']}
+
+    fingerprint['distortion_type'] = str(platepar.distortion_type)
+    fingerprint['refraction'] = bool(platepar.refraction)
+    fingerprint['equal_aspect'] = bool(platepar.equal_aspect)
+    fingerprint['force_distortion_centre'] = bool(platepar.force_distortion_centre)
+    fingerprint['x_poly_fwd'] = np.array(platepar.x_poly_fwd, dtype=np.float64).tolist()
+    fingerprint['y_poly_fwd'] = np.array(platepar.y_poly_fwd, dtype=np.float64).tolist()
+
+    return fingerprint
+
+
+
+def saveACFState(state_path, config, platepar, star_dict, matched_stars):
+    """ Save the catalog stars matched by a successful ACF run and their residual statistics, which are used
+        to quickly validate the platepar on the next run.
+
+    Arguments:
+        state_path: [str] Path to the JSON file.
+        config: [Config structure]
+        platepar: [Platepar structure] Final astrometry parameters.
+        star_dict: [dict] Image stars used in the fit, see starListToDict.
+        matched_stars: [dict] Matched stars returned by matchStarsResiduals.
+    """
+
+    if not matched_stars:
+        return
+
+    # Take the unique matched catalog stars, sorted by declination as subsetCatalog requires
+    stars = np.unique(np.concatenate([matched_stars[jd][1][:, :3] for jd in matched_stars]), axis=0)
+    stars = np.ascontiguousarray(stars[np.argsort(stars[:, 1])[::-1]])
+
+    # Compute the residuals in the same way as they will be computed in the validation
+    n_matched, avg_dist, _, _ = matchStarsResiduals(config, platepar, stars, star_dict, \
+        ACF_INCREMENTAL_RADIUS, ret_nmatch=True)
+
+    state = {
+        'platepar': plateparFingerprint(platepar),
+        'median_residual': float(avg_dist),
+        'matched_per_image': n_matched/len(star_dict),
+        'stars': stars.tolist()
+        }
+
+    try:
+        with open(state_path, 'w') as f:
+            json.dump(state, f)
+
+    except (IOError, OSError):
+        print('The ACF state could not be saved to:', state_path)
+
+
+
+def loadACFState(state_path):
+    """ Load the ACF state saved by saveACFState. 
+
+    Arguments:
+        state_path: [str] Path to the JSON file.
+
+    Return:
+        [dict] ACF state, None if the file does not exist or cannot be read.
+    """
+
+    if not os.path.isfile(state_path):
+        return None
+
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+
+    except (IOError, OSError, ValueError):
+        return None
+
+
+
+def incrementalCheckFit(config, platepar, star_dict, state_path):
+    """ Validate the platepar by matching the image stars only to the catalog stars which were matched in
+        the last full ACF run, with a small match radius. The platepar is accepted if it is the same one that
+        the last ACF run produced, enough stars are matched, and the median residual did not grow by more
+        than config.acf_max_drift.
+
+    Arguments:
+        config: [Config structure]
+        platepar: [Platepar structure] Astrometry parameters.
+        star_dict: [dict] Image stars, see starListToDict.
+        state_path: [str] Path to the ACF state saved by saveACFState.
+
+    Return:
+        [bool] True if the platepar is still good, False if the full ACF should be run.
+    """
+
+    state = loadACFState(state_path)
+
+    if state is None:
+        return False
+
+    # The state is valid only for the platepar it was computed with
+    fingerprint = plateparFingerprint(platepar)
+    stored_fingerprint = state.get('platepar', {})
+    if any(fingerprint[key] != stored_fingerprint.get(key) for key in fingerprint):
+        print('The platepar changed since the last ACF run, running the full ACF...')
+        return False
+
+
+    print()
+    print("Validating the platepar with the stars matched in the last ACF run...")
+
+    stars = np.array(state['stars'], dtype=np.float64).reshape(-1, 3)
+
+    n_matched, avg_dist, _, _ = matchStarsResiduals(config, platepar, stars, star_dict, \
+        ACF_INCREMENTAL_RADIUS, ret_nmatch=True, verbose=True)
+
+    matched_per_image = n_matched/len(star_dict)
+    drift = avg_dist - state['median_residual']
+
+    print("    Matched stars per image = {:.1f}, last ACF run: {:.1f}".format(matched_per_image, \
+        state['matched_per_image']))
+    print("    Residual drift          = {:+.3f} px".format(drift))
+
+    if n_matched < config.calstars_files_N:
+        return False
+
+    if matched_per_image < ACF_INCREMENTAL_MIN_MATCH_FRACTION*state['matched_per_image']:
+        return False
+
+    return drift <= config.acf_max_drift
+
+
+
+def autoCheckFit(config, platepar, calstars_list, _fft_refinement=False, state_path=None, _plate_solved=False):
     """ Attempts to refine the astrometry fit with the given stars and and initial astrometry parameters.
     Arguments:
         config: [Config structure]
@@ -435,6 +861,11 @@ def autoCheckFit(config, platepar, calstars_list, _fft_refinement=False):
     Keyword arguments:
         _fft_refinement: [bool] Internal flag indicating that autoCF is running the second time recursively
             after FFT platepar adjustment.
+        state_path: [str] Path to the file with the stars matched in the last successful ACF run. If given,
+            the platepar is first validated with these stars and the full ACF is skipped if the platepar is
+            still good. The file is updated after every successful full ACF run. None by default.
+        _plate_solved: [bool] Internal flag indicating that autoCF is running recursively with the platepar
+            found by blind plate solving, after the FFT platepar adjustment failed.
 
     Return:
         (platepar, fit_status):
@@ -443,8 +874,8 @@ def autoCheckFit(config, platepar, calstars_list, _fft_refinement=False):
     """
 
 
-    def _handleFailure(config, platepar, calstars_list, catalog_stars, _fft_refinement):
-        """ Run FFT alignment before giving up on ACF. """
+    def _handleFailure(config, platepar, calstars_list, catalog_stars, _fft_refinement, _plate_solved):
+        """ Run FFT alignment and then blind plate solving before giving up on ACF. """
 
         if not _fft_refinement:
 
@@ -500,21 +931,42 @@ def autoCheckFit(config, platepar, calstars_list, _fft_refinement=False):
 
 
             # Redo autoCF
-            return autoCheckFit(config, platepar_refined, calstars_list, _fft_refinement=True)
+            return autoCheckFit(config, platepar_refined, calstars_list, _fft_refinement=True, \
+                state_path=state_path)
 
-        else:
-            print('Auto Check Fit failed completely, please redo the plate manually!')
-            return platepar, False
+        if config.acf_plate_solve and not _plate_solved:
 
+            print()
+            print("-------------------------------------------------------------------------------")
+            print('The FFT alignment failed, trying to find the pointing by blind plate solving...')
+            print()
 
-    if _fft_refinement:
-        print('Second ACF run with an updated platepar via FFT phase correlation...')
+            # Plate solving is only the last resort, so any error in it is treated as a failed solution
+            try:
+                platepar_solved = plateSolveCalstars(config, platepar, calstars_list, catalog_stars)
 
+            except Exception:
+                print('Plate solving failed with an error:')
+                print(traceback.format_exc())
+                platepar_solved = None
 
-    # Load catalog stars (overwrite the mag band ratios if specific catalog is used)
-    catalog_stars, _, config.star_catalog_band_ratios = StarCatalog.readStarCatalog(config.star_catalog_path, \
-        config.star_catalog_file, lim_mag=config.catalog_mag_limit, \
-        mag_band_ratios=config.star_catalog_band_ratios)
+            print()
+
+            # Redo autoCF
+            if platepar_solved is not None:
+                return autoCheckFit(config, platepar_solved, calstars_list, _fft_refinement=True, \
+                    state_path=state_path, _plate_solved=True)
+
+
+        print('Auto Check Fit failed completely, please redo the plate manually!')
+        return platepar, False
+
+
+    if _plate_solved:
+        print('ACF run with the platepar found by blind plate solving...')
+
+    elif _fft_refinement:
+        print('Second ACF run with an updated platepar via FFT phase correlation...')
 
 
     # Dictionary which will contain the JD, and a list of (X, Y, bg_intens, intens) of the stars
@@ -535,24 +987,45 @@ def autoCheckFit(config, platepar, calstars_list, _fft_refinement=False):
         return platepar, False
 
 
+    # Skip the full ACF if the platepar still fits the stars matched in the last run
+    if state_path is not None:
+        if incrementalCheckFit(config, platepar, star_dict, state_path):
+            print("The platepar is still good, skipping the full ACF!")
+            return platepar, True
+
+
+    # Load catalog stars (overwrite the mag band ratios if specific catalog is used)
+    catalog_stars, _, config.star_catalog_band_ratios = StarCatalog.readStarCatalog(config.star_catalog_path, \
+        config.star_catalog_file, lim_mag=config.catalog_mag_limit, \
+        mag_band_ratios=config.star_catalog_band_ratios)
+
+
     print()
 
 
+    # Catalog subsets around every image which will be reused during the fit
+    context = MatchStarsContext(catalog_stars)
+
+
     # A list of matching radiuses to try
     min_radius = 0.5
     radius_list = [10, 5, 3, 1.5, min_radius]
 
 
-    # Calculate the function tolerance, so the desired precision can be reached (the number is calculated
-    # in the same regard as the cost function)
-    fatol, xatol_ang = computeMinimizationTolerances(config, platepar, len(star_dict))
+    def _saveState(platepar):
+        """ Save the stars matched with the final platepar for the validation on the next run. """
+
+        if state_path is not None:
+            _, _, _, matched_stars = matchStarsResiduals(config, platepar, catalog_stars, star_dict, \
+                min_radius, ret_nmatch=True, context=context)
+            saveACFState(state_path, config, platepar, star_dict, matched_stars)
 
 
     ### If the initial match is good enough, do only quick recalibratoin ###
 
     # Match the stars and calculate the residuals
     n_matched, avg_dist, cost, _ = matchStarsResiduals(config, platepar, catalog_stars, star_dict, \
-        min_radius, ret_nmatch=True)
+        min_radius, ret_nmatch=True, context=context)
 
     if n_matched >= config.calstars_files_N:
 
@@ -572,7 +1045,7 @@ def autoCheckFit(config, platepar, calstars_list, _fft_refinement=False):
 
         # Match the stars and calculate the residuals
         n_matched, avg_dist, cost, _ = matchStarsResiduals(config, platepar, catalog_stars, star_dict, \
-            match_radius, ret_nmatch=True)
+            match_radius, ret_nmatch=True, context=context)
 
         print()
         print("-------------------------------------------------------------")
@@ -588,26 +1061,25 @@ def autoCheckFit(config, platepar, calstars_list, _fft_refinement=False):
             print("The total number of initially matched stars is too small! Please manually redo the plate or make sure there are enough calibration stars.")
 
             # Try to refine the platepar with FFT phase correlation and redo the ACF
-            return _handleFailure(config, platepar, calstars_list, catalog_stars, _fft_refinement)
+            return _handleFailure(config, platepar, calstars_list, catalog_stars, _fft_refinement, \
+                _plate_solved)
 
 
         # Check if the platepar is good enough and do not estimate further parameters
-        if checkFitGoodness(config, platepar, catalog_stars, star_dict, min_radius, verbose=True):
+        if checkFitGoodness(config, platepar, catalog_stars, star_dict, min_radius, verbose=True, \
+            context=context):
 
             # Print out notice only if the platepar is good right away
             if i == 0:
                 print("Initial platepar is good enough!")
 
-            return platepar, True
+            _saveState(platepar)
 
+            return platepar, True
 
-        # Initial parameters for the astrometric fit
-        p0 = [platepar.RA_d, platepar.dec_d, platepar.pos_angle_ref, platepar.F_scale]
 
         # Fit the astrometric parameters
-        res = scipy.optimize.minimize(_calcImageResidualsAstro, p0, args=(config, platepar, catalog_stars, \
-            star_dict, match_radius), method='Nelder-Mead', \
-            options={'fatol': fatol, 'xatol': xatol_ang})
+        res = refineAstrometry(config, platepar, catalog_stars, star_dict, match_radius, context=context)
 
         print(res)
 
@@ -615,7 +1087,8 @@ def autoCheckFit(config, platepar, calstars_list, _fft_refinement=False):
         if not res.success:
 
             # Try to refine the platepar with FFT phase correlation and redo the ACF
-            return _handleFailure(config, platepar, calstars_list, catalog_stars, _fft_refinement)
+            return _handleFailure(config, platepar, calstars_list, catalog_stars, _fft_refinement, \
+                _plate_solved)
 
 
         else:
@@ -630,14 +1103,18 @@ def autoCheckFit(config, platepar, calstars_list, _fft_refinement=False):
 
 
         # Check if the platepar is good enough and do not estimate further parameters
-        if checkFitGoodness(config, platepar, catalog_stars, star_dict, min_radius, verbose=True):
+        if checkFitGoodness(config, platepar, catalog_stars, star_dict, min_radius, verbose=True, \
+            context=context):
+
+            _saveState(platepar)
+
             return platepar, True
 
 
 
     # Match the stars and calculate the residuals
     n_matched, avg_dist, cost, matched_stars = matchStarsResiduals(config, platepar, catalog_stars, \
-        star_dict, min_radius, ret_nmatch=True)
+        star_dict, min_radius, ret_nmatch=True, context=context)
 
     print("FINAL SOLUTION with radius {:.1} px:".format(min_radius))
     print("    Matched stars     = {:>6d}".format(n_matched))
@@ -654,6 +1131,9 @@ def autoCheckFit(config, platepar, calstars_list, _fft_refinement=False):
     # Recompute the rotation wrt horizon
     platepar.rotation_from_horiz = rotationWrtHorizon(platepar)
 
+    if state_path is not None:
+        saveACFState(state_path, config, platepar, star_dict, matched_stars)
+
 
 
     return platepar, True
@@ -727,8 +1207,13 @@ if __name__ == "__main__":
 
 
 
+    # Validate the platepar with the stars from the last run if enabled
+    state_path = None
+    if config.acf_incremental:
+        state_path = os.path.join(dir_path, config.acf_state_name)
+
     # Run the automatic astrometry fit
-    pp, fit_status = autoCheckFit(config, platepar, calstars_list)
+    pp, fit_status = autoCheckFit(config, platepar, calstars_list, state_path=state_path)
 
 
     # If the fit suceeded, save the platepar
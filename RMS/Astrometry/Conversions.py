@@ -193,6 +193,106 @@ def datetime2JD(dt, UT_corr=0.0):
                    UT_corr=UT_corr)
 
 
+def _unixDays2JD(days, day_seconds, microseconds, UT_corr=0.0):
+    """ Convert arrays of days since 1970-01-01, seconds of the day and microseconds to Julian dates. The
+        computation is done in integer microseconds and the result is formed in the same way as in date2JD,
+        so the Julian dates are identical.
+    """
+
+    us_per_day = 86400*1000000
+
+    # Days from 1970-01-01 00:00 to the Julian epoch (2000-01-01 12:00)
+    epoch_days = (JULIAN_EPOCH - datetime(1970, 1, 1)).days
+    epoch_seconds = (JULIAN_EPOCH - datetime(1970, 1, 1)).seconds
+
+    # Total number of microseconds since the beginning of the Julian date count
+    total_us = (days - epoch_days + J2000_JD.days)*us_per_day + (day_seconds - epoch_seconds)*1000000 \
+        + microseconds - int(round(UT_corr*3600*1000000))
+
+    julian_days = total_us//us_per_day
+    day_us = total_us%us_per_day
+
+    return julian_days + (day_us//1000000 + (day_us%1000000)/1000000.0)/86400.0
+
+
+def date2JDArray(time_data, UT_corr=0.0):
+    """ Convert an array of dates and times to Julian dates in one vectorized call. The results are
+        identical to calling date2JD on every entry.
+
+    Arguments:
+        time_data: [2D ndarray] Array of (year, month, day, hour, minute, second, millisecond) rows. The
+            millisecond column may be omitted.
+
+    Keyword arguments:
+        UT_corr: [float] UT correction in hours (difference from local time to UT)
+
+    Return:
+        [ndarray] Julian dates.
+    """
+
+    time_data = np.array(time_data, dtype=np.float64)
+
+    # No dates given
+    if len(time_data) == 0:
+        return np.array([], dtype=np.float64)
+
+    time_data = np.atleast_2d(time_data)
+
+    year, month, day, hour, minute, second = np.trunc(time_data[:, :6]).astype(np.int64).T
+
+    # Milliseconds are converted to microseconds in the same way as in date2JD
+    if time_data.shape[1] > 6:
+        microseconds = np.trunc(time_data[:, 6]*1000).astype(np.int64)
+    else:
+        microseconds = np.zeros_like(year)
+
+    # Compute the number of days since 1970-01-01
+    months = (year - 1970).astype('datetime64[Y]').astype('datetime64[M]') \
+        + (month - 1).astype('timedelta64[M]')
+    days = (months.astype('datetime64[D]') + (day - 1).astype('timedelta64[D]')).astype(np.int64)
+
+    return _unixDays2JD(days, 3600*hour + 60*minute + second, microseconds, UT_corr=UT_corr)
+
+
+def datetimeOffsets2JD(dt, offsets, UT_corr=0.0, truncate_ms=False):
+    """ Convert time offsets from the given reference time (e.g. frame times from the beginning of an FF
+        file) to Julian dates in one vectorized call. The results are identical to calling
+        datetime2JD(dt + timedelta(seconds=offset)) for every offset.
+
+    Arguments:
+        dt: [datetime object] Reference time.
+        offsets: [ndarray] Time offsets from the reference time (seconds).
+
+    Keyword arguments:
+        UT_corr: [float] UT correction in hours (difference from local time to UT)
+        truncate_ms: [bool] Truncate the times to whole milliseconds, as when the times are given as 
+            (year, month, day, hour, minute, second, int(microsecond/1000)) to date2JD. False by default.
+
+    Return:
+        [ndarray] Julian dates.
+    """
+
+    us_per_day = 86400*1000000
+
+    # Microseconds from 1970-01-01 to the reference time
+    td = dt - datetime(1970, 1, 1)
+    ref_us = (td.days*86400 + td.seconds)*1000000 + td.microseconds
+
+    # Add the offsets rounded to microseconds, as timedelta does
+    total_us = ref_us + np.round(np.array(offsets, dtype=np.float64)*1000000).astype(np.int64)
+
+    days = total_us//us_per_day
+    day_us = total_us%us_per_day
+
+    # Microseconds go through milliseconds as in datetime2JD
+    if truncate_ms:
+        microseconds = 1000*((day_us%1000000)//1000)
+    else:
+        microseconds = np.trunc(((day_us%1000000)/1000.0)*1000).astype(np.int64)
+
+    return _unixDays2JD(days, day_us//1000000, microseconds, UT_corr=UT_corr)
+
+
 def jd2Date(jd, UT_corr=0, dt_obj=False):
     """ Converts the given Julian date to (year, month, day, hour, minute, second, millisecond) tuple.
     Arguments:
@@ -459,7 +559,14 @@ def trueRaDec2ApparentAltAz(ra, dec, jd, lat, lon, refraction=True):
     if isinstance(ra, float) or isinstance(ra, int) or isinstance(ra, np.float64):
         azim, elev = cy.trueRaDec2ApparentAltAz(ra, dec, jd, lat, lon, refraction)
     elif isinstance(ra, np.ndarray):
-        azim, elev = cy.trueRaDec2ApparentAltAz_vect(ra, dec, jd, lat, lon, refraction)
+
+        # Every point has its own time
+        if isinstance(jd, np.ndarray):
+            azim, elev = cy.trueRaDec2ApparentAltAzArray(ra, dec, jd.astype(np.float64), lat, lon, refraction)
+
+        else:
+            azim, elev = cy.trueRaDec2ApparentAltAz_vect(ra, dec, jd, lat, lon, refraction)
+
     else:
         raise TypeError("ra must be a number or np.ndarray, given: {}".format(type(ra)))
 
@@ -7,6 +7,7 @@ import numpy as np
 # Cython import
 cimport numpy as np
 cimport cython
+from cython.parallel cimport prange
 
 # Import the Python bool type
 from cpython cimport bool
@@ -27,7 +28,7 @@ cdef double pi = np.pi
 cdef double J2000_DAYS = 2451545.0
 
 # Declare math functions
-cdef extern from "math.h":
+cdef extern from "math.h" nogil:
     double fabs(double)
     double sin(double)
     double asin(double)
@@ -36,10 +37,12 @@ cdef extern from "math.h":
     double tan(double)
     double atan2(double, double)
     double sqrt(double)
+    double floor(double)
+    bint isfinite(double)
 
 
 @cython.cdivision(True)
-cdef double radians(double deg):
+cdef double radians(double deg) noexcept nogil:
     """Converts degrees to radians.
     """
 
@@ -47,7 +50,7 @@ cdef double radians(double deg):
 
 
 @cython.cdivision(True)
-cdef double degrees(double deg):
+cdef double degrees(double deg) noexcept nogil:
     """Converts radians to degrees.
     """
 
@@ -56,7 +59,7 @@ cdef double degrees(double deg):
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-cpdef double angularSeparation(double ra1, double dec1, double ra2, double dec2):
+cpdef double angularSeparation(double ra1, double dec1, double ra2, double dec2) noexcept nogil:
     """ Calculate the angular separation between 2 stars in equatorial celestial coordinates. 
     
     Source of the equation: http://www.astronomycafe.net/qadir/q1890.html (May 1, 2016)
@@ -101,10 +104,176 @@ def angularSeparation_fv(double ra1, double dec1,
     return np.degrees(np.arccos(sin(dec1)*np.sin(dec2) + np.cos(dec1)*np.cos(dec2)*np.cos(ra2 - ra1)))
 
 
+@cython.cdivision(True)
+cdef inline double _elevation(double ra, double dec, double lst, double sin_lat, double cos_lat) noexcept \
+    nogil:
+    """ Compute the elevation of a star in the same way as cyraDec2AltAz, but with the local sidereal time and
+        the latitude terms precomputed.
+
+    Arguments:
+        ra: [float] Right ascension in radians.
+        dec: [float] Declination in radians.
+        lst: [float] Local sidereal time in radians.
+        sin_lat: [float] Sine of the latitude.
+        cos_lat: [float] Cosine of the latitude.
+
+    Return:
+        elev: [float] Elevation above horizon in radians.
+    """
+
+    cdef double ha, sin_elev
+
+    # Calculate the hour angle and constrain it to [-pi, pi] range
+    ha = lst - ra
+    ha = (ha + pi)%(2*pi) - pi
+
+    # Calculate the sine of elevation and wrap it in the [-1, +1] range
+    sin_elev = sin_lat*sin(dec) + cos_lat*cos(dec)*cos(ha)
+    sin_elev = (sin_elev + 1)%2 - 1
+
+    return asin(sin_elev)
+
+
+
+def buildCatalogTiles(np.ndarray[FLOAT_TYPE_t, ndim=2] catalog_list, double tile_size=2.0):
+    """ Build a sky tile index of the star catalog, which is used by subsetCatalog to check only the stars in
+        the tiles which overlap the extraction cone. The sky is split into declination bands of the given
+        width, and every band is split into RA cells which are roughly as wide as the band.
+
+    Arguments:
+        catalog_list: [ndarray] An array of (ra, dec, mag) pairs for stars (J2000, degrees).
+
+    Keyword arguments:
+        tile_size: [float] Size of the tiles (degrees). 2 by default.
+
+    Return:
+        (tile_size, band_tile_start, band_n_ra, tile_offsets, tile_stars): [tuple]
+            - tile_size - Size of the tiles (degrees).
+            - band_tile_start - Index of the first tile in every declination band, bands go from +90 down.
+            - band_n_ra - Number of RA cells in every declination band.
+            - tile_offsets - Index of the first star of every tile in tile_stars, with the total number of
+                stars at the end.
+            - tile_stars - Catalog indices of stars sorted by tile, and ascending inside every tile.
+    """
+
+    cdef int n_bands = int(np.ceil(180.0/tile_size))
+    cdef int b
+    cdef double dec_hi, dec_lo, cos_max
+
+    # Number of RA cells in every declination band, the cells are as wide as the band where the band is
+    #   the widest
+    band_n_ra = np.zeros(n_bands, dtype=np.int64)
+    for b in range(n_bands):
+
+        dec_hi = 90.0 - b*tile_size
+        dec_lo = max(90.0 - (b + 1)*tile_size, -90.0)
+
+        if (dec_hi >= 0) and (dec_lo <= 0):
+            cos_max = 1.0
+        else:
+            cos_max = max(cos(radians(dec_hi)), cos(radians(dec_lo)))
+
+        band_n_ra[b] = max(1, int(360.0*cos_max/tile_size))
+
+    band_tile_start = np.zeros(n_bands + 1, dtype=np.int64)
+    band_tile_start[1:] = np.cumsum(band_n_ra)
+
+    # Compute the tile of every star
+    ra = catalog_list[:, 0]%360.0
+    band = np.clip(((90.0 - catalog_list[:, 1])/tile_size).astype(np.int64), 0, n_bands - 1)
+    n_ra = band_n_ra[band]
+    cell = np.minimum((ra*n_ra/360.0).astype(np.int64), n_ra - 1)
+    tile_ids = band_tile_start[band] + cell
+
+    # Sort the stars by tile, the stable sort keeps the catalog order inside every tile
+    tile_stars = np.argsort(tile_ids, kind='mergesort').astype(np.int64)
+    tile_offsets = np.searchsorted(tile_ids[tile_stars], np.arange(band_tile_start[-1] + 1)).astype(np.int64)
+
+    return tile_size, band_tile_start, band_n_ra, tile_offsets, tile_stars
+
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef object _tileCandidates(tuple tiles, double ra_c, double dec_c, double radius, double dec_min,
+        double dec_max, long max_candidates):
+    """ Return sorted catalog indices of all stars in the tiles which overlap the extraction cone. See
+        buildCatalogTiles for the description of the tiles. None is returned if there are more than
+        max_candidates stars in these tiles, as then the declination band scan is faster.
+    """
+
+    cdef double tile_size, ra_half, cell_width, margin
+    cdef long b, b_min, b_max, c, c_lo, c_hi, n_ra, n_bands, tile, n_candidates, k, m
+    cdef bint all_cells
+
+    cdef np.ndarray[np.int64_t, ndim=1] band_tile_start, band_n_ra, tile_offsets, tile_stars
+    cdef np.ndarray[np.int64_t, ndim=1] candidates = None
+
+    tile_size, band_tile_start, band_n_ra, tile_offsets, tile_stars = tiles
+    n_bands = band_n_ra.shape[0]
+
+    # Small margin which makes sure that stars on the tile edges are never missed due to rounding
+    margin = 1e-6
+
+    # Range of declination bands
+    b_min = max(int((90.0 - dec_max - margin)/tile_size), 0)
+    b_max = min(int((90.0 - dec_min + margin)/tile_size), n_bands - 1)
+
+    # Half width of the cone in RA. If the cone contains a pole, all RA cells have to be checked
+    all_cells = (dec_max >= 90) or (dec_min <= -90) or (radius >= 90)
+    ra_half = 180.0
+    if not all_cells:
+        ra_half = degrees(asin(min(sin(radians(radius))/cos(radians(dec_c)), 1.0))) + margin
+
+    # Count the candidates first, so the buffer can be allocated with the right size
+    n_candidates = 0
+    for k in range(2):
+
+        if k == 1:
+
+            if n_candidates > max_candidates:
+                return None
+
+            candidates = np.empty(n_candidates, dtype=np.int64)
+            n_candidates = 0
+
+        for b in range(b_min, b_max + 1):
+
+            n_ra = band_n_ra[b]
+            cell_width = 360.0/n_ra
+
+            # Range of RA cells in this band (they may wrap around 0)
+            c_lo = <long>floor((ra_c - ra_half)/cell_width)
+            c_hi = <long>floor((ra_c + ra_half)/cell_width)
+
+            if all_cells or (c_hi - c_lo + 1 >= n_ra):
+                c_lo = 0
+                c_hi = n_ra - 1
+
+            for c in range(c_lo, c_hi + 1):
+
+                tile = band_tile_start[b] + (c%n_ra + n_ra)%n_ra
+
+                if k == 0:
+                    n_candidates += tile_offsets[tile + 1] - tile_offsets[tile]
+
+                else:
+                    for m in range(tile_offsets[tile], tile_offsets[tile + 1]):
+                        candidates[n_candidates] = tile_stars[m]
+                        n_candidates += 1
+
+
+    # Sort the candidates, so the stars are checked in the catalog order
+    candidates.sort()
+
+    return candidates
+
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 def subsetCatalog(np.ndarray[FLOAT_TYPE_t, ndim=2] catalog_list, double ra_c, double dec_c, double jd,
-        double lat, double lon, double radius, double mag_limit):
+        double lat, double lon, double radius, double mag_limit, tuple tiles=None):
     """ Make a subset of stars from the given star catalog around the given coordinates with a given radius.
 
     Arguments:
@@ -116,6 +285,12 @@ def subsetCatalog(np.ndarray[FLOAT_TYPE_t, ndim=2] catalog_list, double ra_c, do
         lon: [float] Observer longitude (deg).
         radius: [float] Extraction radius (degrees).
         mag_limit: [float] Limiting magnitude.
+
+    Keyword arguments:
+        tiles: [tuple] Sky tile index of catalog_list built by buildCatalogTiles. If given, only the stars
+            in the tiles which overlap the extraction cone are checked. The results are identical to the 
+            ones without the index. None by default.
+
     Return:
         filtered_indices, filtered_list: (ndarray, ndarray)
             - filtered_indices - Indices of catalog_list entries which satifly the filters.
@@ -125,14 +300,14 @@ def subsetCatalog(np.ndarray[FLOAT_TYPE_t, ndim=2] catalog_list, double ra_c, do
 
 
     # Define variables
-    cdef int i, k
+    cdef int i, j, k, i_start, i_end, n_candidates
     cdef double dec_min, dec_max
     cdef double ra, dec, mag, elev
-    cdef np.ndarray[FLOAT_TYPE_t, ndim=2] filtered_list = np.zeros(shape=(catalog_list.shape[0], \
-        catalog_list.shape[1]), dtype=FLOAT_TYPE)
-
-    cdef np.ndarray[INT_TYPE_t, ndim=1] filtered_indices = np.zeros(shape=(catalog_list.shape[0]), \
-        dtype=INT_TYPE)
+    cdef double lst, sin_lat, cos_lat, sin_dec_c, cos_dec_c
+    cdef np.ndarray[FLOAT_TYPE_t, ndim=2] filtered_list
+    cdef np.ndarray[INT_TYPE_t, ndim=1] filtered_indices
+    cdef np.ndarray[np.int64_t, ndim=1] candidates = None
+    cdef bint use_tiles
 
     # Calculate minimum and maximum declination
     dec_min = dec_c - radius
@@ -143,26 +318,80 @@ def subsetCatalog(np.ndarray[FLOAT_TYPE_t, ndim=2] catalog_list, double ra_c, do
     if dec_max > 90:
         dec_max = 90
 
+
+    # The catalog is sorted by descending declination, so find the first star below the maximum declination
+    #   by bisection
+    i_start = 0
+    i_end = catalog_list.shape[0]
+    while i_start < i_end:
+
+        i = (i_start + i_end)//2
+
+        if catalog_list[i, 1] > dec_max:
+            i_start = i + 1
+        else:
+            i_end = i
+
+    # Find the first star below the minimum declination in the same way
+    i = i_start
+    i_end = catalog_list.shape[0]
+    while i < i_end:
+
+        j = (i + i_end)//2
+
+        if catalog_list[j, 1] >= dec_min:
+            i = j + 1
+        else:
+            i_end = j
+
+    n_candidates = i_end - i_start
+
+    # Take the candidate stars from the tiles which overlap the cone, if there are fewer of them than stars in
+    #   the declination band
+    candidates_obj = None
+    if tiles is not None:
+        candidates_obj = _tileCandidates(tiles, ra_c, dec_c, radius, dec_min, dec_max, n_candidates)
+
+    use_tiles = candidates_obj is not None
+    if use_tiles:
+        candidates = candidates_obj
+        n_candidates = candidates.shape[0]
+
+
+    # Allocate the output buffers only for the candidate stars
+    filtered_list = np.zeros(shape=(n_candidates, catalog_list.shape[1]), dtype=FLOAT_TYPE)
+    filtered_indices = np.zeros(shape=(n_candidates), dtype=INT_TYPE)
+
+    # Compute the local sidereal time and the trigonometric functions of the latitude and the centre only once
+    lst = radians(cyjd2LST(jd, degrees(radians(lon))))
+    sin_lat = sin(radians(lat))
+    cos_lat = cos(radians(lat))
+    sin_dec_c = sin(radians(dec_c))
+    cos_dec_c = cos(radians(dec_c))
+
     k = 0
-    for i in range(catalog_list.shape[0]):
+    for j in range(n_candidates):
+
+        if use_tiles:
+            i = candidates[j]
+        else:
+            i = i_start + j
 
         ra = catalog_list[i,0]
         dec = catalog_list[i,1]
         mag = catalog_list[i,2]
 
-        # Skip if the declination is too large
-        if dec > dec_max:
+        # Skip if the declination is outside the range
+        if (dec > dec_max) or (dec < dec_min):
             continue
 
-        # End the loop if the declination is too small
-        if dec < dec_min:
-            break
-
-        # Add star to the list if it is within a given radius and has a certain brightness
-        if (angularSeparation(ra, dec, ra_c, dec_c) <= radius) and (mag <= mag_limit):
+        # Add star to the list if it is within a given radius and has a certain brightness (the angular
+        #   separation is computed in the same way as in angularSeparation)
+        if (degrees(acos(sin(radians(dec))*sin_dec_c + cos(radians(dec))*cos_dec_c*cos(radians(ra_c) \
+            - radians(ra)))) <= radius) and (mag <= mag_limit):
 
             # Compute the local star elevation
-            _, elev = cyraDec2AltAz(radians(ra), radians(dec), jd, radians(lat), radians(lon))
+            elev = _elevation(radians(ra), radians(dec), lst, sin_lat, cos_lat)
 
 
             # Only take stars above -20 degrees
@@ -185,11 +414,203 @@ def subsetCatalog(np.ndarray[FLOAT_TYPE_t, ndim=2] catalog_list, double ra_c, do
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
+@cython.cdivision(True)
 def matchStars(np.ndarray[FLOAT_TYPE_t, ndim=2] stars_list, np.ndarray[FLOAT_TYPE_t, ndim=1] cat_x_array, \
     np.ndarray[FLOAT_TYPE_t, ndim=1] cat_y_array, np.ndarray[INT_TYPE_t, ndim=1] cat_good_indices, \
     double max_radius):
+    """ Match image stars to the closest catalog stars within the given radius. 
+
+    The catalog stars are put in a uniform grid with the cell size of at least max_radius, so only the 
+    catalog stars in the 3x3 cells around each image star have to be checked. If several catalog stars are 
+    at the same distance, the one which comes first in cat_good_indices is taken, so the results are 
+    identical to matchStarsBruteForce.
+
+    Arguments:
+        stars_list: [ndarray] Image stars, the first two columns are (y, x).
+        cat_x_array: [ndarray] X image coordinates of catalog stars.
+        cat_y_array: [ndarray] Y image coordinates of catalog stars.
+        cat_good_indices: [ndarray] Indices of catalog stars which should be matched.
+        max_radius: [float] Maximum match distance in pixels.
+
+    Return:
+        matched_indices: [ndarray] Rows of (image star index, catalog star index, distance).
+    """
 
 
+    cdef int i, j, n, cell, cx, cy, cx_min, cx_max, cy_min, cy_max, best_j
+    cdef unsigned int cat_idx
+    cdef int k = 0
+    cdef double min_dist, dist
+    cdef double cat_match_indx, im_star_y, im_star_x, cat_x, cat_y
+    cdef double x_min, x_max, y_min, y_max, cell_size
+
+    # Get the lenghts of input arrays
+    cdef int stars_len = stars_list.shape[0]
+    cdef int cat_len = cat_good_indices.shape[0]
+
+    # List for matched indices
+    cdef np.ndarray[FLOAT_TYPE_t, ndim=2] matched_indices = np.zeros(shape=(stars_list.shape[0], 3), \
+        dtype=FLOAT_TYPE)
+
+    # Nothing can be matched
+    if (max_radius <= 0) or (cat_len == 0) or (stars_len == 0):
+        return matched_indices[:0]
+
+
+    ### Put the catalog stars into a grid ###
+
+    # Find the extent of the catalog stars
+    x_min = y_min = np.inf
+    x_max = y_max = -np.inf
+    for j in range(cat_len):
+
+        cat_idx = cat_good_indices[j]
+        cat_x = cat_x_array[cat_idx]
+        cat_y = cat_y_array[cat_idx]
+
+        if not (isfinite(cat_x) and isfinite(cat_y)):
+            continue
+
+        if cat_x < x_min: x_min = cat_x
+        if cat_x > x_max: x_max = cat_x
+        if cat_y < y_min: y_min = cat_y
+        if cat_y > y_max: y_max = cat_y
+
+
+    # All catalog coordinates are NaN
+    if x_min > x_max:
+        return matched_indices[:0]
+
+
+    # Choose the cell size so that all matches are in the neighbouring cells, and that the number of cells 
+    #   is not much larger than the number of stars
+    cell_size = max_radius
+    n = <int>sqrt(cat_len) + 1
+    if (x_max - x_min)/n > cell_size: cell_size = (x_max - x_min)/n
+    if (y_max - y_min)/n > cell_size: cell_size = (y_max - y_min)/n
+
+    cdef int nx = <int>floor((x_max - x_min)/cell_size) + 1
+    cdef int ny = <int>floor((y_max - y_min)/cell_size) + 1
+
+    # Assign every catalog star to a cell (-1 for invalid coordinates)
+    cdef np.ndarray[np.int32_t, ndim=1] star_cells = np.empty(cat_len, dtype=np.int32)
+    cdef np.ndarray[np.int32_t, ndim=1] cell_start = np.zeros(nx*ny + 1, dtype=np.int32)
+    cdef np.ndarray[np.int32_t, ndim=1] cell_fill = np.zeros(nx*ny, dtype=np.int32)
+    cdef np.ndarray[np.int32_t, ndim=1] cell_stars = np.empty(cat_len, dtype=np.int32)
+
+    for j in range(cat_len):
+
+        cat_idx = cat_good_indices[j]
+        cat_x = cat_x_array[cat_idx]
+        cat_y = cat_y_array[cat_idx]
+
+        if not (isfinite(cat_x) and isfinite(cat_y)):
+            star_cells[j] = -1
+            continue
+
+        cell = <int>((cat_y - y_min)/cell_size)*nx + <int>((cat_x - x_min)/cell_size)
+        star_cells[j] = cell
+        cell_start[cell + 1] += 1
+
+    for cell in range(nx*ny):
+        cell_start[cell + 1] += cell_start[cell]
+
+    # Store the star indices ordered by cell, keeping the order of stars inside every cell
+    for j in range(cat_len):
+
+        cell = star_cells[j]
+        if cell < 0:
+            continue
+
+        cell_stars[cell_start[cell] + cell_fill[cell]] = j
+        cell_fill[cell] += 1
+
+
+    ### Match image and catalog stars ###
+
+    # Go through all image stars
+    for i in range(stars_len):
+
+        # Extract image star coordinates
+        im_star_y = stars_list[i, 0]
+        im_star_x = stars_list[i, 1]
+
+        if not (isfinite(im_star_x) and isfinite(im_star_y)):
+            continue
+
+        # Skip the stars which are too far from all catalog stars
+        if (im_star_x < x_min - max_radius) or (im_star_x > x_max + max_radius) \
+            or (im_star_y < y_min - max_radius) or (im_star_y > y_max + max_radius):
+
+            continue
+
+        min_dist = max_radius
+        cat_match_indx = -1
+        best_j = cat_len
+
+        # Find the cells around the image star
+        cx = <int>floor((im_star_x - x_min)/cell_size)
+        cy = <int>floor((im_star_y - y_min)/cell_size)
+
+        cx_min = cx - 1 if cx > 0 else 0
+        cx_max = cx + 1 if cx < nx - 1 else nx - 1
+        cy_min = cy - 1 if cy > 0 else 0
+        cy_max = cy + 1 if cy < ny - 1 else ny - 1
+
+        # Check for the best match among catalog stars in the neighbouring cells
+        for cy in range(cy_min, cy_max + 1):
+            for cx in range(cx_min, cx_max + 1):
+
+                cell = cy*nx + cx
+
+                for n in range(cell_start[cell], cell_start[cell + 1]):
+
+                    j = cell_stars[n]
+                    cat_idx = cat_good_indices[j]
+
+                    # Extract catalog coordinates
+                    cat_x = cat_x_array[cat_idx]
+                    cat_y = cat_y_array[cat_idx]
+
+                    # Calculate the distance between stars
+                    dist = sqrt((im_star_x - cat_x)**2 + (im_star_y - cat_y)**2)
+
+                    # Set the catalog star as the best match if it is the closest to the image star, 
+                    #   preferring the star which comes first in the list of catalog stars
+                    if (dist < min_dist) or ((dist == min_dist) and (j < best_j) and (dist < max_radius)):
+                        min_dist = dist
+                        cat_match_indx = cat_idx
+                        best_j = j
+
+
+        # Take the best matched star if the distance was within the maximum radius
+        if min_dist < max_radius:
+
+            # Add the matched indices to the output list
+            matched_indices[k, 0] = i
+            matched_indices[k, 1] = cat_match_indx
+            matched_indices[k, 2] = min_dist
+
+            k += 1
+
+
+
+    # Cut the output list to the number of matched stars
+    matched_indices = matched_indices[:k]
+
+    return matched_indices
+
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def matchStarsBruteForce(np.ndarray[FLOAT_TYPE_t, ndim=2] stars_list, np.ndarray[FLOAT_TYPE_t, ndim=1] cat_x_array, \
+    np.ndarray[FLOAT_TYPE_t, ndim=1] cat_y_array, np.ndarray[INT_TYPE_t, ndim=1] cat_good_indices, \
+    double max_radius):
+    """ Match image and catalog stars by comparing every image star with every catalog star. This is the 
+        reference implementation of matchStars, which gives identical results.
+    """
+
     cdef int i, j
     cdef unsigned int cat_idx
     cdef int k = 0
@@ -256,7 +677,7 @@ def matchStars(np.ndarray[FLOAT_TYPE_t, ndim=2] stars_list, np.ndarray[FLOAT_TYP
 
 
 @cython.cdivision(True)
-cdef double cyjd2LST(double jd, double lon):
+cdef double cyjd2LST(double jd, double lon) noexcept nogil:
     """ Convert Julian date to apparent Local Sidereal Time. The times is apparent, not mean!
     Source: J. Meeus: Astronomical Algorithms
     Arguments:
@@ -283,7 +704,7 @@ cdef double cyjd2LST(double jd, double lon):
 
 @cython.cdivision(True)
 cpdef (double, double) equatorialCoordPrecession(double start_epoch, double final_epoch, double ra, \
-    double dec):
+    double dec) noexcept nogil:
     """ Corrects Right Ascension and Declination from one epoch to another, taking only precession into 
         account.
         Implemented from: Jean Meeus - Astronomical Algorithms, 2nd edition, pages 134-135
@@ -324,7 +745,10 @@ cpdef (double, double) equatorialCoordPrecession(double start_epoch, double fina
 
     # Calculate declination (apply a different equation if close to the pole, closer then 0.5 degrees)
     if (pi/2 - fabs(dec)) < radians(0.5):
-        dec_corr = np.sign(dec)*acos(sqrt(A**2 + B**2))
+        if dec < 0:
+            dec_corr = -acos(sqrt(A**2 + B**2))
+        else:
+            dec_corr = acos(sqrt(A**2 + B**2))
     else:
         dec_corr = asin(C)
 
@@ -383,7 +807,7 @@ def equatorialCoordPrecession_vect(double start_epoch, double final_epoch, np.nd
 
 
 @cython.cdivision(True)
-cdef double refractionApparentToTrue(double elev):
+cdef double refractionApparentToTrue(double elev) noexcept nogil:
     """ Correct the apparent elevation of a star for refraction to true elevation. The temperature and air
         pressure are assumed to be unknown. 
         Source: Explanatory Supplement to the Astronomical Almanac (1992), p. 144.
@@ -433,7 +857,8 @@ cpdef np.ndarray[FLOAT_TYPE_t, ndim=1] refractionApparentToTrue_vect(np.ndarray[
     return elev + refraction
 
 
-cpdef (double, double) eqRefractionApparentToTrue(double ra, double dec, double jd, double lat, double lon):
+cpdef (double, double) eqRefractionApparentToTrue(double ra, double dec, double jd, double lat, double lon) \
+    noexcept nogil:
     """ Correct the equatorial coordinates for refraction. The correction is done from apparent to true
         coordinates.
     
@@ -472,7 +897,7 @@ cpdef (double, double) eqRefractionApparentToTrue(double ra, double dec, double
 
 
 @cython.cdivision(True)
-cdef double refractionTrueToApparent(double elev):
+cdef double refractionTrueToApparent(double elev) noexcept nogil:
     """ Correct the true elevation of a star for refraction to apparent elevation. The temperature and air
         pressure are assumed to be unknown. 
         Source: https://en.wikipedia.org/wiki/Atmospheric_refraction
@@ -523,7 +948,8 @@ cpdef np.ndarray[FLOAT_TYPE_t, ndim=1] refractionTrueToApparent_vect(np.ndarray[
 
 
 
-cpdef (double, double) eqRefractionTrueToApparent(double ra, double dec, double jd, double lat, double lon):
+cpdef (double, double) eqRefractionTrueToApparent(double ra, double dec, double jd, double lat, double lon) \
+    noexcept nogil:
     """ Correct the equatorial coordinates for refraction. The correction is done from true to apparent
         coordinates.
     
@@ -561,9 +987,47 @@ cpdef (double, double) eqRefractionTrueToApparent(double ra, double dec, double
 
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def eqRefractionTrueToApparent_vect(np.ndarray[FLOAT_TYPE_t, ndim=1] ra_data, \
+    np.ndarray[FLOAT_TYPE_t, ndim=1] dec_data, double jd, double lat, double lon):
+    """ Correct an array of equatorial coordinates for refraction, from true to apparent coordinates. The 
+        results can be given to cyraDecToXY with apparent=True, so the correction does not have to be 
+        repeated when the same stars are projected many times for the same time.
+    
+    Arguments:
+        ra_data: [ndarray] J2000 right ascensions (degrees).
+        dec_data: [ndarray] J2000 declinations (degrees).
+        jd: [float] Julian date.
+        lat: [float] Latitude (degrees).
+        lon: [float] Longitude (degrees).
+    Return:
+        (ra, dec): [tuple of ndarrays] Apparent right ascensions and declinations (degrees).
+    """
+
+    cdef int i
+    cdef double ra, dec
+
+    cdef np.ndarray[FLOAT_TYPE_t, ndim=1] ra_app = np.zeros_like(ra_data)
+    cdef np.ndarray[FLOAT_TYPE_t, ndim=1] dec_app = np.zeros_like(dec_data)
+
+    for i in range(ra_data.shape[0]):
+
+        ra, dec = eqRefractionTrueToApparent(radians(ra_data[i]), radians(dec_data[i]), jd, radians(lat), \
+            radians(lon))
+
+        ra_app[i] = degrees(ra)
+        dec_app[i] = degrees(dec)
+
+
+    return ra_app, dec_app
+
+
+
 
 @cython.cdivision(True)
-cpdef (double, double) cyraDec2AltAz(double ra, double dec, double jd, double lat, double lon):
+cpdef (double, double) cyraDec2AltAz(double ra, double dec, double jd, double lat, double lon) \
+    noexcept nogil:
     """ Convert right ascension and declination to azimuth (+East of due North) and altitude. Same epoch is
         assumed, no correction for refraction is done.
     Arguments:
@@ -717,8 +1181,43 @@ cpdef trueRaDec2ApparentAltAz_vect(np.ndarray[FLOAT_TYPE_t, ndim=1] ra, np.ndarr
 
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def trueRaDec2ApparentAltAzArray(np.ndarray[FLOAT_TYPE_t, ndim=1] ra, np.ndarray[FLOAT_TYPE_t, ndim=1] dec,
+    np.ndarray[FLOAT_TYPE_t, ndim=1] jd, double lat, double lon, bool refraction=True):
+    """ Convert the true right ascension and declination in J2000 to azimuth (+East of due North) and 
+        altitude in the epoch of date, where every point has its own Julian date. The results are identical 
+        to calling trueRaDec2ApparentAltAz on every point.
+    Arguments:
+        ra: [ndarray] Right ascension in radians (J2000).
+        dec: [ndarray] Declination in radians (J2000).
+        jd: [ndarray] Julian dates.
+        lat: [float] Latitude in radians.
+        lon: [float] Longitude in radians.
+    Keyword arguments:
+        refraction: [bool] Apply refraction correction. True by default.
+    Return:
+        (azim, elev): [tuple of ndarrays]
+            azim: [ndarray] Azimuth (+east of due north) in radians (epoch of date).
+            elev: [ndarray] Elevation above horizon in radians (epoch of date).
+        """
+
+    cdef int i
+    cdef int n = ra.shape[0]
+    cdef np.ndarray[FLOAT_TYPE_t, ndim=1] azim = np.zeros(n, dtype=FLOAT_TYPE)
+    cdef np.ndarray[FLOAT_TYPE_t, ndim=1] elev = np.zeros(n, dtype=FLOAT_TYPE)
+
+    for i in range(n):
+        azim[i], elev[i] = trueRaDec2ApparentAltAz(ra[i], dec[i], jd[i], lat, lon, refraction)
+
+    return (azim, elev)
+
+
+
+
 @cython.cdivision(True)
-cpdef (double, double) cyaltAz2RADec(double azim, double elev, double jd, double lat, double lon):
+cpdef (double, double) cyaltAz2RADec(double azim, double elev, double jd, double lat, double lon) \
+    noexcept nogil:
     """ Convert azimuth and altitude in a given time and position on Earth to right ascension and 
         declination. 
     Arguments:
@@ -862,6 +1361,234 @@ def apparentAltAz2TrueRADec_vect(np.ndarray[FLOAT_TYPE_t, ndim=1] azim, np.ndarr
 
 
 
+# Distortion types, used in the nogil loops instead of the distortion type strings
+cdef enum:
+    DIST_NONE = 0
+    DIST_POLY3_RADIAL = 1
+    DIST_RADIAL = 2
+
+
+# Conversions with at least this many points are run in parallel on all available cores
+PARALLEL_THRESHOLD = 10000
+
+
+cdef struct ProjectionParams:
+
+    # Observer location (degrees) and the image size (px)
+    double lat, lon, x_res, y_res
+
+    # Julian date (used only by raDecToXY) and the FOV centre corrected for refraction (radians)
+    double jd, ra_centre, dec_centre
+
+    # Reference hour angle (deg), reference FOV centre (radians), position angle (deg) and scale (px/deg)
+    double h0, ra_ref, dec_ref, pos_angle_ref, pix_scale
+
+    # Distortion parameters
+    int dist_code, radial_order
+    double x0, y0, xy, k1, k2, k3, k4
+    double *x_poly
+    double *y_poly
+
+    bint refraction, apparent
+
+
+
+cdef int _distortionParams(ProjectionParams *params, str dist_type, double[::1] x_poly, double[::1] y_poly, \
+    bint equal_aspect, bint force_distortion_centre) except -1:
+    """ Unpack the distortion parameters into the projection parameters. """
+
+    params.x_poly = &x_poly[0]
+    params.y_poly = &y_poly[0]
+    params.radial_order = 0
+
+    # If the radial distortion is used, unpack radial parameters
+    if dist_type.startswith("radial"):
+
+        params.dist_code = DIST_RADIAL
+
+        if dist_type == "radial3":
+            params.radial_order = 3
+        elif dist_type == "radial4":
+            params.radial_order = 4
+        elif dist_type == "radial5":
+            params.radial_order = 5
+
+
+        # Force the distortion centre to the image centre
+        if force_distortion_centre:
+            params.x0 = 0.5
+            params.y0 = 0.5
+        else:
+            # Read distortion offsets
+            params.x0 = x_poly[0]
+            params.y0 = x_poly[1]
+
+
+        # Aspect ratio
+        if equal_aspect:
+            params.xy = 0.0
+        else:
+            params.xy = x_poly[2]
+
+
+        # Distortion coeffs
+        params.k1 = x_poly[3]
+        params.k2 = x_poly[4]
+        params.k3 = x_poly[5]
+        params.k4 = x_poly[6]
+
+    # If the polynomial distortion was used, unpack the offsets
+    else:
+
+        if dist_type == "poly3+radial":
+            params.dist_code = DIST_POLY3_RADIAL
+        else:
+            params.dist_code = DIST_NONE
+
+        params.x0 = x_poly[0]
+        params.y0 = y_poly[0]
+
+
+    return 0
+
+
+
+@cython.cdivision(True)
+cdef void _raDecToXYPoint(ProjectionParams *p, double ra_deg, double dec_deg, double *x_out, double *y_out) \
+    noexcept nogil:
+    """ Convert one pair of RA, Dec (degrees) to image coordinates. See cyraDecToXY. """
+
+    cdef double ra, dec, radius, sin_ang, cos_ang, theta, x, y, r, dx, dy, x_img, y_img, r_corr, r_scale
+    cdef double x0 = p.x0
+    cdef double y0 = p.y0
+    cdef double xy = p.xy
+    cdef double k1 = p.k1
+    cdef double k2 = p.k2
+    cdef double k3 = p.k3
+    cdef double k4 = p.k4
+    cdef double *x_poly_rev = p.x_poly
+    cdef double *y_poly_rev = p.y_poly
+    cdef double ra_centre = p.ra_centre
+    cdef double dec_centre = p.dec_centre
+    cdef double pix_scale = p.pix_scale
+    cdef double x_res = p.x_res
+
+    ra = radians(ra_deg)
+    dec = radians(dec_deg)
+
+    ### Gnomonization of star coordinates to image coordinates ###
+
+    # Apply refraction
+    if p.refraction and (not p.apparent):
+        ra, dec = eqRefractionTrueToApparent(ra, dec, p.jd, radians(p.lat), radians(p.lon))
+
+
+    # Compute the distance from the FOV centre to the sky coordinate
+    radius = radians(angularSeparation(degrees(ra), degrees(dec), degrees(ra_centre),
+        degrees(dec_centre)))
+
+    # Compute theta - the direction angle between the FOV centre, sky coordinate, and the image vertical
+    sin_ang = cos(dec)*sin(ra - ra_centre)/sin(radius)
+    cos_ang = (sin(dec) - sin(dec_centre)*cos(radius))/(cos(dec_centre)*sin(radius))
+    theta   = -atan2(sin_ang, cos_ang) + radians(p.pos_angle_ref) - pi/2.0
+
+    # Calculate the standard coordinates
+    x = degrees(radius)*cos(theta)*pix_scale
+    y = degrees(radius)*sin(theta)*pix_scale
+
+    ### ###
+
+    # Set initial distorsion values
+    dx = 0
+    dy = 0
+
+    # Apply 3rd order polynomial + one radial term distortion
+    if p.dist_code == DIST_POLY3_RADIAL:
+
+        # Compute the radius
+        r = sqrt((x - x0)**2 + (y - y0)**2)
+
+        # Calculate the distortion in X direction
+        dx = (x0
+            + x_poly_rev[1]*x
+            + x_poly_rev[2]*y
+            + x_poly_rev[3]*x**2
+            + x_poly_rev[4]*x*y
+            + x_poly_rev[5]*y**2
+            + x_poly_rev[6]*x**3
+            + x_poly_rev[7]*x**2*y
+            + x_poly_rev[8]*x*y**2
+            + x_poly_rev[9]*y**3
+            + x_poly_rev[10]*x*r
+            + x_poly_rev[11]*y*r)
+
+        # Calculate the distortion in Y direction
+        dy = (y0
+            + y_poly_rev[1]*x
+            + y_poly_rev[2]*y
+            + y_poly_rev[3]*x**2
+            + y_poly_rev[4]*x*y
+            + y_poly_rev[5]*y**2
+            + y_poly_rev[6]*x**3
+            + y_poly_rev[7]*x**2*y
+            + y_poly_rev[8]*x*y**2
+            + y_poly_rev[9]*y**3
+            + y_poly_rev[10]*y*r
+            + y_poly_rev[11]*x*r)
+
+
+    # Apply a radial distortion
+    elif p.dist_code == DIST_RADIAL:
+
+        # Compute the normalized radius to horizontal size
+        r = sqrt(x**2 + y**2)/(x_res/2.0)
+        r_corr = r
+
+        # Apply the 3rd order radial distortion
+        if p.radial_order == 3:
+
+            # Compute the new radius
+            r_corr = (1.0 - k1 - k2)*r + k1*r**2 - k2*r**3
+
+        # Apply the 4th order radial distortion
+        elif p.radial_order == 4:
+
+            # Compute the new radius
+            r_corr = (1.0 - k1 - k2 - k3)*r + k1*r**2 - k2*r**3 + k3*r**4
+
+
+        # Apply the 5th order radial distortion
+        elif p.radial_order == 5:
+
+            # Compute the new radius
+            r_corr = (1.0 - k1 - k2 - k3 - k4)*r + k1*r**2 - k2*r**3 + k3*r**4 - k4*r**5
+
+
+        # Compute the scaling term
+        if r == 0:
+            r_scale = 0
+        else:
+            r_scale = (r_corr/r - 1)
+
+        # Compute distortion offsets
+        dx = (x - x0)*r_scale
+        dy = (y - y0)*r_scale/(1.0 + xy)
+
+
+
+    # Add the distortion
+    x_img = x - dx
+    y_img = y - dy
+
+
+    # Calculate X image coordinates
+    x_out[0] = x_img + x_res/2.0
+
+    # Calculate Y image coordinates
+    y_out[0] = y_img + p.y_res/2.0
+
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.cdivision(True)
@@ -869,7 +1596,8 @@ def cyraDecToXY(np.ndarray[FLOAT_TYPE_t, ndim=1] ra_data, \
     np.ndarray[FLOAT_TYPE_t, ndim=1] dec_data, double jd, double lat, double lon, double x_res, \
     double y_res, double h0, double ra_ref, double dec_ref, double pos_angle_ref, double pix_scale, \
     np.ndarray[FLOAT_TYPE_t, ndim=1] x_poly_rev, np.ndarray[FLOAT_TYPE_t, ndim=1] y_poly_rev, \
-    str dist_type, bool refraction=True, bool equal_aspect=False, bool force_distortion_centre=False):
+    str dist_type, bool refraction=True, bool equal_aspect=False, bool force_distortion_centre=False, \
+    bool apparent=False, parallel=None):
     """ Convert RA, Dec to distorion corrected image coordinates.
     Arguments:
         RA_data: [ndarray] Array of right ascensions (degrees).
@@ -893,24 +1621,24 @@ def cyraDecToXY(np.ndarray[FLOAT_TYPE_t, ndim=1] ra_data, \
         equal_aspect: [bool] Force the X/Y aspect ratio to be equal. Used only for radial distortion. \
             False by default.
         force_distortion_centre: [bool] Force the distortion centre to the image centre. False by default.
+        apparent: [bool] The given coordinates are already corrected for refraction (e.g. with 
+            eqRefractionTrueToApparent_vect), so only the FOV centre is corrected. False by default.
+        parallel: [bool] Run the conversion on all cores without the GIL. If None (default), it is run in 
+            parallel when there are at least PARALLEL_THRESHOLD points. The results are identical either way.
 
     Return:
         (x, y): [tuple of ndarrays] Image X and Y coordinates.
     """
 
     cdef int i
-    cdef double ra_centre, dec_centre, ra, dec
-    cdef double radius, sin_ang, cos_ang, theta, x, y, r, dx, dy, x_img, y_img, r_corr, r_scale
-    cdef double x0, y0, xy, k1, k2, k3, k4
+    cdef int n = ra_data.shape[0]
+    cdef double ra_centre, dec_centre
+    cdef ProjectionParams params
 
     # Init output arrays
     cdef np.ndarray[FLOAT_TYPE_t, ndim=1] x_array = np.zeros_like(ra_data)
     cdef np.ndarray[FLOAT_TYPE_t, ndim=1] y_array = np.zeros_like(ra_data)
 
-    # Precalculate some parameters
-    cdef double sl = sin(radians(lat))
-    cdef double cl = cos(radians(lat))
-
 
     # Compute the current RA of the FOV centre by adding the difference in between the current and the
     #   reference hour angle
@@ -923,158 +1651,210 @@ def cyraDecToXY(np.ndarray[FLOAT_TYPE_t, ndim=1] ra_data, \
             radians(lon))
 
 
-    # If the radial distortion is used, unpack radial parameters
-    if dist_type.startswith("radial"):
-
-
-        # Force the distortion centre to the image centre
-        if force_distortion_centre:
-            x0 = 0.5
-            y0 = 0.5
-        else:
-            # Read distortion offsets
-            x0 = x_poly_rev[0]
-            y0 = x_poly_rev[1]
+    params.lat = lat
+    params.lon = lon
+    params.x_res = x_res
+    params.y_res = y_res
+    params.jd = jd
+    params.ra_centre = ra_centre
+    params.dec_centre = dec_centre
+    params.pos_angle_ref = pos_angle_ref
+    params.pix_scale = pix_scale
+    params.refraction = refraction
+    params.apparent = apparent
 
+    # Unpack the distortion parameters
+    _distortionParams(&params, dist_type, x_poly_rev, y_poly_rev, equal_aspect, force_distortion_centre)
 
-        # Aspect ratio
-        if equal_aspect:
-            xy = 0.0
-        else:
-            xy = x_poly_rev[2]
+    if parallel is None:
+        parallel = n >= PARALLEL_THRESHOLD
 
 
-        # Distortion coeffs
-        k1 = x_poly_rev[3]
-        k2 = x_poly_rev[4]
-        k3 = x_poly_rev[5]
-        k4 = x_poly_rev[6]
+    # Convert all equatorial coordinates to image coordinates
+    if parallel:
+        for i in prange(n, nogil=True, schedule='static'):
+            _raDecToXYPoint(&params, ra_data[i], dec_data[i], &x_array[i], &y_array[i])
 
-    # If the polynomial distortion was used, unpack the offsets
     else:
-        x0 = x_poly_rev[0]
-        y0 = y_poly_rev[0]
-
-
-    # Convert all equatorial coordinates to image coordinates
-    for i in range(ra_data.shape[0]):
+        for i in range(n):
+            _raDecToXYPoint(&params, ra_data[i], dec_data[i], &x_array[i], &y_array[i])
 
-        ra = radians(ra_data[i])
-        dec = radians(dec_data[i])
 
-        ### Gnomonization of star coordinates to image coordinates ###
+    return x_array, y_array
 
-        # Apply refraction
-        if refraction:
-            ra, dec = eqRefractionTrueToApparent(ra, dec, jd, radians(lat), radians(lon))
 
 
-        # Compute the distance from the FOV centre to the sky coordinate
-        radius = radians(angularSeparation(degrees(ra), degrees(dec), degrees(ra_centre),
-            degrees(dec_centre)))
+@cython.cdivision(True)
+cdef void _undistortPoint(ProjectionParams *p, double x_img, double y_img, double *x_out, double *y_out) \
+    noexcept nogil:
+    """ Correct one pair of image coordinates for distortion and convert them to gnomonic coordinates 
+        (degrees). See cyXYToRADec.
+    """
 
-        # Compute theta - the direction angle between the FOV centre, sky coordinate, and the image vertical
-        sin_ang = cos(dec)*sin(ra - ra_centre)/sin(radius)
-        cos_ang = (sin(dec) - sin(dec_centre)*cos(radius))/(cos(dec_centre)*sin(radius))
-        theta   = -atan2(sin_ang, cos_ang) + radians(pos_angle_ref) - pi/2.0
+    cdef double r, dx, x_corr, dy, y_corr, r_corr, r_scale
+    cdef double x0 = p.x0
+    cdef double y0 = p.y0
+    cdef double xy = p.xy
+    cdef double k1 = p.k1
+    cdef double k2 = p.k2
+    cdef double k3 = p.k3
+    cdef double k4 = p.k4
+    cdef double *x_poly_fwd = p.x_poly
+    cdef double *y_poly_fwd = p.y_poly
+    cdef double x_res = p.x_res
+    cdef double pix_scale = p.pix_scale
+
+    ### APPLY DISTORTION CORRECTION ###
+
+    # Normalize image coordinates to the image centre and compute the radius from image centre
+    x_img = x_img - x_res/2.0
+    y_img = y_img - p.y_res/2.0
+
+    # Set initial distorsion values
+    dx = 0
+    dy = 0
+
+    # Apply 3rd order polynomial + one radial term distortion
+    if p.dist_code == DIST_POLY3_RADIAL:
+
+        # Compute the radius
+        r = sqrt((x_img - x0)**2 + (y_img - y0)**2)
+
+        # Compute offset in X direction
+        dx = (x0
+            + x_poly_fwd[1]*x_img
+            + x_poly_fwd[2]*y_img
+            + x_poly_fwd[3]*x_img**2
+            + x_poly_fwd[4]*x_img*y_img
+            + x_poly_fwd[5]*y_img**2
+            + x_poly_fwd[6]*x_img**3
+            + x_poly_fwd[7]*x_img**2*y_img
+            + x_poly_fwd[8]*x_img*y_img**2
+            + x_poly_fwd[9]*y_img**3
+            + x_poly_fwd[10]*x_img*r
+            + x_poly_fwd[11]*y_img*r)
+
+        # Compute offset in Y direction
+        dy = (y0
+            + y_poly_fwd[1]*x_img
+            + y_poly_fwd[2]*y_img
+            + y_poly_fwd[3]*x_img**2
+            + y_poly_fwd[4]*x_img*y_img
+            + y_poly_fwd[5]*y_img**2
+            + y_poly_fwd[6]*x_img**3
+            + y_poly_fwd[7]*x_img**2*y_img
+            + y_poly_fwd[8]*x_img*y_img**2
+            + y_poly_fwd[9]*y_img**3
+            + y_poly_fwd[10]*y_img*r
+            + y_poly_fwd[11]*x_img*r)
+
+
+    # Apply a radial distortion
+    elif p.dist_code == DIST_RADIAL:
+
+        # Compute the radius normalized to the horizontal image size
+        r = sqrt(x_img**2 + (1.0 + xy)*y_img**2)/(x_res/2.0)
+        r_corr = r
+
+        # Apply the 3rd order radial distortion
+        if p.radial_order == 3:
+
+            # Compute the new radius
+            r_corr = (1.0 - k1 - k2)*r + k1*r**2 - k2*r**3
+
+        # Apply the 4th order radial distortion
+        elif p.radial_order == 4:
+
+            # Compute the new radius
+            r_corr = (1.0 - k1 - k2 - k3)*r + k1*r**2 - k2*r**3 + k3*r**4
+
+        # Apply the 5th order radial distortion
+        elif p.radial_order == 5:
+
+            # Compute the new radius
+            r_corr = (1.0 - k1 - k2 - k3 - k4)*r + k1*r**2 - k2*r**3 + k3*r**4 - k4*r**5
+
+
+        # Compute the scaling term
+        if r == 0:
+            r_scale = 0
+        else:
+            r_scale = (r_corr/r - 1)
 
-        # Calculate the standard coordinates
-        x = degrees(radius)*cos(theta)*pix_scale
-        y = degrees(radius)*sin(theta)*pix_scale
+        # Compute offsets
+        dx = (x_img - x0)*r_scale
+        dy = (y_img - y0)*r_scale*(1.0 + xy)
 
-        ### ###
 
-        # Set initial distorsion values
-        dx = 0
-        dy = 0
+    # Correct image coordinates for distortion
+    x_corr = x_img + dx
+    y_corr = y_img + dy
 
-        # Apply 3rd order polynomial + one radial term distortion
-        if dist_type == "poly3+radial":
 
-            # Compute the radius
-            r = sqrt((x - x0)**2 + (y - y0)**2)
+    # Gnomonize coordinates
+    x_out[0] = x_corr/pix_scale
+    y_out[0] = y_corr/pix_scale
 
-            # Calculate the distortion in X direction
-            dx = (x0
-                + x_poly_rev[1]*x
-                + x_poly_rev[2]*y
-                + x_poly_rev[3]*x**2
-                + x_poly_rev[4]*x*y
-                + x_poly_rev[5]*y**2
-                + x_poly_rev[6]*x**3
-                + x_poly_rev[7]*x**2*y
-                + x_poly_rev[8]*x*y**2
-                + x_poly_rev[9]*y**3
-                + x_poly_rev[10]*x*r
-                + x_poly_rev[11]*y*r)
 
-            # Calculate the distortion in Y direction
-            dy = (y0
-                + y_poly_rev[1]*x
-                + y_poly_rev[2]*y
-                + y_poly_rev[3]*x**2
-                + y_poly_rev[4]*x*y
-                + y_poly_rev[5]*y**2
-                + y_poly_rev[6]*x**3
-                + y_poly_rev[7]*x**2*y
-                + y_poly_rev[8]*x*y**2
-                + y_poly_rev[9]*y**3
-                + y_poly_rev[10]*y*r
-                + y_poly_rev[11]*x*r)
 
+@cython.cdivision(True)
+cdef void _xyToRADecPoint(ProjectionParams *p, double jd, double x_img, double y_img, double *ra_out, \
+    double *dec_out) noexcept nogil:
+    """ Convert one pair of image coordinates to RA, Dec (degrees). See cyXYToRADec. """
 
-        # Apply a radial distortion
-        elif dist_type.startswith("radial"):
+    cdef double x_corr, y_corr
+    cdef double radius, theta, sin_t, cos_t
+    cdef double ra_ref_now, ra_ref_now_corr, ra, dec, dec_ref_corr
 
-            # Compute the normalized radius to horizontal size
-            r = sqrt(x**2 + y**2)/(x_res/2.0)
-            r_corr = r
+    ### APPLY DISTORTION CORRECTION ###
 
-            # Apply the 3rd order radial distortion
-            if dist_type == "radial3":
+    _undistortPoint(p, x_img, y_img, &x_corr, &y_corr)
 
-                # Compute the new radius
-                r_corr = (1.0 - k1 - k2)*r + k1*r**2 - k2*r**3
+    ### ###
 
-            # Apply the 4th order radial distortion
-            elif dist_type == "radial4":
 
-                # Compute the new radius
-                r_corr = (1.0 - k1 - k2 - k3)*r + k1*r**2 - k2*r**3 + k3*r**4
+    ### Convert gnomonic X, Y to RA, Dec ###
 
+    # Radius from FOV centre to sky coordinate
+    radius = radians(sqrt(x_corr**2 + y_corr**2))
 
-            # Apply the 5th order radial distortion
-            elif dist_type == "radial5":
+    # Compute theta - the direction angle between the FOV centre, sky coordinate, and the north
+    #   celestial pole
+    theta = (pi/2 - radians(p.pos_angle_ref) + atan2(y_corr, x_corr))%(2*pi)
 
-                # Compute the new radius
-                r_corr = (1.0 - k1 - k2 - k3 - k4)*r + k1*r**2 - k2*r**3 + k3*r**4 - k4*r**5
 
+    # Compute the reference RA centre at the given JD by adding the hour angle difference
+    ra_ref_now = (p.ra_ref + radians(cyjd2LST(jd, 0)) - radians(p.h0) + 2*pi)%(2*pi)
 
-            # Compute the scaling term
-            if r == 0:
-                r_scale = 0
-            else:
-                r_scale = (r_corr/r - 1)
 
-            # Compute distortion offsets
-            dx = (x - x0)*r_scale
-            dy = (y - y0)*r_scale/(1.0 + xy)
+    # Correct the FOV centre for refraction
+    if p.refraction:
+        ra_ref_now_corr, dec_ref_corr = eqRefractionTrueToApparent(ra_ref_now, p.dec_ref, jd, \
+            radians(p.lat), radians(p.lon))
 
+    else:
+        ra_ref_now_corr = ra_ref_now
+        dec_ref_corr = p.dec_ref
 
 
-        # Add the distortion
-        x_img = x - dx
-        y_img = y - dy
+    # Compute declination
+    sin_t = sin(dec_ref_corr)*cos(radius) + cos(dec_ref_corr)*sin(radius)*cos(theta)
+    dec = atan2(sin_t, sqrt(1 - sin_t**2))
 
+    # Compute right ascension
+    sin_t = sin(theta)*sin(radius)/cos(dec)
+    cos_t = (cos(radius) - sin(dec)*sin(dec_ref_corr))/(cos(dec)*cos(dec_ref_corr))
+    ra = (ra_ref_now_corr - atan2(sin_t, cos_t) + 2*pi)%(2*pi)
 
-        # Calculate X image coordinates
-        x_array[i] = x_img + x_res/2.0
 
-        # Calculate Y image coordinates
-        y_array[i] = y_img + y_res/2.0
+    # Apply refraction correction
+    if p.refraction:
+        ra, dec = eqRefractionApparentToTrue(ra, dec, jd, radians(p.lat), radians(p.lon))
 
 
-    return x_array, y_array
+    # Convert coordinates to degrees
+    ra_out[0] = degrees(ra)
+    dec_out[0] = degrees(dec)
 
 
 
@@ -1085,7 +1865,8 @@ def cyXYToRADec(np.ndarray[FLOAT_TYPE_t, ndim=1] jd_data, np.ndarray[FLOAT_TYPE_
     np.ndarray[FLOAT_TYPE_t, ndim=1] y_data, double lat, double lon, double x_res, double y_res, \
     double h0, double ra_ref, double dec_ref, double pos_angle_ref, double pix_scale, \
     np.ndarray[FLOAT_TYPE_t, ndim=1] x_poly_fwd, np.ndarray[FLOAT_TYPE_t, ndim=1] y_poly_fwd, \
-    str dist_type, bool refraction=True, bool equal_aspect=False, bool force_distortion_centre=False):
+    str dist_type, bool refraction=True, bool equal_aspect=False, bool force_distortion_centre=False, \
+    parallel=None):
     """
     Arguments:
         jd_data: [ndarray] Julian date of each data point.
@@ -1109,6 +1890,8 @@ def cyXYToRADec(np.ndarray[FLOAT_TYPE_t, ndim=1] jd_data, np.ndarray[FLOAT_TYPE_
         equal_aspect: [bool] Force the X/Y aspect ratio to be equal. Used only for radial distortion. \
             False by default.
         force_distortion_centre: [bool] Force the distortion centre to the image centre. False by default.
+        parallel: [bool] Run the conversion on all cores without the GIL. If None (default), it is run in 
+            parallel when there are at least PARALLEL_THRESHOLD points. The results are identical either way.
 
     Return:
         (ra_data, dec_data): [tuple of ndarrays]
@@ -1119,204 +1902,94 @@ def cyXYToRADec(np.ndarray[FLOAT_TYPE_t, ndim=1] jd_data, np.ndarray[FLOAT_TYPE_
     """
 
     cdef int i
-    cdef double jd, x_img, y_img, r, dx, x_corr, dy, y_corr, r_corr, r_scale
-    cdef double x0, y0, xy, k1, k2, k3, k4
-    cdef double radius, theta, sin_t, cos_t
-    cdef double ha, ra_ref_now, ra_ref_now_corr, ra, dec, dec_ref_corr
-
-    # Convert the reference pointing direction to radians
-    ra_ref  = radians(ra_ref)
-    dec_ref = radians(dec_ref)
+    cdef int n = jd_data.shape[0]
+    cdef ProjectionParams params
 
     cdef np.ndarray[FLOAT_TYPE_t, ndim=1] ra_data = np.zeros_like(jd_data)
     cdef np.ndarray[FLOAT_TYPE_t, ndim=1] dec_data = np.zeros_like(jd_data)
 
 
-    # If the radial distortion is used, unpack radial parameters
-    if dist_type.startswith("radial"):
-
-        # Force the distortion centre to the image centre
-        if force_distortion_centre:
-            x0 = 0.5
-            y0 = 0.5
-        else:
-            # Read distortion offsets
-            x0 = x_poly_fwd[0]
-            y0 = x_poly_fwd[1]
-
-
-        # Aspect ratio
-        if equal_aspect:
-            xy = 0.0
-        else:
-            # Read aspect ratio
-            xy = x_poly_fwd[2]
-
+    # Convert the reference pointing direction to radians
+    params.ra_ref = radians(ra_ref)
+    params.dec_ref = radians(dec_ref)
 
-        # Distortion coeffs
-        k1 = x_poly_fwd[3]
-        k2 = x_poly_fwd[4]
-        k3 = x_poly_fwd[5]
-        k4 = x_poly_fwd[6]
+    params.lat = lat
+    params.lon = lon
+    params.x_res = x_res
+    params.y_res = y_res
+    params.h0 = h0
+    params.pos_angle_ref = pos_angle_ref
+    params.pix_scale = pix_scale
+    params.refraction = refraction
 
+    # Unpack the distortion parameters
+    _distortionParams(&params, dist_type, x_poly_fwd, y_poly_fwd, equal_aspect, force_distortion_centre)
 
-    # If the polynomial distortion was used, unpack the offsets
-    else:
-        x0 = x_poly_fwd[0]
-        y0 = y_poly_fwd[0]
+    if parallel is None:
+        parallel = n >= PARALLEL_THRESHOLD
 
 
     # Go through all given data points and convert them from X, Y to RA, Dec
-    for i in range(jd_data.shape[0]):
-
-        # Choose time and image coordiantes
-        jd = jd_data[i]
-        x_img = x_data[i]
-        y_img = y_data[i]
-
-
-        ### APPLY DISTORTION CORRECTION ###
-
-        # Normalize image coordinates to the image centre and compute the radius from image centre
-        x_img = x_img - x_res/2.0
-        y_img = y_img - y_res/2.0
-
-
-        # Apply 3rd order polynomial + one radial term distortion
-        if dist_type == "poly3+radial":
-
-            # Compute the radius
-            r = sqrt((x_img - x0)**2 + (y_img - y0)**2)
-
-            # Compute offset in X direction
-            dx = (x0
-                + x_poly_fwd[1]*x_img
-                + x_poly_fwd[2]*y_img
-                + x_poly_fwd[3]*x_img**2
-                + x_poly_fwd[4]*x_img*y_img
-                + x_poly_fwd[5]*y_img**2
-                + x_poly_fwd[6]*x_img**3
-                + x_poly_fwd[7]*x_img**2*y_img
-                + x_poly_fwd[8]*x_img*y_img**2
-                + x_poly_fwd[9]*y_img**3
-                + x_poly_fwd[10]*x_img*r
-                + x_poly_fwd[11]*y_img*r)
-
-            # Compute offset in Y direction
-            dy = (y0
-                + y_poly_fwd[1]*x_img
-                + y_poly_fwd[2]*y_img
-                + y_poly_fwd[3]*x_img**2
-                + y_poly_fwd[4]*x_img*y_img
-                + y_poly_fwd[5]*y_img**2
-                + y_poly_fwd[6]*x_img**3
-                + y_poly_fwd[7]*x_img**2*y_img
-                + y_poly_fwd[8]*x_img*y_img**2
-                + y_poly_fwd[9]*y_img**3
-                + y_poly_fwd[10]*y_img*r
-                + y_poly_fwd[11]*x_img*r)
-
-
-        # Apply a radial distortion
-        elif dist_type.startswith("radial"):
-
-            # Compute the radius normalized to the horizontal image size
-            r = sqrt(x_img**2 + (1.0 + xy)*y_img**2)/(x_res/2.0)
-            r_corr = r
-
-            # Apply the 3rd order radial distortion
-            if dist_type == "radial3":
-
-                # Compute the new radius
-                r_corr = (1.0 - k1 - k2)*r + k1*r**2 - k2*r**3
-
-            # Apply the 4th order radial distortion
-            elif dist_type == "radial4":
-
-                # Compute the new radius
-                r_corr = (1.0 - k1 - k2 - k3)*r + k1*r**2 - k2*r**3 + k3*r**4
-
-            # Apply the 5th order radial distortion
-            elif dist_type == "radial5":
-
-                # Compute the new radius
-                r_corr = (1.0 - k1 - k2 - k3 - k4)*r + k1*r**2 - k2*r**3 + k3*r**4 - k4*r**5
-
-
-            # Compute the scaling term
-            if r == 0:
-                r_scale = 0
-            else:
-                r_scale = (r_corr/r - 1)
-
-            # Compute offsets
-            dx = (x_img - x0)*r_scale
-            dy = (y_img - y0)*r_scale*(1.0 + xy)
-
-
-        # Correct image coordinates for distortion
-        x_corr = x_img + dx
-        y_corr = y_img + dy
-
-
-        # Gnomonize coordinates
-        x_corr = x_corr/pix_scale
-        y_corr = y_corr/pix_scale
-
-        ### ###
-
-
-        ### Convert gnomonic X, Y to RA, Dec ###
-
-        # Radius from FOV centre to sky coordinate
-        radius = radians(sqrt(x_corr**2 + y_corr**2))
+    if parallel:
+        for i in prange(n, nogil=True, schedule='static'):
+            _xyToRADecPoint(&params, jd_data[i], x_data[i], y_data[i], &ra_data[i], &dec_data[i])
 
-        # Compute theta - the direction angle between the FOV centre, sky coordinate, and the north
-        #   celestial pole
-        theta = (pi/2 - radians(pos_angle_ref) + atan2(y_corr, x_corr))%(2*pi)
-
-
-        # Compute the reference RA centre at the given JD by adding the hour angle difference
-        ra_ref_now = (ra_ref + radians(cyjd2LST(jd, 0)) - radians(h0) + 2*pi)%(2*pi)
+    else:
+        for i in range(n):
+            _xyToRADecPoint(&params, jd_data[i], x_data[i], y_data[i], &ra_data[i], &dec_data[i])
 
 
-        # Correct the FOV centre for refraction
-        if refraction:
-            ra_ref_now_corr, dec_ref_corr = eqRefractionTrueToApparent(ra_ref_now, dec_ref, jd, \
-                radians(lat), radians(lon))
+    return ra_data, dec_data
 
-        else:
-            ra_ref_now_corr = ra_ref_now
-            dec_ref_corr = dec_ref
 
 
-        # Compute declination
-        sin_t = sin(dec_ref_corr)*cos(radius) + cos(dec_ref_corr)*sin(radius)*cos(theta)
-        dec = atan2(sin_t, sqrt(1 - sin_t**2))
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def cyXYToGnomonic(np.ndarray[FLOAT_TYPE_t, ndim=1] x_data, np.ndarray[FLOAT_TYPE_t, ndim=1] y_data, \
+    double x_res, double y_res, double pix_scale, np.ndarray[FLOAT_TYPE_t, ndim=1] x_poly_fwd, \
+    np.ndarray[FLOAT_TYPE_t, ndim=1] y_poly_fwd, str dist_type, bool equal_aspect=False, \
+    bool force_distortion_centre=False):
+    """ Correct image coordinates for distortion and convert them to gnomonic coordinates, in the same way 
+        as cyXYToRADec does before the conversion to RA, Dec. This part of the conversion does not depend on 
+        time.
 
-        # Compute right ascension
-        sin_t = sin(theta)*sin(radius)/cos(dec)
-        cos_t = (cos(radius) - sin(dec)*sin(dec_ref_corr))/(cos(dec)*cos(dec_ref_corr))
-        ra = (ra_ref_now_corr - atan2(sin_t, cos_t) + 2*pi)%(2*pi)
+    Arguments:
+        x_data: [ndarray] 1D numpy array containing the image column.
+        y_data: [ndarray] 1D numpy array containing the image row.
+        x_res: [int] Image size, X dimension (px).
+        y_res: [int] Image size, Y dimenstion (px).
+        pix_scale: [float] Plate scale (px/deg).
+        x_poly_fwd: [ndarray] 1D numpy array of 12 elements containing forward X axis polynomial parameters.
+        y_poly_fwd: [ndarray] 1D numpy array of 12 elements containing forward Y axis polynomial parameters.
+        dist_type: [str] Distortion type. Can be: poly3+radial, radial3, radial4, or radial5.
 
+    Keyword arguments:
+        equal_aspect: [bool] Force the X/Y aspect ratio to be equal. Used only for radial distortion. \
+            False by default.
+        force_distortion_centre: [bool] Force the distortion centre to the image centre. False by default.
 
-        # Apply refraction correction
-        if refraction:
-            ra, dec = eqRefractionApparentToTrue(ra, dec, jd, radians(lat), radians(lon))
+    Return:
+        (x_gnom, y_gnom): [tuple of ndarrays] Gnomonic coordinates, relative to the FOV centre (degrees).
+    """
 
+    cdef int i
+    cdef ProjectionParams params
 
+    cdef np.ndarray[FLOAT_TYPE_t, ndim=1] x_gnom = np.zeros_like(x_data)
+    cdef np.ndarray[FLOAT_TYPE_t, ndim=1] y_gnom = np.zeros_like(x_data)
 
-        # Convert coordinates to degrees
-        ra = degrees(ra)
-        dec = degrees(dec)
+    params.x_res = x_res
+    params.y_res = y_res
+    params.pix_scale = pix_scale
 
+    # Unpack the distortion parameters
+    _distortionParams(&params, dist_type, x_poly_fwd, y_poly_fwd, equal_aspect, force_distortion_centre)
 
-        # Assign values to output list
-        ra_data[i] = ra
-        dec_data[i] = dec
+    for i in range(x_data.shape[0]):
+        _undistortPoint(&params, x_data[i], y_data[i], &x_gnom[i], &y_gnom[i])
 
 
-    return ra_data, dec_data
+    return x_gnom, y_gnom
 
 
 # @cython.boundscheck(False)
@@ -0,0 +1,404 @@
+""" Distortion lookup tables for fast conversion of many image coordinates (e.g. every pixel of the image) to
+    RA, Dec with the same platepar.
+
+    The distortion correction and the conversion to gnomonic coordinates do not depend on time, so they are
+    evaluated once on a grid of nodes and stored as unit vectors in the camera frame. Any image coordinates
+    are then converted by bilinear interpolation of these vectors and a rotation to the sky for the given
+    time. The refraction correction is applied as a rotation to the horizontal frame, a correction of the
+    elevation, and a rotation back.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import time
+import hashlib
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+
+from RMS.Astrometry.Conversions import JD2LST
+from RMS.Formats import Platepar
+
+# Import Cython functions
+import pyximport
+pyximport.install(setup_args={'include_dirs':[np.get_include()]})
+from RMS.Astrometry.CyFunctions import cyXYToGnomonic, cyXYToRADec, equatorialCoordPrecession, \
+    cyraDec2AltAz, eqRefractionTrueToApparent
+
+
+# Julian date of the J2000 epoch
+J2000_DAYS = 2451545.0
+
+# Default distance between the LUT nodes (px)
+LUT_STEP = 8
+
+# Number of LUTs kept in the cache
+LUT_CACHE_SIZE = 8
+
+# Cached LUTs, the keys are the hashes of the platepar parameters they were computed from
+DISTORTION_LUTS = OrderedDict()
+
+
+
+def distortionHash(platepar, step):
+    """ Compute the hash of the platepar parameters which define the time independent part of the
+        conversion from image coordinates to RA, Dec.
+
+    Arguments:
+        platepar: [Platepar structure] Astrometry parameters.
+        step: [int] Distance between the LUT nodes (px).
+
+    Return:
+        [str] Hex digest of the hash.
+    """
+
+    params = (platepar.X_res, platepar.Y_res, platepar.F_scale, platepar.pos_angle_ref, \
+        platepar.distortion_type, platepar.equal_aspect, platepar.force_distortion_centre, step)
+
+    lut_hash = hashlib.sha1(repr(tuple(float(p) if isinstance(p, (float, np.floating)) else p \
+        for p in params)).encode('utf-8'))
+
+    lut_hash.update(np.ascontiguousarray(platepar.x_poly_fwd, dtype=np.float64).tobytes())
+    lut_hash.update(np.ascontiguousarray(platepar.y_poly_fwd, dtype=np.float64).tobytes())
+
+    return lut_hash.hexdigest()
+
+
+
+def cameraVectors(x_data, y_data, platepar):
+    """ Convert image coordinates to unit vectors in the camera frame. The vectors are given in the basis of
+        the FOV centre, the north and the east direction at the FOV centre.
+
+    Arguments:
+        x_data: [ndarray] Image columns.
+        y_data: [ndarray] Image rows.
+        platepar: [Platepar structure] Astrometry parameters.
+
+    Return:
+        [ndarray] (N, 3) array of unit vectors.
+    """
+
+    # Correct the coordinates for distortion
+    x_gnom, y_gnom = cyXYToGnomonic(np.array(x_data, dtype=np.float64), np.array(y_data, dtype=np.float64), \
+        float(platepar.X_res), float(platepar.Y_res), float(platepar.F_scale), platepar.x_poly_fwd, \
+        platepar.y_poly_fwd, str(platepar.distortion_type), equal_aspect=platepar.equal_aspect, \
+        force_distortion_centre=platepar.force_distortion_centre)
+
+    # Compute the distance from the FOV centre and the direction angle, as in cyXYToRADec
+    radius = np.radians(np.hypot(x_gnom, y_gnom))
+    theta = np.pi/2 - np.radians(platepar.pos_angle_ref) + np.arctan2(y_gnom, x_gnom)
+
+    return np.c_[np.cos(radius), np.sin(radius)*np.cos(theta), -np.sin(radius)*np.sin(theta)]
+
+
+
+class DistortionLUT(object):
+    def __init__(self, platepar, step=LUT_STEP):
+        """ Lookup table of camera frame unit vectors on a grid of image coordinates. The maximum
+            interpolation error is estimated when the LUT is built by comparing the interpolated and the
+            exact vectors in the centres of all grid cells, where the bilinear interpolation error is the
+            largest, and in the distortion centre.
+
+        Arguments:
+            platepar: [Platepar structure] Astrometry parameters.
+
+        Keyword arguments:
+            step: [int] Distance between the LUT nodes (px). LUT_STEP by default.
+        """
+
+        self.step = step
+        self.key = distortionHash(platepar, step)
+
+        # The nodes cover the whole image
+        self.nx = int(np.ceil(platepar.X_res/step)) + 1
+        self.ny = int(np.ceil(platepar.Y_res/step)) + 1
+
+        x_nodes = step*np.arange(self.nx, dtype=np.float64)
+        y_nodes = step*np.arange(self.ny, dtype=np.float64)
+        x_grid, y_grid = np.meshgrid(x_nodes, y_nodes)
+
+        self.vectors = cameraVectors(x_grid.ravel(), y_grid.ravel(), platepar).reshape(self.ny, self.nx, 3)
+
+
+        # Estimate the maximum interpolation error in the cell centres
+        x_grid, y_grid = np.meshgrid(x_nodes[:-1] + step/2.0, y_nodes[:-1] + step/2.0)
+        x_check, y_check = x_grid.ravel(), y_grid.ravel()
+
+        # The distortion models are not smooth in the distortion centre, so check the error there as well
+        x_centre, y_centre = platepar.X_res/2.0, platepar.Y_res/2.0
+        x_check = np.append(x_check, [x_centre, x_centre + platepar.x_poly_fwd[0]])
+        y_check = np.append(y_check, [y_centre, y_centre + platepar.y_poly_fwd[0]])
+
+        exact = cameraVectors(x_check, y_check, platepar)
+        interpolated = self.interpolate(x_check, y_check)
+
+        # Maximum error in pixels
+        max_angle = 2*np.arcsin(np.clip(np.max(np.linalg.norm(exact - interpolated, axis=1))/2, 0, 1))
+        self.max_error = np.degrees(max_angle)*platepar.F_scale
+
+
+    def interpolate(self, x_data, y_data, rotation=None):
+        """ Interpolate the camera frame unit vectors in the given image coordinates.
+
+        Arguments:
+            x_data: [ndarray] Image columns.
+            y_data: [ndarray] Image rows.
+
+        Keyword arguments:
+            rotation: [ndarray] 3x3 matrix which is applied to the vectors. As the rotation and the 
+                interpolation commute, the LUT nodes are rotated before the interpolation. None by default.
+
+        Return:
+            [ndarray] (N, 3) array of unit vectors.
+        """
+
+        # Vector components of the nodes, one row per component
+        nodes = self.vectors.reshape(-1, 3)
+        if rotation is not None:
+            nodes = nodes.dot(rotation.T)
+
+        nodes = np.ascontiguousarray(nodes.T)
+
+        x_data = np.asarray(x_data, dtype=np.float64)/self.step
+        y_data = np.asarray(y_data, dtype=np.float64)/self.step
+
+        # Indices of the cells, the points outside the image are extrapolated from the edge cells
+        i = np.clip(np.floor(x_data).astype(np.int64), 0, self.nx - 2)
+        j = np.clip(np.floor(y_data).astype(np.int64), 0, self.ny - 2)
+
+        tx = x_data - i
+        ty = y_data - j
+
+        # Bilinear interpolation weights of the cell corners
+        w_10 = tx*(1 - ty)
+        w_01 = (1 - tx)*ty
+        w_11 = tx*ty
+        w_00 = 1 - tx - ty + w_11
+
+        # Flat indices of the top left cell corners
+        k = j*self.nx + i
+
+        vectors = np.empty((len(k), 3), dtype=np.float64)
+        for c in range(3):
+            vectors[:, c] = w_00*nodes[c].take(k) + w_10*nodes[c].take(k + 1) \
+                + w_01*nodes[c].take(k + self.nx) + w_11*nodes[c].take(k + self.nx + 1)
+
+        return vectors/np.sqrt(np.einsum('ij,ij->i', vectors, vectors))[:, np.newaxis]
+
+
+
+def distortionLUT(platepar, step=LUT_STEP):
+    """ Return the distortion LUT for the given platepar. It is computed only if the time independent
+        parameters of the platepar changed, otherwise it is taken from the cache.
+
+    Arguments:
+        platepar: [Platepar structure] Astrometry parameters.
+
+    Keyword arguments:
+        step: [int] Distance between the LUT nodes (px). LUT_STEP by default.
+
+    Return:
+        [DistortionLUT] Distortion lookup table.
+    """
+
+    key = distortionHash(platepar, step)
+
+    if key in DISTORTION_LUTS:
+        return DISTORTION_LUTS[key]
+
+    lut = DistortionLUT(platepar, step=step)
+    DISTORTION_LUTS[key] = lut
+
+    # Drop the oldest LUT
+    if len(DISTORTION_LUTS) > LUT_CACHE_SIZE:
+        DISTORTION_LUTS.popitem(last=False)
+
+    return lut
+
+
+
+def horizontalRotation(jd, lat, lon):
+    """ Compute the matrix which converts J2000 equatorial unit vectors to horizontal unit vectors
+        (azimuth +east of due north, elevation) at the given time. The matrix is built by converting the
+        basis vectors with the same precession and alt/az functions used by the refraction correction.
+
+    Arguments:
+        jd: [float] Julian date.
+        lat: [float] Latitude (degrees).
+        lon: [float] Longitude (degrees).
+
+    Return:
+        [ndarray] 3x3 orthogonal matrix.
+    """
+
+    columns = []
+    for ra, dec in [(0, 0), (np.pi/2, 0), (0, np.pi/2)]:
+
+        ra, dec = equatorialCoordPrecession(J2000_DAYS, jd, ra, dec)
+        azim, elev = cyraDec2AltAz(ra, dec, jd, np.radians(lat), np.radians(lon))
+
+        columns.append([np.cos(elev)*np.cos(azim), np.cos(elev)*np.sin(azim), np.sin(elev)])
+
+
+    return np.array(columns).T
+
+
+
+def xyToRaDecLUT(jd, x_data, y_data, platepar, step=LUT_STEP):
+    """ Convert image coordinates to RA, Dec using the distortion LUT. The results differ from xyToRaDecPP
+        by at most the interpolation error of the LUT, given by distortionLUT(platepar).max_error (px). The
+        only exception are the points closer than this error to the elevation of -0.5 deg, where the
+        refraction correction is discontinuous.
+
+    Arguments:
+        jd: [float] Julian date.
+        x_data: [ndarray] Image columns.
+        y_data: [ndarray] Image rows.
+        platepar: [Platepar structure] Astrometry parameters.
+
+    Keyword arguments:
+        step: [int] Distance between the LUT nodes (px). LUT_STEP by default.
+
+    Return:
+        (ra_data, dec_data): [tuple of ndarrays] J2000 right ascension and declination (degrees).
+    """
+
+    # Compute the FOV centre at the given time, as in cyXYToRADec
+    ra_ref_now = (np.radians(platepar.RA_d) + np.radians(JD2LST(jd, 0)[0]) - np.radians(platepar.Ho) \
+        + 2*np.pi)%(2*np.pi)
+    dec_ref = np.radians(platepar.dec_d)
+
+    # Correct the FOV centre for refraction
+    if platepar.refraction:
+        ra_ref_now, dec_ref = eqRefractionTrueToApparent(ra_ref_now, dec_ref, jd, np.radians(platepar.lat), \
+            np.radians(platepar.lon))
+
+    # Rotate the vectors to the sky, the columns are the FOV centre, north and east directions
+    sin_ra, cos_ra = np.sin(ra_ref_now), np.cos(ra_ref_now)
+    sin_dec, cos_dec = np.sin(dec_ref), np.cos(dec_ref)
+    rotation = np.array([
+        [cos_dec*cos_ra, -sin_dec*cos_ra, -sin_ra],
+        [cos_dec*sin_ra, -sin_dec*sin_ra,  cos_ra],
+        [sin_dec,         cos_dec,         0.0   ]])
+
+    # Interpolate the vectors from the LUT, rotated to the sky
+    vectors = distortionLUT(platepar, step=step).interpolate(np.ravel(x_data), np.ravel(y_data), \
+        rotation=rotation)
+
+
+    # Correct the apparent coordinates for refraction
+    if platepar.refraction:
+
+        # Convert the vectors to the horizontal frame
+        hor_rotation = horizontalRotation(jd, platepar.lat, platepar.lon)
+        vectors = vectors.dot(hor_rotation.T)
+
+        elev = np.arcsin(np.clip(vectors[:, 2], -1, 1))
+
+        # Compute the true elevation in the same way as refractionApparentToTrue
+        elev_deg = np.degrees(elev)
+        refraction = np.zeros_like(elev)
+        filt = elev > np.radians(-0.5)
+        refraction[filt] = np.radians(1.0/(60*np.tan(np.radians(elev_deg[filt] \
+            + 7.31/(elev_deg[filt] + 4.4)))))
+        elev_true = elev - refraction
+
+        # Change the elevation of the vectors and convert them back to the equatorial frame
+        cos_elev = np.cos(elev)
+        scale = np.ones_like(elev)
+        scale[cos_elev > 0] = np.cos(elev_true[cos_elev > 0])/cos_elev[cos_elev > 0]
+
+        vectors = np.c_[vectors[:, 0]*scale, vectors[:, 1]*scale, np.sin(elev_true)].dot(hor_rotation)
+
+
+    ra_data = np.degrees(np.arctan2(vectors[:, 1], vectors[:, 0]))%360
+    dec_data = np.degrees(np.arcsin(np.clip(vectors[:, 2], -1, 1)))
+
+    return ra_data.reshape(np.shape(x_data)), dec_data.reshape(np.shape(x_data))
+
+
+
+def imageRaDecMap(jd, platepar, step=LUT_STEP):
+    """ Compute RA, Dec of every pixel of the image using the distortion LUT.
+
+    Arguments:
+        jd: [float] Julian date.
+        platepar: [Platepar structure] Astrometry parameters.
+
+    Keyword arguments:
+        step: [int] Distance between the LUT nodes (px). LUT_STEP by default.
+
+    Return:
+        (ra_map, dec_map): [tuple of ndarrays] (Y_res, X_res) arrays of J2000 right ascension and
+            declination (degrees).
+    """
+
+    y_img, x_img = np.indices((int(platepar.Y_res), int(platepar.X_res)), dtype=np.float64)
+
+    return xyToRaDecLUT(jd, x_img, y_img, platepar, step=step)
+
+
+
+
+if __name__ == "__main__":
+
+    ### COMMAND LINE ARGUMENTS
+
+    # Init the command line arguments parser
+    arg_parser = argparse.ArgumentParser(description="Compare the RA, Dec map of the whole image computed with \
+        the distortion LUT and with the full astrometry model.")
+
+    arg_parser.add_argument('platepar_path', metavar='PLATEPAR', type=str, \
+        help='Path to the platepar file.')
+
+    arg_parser.add_argument('-s', '--step', metavar='STEP', type=int, default=LUT_STEP, \
+        help='Distance between the LUT nodes (px). {:d} by default.'.format(LUT_STEP))
+
+    # Parse the command line arguments
+    cml_args = arg_parser.parse_args()
+
+    #########################
+
+
+    platepar = Platepar.Platepar()
+    platepar.read(cml_args.platepar_path)
+
+    jd = platepar.JD
+
+
+    # Compute the map with the full model
+    t1 = time.time()
+    y_img, x_img = np.indices((int(platepar.Y_res), int(platepar.X_res)), dtype=np.float64)
+    ra_full, dec_full = cyXYToRADec(np.full(x_img.size, jd), x_img.ravel(), y_img.ravel(), \
+        float(platepar.lat), float(platepar.lon), float(platepar.X_res), float(platepar.Y_res), \
+        float(platepar.Ho), float(platepar.RA_d), float(platepar.dec_d), float(platepar.pos_angle_ref), \
+        float(platepar.F_scale), platepar.x_poly_fwd, platepar.y_poly_fwd, str(platepar.distortion_type), \
+        refraction=platepar.refraction, equal_aspect=platepar.equal_aspect, \
+        force_distortion_centre=platepar.force_distortion_centre)
+    t_full = time.time() - t1
+
+    # Build the LUT
+    t1 = time.time()
+    lut = distortionLUT(platepar, step=cml_args.step)
+    t_build = time.time() - t1
+
+    # Compute the map with the LUT
+    t1 = time.time()
+    ra_lut, dec_lut = imageRaDecMap(jd, platepar, step=cml_args.step)
+    t_lut = time.time() - t1
+
+
+    # Angular difference between the maps in pixels, computed from the chord between the unit vectors which
+    #   is accurate for small angles
+    ra_full, dec_full = np.radians(ra_full), np.radians(dec_full)
+    ra_lut, dec_lut = np.radians(ra_lut.ravel()), np.radians(dec_lut.ravel())
+    chord = np.sqrt((np.cos(dec_full)*np.cos(ra_full) - np.cos(dec_lut)*np.cos(ra_lut))**2 \
+        + (np.cos(dec_full)*np.sin(ra_full) - np.cos(dec_lut)*np.sin(ra_lut))**2 \
+        + (np.sin(dec_full) - np.sin(dec_lut))**2)
+    diff_px = np.degrees(2*np.arcsin(np.clip(chord/2, 0, 1)))*platepar.F_scale
+
+    print('Full model: {:.3f} s'.format(t_full))
+    print('LUT: {:.3f} s to build, {:.3f} s per map'.format(t_build, t_lut))
+    print('Stated error bound: {:.4f} px'.format(lut.max_error))
+    print('Error: median {:.4f} px, max {:.4f} px'.format(np.median(diff_px), np.max(diff_px)))
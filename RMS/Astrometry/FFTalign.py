@@ -14,10 +14,12 @@ import os
 import sys
 import copy
 import shutil
+import hashlib
 import argparse
 
 
 import numpy as np
+import scipy.ndimage
 import matplotlib.pyplot as plt
 
 from RMS.Astrometry import ApplyAstrometry
@@ -35,38 +37,65 @@ pyximport.install(setup_args={'include_dirs':[np.get_include()]})
 from RMS.Astrometry.CyFunctions import subsetCatalog
 
 
+# Log-polar transform parameters for every used image size
+LOG_POLAR_GRIDS = {}
+
+# Cached spectra of the synthetic star images, the keys are hashes of the images
+IMAGE_SPECTRA_CACHE = {}
+
+# Maximum number of cached image spectra
+IMAGE_SPECTRA_CACHE_SIZE = 32
 
-def addPoint(img, xc, yc, radius):
-    """ Add a point to the image. """
 
-    img_w = img.shape[1]
-    img_h = img.shape[0]
+
+def addPoints(img, x_data, y_data, radius):
+    """ Add Gaussian dots centred at the given points to the image. Overlapping dots are combined by taking
+        the maximum value.
+
+    Arguments:
+        img: [ndarray] Image to which the dots will be added.
+        x_data: [ndarray] X coordinates of the dot centres.
+        y_data: [ndarray] Y coordinates of the dot centres.
+        radius: [int] Radius of the dots (px).
+
+    Return:
+        img: [ndarray] Image with added dots.
+    """
+
+    img_h, img_w = img.shape
+
+    x_data = np.asarray(x_data, dtype=np.float64).ravel()
+    y_data = np.asarray(y_data, dtype=np.float64).ravel()
 
     sigma, mu = 1.0, 0.0
 
     # Generate a small array with a gaussian
-    grid_arr = np.linspace(-radius, radius, 2*radius + 1, dtype=np.int)
+    grid_arr = np.arange(-radius, radius + 1)
     x, y = np.meshgrid(grid_arr, grid_arr)
     d = np.sqrt(x**2 + y**2)
     gauss = 255*np.exp(-((d - mu)**2/(2.0*sigma**2)))
 
-    # Overlay the Gaussian on the image
-    for xi, i in enumerate(grid_arr):
-        for yj, j in enumerate(grid_arr):
+    # Compute the coordinates of all dot pixels (truncated towards zero), one row per point
+    xp = (x.ravel() + x_data[:, np.newaxis]).astype(np.int64)
+    yp = (y.ravel() + y_data[:, np.newaxis]).astype(np.int64)
+    values = np.broadcast_to(gauss.ravel(), xp.shape)
 
-            # Compute the coordinates of the point
-            xp = int(i + xc)
-            yp = int(j + yc)
+    # Take only the pixels inside the image
+    filt = (xp >= 0) & (xp < img_w) & (yp >= 0) & (yp < img_h)
 
-            # Check that the point is inside the image
-            if (xp >=0) and (xp < img_w) and (yp >= 0) and (yp < img_h):
+    # Overlay the Gaussians on the image
+    img_flat = img.astype(np.float64).ravel()
+    np.maximum.at(img_flat, yp[filt]*img_w + xp[filt], values[filt])
+    img[:] = img_flat.reshape(img.shape)
 
-                # Set the value of the gaussian to the image
-                img[yp, xp] = max(gauss[yj, xi], img[yp, xp])
+    return img
 
 
-    return img
 
+def addPoint(img, xc, yc, radius):
+    """ Add a point to the image. """
+
+    return addPoints(img, [xc], [yc], radius)
 
 
 
@@ -77,15 +106,238 @@ def constructImage(img_size, point_list, dot_radius):
     img = np.zeros((img_size, img_size), dtype=np.uint8)
 
     # Add all given points to the imge
-    for point in point_list:
-        x, y = point
-        img = addPoint(img, x, y, dot_radius)
+    point_list = np.asarray(point_list, dtype=np.float64).reshape(-1, 2)
+    img = addPoints(img, point_list[:, 0], point_list[:, 1], dot_radius)
 
     return img
 
 
 
-def findStarsTransform(config, reference_list, moved_list, img_size=256, dot_radius=2, show_plot=False):
+def apodizationWindow(img_size, apo_radius):
+    """ Compute a window which goes smoothly to zero at the image edges, with a Hanning profile.
+
+    Arguments:
+        img_size: [int] Size of the square image.
+        apo_radius: [int] Width of the edge band where the window is smaller than 1 (px).
+
+    Return:
+        [ndarray] (img_size, img_size) window.
+    """
+
+    window = np.ones(img_size)
+
+    if apo_radius > 0:
+        hanning = np.hanning(2*apo_radius)
+        window[:apo_radius] = hanning[:apo_radius]
+        window[-apo_radius:] = hanning[-apo_radius:]
+
+    return np.outer(window, window)
+
+
+
+def logPolarGrid(img_size):
+    """ Compute the parameters of the log-polar transform of the image spectrum, in the same way as imreg_dft.
+
+    Arguments:
+        img_size: [int] Size of the square image.
+
+    Return:
+        (log_base, coords, spectrum_filter, apodization):
+            - log_base: [float] Base of the logarithm of the radial log-polar coordinate.
+            - coords: [ndarray] (2, img_size, img_size) array of spectrum (y, x) coordinates of the log-polar
+                samples. The rows correspond to angles between 0 and -180 deg, the columns to the log radius.
+            - spectrum_filter: [ndarray] High-pass filter which is applied to the spectrum.
+            - apodization: [ndarray] Window which smoothly suppresses the image edges.
+    """
+
+    if img_size in LOG_POLAR_GRIDS:
+        return LOG_POLAR_GRIDS[img_size]
+
+    centre = img_size/2.0
+
+    # The largest radius is a bit larger than half of the image, the log-polar image is square
+    log_base = np.exp(np.log(img_size*1.1/2.0)/img_size)
+
+    theta = -np.linspace(0, np.pi, img_size, endpoint=False)[:, np.newaxis]
+    radius = log_base**np.arange(img_size, dtype=np.float64)[np.newaxis, :]
+    coords = np.array([radius*np.sin(theta) + centre, radius*np.cos(theta) + centre])
+
+    # Radial cosine filter which suppresses the low spatial frequencies
+    freq = np.linspace(-np.pi/2, np.pi/2, img_size)
+    freq_r = np.hypot(freq[:, np.newaxis], freq[np.newaxis, :])
+    spectrum_filter = 1.0 - np.cos(freq_r)**2
+    spectrum_filter[freq_r > np.pi/2] = 1
+
+    apodization = apodizationWindow(img_size, int(0.12*img_size))
+
+    LOG_POLAR_GRIDS[img_size] = (log_base, coords, spectrum_filter, apodization)
+
+    return LOG_POLAR_GRIDS[img_size]
+
+
+
+def imageSpectra(img):
+    """ Compute the spectrum of the image and the spectrum of the log-polar transform of its amplitude
+        spectrum, which are used for phase correlation. The results are cached, so the spectra of the
+        reference image are computed only once when it is aligned repeatedly.
+
+    Arguments:
+        img: [ndarray] Square image.
+
+    Return:
+        (img_spectrum, logpolar_spectrum): [tuple of ndarrays] Complex spectra.
+    """
+
+    img = np.ascontiguousarray(img)
+    key = (img.shape, img.dtype.str, hashlib.sha1(img.tobytes()).hexdigest())
+
+    if key in IMAGE_SPECTRA_CACHE:
+        return IMAGE_SPECTRA_CACHE[key]
+
+    log_base, coords, spectrum_filter, apodization = logPolarGrid(img.shape[0])
+
+    img = img.astype(np.float64)
+
+    # Amplitude spectrum of the apodized image
+    amplitude = np.abs(np.fft.fftshift(np.fft.fft2(apodization*img))*spectrum_filter)
+
+    # Resample the amplitude spectrum to log-polar coordinates, where rotation and scaling become translations
+    logpolar = scipy.ndimage.map_coordinates(amplitude, coords, order=3, mode='constant', \
+        cval=np.percentile(amplitude, 1))
+
+    spectra = (np.fft.fft2(img), np.fft.fft2(logpolar))
+
+    if len(IMAGE_SPECTRA_CACHE) >= IMAGE_SPECTRA_CACHE_SIZE:
+        IMAGE_SPECTRA_CACHE.clear()
+
+    IMAGE_SPECTRA_CACHE[key] = spectra
+
+    return spectra
+
+
+
+def phaseCorrelation(spectrum_ref, spectrum_mov, window=None):
+    """ Find the translation between two images from their spectra using phase correlation.
+
+    Arguments:
+        spectrum_ref: [ndarray] Spectrum of the reference image.
+        spectrum_mov: [ndarray] Spectrum of the moved image.
+
+    Keyword arguments:
+        window: [ndarray] Window applied to the correlation before finding the peak, in coordinates where
+            zero translation is in the centre. None by default.
+
+    Return:
+        (shift, success):
+            - shift: [ndarray] (y, x) translation which should be applied to the moved image to match the
+                reference image, with subpixel precision.
+            - success: [float] Strength of the correlation peak.
+    """
+
+    shape = np.array(spectrum_ref.shape)
+
+    # Normalized cross-power spectrum
+    cross_power = spectrum_ref*spectrum_mov.conjugate()
+    eps = np.abs(spectrum_mov).max()*1e-15
+    corr = np.fft.fftshift(np.abs(np.fft.ifft2(cross_power/(np.abs(cross_power) + eps))))
+
+    corr_filtered = corr if window is None else corr*window
+
+    # Refine the peak position using the centre of mass of the 5x5 neighbourhood
+    peak = np.array(np.unravel_index(np.argmax(corr_filtered), corr_filtered.shape))
+    rows = (peak[0] + np.arange(-2, 3))%shape[0]
+    cols = (peak[1] + np.arange(-2, 3))%shape[1]
+    neighbourhood = corr_filtered[np.ix_(rows, cols)]
+
+    offset = np.arange(-2, 3)
+    com = np.array([np.sum(neighbourhood*offset[:, np.newaxis]), np.sum(neighbourhood*offset)])
+    com /= np.sum(neighbourhood)
+
+    # Wrap the peak position around the correlation image
+    shift = (peak + com + 0.5)%shape - 0.5 - shape//2
+
+    peak = np.round(peak + com).astype(int)%shape
+    success = np.sqrt(np.sum(corr[np.ix_((peak[0] + np.arange(-2, 3))%shape[0], \
+        (peak[1] + np.arange(-2, 3))%shape[1])])*corr[peak[0], peak[1]])
+
+    return shift, success
+
+
+
+def similarityTransform(reference_list, moved_list, img_size, dot_radius):
+    """ Find the rotation, scale and translation between two lists of star positions by phase correlation.
+        This follows the approach of imreg_dft.imreg.similarity, but only NumPy and SciPy are required. The
+        rotation and scale are found by correlating the log-polar amplitude spectra of the synthetic
+        images, and the translation by correlating the reference image with the image of the transformed
+        moved stars.
+
+    Arguments:
+        reference_list: [ndarray] (x, y) coordinates of reference stars on the synthetic image.
+        moved_list: [ndarray] (x, y) coordinates of moved stars on the synthetic image.
+        img_size: [int] Size of the synthetic images.
+        dot_radius: [int] The radius of the dot which will be drawn on the synthetic image.
+
+    Return:
+        (angle, scale, tvec, img_ref, img_transformed):
+            - angle: [float] Clockwise angle of rotation of the moved image (deg).
+            - scale: [float] Scale of the moved image.
+            - tvec: [ndarray] (y, x) translation of the moved image after rotation and scaling.
+            - img_ref: [ndarray] Synthetic reference image.
+            - img_transformed: [ndarray] Synthetic image of the transformed moved stars.
+    """
+
+    log_base, _, _, _ = logPolarGrid(img_size)
+
+    img_ref = constructImage(img_size, reference_list, dot_radius)
+    img_mov = constructImage(img_size, moved_list, dot_radius)
+
+    img_ref_spectrum, logpolar_ref_spectrum = imageSpectra(img_ref)
+    _, logpolar_mov_spectrum = imageSpectra(img_mov)
+
+    # Find the rotation and the scale
+    (arg_angle, arg_radius), _ = phaseCorrelation(logpolar_ref_spectrum, logpolar_mov_spectrum)
+
+    angle = (180*arg_angle/img_size + 180)%360 - 180
+    scale = 1.0/log_base**arg_radius
+
+    if not 0.5 < scale < 2:
+        raise ValueError("The scale change {:g} is too large!".format(scale))
+
+
+    # Suppress the large translations
+    window = apodizationWindow(img_size, img_size//6)
+
+
+    # Rotate and scale the moved stars around the image centre. The rotation is ambiguous by 180 deg, so
+    #   the translation is computed for both angles and the one with the stronger correlation is taken
+    best = None
+    centre = img_size/2.0
+    moved_x = moved_list[:, 0] - centre
+    moved_y = moved_list[:, 1] - centre
+    for angle_try in [angle, (angle + 360)%360 - 180]:
+
+        cos_ang, sin_ang = np.cos(np.radians(angle_try)), np.sin(np.radians(angle_try))
+        transformed = np.c_[centre + scale*(cos_ang*moved_x + sin_ang*moved_y), \
+            centre + scale*(-sin_ang*moved_x + cos_ang*moved_y)]
+
+        img_transformed = constructImage(img_size, transformed, dot_radius)
+        tvec, success = phaseCorrelation(img_ref_spectrum, np.fft.fft2(img_transformed), window=window)
+
+        if (best is None) or (success > best[0]):
+            best = (success, angle_try, tvec, transformed)
+
+
+    _, angle, tvec, transformed = best
+
+    # Construct the transformed image for plotting
+    img_transformed = constructImage(img_size, transformed + tvec[::-1], dot_radius)
+
+    return angle, scale, tvec, img_ref, img_transformed
+
+
+
+def findStarsTransform(config, reference_list, moved_list, img_size=256, dot_radius=2, show_plot=False, \
+    use_imreg=False):
     """ Given a list of reference and predicted star positions, return a transform (rotation, scale, \
         translation) between the two lists using FFT image registration. This is achieved by creating a
         synthetic star image using both lists and searching for the transform using phase correlation.
@@ -99,6 +351,8 @@ def findStarsTransform(config, reference_list, moved_list, img_size=256, dot_rad
             FFT registration algorithm.
         dot_radius: [int] The radius of the dot which will be drawn on the synthetic image.
         show_plot: [bool] Show the comparison between the reference and image synthetic images.
+        use_imreg: [bool] Use the imreg_dft library for the registration instead of the built-in NumPy
+            phase correlation, which caches the spectra of the reference image. False by default.
     Return:
         angle, scale, translation_x, translation_y:
             - angle: [float] Angle of rotation (deg).
@@ -107,19 +361,20 @@ def findStarsTransform(config, reference_list, moved_list, img_size=256, dot_rad
             - translation_y: [float]
     """
 
-    # If the image registration library is not installed, return nothing
-    if not IMREG_INSTALLED:
+    # If the image registration library is not installed, use the built-in registration
+    if use_imreg and not IMREG_INSTALLED:
         print("WARNING:")
         print('The imreg_dft library is not installed! Install it by running either:')
         print(' a) pip install imreg_dft')
         print(' b) conda install -c conda-forge imreg_dft')
+        print('Using the built-in phase correlation instead...')
 
-        return 0.0, 1.0, 0.0, 0.0
+        use_imreg = False
 
 
     # Set input types
-    reference_list = np.array(reference_list).astype(np.float)
-    moved_list = np.array(moved_list).astype(np.float)
+    reference_list = np.array(reference_list).astype(np.float64)
+    moved_list = np.array(moved_list).astype(np.float64)
 
     # Rescale the coordinates so the whole image fits inside the square (rescale by the smaller image axis)
     rescale_factor = min(config.width, config.height)/img_size
@@ -137,22 +392,40 @@ def findStarsTransform(config, reference_list, moved_list, img_size=256, dot_rad
     moved_list[:, 0] += shift_x
     moved_list[:, 1] += shift_y
 
-    # Construct the reference and moved images
-    img_ref = constructImage(img_size, reference_list, dot_radius)
-    img_mov = constructImage(img_size, moved_list, dot_radius)
 
+    if use_imreg:
+
+        # Construct the reference and moved images
+        img_ref = constructImage(img_size, reference_list, dot_radius)
+        img_mov = constructImage(img_size, moved_list, dot_radius)
 
-    # Run the FFT registration
-    try:
-        res = imreg_dft.imreg.similarity(img_ref, img_mov)
-    except ValueError:
-        print('imreg_dft error: The scale correction is too high!')
-        return 0.0, 1.0, 0.0, 0.0
+        # Run the FFT registration
+        try:
+            res = imreg_dft.imreg.similarity(img_ref, img_mov)
+        except ValueError:
+            print('imreg_dft error: The scale correction is too high!')
+            return 0.0, 1.0, 0.0, 0.0
 
+        angle = res['angle']
+        scale = res['scale']
+        translate = res['tvec']
+        img_transformed = res['timg']
+
+    else:
+
+        # Run the built-in FFT registration
+        try:
+            angle, scale, translate, img_ref, img_transformed = similarityTransform(reference_list, \
+                moved_list, img_size, dot_radius)
+        except ValueError:
+            print('FFT registration error: The scale correction is too high!')
+            return 0.0, 1.0, 0.0, 0.0
+
+        # The registration fails if there are no stars in the central part of one of the images
+        if not np.all(np.isfinite([angle, scale, translate[0], translate[1]])):
+            print('FFT registration error: No stars to register!')
+            return 0.0, 1.0, 0.0, 0.0
 
-    angle = res['angle']
-    scale = res['scale']
-    translate = res['tvec']
 
     # Extract translation and rescale it
     translation_x = rescale_factor*translate[1]
@@ -173,13 +446,13 @@ def findStarsTransform(config, reference_list, moved_list, img_size=256, dot_rad
         ax1.imshow(img_ref, cmap='gray')
         ax1.set_title('Reference')
 
-        ax2.imshow(img_mov, cmap='gray')
+        ax2.imshow(constructImage(img_size, moved_list, dot_radius), cmap='gray')
         ax2.set_title('Moved')
 
-        ax3.imshow(res['timg'], cmap='gray')
+        ax3.imshow(img_transformed, cmap='gray')
         ax3.set_title('Transformed')
 
-        ax4.imshow(np.abs(res['timg'].astype(np.int) - img_ref.astype(np.int)).astype(np.uint8), cmap='gray')
+        ax4.imshow(np.abs(img_transformed.astype(int) - img_ref.astype(int)).astype(np.uint8), cmap='gray')
         ax4.set_title('Difference')
 
         plt.tight_layout()
@@ -215,42 +488,44 @@ def alignPlatepar(config, platepar, calstars_time, calstars_coords, scale_update
     maxiter = 10
     search_fainter = True
     mag_step = 0.2
-    for inum in range(maxiter):
 
-        # Load the catalog stars
-        catalog_stars, _, _ = StarCatalog.readStarCatalog(config.star_catalog_path, config.star_catalog_file, \
-            lim_mag=config.catalog_mag_limit, mag_band_ratios=config.star_catalog_band_ratios)
+    # Load the catalog stars down to the faintest magnitude which can be reached in the search, so the catalog
+    #   is loaded and projected to the image only once
+    mag_limit_faintest = config.catalog_mag_limit + maxiter*mag_step
+    catalog_stars, _, _ = StarCatalog.readStarCatalog(config.star_catalog_path, config.star_catalog_file, \
+        lim_mag=mag_limit_faintest, mag_band_ratios=config.star_catalog_band_ratios)
+
+    # Get the RA/Dec of the image centre
+    _, ra_centre, dec_centre, _ = ApplyAstrometry.xyToRaDecPP([calstars_time], [platepar.X_res/2], \
+            [platepar.Y_res/2], [1], platepar, extinction_correction=False)
 
-        # Get the RA/Dec of the image centre
-        _, ra_centre, dec_centre, _ = ApplyAstrometry.xyToRaDecPP([calstars_time], [platepar.X_res/2], \
-                [platepar.Y_res/2], [1], platepar, extinction_correction=False)
+    ra_centre = ra_centre[0]
+    dec_centre = dec_centre[0]
 
-        ra_centre = ra_centre[0]
-        dec_centre = dec_centre[0]
+    # Compute Julian date
+    jd = date2JD(*calstars_time)
 
-        # Compute Julian date
-        jd = date2JD(*calstars_time)
+    # Calculate the FOV radius in degrees
+    fov_y, fov_x = ApplyAstrometry.computeFOVSize(platepar)
+    fov_radius = np.sqrt(fov_x**2 + fov_y**2)
 
-        # Calculate the FOV radius in degrees
-        fov_y, fov_x = ApplyAstrometry.computeFOVSize(platepar)
-        fov_radius = np.sqrt(fov_x**2 + fov_y**2)
+    # Take only those stars which are inside the FOV
+    filtered_indices, _ = subsetCatalog(catalog_stars, ra_centre, dec_centre, jd, platepar.lat, \
+        platepar.lon, fov_radius, mag_limit_faintest)
 
-        # Take only those stars which are inside the FOV
-        filtered_indices, _ = subsetCatalog(catalog_stars, ra_centre, dec_centre, jd, platepar.lat, \
-            platepar.lon, fov_radius, config.catalog_mag_limit)
+    # Take those catalog stars which should be inside the FOV
+    ra_catalog, dec_catalog, mag_catalog = catalog_stars[filtered_indices].T
+    catalog_x, catalog_y = ApplyAstrometry.raDecToXYPP(ra_catalog, dec_catalog, jd, platepar)
 
-        # Take those catalog stars which should be inside the FOV
-        ra_catalog, dec_catalog, _ = catalog_stars[filtered_indices].T
-        catalog_xy = ApplyAstrometry.raDecToXYPP(ra_catalog, dec_catalog, jd, platepar)
+    # Cut all stars that are outside image coordinates
+    inside = (catalog_x > 0) & (catalog_x < config.width) & (catalog_y > 0) & (catalog_y < config.height)
+    catalog_xy_all = np.c_[catalog_x, catalog_y][inside]
+    mag_catalog = mag_catalog[inside]
 
-        catalog_x, catalog_y = catalog_xy
-        catalog_xy = np.c_[catalog_x, catalog_y]
+    for inum in range(maxiter):
 
-        # Cut all stars that are outside image coordinates
-        catalog_xy = catalog_xy[catalog_xy[:, 0] > 0]
-        catalog_xy = catalog_xy[catalog_xy[:, 0] < config.width]
-        catalog_xy = catalog_xy[catalog_xy[:, 1] > 0]
-        catalog_xy = catalog_xy[catalog_xy[:, 1] < config.height]
+        # Take the stars brighter than the current limiting magnitude
+        catalog_xy = catalog_xy_all[mag_catalog <= config.catalog_mag_limit]
 
 
         # If there are more catalog than image stars, this means that the limiting magnitude is too faint
@@ -0,0 +1,863 @@
+""" Blind plate solving of stars detected on an image using the star catalog, without contacting the
+    nova.astrometry.net service.
+
+The sky is covered with overlapping tiles. The brightest catalog stars in every tile are projected to the
+tangent plane of the tile, and all triangles formed by them are indexed by their side ratios, which do not
+change with the rotation, scale and the position of the triangle. Triangles formed by the brightest stars
+on the image are looked up in the index, every match gives a similarity transform between the tangent plane
+of the tile and the image, and the transforms are voted on. The best voted transforms are verified by
+counting the matched stars, and the best one is refined using all stars in the FOV.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import copy
+import argparse
+import itertools
+
+import numpy as np
+import scipy.optimize
+import scipy.spatial
+
+from RMS.Astrometry.ApplyAstrometry import raDecToXYPP, rotationWrtHorizon
+from RMS.Astrometry.Conversions import date2JD, JD2HourAngle, raDec2AltAz
+import RMS.ConfigReader as cr
+from RMS.Formats import CALSTARS
+from RMS.Formats.FFfile import getMiddleTimeFF
+from RMS.Formats import Platepar
+from RMS.Formats import StarCatalog
+
+
+# Cached triangle indices, the keys are the catalog hash, the tile radius and the number of stars
+PLATE_SOLVE_INDEX_CACHE = {}
+
+# Maximum number of cached triangle indices
+PLATE_SOLVE_INDEX_CACHE_SIZE = 4
+
+# Maximum difference between side ratios of matched triangles
+PLATE_SOLVE_TRIANGLE_TOLERANCE = 0.01
+
+# Maximum number of catalog triangles matched to every image triangle
+PLATE_SOLVE_MAX_TRIANGLE_MATCHES = 200
+
+# Maximum radius of the part of the image used for matching triangles (deg)
+PLATE_SOLVE_MAX_RADIUS = 20.0
+
+# Minimum number of matched stars for the solution to be accepted
+PLATE_SOLVE_MIN_MATCHED = 8
+
+# Minimum fraction of the brightest stars in the FOV which have to be matched for the solution to be accepted
+PLATE_SOLVE_MIN_MATCHED_FRACTION = 0.35
+
+
+
+def gnomonicProject(ra, dec, ra0, dec0):
+    """ Project the given sky coordinates to the tangent plane at (ra0, dec0).
+
+    Arguments:
+        ra: [ndarray] Right ascension (deg).
+        dec: [ndarray] Declination (deg).
+        ra0: [float] Right ascension of the tangent point (deg).
+        dec0: [float] Declination of the tangent point (deg).
+
+    Return:
+        (xi, eta, cos_c): [tuple of ndarrays] Standard coordinates towards the east and the north (radians
+            on the tangent plane), and the cosine of the angular distance from the tangent point.
+    """
+
+    ra = np.radians(ra)
+    dec = np.radians(dec)
+    ra0 = np.radians(ra0)
+    dec0 = np.radians(dec0)
+
+    cos_c = np.sin(dec0)*np.sin(dec) + np.cos(dec0)*np.cos(dec)*np.cos(ra - ra0)
+
+    xi = np.cos(dec)*np.sin(ra - ra0)/cos_c
+    eta = (np.cos(dec0)*np.sin(dec) - np.sin(dec0)*np.cos(dec)*np.cos(ra - ra0))/cos_c
+
+    return xi, eta, cos_c
+
+
+
+def gnomonicUnproject(xi, eta, ra0, dec0):
+    """ Compute sky coordinates of points on the tangent plane at (ra0, dec0). Inverse of gnomonicProject.
+
+    Arguments:
+        xi: [ndarray] Standard coordinate towards the east (radians on the tangent plane).
+        eta: [ndarray] Standard coordinate towards the north (radians on the tangent plane).
+        ra0: [float] Right ascension of the tangent point (deg).
+        dec0: [float] Declination of the tangent point (deg).
+
+    Return:
+        (ra, dec): [tuple of ndarrays] Right ascension and declination (deg).
+    """
+
+    ra0 = np.radians(ra0)
+    dec0 = np.radians(dec0)
+
+    rho = np.hypot(xi, eta)
+    c = np.arctan(rho)
+
+    ra = ra0 + np.arctan2(xi*np.sin(c), rho*np.cos(dec0)*np.cos(c) - eta*np.sin(dec0)*np.sin(c))
+    dec = np.arcsin(np.cos(c)*np.sin(dec0) + eta*np.sin(c)*np.cos(dec0)/np.where(rho > 0, rho, 1.0))
+
+    return np.degrees(ra)%360, np.degrees(dec)
+
+
+
+def triangles(x, y):
+    """ Form all triangles between the given points and compute their side ratios. The vertices of every
+        triangle are ordered by the length of the opposite side, from the longest to the shortest, so the
+        vertices of the same triangle are in the same order regardless of the rotation, scale and the
+        reflection of the points. Triangles which are too narrow, or which have sides of almost the same
+        length (so their vertices can't be ordered reliably), are rejected.
+
+    Arguments:
+        x: [ndarray] X coordinates of points.
+        y: [ndarray] Y coordinates of points.
+
+    Return:
+        (ratios, vertices):
+            ratios: [ndarray] Ratios of the middle and the shortest side to the longest side (N x 2).
+            vertices: [ndarray] Indices of the ordered vertices of every triangle (N x 3).
+    """
+
+    if len(x) < 3:
+        return np.zeros((0, 2)), np.zeros((0, 3), dtype=np.int64)
+
+    vertices = np.array(list(itertools.combinations(range(len(x)), 3)), dtype=np.int64)
+
+    # Lengths of sides opposite to every vertex
+    sides = np.c_[
+        np.hypot(x[vertices[:, 1]] - x[vertices[:, 2]], y[vertices[:, 1]] - y[vertices[:, 2]]),
+        np.hypot(x[vertices[:, 0]] - x[vertices[:, 2]], y[vertices[:, 0]] - y[vertices[:, 2]]),
+        np.hypot(x[vertices[:, 0]] - x[vertices[:, 1]], y[vertices[:, 0]] - y[vertices[:, 1]])]
+
+    # Order the vertices by the length of the opposite side
+    order = np.argsort(-sides, axis=1)
+    sides = np.take_along_axis(sides, order, axis=1)
+    vertices = np.take_along_axis(vertices, order, axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratios = sides[:, 1:]/sides[:, :1]
+
+    # Reject narrow triangles and triangles with ambiguous ordering of vertices
+    good = (ratios[:, 1] > 0.1) & (ratios[:, 0] < 1 - 2*PLATE_SOLVE_TRIANGLE_TOLERANCE) \
+        & (ratios[:, 0] - ratios[:, 1] > 2*PLATE_SOLVE_TRIANGLE_TOLERANCE)
+
+    return ratios[good], vertices[good]
+
+
+
+def fibonacciSphere(n_points):
+    """ Return RA and Dec (deg) of approximately uniformly distributed points on the sphere. """
+
+    i = np.arange(n_points) + 0.5
+
+    dec = np.degrees(np.arcsin(1 - 2*i/n_points))
+    ra = (np.degrees(np.pi*(1 + 5**0.5)*i))%360
+
+    return ra, dec
+
+
+
+def raDecToUnitVectors(ra, dec):
+    """ Convert RA and Dec (deg) to unit vectors. """
+
+    ra = np.radians(ra)
+    dec = np.radians(dec)
+
+    return np.c_[np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra), np.sin(dec)]
+
+
+
+class PlateSolveIndex(object):
+    def __init__(self, catalog_stars, tile_radius, n_stars):
+        """ Index of triangles formed by the brightest catalog stars in overlapping tiles covering the sky.
+
+        Arguments:
+            catalog_stars: [ndarray] An array of catalog stars (ra, dec, mag).
+            tile_radius: [float] Radius of every tile (deg). It should be similar to the radius of the part
+                of the image from which the stars are taken.
+            n_stars: [int] Number of the brightest stars in every tile used to form the triangles.
+        """
+
+        self.catalog_stars = catalog_stars
+        self.tile_radius = tile_radius
+
+        # Catalog indices sorted by magnitude, so the brightest stars come first
+        self.mag_order = np.argsort(catalog_stars[:, 2], kind='stable')
+        self.star_tree = scipy.spatial.cKDTree(raDecToUnitVectors(catalog_stars[self.mag_order, 0], \
+            catalog_stars[self.mag_order, 1]))
+
+        # Space the tiles by a half of the tile radius
+        tile_spacing = np.radians(tile_radius/2)
+        self.tile_ra, self.tile_dec = fibonacciSphere(int(np.ceil(4*np.pi/tile_spacing**2)))
+
+        ratios_list = []
+        tile_list = []
+        vertices_list = []
+
+        self.tile_xi = []
+        self.tile_eta = []
+        self.tile_stars = []
+
+        chord = 2*np.sin(np.radians(tile_radius)/2)
+        for tile_id, tile_vect in enumerate(raDecToUnitVectors(self.tile_ra, self.tile_dec)):
+
+            # Take the brightest stars in the tile. Tiles with too few stars (e.g. with a narrow FOV and a bright
+            #   catalog limit) are kept empty so the tile IDs don't change
+            star_indices = np.sort(np.array(self.star_tree.query_ball_point(tile_vect, chord), \
+                dtype=np.int64))[:n_stars]
+            star_indices = self.mag_order[star_indices] if len(star_indices) >= 3 \
+                else np.zeros(0, dtype=np.int64)
+
+            # Project the stars to the tangent plane of the tile
+            xi, eta, _ = gnomonicProject(catalog_stars[star_indices, 0], catalog_stars[star_indices, 1], \
+                self.tile_ra[tile_id], self.tile_dec[tile_id])
+
+            self.tile_xi.append(xi)
+            self.tile_eta.append(eta)
+            self.tile_stars.append(star_indices)
+
+            ratios, vertices = triangles(xi, eta)
+
+            ratios_list.append(ratios)
+            vertices_list.append(vertices)
+            tile_list.append(np.zeros(len(ratios), dtype=np.int64) + tile_id)
+
+
+        self.tri_ratios = np.concatenate(ratios_list)
+        self.tri_vertices = np.concatenate(vertices_list)
+        self.tri_tile = np.concatenate(tile_list)
+
+        self.tri_tree = scipy.spatial.cKDTree(self.tri_ratios)
+
+
+
+def plateSolveIndex(catalog_stars, tile_radius, n_stars):
+    """ Return the triangle index for the given catalog, reusing a cached one if possible. See
+        PlateSolveIndex.
+    """
+
+    # Round the tile radius so small changes in the FOV size don't rebuild the index
+    tile_radius = round(tile_radius, 0)
+
+    # The catalog is reloaded on every ACF run, so the key is computed from the catalog contents
+    key = (hash(np.ascontiguousarray(catalog_stars).tobytes()), tile_radius, n_stars)
+
+    index = PLATE_SOLVE_INDEX_CACHE.get(key)
+    if index is None:
+
+        if len(PLATE_SOLVE_INDEX_CACHE) >= PLATE_SOLVE_INDEX_CACHE_SIZE:
+            PLATE_SOLVE_INDEX_CACHE.clear()
+
+        index = PlateSolveIndex(catalog_stars, tile_radius, n_stars)
+        PLATE_SOLVE_INDEX_CACHE[key] = index
+
+    return index
+
+
+
+def fitSimilarity(src, dst, parity):
+    """ Fit a similarity transform dst = a*src + b (or a*conj(src) + b if the parity is -1) by least squares.
+        The points are given as complex numbers.
+
+    Arguments:
+        src: [ndarray] Source points (complex), the last axis are points.
+        dst: [ndarray] Destination points (complex), the last axis are points.
+        parity: [int or ndarray] 1 for a proper similarity transform, -1 for a reflected one.
+
+    Return:
+        (a, b): [tuple of complex] Scale and rotation, and the translation.
+    """
+
+    src = np.where(parity > 0, src, np.conj(src)) if np.ndim(parity) == 0 \
+        else np.where(np.expand_dims(parity, -1) > 0, src, np.conj(src))
+
+    src_mean = np.mean(src, axis=-1, keepdims=True)
+    dst_mean = np.mean(dst, axis=-1, keepdims=True)
+
+    a = np.sum((dst - dst_mean)*np.conj(src - src_mean), axis=-1)/np.sum(np.abs(src - src_mean)**2, axis=-1)
+    b = dst_mean[..., 0] - a*src_mean[..., 0]
+
+    return a, b
+
+
+
+def applySimilarity(a, b, parity, src):
+    """ Apply the similarity transform fitted with fitSimilarity to the given complex points. """
+
+    if parity < 0:
+        src = np.conj(src)
+
+    return a*src + b
+
+
+
+def invertSimilarity(a, b, parity, dst):
+    """ Compute source points of the given destination points. Inverse of applySimilarity. """
+
+    src = (dst - b)/a
+
+    if parity < 0:
+        src = np.conj(src)
+
+    return src
+
+
+
+def matchPoints(tree, points, match_radius):
+    """ Match every point to the closest point in the KD tree, and keep only the unique matches inside the
+        match radius.
+
+    Arguments:
+        tree: [cKDTree] KD tree of image stars.
+        points: [ndarray] Points to match (N x 2).
+        match_radius: [float] Maximum distance between the matched points.
+
+    Return:
+        (point_indices, tree_indices): [tuple of ndarrays] Indices of matched points and the tree points.
+    """
+
+    dist, tree_indices = tree.query(points, distance_upper_bound=match_radius)
+
+    point_indices = np.where(np.isfinite(dist))[0]
+    tree_indices = tree_indices[point_indices]
+
+    # Keep only the closest point if many points were matched to the same tree point
+    order = np.argsort(dist[point_indices])
+    _, unique_indices = np.unique(tree_indices[order], return_index=True)
+    keep = order[unique_indices]
+
+    return point_indices[keep], tree_indices[keep]
+
+
+
+def _solveField(x_data, y_data, img_w, img_h, catalog_stars, intens_data=None, fov_w_range=None, \
+    n_image_stars=20, n_catalog_stars=20, verbose=False):
+    """ Find the sky coordinates of the image centre, and the similarity transform between the tangent plane
+        at the image centre and the image, from the detected stars. See plateSolve for the arguments.
+
+    Return:
+        None if the image could not be solved, otherwise (ra, dec, a, b, parity, image_indices,
+            catalog_indices):
+            ra: [float] Right ascension of the image centre (deg).
+            dec: [float] Declination of the image centre (deg).
+            a, b, parity: Similarity transform from the tangent plane at the image centre (radians) to the
+                image coordinates (complex x + iy), see applySimilarity.
+            image_indices: [ndarray] Indices of matched image stars.
+            catalog_indices: [ndarray] Indices of matched catalog stars.
+    """
+
+    x_data = np.array(x_data, dtype=np.float64)
+    y_data = np.array(y_data, dtype=np.float64)
+
+    if intens_data is None:
+        intens_data = np.ones_like(x_data)
+
+    intens_data = np.array(intens_data, dtype=np.float64)
+
+    if len(x_data) < PLATE_SOLVE_MIN_MATCHED:
+        if verbose:
+            print('Not enough stars on the image for plate solving!')
+        return None
+
+
+    img_centre = img_w/2 + 1j*img_h/2
+    img_points = x_data + 1j*y_data
+    brightness_order = np.argsort(-intens_data, kind='stable')
+
+
+    # Range of image scales (px/rad). Without the FOV size assume a wide field meteor camera
+    if fov_w_range is None:
+        fov_w_range = [10.0, 120.0]
+
+    scale_min = img_w/np.radians(fov_w_range[1])
+    scale_max = img_w/np.radians(fov_w_range[0])
+
+    # Take the brightest stars inside the circle inscribed into the image, where the distortion is smallest.
+    #   On all-sky images the circle is made smaller, as the gnomonic projection doesn't hold far from the
+    #   centre of the fisheye lens
+    circle_radius = min(0.45*min(img_w, img_h), np.sqrt(scale_min*scale_max)*np.radians(PLATE_SOLVE_MAX_RADIUS))
+    inside = brightness_order[np.abs(img_points[brightness_order] - img_centre) < circle_radius]
+    img_stars = inside[:n_image_stars]
+
+    # The solutions are verified on a few times more stars in a slightly larger circle. Only the brightest
+    #   stars are used so that few stars are matched by chance
+    verify_radius = circle_radius/0.9
+    inside = brightness_order[np.abs(img_points[brightness_order] - img_centre) < verify_radius]
+    verify_stars = inside[:4*n_catalog_stars]
+    verify_tree = scipy.spatial.cKDTree(np.c_[x_data[verify_stars], y_data[verify_stars]])
+    match_radius = 0.005*np.hypot(img_w, img_h)
+
+
+    # Index the catalog in tiles of the same size as the circle on the sky
+    tile_radius = np.degrees(circle_radius/np.sqrt(scale_min*scale_max))
+    index = plateSolveIndex(catalog_stars, tile_radius, n_catalog_stars)
+
+
+    ### Find and vote on candidate transforms ###
+
+    img_ratios, img_vertices = triangles(x_data[img_stars], y_data[img_stars])
+    img_vertices = img_stars[img_vertices]
+
+    if (len(img_ratios) == 0) or (len(index.tri_ratios) == 0):
+        return None
+
+    # Take only the closest catalog triangles to every image triangle, so the number of candidates (and the
+    #   memory used for the voting) is bounded for deep catalogs
+    dist, cat_tri = index.tri_tree.query(img_ratios, k=min(PLATE_SOLVE_MAX_TRIANGLE_MATCHES, \
+        len(index.tri_ratios)), distance_upper_bound=PLATE_SOLVE_TRIANGLE_TOLERANCE)
+
+    img_tri = np.repeat(np.arange(len(img_ratios)), cat_tri.size//len(img_ratios))
+    valid = np.isfinite(dist.ravel())
+    img_tri = img_tri[valid]
+    cat_tri = cat_tri.ravel()[valid]
+
+    if len(cat_tri) == 0:
+        return None
+
+    tiles = index.tri_tile[cat_tri]
+
+    # Tangent plane coordinates of the catalog triangle vertices
+    tile_offsets = np.cumsum([0] + [len(xi) for xi in index.tile_xi])
+    tile_points = np.concatenate(index.tile_xi) + 1j*np.concatenate(index.tile_eta)
+    src = tile_points[tile_offsets[tiles][:, np.newaxis] + index.tri_vertices[cat_tri]]
+    dst = img_points[img_vertices[img_tri]]
+
+    # The parity is given by the signs of the triangle areas
+    def _area(p):
+        return np.imag((p[:, 1] - p[:, 0])*np.conj(p[:, 2] - p[:, 0]))
+
+    parity = np.where(np.sign(_area(src)) == np.sign(_area(dst)), 1, -1)
+
+    a, b = fitSimilarity(src, dst, parity)
+
+    # Keep only the transforms with the expected scale
+    scale = np.abs(a)
+    good = (scale > scale_min) & (scale < scale_max)
+
+    tiles, parity, a, b = tiles[good], parity[good], a[good], b[good]
+
+    if len(a) == 0:
+        return None
+
+    # Tangent plane coordinates of the image centre in every tile
+    centre = (img_centre - b)/a
+    centre = np.where(parity > 0, centre, np.conj(centre))
+
+    # Vote on the transforms in bins of the rotation, scale and position of the image centre
+    centre_bin = 0.1*circle_radius/np.abs(a)
+    keys = np.c_[tiles, parity, np.round(np.degrees(np.angle(a))/2), np.round(np.log(np.abs(a))/0.02), \
+        np.round(np.real(centre)/centre_bin), np.round(np.imag(centre)/centre_bin)].astype(np.int64)
+
+    _, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+
+    ### ###
+
+
+    ### Verify the best voted transforms ###
+
+    best = None
+    for bin_id in np.argsort(-counts, kind='stable')[:20]:
+
+        if counts[bin_id] < 2:
+            break
+
+        members = np.where(inverse == bin_id)[0]
+        tile_id = tiles[members[0]]
+        tile_parity = parity[members[0]]
+
+        # Median transform of all votes in the bin
+        tile_a = np.median(np.real(a[members])) + 1j*np.median(np.imag(a[members]))
+        tile_b = np.median(np.real(b[members])) + 1j*np.median(np.imag(b[members]))
+
+        # Compute the sky coordinates of the image centre
+        tile_centre = invertSimilarity(tile_a, tile_b, tile_parity, img_centre)
+        ra_c, dec_c = gnomonicUnproject(np.real(tile_centre), np.imag(tile_centre), index.tile_ra[tile_id], \
+            index.tile_dec[tile_id])
+
+        solution = _refineSolution(index, ra_c, dec_c, tile_a, tile_parity, img_w, img_h, verify_radius, \
+            img_points[verify_stars], verify_tree, match_radius)
+
+        if (solution is not None) and ((best is None) or (len(solution[5]) > len(best[5]))):
+            best = solution
+
+            # Stop if most of the stars were matched
+            if len(best[5]) > 0.5*len(verify_stars):
+                break
+
+    ### ###
+
+
+    # Reject the solution if only a small fraction of stars were matched, which is likely to happen by chance
+    if (best is None) or (len(best[5]) < max(PLATE_SOLVE_MIN_MATCHED, \
+        PLATE_SOLVE_MIN_MATCHED_FRACTION*len(verify_stars))):
+
+        if verbose:
+            print('No plate solution found!')
+        return None
+
+    ra_c, dec_c, a, b, parity, image_indices, catalog_indices = best
+
+    return ra_c, dec_c, a, b, parity, verify_stars[image_indices], catalog_indices
+
+
+
+def _refineSolution(index, ra_c, dec_c, a, parity, img_w, img_h, circle_radius, img_points, img_tree, \
+    match_radius):
+    """ Refine the solution with catalog stars inside the circle in the centre of the image, where the lens
+        distortion is small. The catalog stars are projected to the tangent plane at the image centre,
+        matched to image stars and the transform is refitted a few times.
+    """
+
+    img_centre = img_w/2 + 1j*img_h/2
+
+    # Radius of the circle on the sky
+    chord = 2*np.sin(np.arctan(circle_radius/np.abs(a))/2)
+
+    image_indices = np.zeros(0, dtype=np.int64)
+    catalog_indices = np.zeros(0, dtype=np.int64)
+
+    for i in range(3):
+
+        # Take as many brightest catalog stars in the circle as there are image stars
+        star_indices = index.mag_order[np.sort(np.array(index.star_tree.query_ball_point( \
+            raDecToUnitVectors(ra_c, dec_c)[0], chord), dtype=np.int64))[:len(img_points)]]
+
+        if len(star_indices) < 3:
+            return None
+
+        xi, eta, cos_c = gnomonicProject(index.catalog_stars[star_indices, 0], \
+            index.catalog_stars[star_indices, 1], ra_c, dec_c)
+
+        # Project the stars to the image, assuming the tangent point is in the image centre
+        b = img_centre
+        projected = applySimilarity(a, b, parity, xi + 1j*eta)
+
+        inside = (cos_c > 0) & (np.abs(projected - img_centre) < circle_radius)
+
+        cat_matched, img_matched = matchPoints(img_tree, np.c_[np.real(projected[inside]), \
+            np.imag(projected[inside])], match_radius)
+
+        if len(cat_matched) < 3:
+            return None
+
+        image_indices = img_matched
+        catalog_indices = star_indices[inside][cat_matched]
+
+        # Refit the transform and move the tangent point to the image centre
+        a_new, b_new = fitSimilarity((xi + 1j*eta)[inside][cat_matched], img_points[img_matched], parity)
+        centre_new = invertSimilarity(a_new, b_new, parity, img_centre)
+        ra_c, dec_c = gnomonicUnproject(np.real(centre_new), np.imag(centre_new), ra_c, dec_c)
+        a = a_new
+
+
+    return ra_c, dec_c, a, img_centre, parity, image_indices, catalog_indices
+
+
+
+def plateSolve(x_data, y_data, img_w, img_h, catalog_stars, intens_data=None, fov_w_range=None, \
+    verbose=False):
+    """ Find an astrometric solution of X, Y image coordinates of stars detected on an image using the star
+        catalog. It is a local replacement for novaAstrometryNetSolve and it returns the same values.
+
+    Arguments:
+        x_data: [list] A list of star x image coordiantes.
+        y_data: [list] A list of star y image coordiantes.
+        img_w: [int] Image width (px).
+        img_h: [int] Image height (px).
+        catalog_stars: [ndarray] An array of catalog stars (ra, dec, mag).
+
+    Keyword arguments:
+        intens_data: [list] Intensities of the stars, used to select the brightest stars. None by default, in
+            which case the stars should be sorted by brightness.
+        fov_w_range: [2 element tuple] The estimate of the lower and the upper width of the FOV in degrees.
+            None by default, in which case FOVs between 10 and 120 degrees are searched.
+        verbose: [bool] Print the progress. False by default.
+
+    Return:
+        (ra, dec, orientation, scale, fov_w, fov_h): [tuple of floats] All in degrees, scale in px/deg. The
+            orientation is the direction of the image up, east of north. None is returned if the image
+            could not be solved.
+    """
+
+    solution = _solveField(x_data, y_data, img_w, img_h, catalog_stars, intens_data=intens_data, \
+        fov_w_range=fov_w_range, verbose=verbose)
+
+    if solution is None:
+        return None
+
+    ra, dec, a, b, parity, image_indices, _ = solution
+
+    # Compute the direction of the image up on the tangent plane
+    up = invertSimilarity(a, b, parity, b - 1j) - invertSimilarity(a, b, parity, b)
+    orientation = np.degrees(np.arctan2(np.real(up), np.imag(up)))
+
+    # Image scale in px/deg
+    scale = np.abs(a)*np.pi/180
+
+    if verbose:
+        print('Plate solved with {:d} matched stars'.format(len(image_indices)))
+
+    return ra, dec, orientation, scale, img_w/scale, img_h/scale
+
+
+
+def plateSolvePlatepar(config, platepar, calstars_time, star_data, catalog_stars, verbose=True):
+    """ Find the pointing, rotation and scale of the platepar by blind plate solving of stars detected on
+        one image. The distortion of the given platepar is kept. The platepar reference time is set to the
+        time of the image.
+
+    Arguments:
+        config: [Config instance]
+        platepar: [Platepar instance] Platepar of the camera.
+        calstars_time: [list] (year, month, day, hour, minute, second, millisecond) of the middle of the
+            FF file.
+        star_data: [list] Stars detected on the image, entries are (Y, X, intensity, amplitude), as read
+            from CALSTARS.
+        catalog_stars: [ndarray] An array of catalog stars (ra, dec, mag).
+
+    Keyword arguments:
+        verbose: [bool] Print the progress. True by default.
+
+    Return:
+        platepar_solved: [Platepar instance] The solved platepar, or None if the image could not be solved.
+    """
+
+    star_data = np.array(star_data)
+    if len(star_data) == 0:
+        return None
+
+    y_data, x_data, intens_data = star_data[:, 0], star_data[:, 1], star_data[:, 2]
+
+    # Search the FOV widths around the width from the config and the width given by the platepar scale, as
+    #   either of them might be only a rough estimate
+    fov_w_list = [fov_w for fov_w in [config.fov_w, platepar.X_res/platepar.F_scale] if 0 < fov_w < 180]
+
+    fov_w_range = None
+    if fov_w_list:
+        fov_w_range = [0.75*min(fov_w_list), 1.25*max(fov_w_list)]
+
+    solution = _solveField(x_data, y_data, platepar.X_res, platepar.Y_res, catalog_stars, \
+        intens_data=intens_data, fov_w_range=fov_w_range, verbose=verbose)
+
+    if solution is None:
+        return None
+
+    ra, dec, a, _, _, image_indices, catalog_indices = solution
+
+    jd = date2JD(*calstars_time)
+
+
+    ### Fit the platepar parameters on the matched stars ###
+
+    platepar_solved = copy.deepcopy(platepar)
+
+    # Set the reference time to the time of the image
+    platepar_solved.JD = jd
+    platepar_solved.Ho = JD2HourAngle(jd)%360
+
+    platepar_solved.RA_d = ra
+    platepar_solved.dec_d = dec
+    platepar_solved.F_scale = np.abs(a)*np.pi/180
+
+
+    def _residuals(params, platepar_fit, ra_catalog, dec_catalog, x_matched, y_matched):
+
+        platepar_fit.RA_d, platepar_fit.dec_d, platepar_fit.pos_angle_ref, platepar_fit.F_scale = params
+
+        x_predicted, y_predicted = raDecToXYPP(ra_catalog, dec_catalog, jd, platepar_fit)
+
+        return np.r_[x_predicted - x_matched, y_predicted - y_matched]
+
+
+    def _fit(initial_params, image_indices, catalog_indices):
+
+        args = (copy.deepcopy(platepar_solved), catalog_stars[catalog_indices, 0], \
+            catalog_stars[catalog_indices, 1], x_data[image_indices], y_data[image_indices])
+
+        return scipy.optimize.least_squares(_residuals, initial_params, args=args, loss='soft_l1', \
+            f_scale=2.0, bounds=([-np.inf, -90, -np.inf, 0], [np.inf, 90, np.inf, np.inf]))
+
+
+    # Estimate the position angle from the rotation between the predicted and the image stars
+    platepar_solved.pos_angle_ref = 0
+    x_predicted, y_predicted = raDecToXYPP(catalog_stars[catalog_indices, 0], \
+        catalog_stars[catalog_indices, 1], jd, platepar_solved)
+    img_centre = platepar.X_res/2 + 1j*platepar.Y_res/2
+    rotation = np.degrees(np.angle(np.sum((x_data[image_indices] + 1j*y_data[image_indices] - img_centre) \
+        *np.conj(x_predicted + 1j*y_predicted - img_centre))))
+
+    # The sign of the position angle depends on the projection, try both
+    best = None
+    for pos_angle in [rotation, -rotation]:
+
+        res = _fit([ra, dec, pos_angle%360, platepar_solved.F_scale], image_indices, catalog_indices)
+
+        if (best is None) or (res.cost < best.cost):
+            best = res
+
+
+    # Match all catalog stars in the FOV using the distortion of the platepar and refit, with a decreasing
+    #   match radius
+    img_tree = scipy.spatial.cKDTree(np.c_[x_data, y_data])
+    match_radius = 0.005*np.hypot(platepar.X_res, platepar.Y_res)
+    for i in range(3):
+
+        platepar_solved.RA_d, platepar_solved.dec_d, platepar_solved.pos_angle_ref, \
+            platepar_solved.F_scale = best.x
+
+        # Take as many brightest catalog stars in the FOV as there are image stars
+        mag_order = np.argsort(catalog_stars[:, 2], kind='stable')
+        x_predicted, y_predicted = raDecToXYPP(catalog_stars[mag_order, 0], catalog_stars[mag_order, 1], jd, \
+            platepar_solved)
+        inside = np.where((x_predicted >= 0) & (x_predicted <= platepar.X_res) & (y_predicted >= 0) \
+            & (y_predicted <= platepar.Y_res))[0][:len(x_data)]
+
+        cat_matched, image_indices = matchPoints(img_tree, np.c_[x_predicted[inside], y_predicted[inside]], \
+            match_radius)
+        catalog_indices = mag_order[inside[cat_matched]]
+
+        if len(image_indices) < PLATE_SOLVE_MIN_MATCHED:
+            if verbose:
+                print('Not enough stars matched with the plate solution!')
+            return None
+
+        best = _fit(best.x, image_indices, catalog_indices)
+        match_radius /= 2
+
+
+    platepar_solved.RA_d, platepar_solved.dec_d, platepar_solved.pos_angle_ref, platepar_solved.F_scale = \
+        best.x
+    platepar_solved.RA_d %= 360
+    platepar_solved.pos_angle_ref %= 360
+
+    ### ###
+
+
+    # Recompute the FOV centre in Alt/Az and the rotation
+    platepar_solved.az_centre, platepar_solved.alt_centre = raDec2AltAz(platepar_solved.RA_d, \
+        platepar_solved.dec_d, platepar_solved.JD, platepar_solved.lat, platepar_solved.lon)
+    platepar_solved.rotation_from_horiz = rotationWrtHorizon(platepar_solved)
+
+    if verbose:
+        resid = np.hypot(*best.fun.reshape(2, -1))
+        print('Plate solved: RA = {:.2f}, Dec = {:+.2f}, scale = {:.2f} arcmin/px, {:d} stars, ' \
+            'median residual = {:.2f} px'.format(platepar_solved.RA_d, platepar_solved.dec_d, \
+            60/platepar_solved.F_scale, len(image_indices), np.median(resid)))
+
+    return platepar_solved
+
+
+
+def plateSolveCalstars(config, platepar, calstars_list, catalog_stars, max_ffs=5):
+    """ Plate solve the FF files with the most stars in CALSTARS, until one is solved. See
+        plateSolvePlatepar.
+
+    Arguments:
+        config: [Config instance]
+        platepar: [Platepar instance] Platepar of the camera.
+        calstars_list: [list] A list of entries [[ff_name, star_data], ...].
+        catalog_stars: [ndarray] An array of catalog stars (ra, dec, mag).
+
+    Keyword arguments:
+        max_ffs: [int] Maximum number of FF files to try. 5 by default.
+
+    Return:
+        platepar_solved: [Platepar instance] The solved platepar, or None if no image could be solved.
+    """
+
+    # Sort FF files by the number of stars
+    calstars_sorted = sorted(calstars_list, key=lambda entry: len(entry[1]), reverse=True)
+
+    for ff_name, star_data in calstars_sorted[:max_ffs]:
+
+        print('Plate solving:', ff_name)
+
+        calstars_time = getMiddleTimeFF(ff_name, config.fps, ret_milliseconds=True)
+        platepar_solved = plateSolvePlatepar(config, platepar, calstars_time, star_data, catalog_stars)
+
+        if platepar_solved is not None:
+            return platepar_solved
+
+
+    return None
+
+
+
+
+if __name__ == "__main__":
+
+    ### COMMAND LINE ARGUMENTS
+
+    # Init the command line arguments parser
+    arg_parser = argparse.ArgumentParser(description="Blind plate solve the stars in the CALSTARS file and " \
+        "save the solved platepar into the night directory.")
+
+    arg_parser.add_argument('dir_path', nargs=1, metavar='DIR_PATH', type=str, \
+        help='Path to the folder with FF files and the CALSTARS file.')
+
+    arg_parser.add_argument('-c', '--config', nargs=1, metavar='CONFIG_PATH', type=str, \
+        help="Path to a config file which will be used instead of the default one.")
+
+    # Parse the command line arguments
+    cml_args = arg_parser.parse_args()
+
+    #########################
+
+    dir_path = cml_args.dir_path[0]
+
+    # Load the config file
+    config = cr.loadConfigFromDirectory(cml_args.config, dir_path)
+
+    # Get a list of files in the night folder
+    file_list = os.listdir(dir_path)
+
+    # Find and load the platepar file
+    if config.platepar_name in file_list:
+
+        # Load the platepar
+        platepar = Platepar.Platepar()
+        platepar.read(os.path.join(dir_path, config.platepar_name), use_flat=config.use_flat)
+
+    else:
+        print('Cannot find the platepar file in the night directory: ', config.platepar_name)
+        platepar = Platepar.Platepar()
+        platepar.X_res = config.width
+        platepar.Y_res = config.height
+        platepar.lat = config.latitude
+        platepar.lon = config.longitude
+        platepar.elev = config.elevation
+
+
+    # Find the CALSTARS file in the given folder
+    calstars_file = None
+    for calstars_file in file_list:
+        if ('CALSTARS' in calstars_file) and ('.txt' in calstars_file):
+            break
+
+    print('CALSTARS file: ' + calstars_file + ' loaded!')
+
+    # Load the calstars file
+    calstars_list = CALSTARS.readCALSTARS(dir_path, calstars_file)
+
+    # Load catalog stars
+    catalog_stars, _, config.star_catalog_band_ratios = StarCatalog.readStarCatalog(config.star_catalog_path, \
+        config.star_catalog_file, lim_mag=config.catalog_mag_limit, \
+        mag_band_ratios=config.star_catalog_band_ratios)
+
+    platepar_solved = plateSolveCalstars(config, platepar, calstars_list, catalog_stars)
+
+    if platepar_solved is not None:
+
+        platepar_path = os.path.join(dir_path, config.platepar_name)
+
+        platepar_solved.write(platepar_path)
+        print('Solved platepar written to:', platepar_path)
+
+    else:
+        print('The plate could not be solved!')
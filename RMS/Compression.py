@@ -113,6 +113,9 @@ class Compressor(multiprocessing.Process):
         self.exit = multiprocessing.Event()
 
         self.run_exited = multiprocessing.Event()
+
+        # Time it took to compress and save the last block of frames (shared with the parent process)
+        self.block_time = multiprocessing.Value('d', 0.0)
     
 
 
@@ -174,6 +177,16 @@ class Compressor(multiprocessing.Process):
     
 
 
+    def compressionLoad(self):
+        """ Return the ratio between the time it took to compress and save the last block of 256 frames and
+            the duration of the block. Values approaching 1 mean that the compression is barely keeping up
+            with the capture.
+        """
+
+        return self.block_time.value/(256.0/self.config.fps)
+
+
+
     def stop(self):
         """ Stop compression.
         """
@@ -267,6 +280,7 @@ class Compressor(multiprocessing.Process):
 
             #log.debug("memory copy: " + str(time.time() - t) + "s")
             t = time.time()
+            t_block = t
             
             # Run the compression
             compressed, field_intensities = self.compress(frames)
@@ -287,6 +301,9 @@ class Compressor(multiprocessing.Process):
             # Save the extracted intensitites per every field
             FieldIntensities.saveFieldIntensitiesBin(field_intensities, self.data_dir, filename)
 
+            # Store the total processing time of the block, so the detector can be scaled accordingly
+            self.block_time.value = time.time() - t_block
+
             # Run the extractor
             if self.config.enable_fireball_detection:
                 extractor = Extractor(self.config, self.data_dir)
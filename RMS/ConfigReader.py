@@ -224,6 +224,9 @@ class Config:
 
         self.reboot_after_processing = False
         self.reboot_lock_file = ".reboot_lock"
+
+        # Number of night post-processing stages which can run in parallel (1 runs them one after another)
+        self.postprocessing_cores = 2
         
         ##### Capture
         self.deviceID = 0
@@ -379,6 +382,11 @@ class Config:
         # By default the peak of the meteor should be at least 16x brighter than the background. This is the multiplier that scales this number (1.0 = 16x).
         self.min_patch_intensity_multiplier = 1.0
 
+        # Adaptive number of detection cores during capture
+        self.detection_adaptive_cores = True # grow and shrink the number of detection workers during capture
+        self.detection_compression_load_max = 0.6 # reduce detection cores if compression takes longer than this fraction of the block duration
+        self.detection_cores_update_period = 60 # how often to update the number of detection cores (seconds)
+
         ##### StarExtraction
 
         # Extraction parameters
@@ -393,6 +401,9 @@ class Config:
         self.roundness_threshold = 0.5 # minimum ratio of 2D Gaussian sigma X and sigma Y to be taken as a stars (hot pixels are narrow, while stars are round)
         self.max_feature_ratio = 0.8 # maximum ratio between 2 sigma of the star and the image segment area
 
+        # Star measurement method, 'psf' for a 2D Gaussian fit, 'moments' for fast image moments
+        self.star_extraction_method = 'psf'
+
 
         ##### Calibration
         self.use_flat = False
@@ -411,6 +422,9 @@ class Config:
         self.platepar_name = 'platepar_cmn2010.cal'
         self.platepars_recalibrated_name = 'platepars_all_recalibrated.json'
 
+        # Name of the JSON file with stars matched on recalibrated FF files, used for the calibration report
+        self.matched_stars_name = 'matched_stars.json'
+
         # Name of the platepar file on the server
         self.platepar_remote_name = 'platepar_latest.cal'
         self.remote_platepar_dir = 'platepars'
@@ -426,6 +440,24 @@ class Config:
 
         self.min_matched_stars = 7
 
+        # Number of processes which recalibrate FF files with detections in parallel (1 recalibrates them 
+        #   one after another)
+        self.recalibration_cores = 1
+
+        # Astrometry refinement method, 'nelder-mead' for the minimization of the residual cost function,
+        #   'least-squares' for the least squares fit on matched stars
+        self.astrometry_fit_method = 'nelder-mead'
+
+        # Validate the platepar using the stars matched in the last full ACF run, and skip the full ACF if the
+        #   median residual did not grow by more than acf_max_drift (px)
+        self.acf_incremental = True
+        self.acf_state_name = 'acf_state.json'
+        self.acf_max_drift = 0.1
+
+        # Blind plate solve the stars using the star catalog if both ACF and the FFT alignment fail. It takes
+        #   up to a few seconds and a few hundred MB of memory per FF file, for up to 5 FF files
+        self.acf_plate_solve = True
+
 
         ##### Thumbnails
         self.thumb_bin =  4
@@ -613,6 +645,9 @@ def parseSystem(config, parser):
 
     if parser.has_option(section, "reboot_lock_file"):
         config.reboot_lock_file = parser.get(section, "reboot_lock_file")
+
+    if parser.has_option(section, "postprocessing_cores"):
+        config.postprocessing_cores = parser.getint(section, "postprocessing_cores")
         
 
 
@@ -1069,6 +1104,16 @@ def parseMeteorDetection(config, parser):
         config.min_patch_intensity_multiplier = parser.getfloat(section, "min_patch_intensity_multiplier")
 
 
+    if parser.has_option(section, "detection_adaptive_cores"):
+        config.detection_adaptive_cores = parser.getboolean(section, "detection_adaptive_cores")
+
+    if parser.has_option(section, "detection_compression_load_max"):
+        config.detection_compression_load_max = parser.getfloat(section, "detection_compression_load_max")
+
+    if parser.has_option(section, "detection_cores_update_period"):
+        config.detection_cores_update_period = parser.getfloat(section, "detection_cores_update_period")
+
+
 
 
 def parseStarExtraction(config, parser):
@@ -1101,6 +1146,13 @@ def parseStarExtraction(config, parser):
     if parser.has_option(section, "max_feature_ratio"):
         config.max_feature_ratio = parser.getfloat(section, "max_feature_ratio")
 
+    if parser.has_option(section, "star_extraction_method"):
+        config.star_extraction_method = parser.get(section, "star_extraction_method").strip().lower()
+
+        if config.star_extraction_method not in ['psf', 'moments']:
+            print('Unknown star extraction method: {:s}, using psf!'.format(config.star_extraction_method))
+            config.star_extraction_method = 'psf'
+
 
 
 def parseCalibration(config, parser):
@@ -1148,6 +1200,9 @@ def parseCalibration(config, parser):
     if parser.has_option(section, "platepars_all_recalibrated"):
         config.platepars_all_recalibrated = parser.get(section, "platepars_all_recalibrated")
 
+    if parser.has_option(section, "matched_stars_name"):
+        config.matched_stars_name = parser.get(section, "matched_stars_name")
+
     if parser.has_option(section, "platepar_remote_name"):
         config.platepar_remote_name = parser.get(section, "platepar_remote_name")
 
@@ -1172,6 +1227,29 @@ def parseCalibration(config, parser):
     if parser.has_option(section, "min_matched_stars"):
         config.min_matched_stars = parser.getint(section, "min_matched_stars")
 
+    if parser.has_option(section, "recalibration_cores"):
+        config.recalibration_cores = parser.getint(section, "recalibration_cores")
+
+    if parser.has_option(section, "astrometry_fit_method"):
+        config.astrometry_fit_method = parser.get(section, "astrometry_fit_method").strip().lower()
+
+        if config.astrometry_fit_method not in ['nelder-mead', 'least-squares']:
+            print('Unknown astrometry fit method: {:s}, using nelder-mead!'.format(\
+                config.astrometry_fit_method))
+            config.astrometry_fit_method = 'nelder-mead'
+
+    if parser.has_option(section, "acf_incremental"):
+        config.acf_incremental = parser.getboolean(section, "acf_incremental")
+
+    if parser.has_option(section, "acf_state_name"):
+        config.acf_state_name = parser.get(section, "acf_state_name")
+
+    if parser.has_option(section, "acf_max_drift"):
+        config.acf_max_drift = parser.getfloat(section, "acf_max_drift")
+
+    if parser.has_option(section, "acf_plate_solve"):
+        config.acf_plate_solve = parser.getboolean(section, "acf_plate_solve")
+
 
 
 def parseThumbnails(config, parser):
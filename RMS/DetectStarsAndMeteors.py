@@ -22,6 +22,15 @@ import time
 import datetime
 import logging
 import argparse
+import traceback
+
+# Python 3
+try:
+    from io import StringIO
+
+# Python 2
+except ImportError:
+    from StringIO import StringIO
 
 # RMS imports
 import RMS.ConfigReader as cr
@@ -106,103 +115,244 @@ def detectStarsAndMeteors(ff_directory, ff_name, config, flat_struct=None, dark=
 
 
 
-def saveDetections(detection_results, ff_dir, config):
-    """ Save detection to CALSTARS and FTPdetectinfo files. 
+def detectStarsAndMeteorsJob(ff_directory, ff_name, config):
+    """ Run star extraction and meteor detection on one FF file and return the results together with the 
+        directory of the FF file, so that results from several night directories can be processed in the 
+        same pool of workers. Errors are logged and returned as an empty result, so every job has an output 
+        which can be assigned to its night.
+
+    Arguments:
+        ff_directory: [str] Path to the directory where the FF file is located.
+        ff_name: [str] Name of the FF file.
+        config: [Config obj]
+
+    Return:
+        ff_directory, ff_name, result: [tuple] result is the output of detectStarsAndMeteors, or None if the
+            detection failed.
+    """
+
+    try:
+        result = detectStarsAndMeteors(ff_directory, ff_name, config)
+
+    except:
+        log.error('Detection failed on ' + ff_name)
+        log.error(traceback.format_exc())
+        result = None
+
+
+    return ff_directory, ff_name, result
+
+
+
+def detectionFileNames(ff_dir, config):
+    """ Return the names of the CALSTARS and FTPdetectinfo files for the given night directory. 
     
     Arguments:
-        detection_results: [list] A list of outputs from detectStarsAndMeteors function.
         ff_dir: [str] Path to the night directory.
         config: [Config obj]
 
     Return:
         calstars_name: [str] Name of the CALSTARS file.
         ftpdetectinfo_name: [str] Name of the FTPdetectinfo file.
-        ff_detected: [list] A list of FF files with detections.
     """
 
+    dir_name = os.path.basename(os.path.abspath(ff_dir))
+    if dir_name.startswith(config.stationID):
+        prefix = dir_name
+    else:
+        prefix = "{:s}_{:s}".format(config.stationID, dir_name)
+
+    # Generate the name for the CALSTARS file
+    calstars_name = 'CALSTARS_' + prefix + '.txt'
+
+    # Generate FTPdetectinfo file name
+    ftpdetectinfo_name = 'FTPdetectinfo_' + os.path.basename(ff_dir) + '.txt'
+
+    return calstars_name, ftpdetectinfo_name
+
+
+
+class DetectionWriter(object):
+    def __init__(self, ff_dir, config):
+        """ Writes detection results to CALSTARS and FTPdetectinfo files as they arrive, so that they don't 
+            have to be kept in memory until the end of processing. 
+
+        The results are appended to partial files (the final file names with a '.partial' suffix) which are
+        in the regular CALSTARS and FTPdetectinfo formats and can be read while processing is running. Only
+        the positions of the entries in the partial files are kept in memory. When finish is called, the
+        entries are copied to the final files sorted by FF name and the partial files are removed.
+
+        Arguments:
+            ff_dir: [str] Path to the night directory.
+            config: [Config obj]
+        """
 
-    ### SAVE DETECTIONS TO FILE
+        self.ff_dir = ff_dir
+        self.config = config
 
-    # Init data lists
-    star_list = []
-    meteor_list = []
-    ff_detected = []
+        self.calstars_name, self.ftpdetectinfo_name = detectionFileNames(ff_dir, config)
 
-    # Remove all 'None' results, which were errors
-    detection_results = [res for res in detection_results if res is not None]
+        self.partial_suffix = '.partial'
+        self.calstars_partial_path = os.path.join(ff_dir, self.calstars_name + self.partial_suffix)
+        self.ftpdetectinfo_partial_path = os.path.join(ff_dir, self.ftpdetectinfo_name \
+            + self.partial_suffix)
 
-    # Sort by FF name
-    detection_results = sorted(detection_results, key=lambda x: x[0])
+        # Positions (offset, length) of the entries in the partial files, per FF file
+        self.calstars_index = {}
+        self.ftpdetectinfo_index = {}
 
+        self.meteors_num = 0
+        self.ff_detected = []
 
-    # Count the number of detected meteors
-    meteors_num = 0
-    for _, _, meteor_data in detection_results:
-        for meteor in meteor_data:
-            meteors_num += 1
 
-    log.info('TOTAL: ' + str(meteors_num) + ' detected meteors.')
+        # Start new partial files. If processing is resumed, the results of previously processed files
+        #   will be passed in again from the QueuedPool backups
+        with open(self.calstars_partial_path, 'w') as star_file:
+            CALSTARS.writeCALSTARSHeader(star_file, ff_dir, config.stationID, config.height, config.width)
 
+        with open(self.ftpdetectinfo_partial_path, 'w') as ftpdetect_file:
+            FTPdetectinfo.writeFTPdetectinfoHeader(ftpdetect_file, 0, ff_dir, ff_dir)
 
-    # Save the detections to a file
-    for ff_name, star_data, meteor_data in detection_results:
 
+    def _appendEntry(self, file_path, entry_str):
+        """ Append the given string to the file and return its position in the file. """
+
+        with open(file_path, 'a') as f:
+            offset = f.tell()
+            f.write(entry_str)
+
+        return offset, len(entry_str)
+
+
+    def addResult(self, result):
+        """ Write the result of the detectStarsAndMeteors function to the partial files. 
+
+        Arguments:
+            result: [list] Output of detectStarsAndMeteors, or None if processing failed.
+        """
+
+        # Skip 'None' results, which were errors
+        if result is None:
+            return None
+
+        ff_name, star_data, meteor_data = result
 
         if len(star_data) == 4:
             x2, y2, background, intensity = star_data
         else:
             _, x2, y2, background, intensity, _ = star_data
-            
 
         # Skip if no stars were found
-        if not x2:
-            continue
+        if not len(x2):
+            return None
 
-        # Construct the table of the star parameters
-        star_data = zip(x2, y2, background, intensity)
+        # Skip results which were already written
+        if ff_name in self.calstars_index:
+            return None
 
-        # Add star info to the star list
-        star_list.append([ff_name, star_data])
 
-        # Handle the detected meteors
-        meteor_No = 1
-        for meteor in meteor_data:
+        # Write the stars
+        star_str = StringIO()
+        CALSTARS.writeCALSTARSEntry(star_str, ff_name, zip(x2, y2, background, intensity))
+        self.calstars_index[ff_name] = self._appendEntry(self.calstars_partial_path, star_str.getvalue())
 
-            rho, theta, centroids = meteor
 
-            # Append to the results list
-            meteor_list.append([ff_name, meteor_No, rho, theta, centroids])
-            meteor_No += 1
+        # Write the detected meteors
+        if meteor_data:
 
+            meteor_str = StringIO()
+            for meteor_No, meteor in enumerate(meteor_data):
 
-        # Add the FF file to the archive list if a meteor was detected on it
-        if meteor_data:
-            ff_detected.append(ff_name)
+                rho, theta, centroids = meteor
 
+                FTPdetectinfo.writeFTPdetectinfoMeteor(meteor_str, [ff_name, meteor_No + 1, rho, theta, \
+                    centroids], self.config.stationID, self.config.fps)
 
+            self.ftpdetectinfo_index[ff_name] = self._appendEntry(self.ftpdetectinfo_partial_path, \
+                meteor_str.getvalue())
 
-    dir_name = os.path.basename(os.path.abspath(ff_dir))
-    if dir_name.startswith(config.stationID):
-        prefix = dir_name
-    else:
-        prefix = "{:s}_{:s}".format(config.stationID, dir_name)
+            self.meteors_num += len(meteor_data)
 
-    # Generate the name for the CALSTARS file
-    calstars_name = 'CALSTARS_' + prefix + '.txt'
+            # Add the FF file to the archive list if a meteor was detected on it
+            self.ff_detected.append(ff_name)
 
-    # Write detected stars to the CALSTARS file
-    CALSTARS.writeCALSTARS(star_list, ff_dir, calstars_name, config.stationID, config.height, 
-        config.width)
 
-    # Generate FTPdetectinfo file name
-    ftpdetectinfo_name = 'FTPdetectinfo_' + os.path.basename(ff_dir) + '.txt'
+    def _copyEntries(self, partial_file, out_file, index):
+        """ Copy the entries from the partial file to the output file, sorted by FF name. """
+
+        for ff_name in sorted(index.keys()):
+
+            offset, length = index[ff_name]
+
+            partial_file.seek(offset)
+            out_file.write(partial_file.read(length))
+
+
+    def finish(self):
+        """ Write the final CALSTARS and FTPdetectinfo files, sorted by FF name, and remove the partial 
+            files.
 
-    # Write FTPdetectinfo file
-    FTPdetectinfo.writeFTPdetectinfo(meteor_list, ff_dir, ftpdetectinfo_name, ff_dir, 
-        config.stationID, config.fps)
+        Return:
+            calstars_name: [str] Name of the CALSTARS file.
+            ftpdetectinfo_name: [str] Name of the FTPdetectinfo file.
+            ff_detected: [list] A list of FF files with detections.
+        """
 
+        log.info('TOTAL: ' + str(self.meteors_num) + ' detected meteors.')
 
-    return calstars_name, ftpdetectinfo_name, ff_detected
+        # Write the final CALSTARS file
+        with open(os.path.join(self.ff_dir, self.calstars_name), 'w') as star_file:
+
+            CALSTARS.writeCALSTARSHeader(star_file, self.ff_dir, self.config.stationID, self.config.height, 
+                self.config.width)
+
+            with open(self.calstars_partial_path) as partial_file:
+                self._copyEntries(partial_file, star_file, self.calstars_index)
+
+            CALSTARS.writeCALSTARSEnd(star_file)
+
+
+        # Write the final FTPdetectinfo file
+        with open(os.path.join(self.ff_dir, self.ftpdetectinfo_name), 'w') as ftpdetect_file:
+
+            FTPdetectinfo.writeFTPdetectinfoHeader(ftpdetect_file, self.meteors_num, self.ff_dir, 
+                self.ff_dir)
+
+            with open(self.ftpdetectinfo_partial_path) as partial_file:
+                self._copyEntries(partial_file, ftpdetect_file, self.ftpdetectinfo_index)
+
+
+        # Remove the partial files
+        for file_path in [self.calstars_partial_path, self.ftpdetectinfo_partial_path]:
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+
+
+        return self.calstars_name, self.ftpdetectinfo_name, sorted(self.ff_detected)
+
+
+
+
+def saveDetections(detection_results, ff_dir, config):
+    """ Save detection to CALSTARS and FTPdetectinfo files. 
+    
+    Arguments:
+        detection_results: [list] A list of outputs from detectStarsAndMeteors function.
+        ff_dir: [str] Path to the night directory.
+        config: [Config obj]
+
+    Return:
+        calstars_name: [str] Name of the CALSTARS file.
+        ftpdetectinfo_name: [str] Name of the FTPdetectinfo file.
+        ff_detected: [list] A list of FF files with detections.
+    """
+
+    detection_writer = DetectionWriter(ff_dir, config)
+
+    for result in detection_results:
+        detection_writer.addResult(result)
+
+    return detection_writer.finish()
 
 
 
@@ -235,6 +385,9 @@ def detectStarsAndMeteorsDirectory(dir_path, config):
 
     print('Starting detection...')
 
+    # Initialize the writer which will save the results as they come in
+    detection_writer = DetectionWriter(ff_dir, config)
+
     # Initialize the detector
     detector = QueuedPool(detectStarsAndMeteors, cores=-1, log=log, backup_dir=ff_dir)
 
@@ -254,23 +407,22 @@ def detectStarsAndMeteorsDirectory(dir_path, config):
             else:
                 time.sleep(0.1)
 
+        # Write the results which are done so far
+        for result in detector.getResults():
+            detection_writer.addResult(result)
+
 
 
     log.info('Waiting for the detection to finish...')
 
-    # Wait for the detector to finish and close it
-    detector.closePool()
+    # Wait for the detector to finish and close it, writing the results as they come in
+    detector.closePool(result_callback=detection_writer.addResult)
 
     log.info('Detection finished!')
 
-    log.info('Collecting results...')
-
-    # Get the detection results from the queue
-    detection_results = detector.getResults()
-
 
-    # Save detection to disk
-    calstars_name, ftpdetectinfo_name, ff_detected = saveDetections(detection_results, ff_dir, config)
+    # Write the final detection files
+    calstars_name, ftpdetectinfo_name, ff_detected = detection_writer.finish()
 
 
     return calstars_name, ftpdetectinfo_name, ff_detected, detector
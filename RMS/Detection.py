@@ -60,6 +60,9 @@ from RMS.Routines.BinImageCy import binImage
 # If True, all detection details will be logged
 VERBOSE_DEBUG = False
 
+# KHT libraries loaded in this process, keyed by the library path
+KHT_LIBRARY_CACHE = {}
+
 
 # Get the logger from the main module
 log = logging.getLogger("logger")
@@ -386,6 +389,40 @@ def checkWhiteRatio(img_thres, ff, max_white_ratio):
 
 
 
+def loadKHT(kht_lib_path):
+    """ Load the KHT library and set up the argument types of the wrapper function. The library is loaded 
+        only once per process, so long-lived worker processes can reuse it for every file.
+
+    Arguments:
+        kht_lib_path: [string] path to the compiled KHT library
+
+    Return:
+        kht: [ctypes.CDLL] Loaded KHT library.
+    """
+
+    if kht_lib_path in KHT_LIBRARY_CACHE:
+        return KHT_LIBRARY_CACHE[kht_lib_path]
+
+    kht = ctypes.cdll.LoadLibrary(kht_lib_path)
+    kht.kht_wrapper.argtypes = [npct.ndpointer(dtype=np.double, ndim=2),
+                                npct.ndpointer(dtype=np.byte, ndim=1),
+                                ctypes.c_size_t,
+                                ctypes.c_size_t,
+                                ctypes.c_size_t,
+                                ctypes.c_size_t,
+                                ctypes.c_double,
+                                ctypes.c_double,
+                                ctypes.c_double,
+                                ctypes.c_double]
+    kht.kht_wrapper.restype = ctypes.c_size_t
+
+    KHT_LIBRARY_CACHE[kht_lib_path] = kht
+
+    return kht
+
+
+
+
 def getLines(img_handle, k1, j1, time_slide, time_window_size, max_lines, max_white_ratio, kht_lib_path, \
     mask=None, flat_struct=None, dark=None, debug=False):
     """ Get (rho, phi) pairs for each meteor present on the image using KHT.
@@ -409,18 +446,7 @@ def getLines(img_handle, k1, j1, time_slide, time_window_size, max_lines, max_wh
     """
 
     # Load the KHT library
-    kht = ctypes.cdll.LoadLibrary(kht_lib_path)
-    kht.kht_wrapper.argtypes = [npct.ndpointer(dtype=np.double, ndim=2),
-                                npct.ndpointer(dtype=np.byte, ndim=1),
-                                ctypes.c_size_t,
-                                ctypes.c_size_t,
-                                ctypes.c_size_t,
-                                ctypes.c_size_t,
-                                ctypes.c_double,
-                                ctypes.c_double,
-                                ctypes.c_double,
-                                ctypes.c_double]
-    kht.kht_wrapper.restype = ctypes.c_size_t
+    kht = loadKHT(kht_lib_path)
 
     line_results = []
 
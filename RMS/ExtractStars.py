@@ -25,9 +25,7 @@ import argparse
 import cv2
 import matplotlib.pyplot as plt
 import numpy as np
-import scipy.optimize as opt
 import scipy.ndimage as ndimage
-import scipy.ndimage.filters as filters
 
 # RMS imports
 import RMS.ConfigReader as cr
@@ -45,6 +43,151 @@ import RMS.Routines.MorphCy as morph
 
 
 
+# Work buffers for finding the local maxima, reused between the images of the same size
+LOCAL_MAXIMA_BUFFERS = {}
+
+# The last mask of pixels where star candidates are allowed, with the inputs it was computed from
+CANDIDATE_MASK_CACHE = {}
+
+
+
+def _localMaximaBuffers(shape):
+    """ Return the work buffers for the local maxima search for the given image shape. """
+
+    if shape not in LOCAL_MAXIMA_BUFFERS:
+
+        LOCAL_MAXIMA_BUFFERS.clear()
+
+        LOCAL_MAXIMA_BUFFERS[shape] = {
+            'img': np.empty(shape, dtype=np.float32),
+            'data': np.empty(shape, dtype=np.float32),
+            'data_max': np.empty(shape, dtype=np.float32),
+            'data_min': np.empty(shape, dtype=np.float32),
+            'maxima': np.empty(shape, dtype=bool),
+            'diff': np.empty(shape, dtype=bool)
+            }
+
+    return LOCAL_MAXIMA_BUFFERS[shape]
+
+
+
+def _candidateMask(shape, border, mask):
+    """ Return a bool mask of pixels where star candidates are allowed, i.e. not too close to the image 
+        border or to the masked areas. The mask is computed only when the inputs change.
+    """
+
+    key = (shape, border)
+
+    if key in CANDIDATE_MASK_CACHE:
+
+        mask_img, candidate_mask = CANDIDATE_MASK_CACHE[key]
+
+        if mask is None:
+            if mask_img is None:
+                return candidate_mask
+
+        elif (mask_img is not None) and np.array_equal(mask_img, mask.img):
+            return candidate_mask
+
+
+    candidate_mask = np.ones(shape, dtype=bool)
+
+    # Apply a border mask
+    if border > 0:
+        candidate_mask[:border, :] = False
+        candidate_mask[-border:, :] = False
+        candidate_mask[:, :border] = False
+        candidate_mask[:, -border:] = False
+
+    # Remove all detections close to the mask image (the mask is not applied if the size is different)
+    mask_img = None
+    if mask is not None:
+
+        mask_img = mask.img.copy()
+
+        if mask_img.shape == shape:
+
+            erosion_kernel = np.ones((5, 5), mask_img.dtype)
+            mask_eroded = cv2.erode(mask_img, erosion_kernel, iterations=1)
+
+            candidate_mask &= mask_eroded > 0
+
+
+    CANDIDATE_MASK_CACHE.clear()
+    CANDIDATE_MASK_CACHE[key] = (mask_img, candidate_mask)
+
+    return candidate_mask
+
+
+
+def findStarCandidates(img, neighborhood_size, intensity_threshold, border, mask=None, max_candidates=None):
+    """ Find star candidates as local maxima on the image which are brighter than their surroundings, and 
+        return their centres of mass. The work buffers, the kernels and the candidate mask are reused 
+        between the calls with the same image size, and the filtering is done by OpenCV, whose min/max 
+        filters are separable van Herk/Gil-Werman filters.
+
+    Arguments:
+        img: [ndarray] Image on which the stars will be searched (usually avepixel).
+        neighborhood_size: [int] Size of the neighbourhood for the maximum search (in pixels).
+        intensity_threshold: [float] Minimum difference between the maximum and the minimum in the 
+            neighbourhood.
+        border: [int] Remove candidates closer than this to the image border (in pixels).
+
+    Keyword arguments:
+        mask: [MaskStruct] Mask structure. Candidates close to the masked areas are removed. None by default.
+        max_candidates: [int] If there are more candidates than this, their positions are not computed. None
+            by default.
+
+    Return:
+        x, y, num_objects: 
+            - x, y: [ndarray] Coordinates of the star candidates, None if there were too many candidates.
+            - num_objects: [int] Number of candidates.
+    """
+
+    shape = img.shape
+    buffers = _localMaximaBuffers(shape)
+
+    # Apply a mean filter to the image to reduce noise (the 2x2 kernel covers the pixel and its next 
+    #   neighbours, in the same way as ndimage.convolve does)
+    np.copyto(buffers['img'], img, casting='unsafe')
+    data = cv2.boxFilter(buffers['img'], -1, (2, 2), dst=buffers['data'], anchor=(0, 0), normalize=True, \
+        borderType=cv2.BORDER_REFLECT)
+
+    # Locate local maxima on the image
+    kernel = np.ones((neighborhood_size, neighborhood_size), dtype=np.uint8)
+    data_max = cv2.dilate(data, kernel, dst=buffers['data_max'], borderType=cv2.BORDER_REFLECT)
+    data_min = cv2.erode(data, kernel, dst=buffers['data_min'], borderType=cv2.BORDER_REFLECT)
+
+    maxima = np.equal(data, data_max, out=buffers['maxima'])
+
+    # Only take the maxima which are brighter than their surroundings
+    np.subtract(data_max, data_min, out=data_max)
+    maxima &= np.greater(data_max, intensity_threshold, out=buffers['diff'])
+
+    # Remove the candidates close to the border and the masked areas
+    maxima &= _candidateMask(shape, border, mask)
+
+
+    # Find and label the maxima
+    labeled, num_objects = ndimage.label(maxima)
+
+    if (max_candidates is not None) and (num_objects > max_candidates):
+        return None, None, num_objects
+
+
+    # Find centres of mass of each labeled objects
+    y_ind, x_ind = np.nonzero(labeled)
+    labels = labeled[y_ind, x_ind]
+    weights = data[y_ind, x_ind].astype(np.float64)
+
+    mass = np.bincount(labels, weights=weights, minlength=num_objects + 1)[1:]
+    y = np.bincount(labels, weights=weights*y_ind, minlength=num_objects + 1)[1:]/mass
+    x = np.bincount(labels, weights=weights*x_ind, minlength=num_objects + 1)[1:]/mass
+
+    return x, y, num_objects
+
+
+
 def extractStars(ff_dir, ff_name, config=None, max_global_intensity=150, border=10, neighborhood_size=10, 
         intensity_threshold=5, flat_struct=None, dark=None, mask=None):
     """ Extracts stars on a given FF bin by searching for local maxima and applying PSF fit for star 
@@ -114,57 +257,25 @@ def extractStars(ff_dir, ff_name, config=None, max_global_intensity=150, border=
     if global_mean > max_global_intensity:
         return error_return
 
-    data = ff.avepixel.astype(np.float32)
-
-
-    # Apply a mean filter to the image to reduce noise
-    data = ndimage.filters.convolve(data, weights=np.full((2, 2), 1.0/4))
-
-    # Locate local maxima on the image
-    data_max = filters.maximum_filter(data, neighborhood_size)
-    maxima = (data == data_max)
-    data_min = filters.minimum_filter(data, neighborhood_size)
-    diff = ((data_max - data_min) > intensity_threshold)
-    maxima[diff == 0] = 0
-
-    # Apply a border mask
-    border_mask = np.ones_like(maxima)*255
-    border_mask[:border,:] = 0
-    border_mask[-border:,:] = 0
-    border_mask[:,:border] = 0
-    border_mask[:,-border:] = 0
-    maxima = MaskImage.applyMask(maxima, border_mask, image=True)
-
-    # Remove all detections close to the mask image
-    if mask is not None:
-        erosion_kernel = np.ones((5, 5), mask.img.dtype)
-        mask_eroded = cv2.erode(mask.img, erosion_kernel, iterations=1)
-
-        maxima = MaskImage.applyMask(maxima, mask_eroded, image=True)
-
-
-    # Find and label the maxima
-    labeled, num_objects = ndimage.label(maxima)
+    # Find the local maxima which are star candidates
+    x, y, num_objects = findStarCandidates(ff.avepixel, neighborhood_size, intensity_threshold, border, \
+        mask=mask, max_candidates=config.max_stars)
 
     # Skip the image if there are too many maxima to process
     if num_objects > config.max_stars:
         print('Too many candidate stars to process! {:d}/{:d}'.format(num_objects, config.max_stars))
         return error_return
 
-    # Find centres of mass of each labeled objects
-    xy = np.array(ndimage.center_of_mass(data, labeled, range(1, num_objects+1)))
-
-    # Remove all detection on the border
-    #xy = xy[np.where((xy[:, 1] > border) & (xy[:,1] < ff.ncols - border) & (xy[:,0] > border) & (xy[:,0] < ff.nrows - border))]
-
-    # Unpack star coordinates
-    y, x = np.hsplit(xy, 2)
-
     # # Plot stars before the PSF fit
     # plotStars(ff, x, y)
 
+    # Measure the stars using image moments, if fast extraction was chosen
+    if config.star_extraction_method == 'moments':
+        x2, y2, amplitude, intensity, sigma_y_fitted, sigma_x_fitted = measureStarMoments(ff, x, y, config)
+
     # Fit a PSF to each star
-    x2, y2, amplitude, intensity, sigma_y_fitted, sigma_x_fitted = fitPSF(ff, global_mean, x, y, config)
+    else:
+        x2, y2, amplitude, intensity, sigma_y_fitted, sigma_x_fitted = fitPSF(ff, global_mean, x, y, config)
     
     # x2, y2, amplitude, intensity = list(x), list(y), [], [] # Skip PSF fit
 
@@ -222,8 +333,356 @@ def twoDGaussian(params, amplitude, xo, yo, sigma_x, sigma_y, theta, offset):
 
 
 
+def twoDGaussianBatch(params, y_ind, x_ind, saturation, jacobian=False):
+    """ Evaluate 2D Gaussians with different parameters on a stack of image segments at once. The 
+        parametrization is the same as in twoDGaussian.
+
+    Arguments:
+        params: [ndarray] (N, 7) array of (amplitude, yo, xo, sigma_y, sigma_x, theta, offset) for every
+            segment.
+        y_ind: [ndarray] (H, W) array of Y indices of the segment pixels.
+        x_ind: [ndarray] (H, W) array of X indices of the segment pixels.
+        saturation: [float] Value at which saturation occurs.
+
+    Keyword arguments:
+        jacobian: [bool] If True, the derivatives of the model w.r.t. every parameter will be returned too.
+            False by default.
+
+    Return:
+        g, (jac): 
+            - g: [ndarray] (N, H, W) values of the Gaussians.
+            - jac: [ndarray] (N, H, W, 7) derivatives of the Gaussians, only returned if jacobian is True.
+    """
+
+    amplitude, yo, xo, sigma_y, sigma_x, theta, offset = [params[:, i, np.newaxis, np.newaxis] \
+        for i in range(7)]
+
+    cos2 = np.cos(theta)**2
+    sin2 = np.sin(theta)**2
+    sin2t = np.sin(2*theta)
+
+    sy2 = sigma_y**2
+    sx2 = sigma_x**2
+
+    a = cos2/(2*sy2) + sin2/(2*sx2)
+    b = -sin2t/(4*sy2) + sin2t/(4*sx2)
+    c = sin2/(2*sy2) + cos2/(2*sx2)
+
+    dy = y_ind - yo
+    dx = x_ind - xo
+
+    expo = np.exp(-(a*dy**2 + 2*b*dy*dx + c*dx**2))
+    g = offset + amplitude*expo
+
+    # Limit values to saturation level
+    saturated = g > saturation
+    g[saturated] = saturation
+
+    if not jacobian:
+        return g
+
+
+    ### Compute the derivatives of the model ###
+
+    ae = amplitude*expo
+
+    sy3 = sigma_y*sy2
+    sx3 = sigma_x*sx2
+
+    da_dt = sin2t*(1.0/(2*sx2) - 1.0/(2*sy2))
+    db_dt = np.cos(2*theta)*(1.0/(2*sx2) - 1.0/(2*sy2))
+
+    jac = np.empty(g.shape + (7,))
+    jac[..., 0] = expo
+    jac[..., 1] = ae*(2*a*dy + 2*b*dx)
+    jac[..., 2] = ae*(2*b*dy + 2*c*dx)
+    jac[..., 3] = ae*(cos2*dy**2 - sin2t*dy*dx + sin2*dx**2)/sy3
+    jac[..., 4] = ae*(sin2*dy**2 + sin2t*dy*dx + cos2*dx**2)/sx3
+    jac[..., 5] = -ae*(da_dt*dy**2 + 2*db_dt*dy*dx - da_dt*dx**2)
+    jac[..., 6] = 1.0
+
+    # The saturated values do not depend on the parameters
+    jac[saturated] = 0
+
+    return g, jac
+
+
+
+def fitPSFBatch(segments, weights, initial_guess, saturation, maxfev=200, ftol=1.49012e-08, 
+    xtol=1.49012e-08):
+    """ Fit 2D Gaussians to a stack of star segments at once with the Levenberg-Marquardt algorithm. All
+        segments are iterated together, so the fitting has no per-star Python overhead. The convergence
+        criteria and the limit on the number of function evaluations follow MINPACK, which is used by
+        scipy.optimize.curve_fit, i.e. a fit which takes more than maxfev function evaluations (counting 7 
+        evaluations for every numerical Jacobian) is considered failed.
+
+    Arguments:
+        segments: [ndarray] (N, H, W) stack of image segments.
+        weights: [ndarray] (N, H, W) weights of the segment pixels, 1 for valid pixels and 0 for padding.
+        initial_guess: [tuple] Initial (amplitude, yo, xo, sigma_y, sigma_x, theta, offset).
+        saturation: [float] Value at which saturation occurs.
+
+    Keyword arguments:
+        maxfev: [int] Maximum number of function evaluations per fit. 200 by default.
+        ftol: [float] Relative tolerance of the sum of squares.
+        xtol: [float] Relative tolerance of the parameters.
+
+    Return:
+        params, success:
+            - params: [ndarray] (N, 7) fitted parameters.
+            - success: [ndarray] (N, ) bool array, True where the fit converged.
+    """
+
+    n_fits = segments.shape[0]
+    n_params = len(initial_guess)
+
+    y_ind, x_ind = np.indices(segments.shape[1:])
+
+    params = np.tile(np.array(initial_guess, dtype=np.float64), (n_fits, 1))
+    segments = segments.astype(np.float64)
+
+    def _residuals(params, segments, weights, jacobian=False):
+
+        if jacobian:
+            g, jac = twoDGaussianBatch(params, y_ind, x_ind, saturation, jacobian=True)
+            jac = (jac*weights[..., np.newaxis]).reshape(len(params), -1, n_params)
+
+        else:
+            g = twoDGaussianBatch(params, y_ind, x_ind, saturation)
+
+        res = ((g - segments)*weights).reshape(len(params), -1)
+
+        if jacobian:
+            return res, jac
+
+        return res
+
+
+    success = np.zeros(n_fits, dtype=bool)
+    active = np.ones(n_fits, dtype=bool)
+
+    # Number of function evaluations per fit, the first evaluation and the Jacobian
+    nfev = np.full(n_fits, 1 + n_params)
+
+    damping = np.full(n_fits, -1.0)
+    diag = np.zeros((n_fits, n_params))
+
+    while np.any(active):
+
+        idx = np.where(active)[0]
+        p = params[idx]
+
+        # Evaluate the residuals and the Jacobian
+        res, jac = _residuals(p, segments[idx], weights[idx], jacobian=True)
+        cost = np.sum(res**2, axis=1)
+
+        jtj = np.einsum('nki,nkj->nij', jac, jac)
+        jtr = np.einsum('nki,nk->ni', jac, res)
+
+        # Scale the parameters by the norms of the Jacobian columns, as MINPACK does
+        diag[idx] = np.maximum(diag[idx], np.diagonal(jtj, axis1=1, axis2=2))
+        d = diag[idx]
+        d[d == 0] = 1.0
+
+        # Initialize the damping factor
+        lam = damping[idx]
+        lam[lam < 0] = 1e-3*np.max(d[lam < 0], axis=1)
+
+
+        # Try steps with increasing damping until the sum of squares is reduced
+        pending = np.ones(len(idx), dtype=bool)
+        while np.any(pending):
+
+            pi = np.where(pending)[0]
+
+            a_mat = jtj[pi] + lam[pi, np.newaxis, np.newaxis]*(d[pi, :, np.newaxis]*np.eye(n_params))
+
+            try:
+                step = -np.linalg.solve(a_mat, jtr[pi][..., np.newaxis])[..., 0]
+            except np.linalg.LinAlgError:
+                step = -np.einsum('nij,nj->ni', np.linalg.pinv(a_mat), jtr[pi])
+
+            p_new = p[pi] + step
+            cost_new = np.sum(_residuals(p_new, segments[idx[pi]], weights[idx[pi]])**2, axis=1)
+            nfev[idx[pi]] += 1
+
+            accepted = np.isfinite(cost_new) & (cost_new < cost[pi])
+
+            # Check the convergence in parameters and in the sum of squares
+            d_sqrt = np.sqrt(d[pi])
+            step_norm = np.linalg.norm(d_sqrt*step, axis=1)
+            p_norm = np.linalg.norm(d_sqrt*p[pi], axis=1)
+            converged_x = step_norm <= xtol*p_norm
+            converged_f = accepted & ((cost[pi] - cost_new) <= ftol*cost[pi])
+            converged = converged_x | converged_f | (cost[pi] == 0)
+
+            # Update the parameters of the accepted steps and the damping
+            params[idx[pi[accepted]]] = p_new[accepted]
+            lam[pi[accepted]] /= 10.0
+            lam[pi[~accepted]] *= 10.0
+
+            done = accepted | converged
+
+            # Mark the converged fits
+            success[idx[pi[converged]]] = True
+            active[idx[pi[converged]]] = False
+
+            # Stop the fits which took too many function evaluations
+            exceeded = (nfev[idx[pi]] >= maxfev) & ~converged
+            active[idx[pi[exceeded]]] = False
+
+            # Stop the fits which diverged
+            diverged = ~np.isfinite(lam[pi]) | (lam[pi] > 1e32)
+            active[idx[pi[diverged]]] = False
+
+            pending[pi[done | exceeded | diverged]] = False
+
+
+        damping[idx] = lam
+
+        # Count the function evaluations for the next Jacobian
+        nfev[idx] += n_params
+
+
+    return params, success
+
+
+
+def _starSegments(ff, x2, y2, segment_radius):
+    """ Extract the image segments around all star candidates into one array. Segments cut by the image 
+        edge are padded, and the valid pixels are marked in the weights.
+
+    Arguments:
+        ff: [ff bin struct] FF bin file loaded in the FF bin structure
+        x2: [ndarray] Star candidate positions (X axis), without NaNs.
+        y2: [ndarray] Star candidate positions (Y axis), without NaNs.
+        segment_radius: [int] Radius (in pixels) of the segment around each star.
+
+    Return:
+        y_min, x_min, seg_h, seg_w, segments, weights:
+            - y_min, x_min: [ndarray] Image coordinates of the upper left corners of the segments.
+            - seg_h, seg_w: [ndarray] Sizes of the segments which are inside the image.
+            - segments: [ndarray] (N, H, W) stack of image segments.
+            - weights: [ndarray] (N, H, W) stack of weights, 1 for valid pixels and 0 for padding.
+    """
+
+    # Compute the extent of the image segment around each star
+    y_min = np.clip(y2 - segment_radius, 0, None).astype(np.int64)
+    y_max = np.clip(y2 + segment_radius, None, ff.nrows).astype(np.int64)
+    x_min = np.clip(x2 - segment_radius, 0, None).astype(np.int64)
+    x_max = np.clip(x2 + segment_radius, None, ff.ncols).astype(np.int64)
+
+    seg_h = np.clip(y_max - y_min, 0, None)
+    seg_w = np.clip(x_max - x_min, 0, None)
+
+    h_max = max(np.max(seg_h), 1)
+    w_max = max(np.max(seg_w), 1)
+    y_ind, x_ind = np.indices((h_max, w_max))
+
+    weights = (y_ind[np.newaxis] < seg_h[:, np.newaxis, np.newaxis]) \
+        & (x_ind[np.newaxis] < seg_w[:, np.newaxis, np.newaxis])
+
+    rows = np.clip(y_min[:, np.newaxis, np.newaxis] + y_ind, 0, ff.nrows - 1)
+    cols = np.clip(x_min[:, np.newaxis, np.newaxis] + x_ind, 0, ff.ncols - 1)
+    segments = ff.avepixel[rows, cols]
+
+    return y_min, x_min, seg_h, seg_w, segments, weights.astype(np.float64)
+
+
+
+def _starIntensity(segments, seg_h, seg_w, yo, xo, sigma_y, sigma_x, background, good, gamma):
+    """ Compute the gamma corrected, background subtracted intensity of stars in the 3 sigma portion of the 
+        segments around the star centres.
+
+    Arguments:
+        segments: [ndarray] (N, H, W) stack of image segments.
+        seg_h, seg_w: [ndarray] Sizes of the segments which are inside the image.
+        yo, xo: [ndarray] Star centres in segment coordinates.
+        sigma_y, sigma_x: [ndarray] Star widths.
+        background: [ndarray] Star backgrounds.
+        good: [ndarray] Bool array of stars for which the intensity should be computed.
+        gamma: [float] Camera gamma.
+
+    Return:
+        intensity, crop_valid: 
+            - intensity: [ndarray] Star intensities.
+            - crop_valid: [ndarray] False for the stars for which the crop is empty.
+    """
+
+    y_ind, x_ind = np.indices(segments.shape[1:])
+
+    yo = np.where(good, yo, 0)
+    xo = np.where(good, xo, 0)
+    sigma_y = np.where(good, sigma_y, 0)
+    sigma_x = np.where(good, sigma_x, 0)
+
+    # Crop the star segment to take 3 sigma portion around the star
+    crop_y_min = np.clip(np.trunc(yo - 3*sigma_y).astype(np.int64) + 1, 0, None)
+    crop_y_max = np.trunc(yo + 3*sigma_y).astype(np.int64) + 1
+    crop_y_max = np.where(crop_y_max >= seg_h, seg_h - 1, crop_y_max)
+
+    crop_x_min = np.clip(np.trunc(xo - 3*sigma_x).astype(np.int64) + 1, 0, None)
+    crop_x_max = np.trunc(xo + 3*sigma_x).astype(np.int64) + 1
+    crop_x_max = np.where(crop_x_max >= seg_w, seg_w - 1, crop_x_max)
+
+    # If the segment is too small, set a fixed size
+    crop_y_min = np.where(seg_h < 3, np.trunc(yo - 2).astype(np.int64), crop_y_min)
+    crop_y_max = np.where(seg_h < 3, np.trunc(yo + 2).astype(np.int64), crop_y_max)
+    crop_x_min = np.where(seg_w < 3, np.trunc(xo - 2).astype(np.int64), crop_x_min)
+    crop_x_max = np.where(seg_w < 3, np.trunc(xo + 2).astype(np.int64), crop_x_max)
+
+    # Resolve the crop limits in the same way as array slicing does
+    crop_y_min, crop_y_max = _sliceLimits(crop_y_min, crop_y_max, seg_h)
+    crop_x_min, crop_x_max = _sliceLimits(crop_x_min, crop_x_max, seg_w)
+
+    crop_mask = (y_ind[np.newaxis] >= crop_y_min[:, np.newaxis, np.newaxis]) \
+        & (y_ind[np.newaxis] < crop_y_max[:, np.newaxis, np.newaxis]) \
+        & (x_ind[np.newaxis] >= crop_x_min[:, np.newaxis, np.newaxis]) \
+        & (x_ind[np.newaxis] < crop_x_max[:, np.newaxis, np.newaxis])
+
+    crop_valid = (crop_y_max > crop_y_min) & (crop_x_max > crop_x_min)
+
+    # Gamma correct the star segment and the background, subtract the background from the star segment 
+    #   and compute the total intensity
+    seg_corrected = Image.gammaCorrectionArray(segments.astype(np.float32), gamma)
+    bg_corrected = Image.gammaCorrectionArray(np.where(good, background, 0), gamma)
+
+    intensity = np.sum((seg_corrected - bg_corrected[:, np.newaxis, np.newaxis])*crop_mask, axis=(1, 2))
+
+    return intensity, crop_valid
+
+
+
+def _sliceLimits(start, stop, length):
+    """ Convert the given arrays of slice limits to the indices which would be taken by slicing an array of 
+        the given length, e.g. negative indices are counted from the end.
+    """
+
+    start = np.where(start < 0, start + length, start)
+    stop = np.where(stop < 0, stop + length, stop)
+
+    start = np.clip(start, 0, length)
+    stop = np.clip(stop, 0, length)
+
+    return start, stop
+
+
+
+def _validCandidates(x2, y2):
+    """ Convert the candidate coordinates to flat arrays and remove the ones with NaN coordinates. """
+
+    y2 = np.array(y2, dtype=np.float64).ravel()
+    x2 = np.array(x2, dtype=np.float64).ravel()
+
+    valid = ~(np.isnan(y2) | np.isnan(x2))
+
+    return x2[valid], y2[valid]
+
+
+
 def fitPSF(ff, avepixel_mean, x2, y2, config):
-    """ Fit a 2D Gaussian to the star candidate cutout to check if it's a star.
+    """ Fit a 2D Gaussian to the star candidate cutout to check if it's a star. All candidates are fitted
+        at once (see fitPSFBatch).
     
     Arguments:
         ff: [ff bin struct] FF bin file loaded in the FF bin structure
@@ -245,163 +704,173 @@ def fitPSF(ff, avepixel_mean, x2, y2, config):
         max_feature_ratio = config.max_feature_ratio
 
 
-    x_fitted = []
-    y_fitted = []
-    amplitude_fitted = []
-    intensity_fitted = []
-    sigma_y_fitted = []
-    sigma_x_fitted = []
+    # Skip the stars with NaN coordinates
+    x2, y2 = _validCandidates(x2, y2)
+
+    if not len(y2):
+        return [], [], [], [], [], []
+
+
+    # Extract image segments around all stars into one array
+    y_min, x_min, seg_h, seg_w, segments, weights = _starSegments(ff, x2, y2, segment_radius)
+
+    # Estimate saturation level from image type
+    saturation = 2**(8*ff.avepixel.itemsize) - 1
 
     # Set the initial guess
     initial_guess = (30.0, segment_radius, segment_radius, 1.0, 1.0, 0.0, avepixel_mean)
-    
-    # Go through all stars
-    for star in zip(list(y2), list(x2)):
 
-        y, x = star
+    # Fit the 2D Gaussian with the limited number of iterations - this reduces the processing time and 
+    #   most of the bad star candidates take more iterations to fit
+    popt, success = fitPSFBatch(segments, weights, initial_guess, saturation, maxfev=200)
 
-        y_min = y - segment_radius
-        y_max = y + segment_radius
-        x_min = x - segment_radius
-        x_max = x + segment_radius
-
-        if y_min < 0:
-            y_min = np.array([0])
-        if y_max > ff.nrows:
-            y_max = np.array([ff.nrows])
-        if x_min < 0:
-            x_min = np.array([0])
-        if x_max > ff.ncols:
-            x_max = np.array([ff.ncols])
-
-        # Check if any of these values is NaN and skip the star
-        if np.any(np.isnan([x_min, x_max, y_min, y_max])):
-            continue
+    # Unpack fitted gaussian parameters
+    amplitude, yo, xo, sigma_y, sigma_x, theta, offset = popt.T
 
-        x_min = int(x_min)
-        x_max = int(x_max)
-        y_min = int(y_min)
-        y_max = int(y_max)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
 
-        # Extract an image segment around each star
-        star_seg = ff.avepixel[y_min:y_max, x_min:x_max]
+        # Skip stars that can't be fitted in 200 iterations
+        good = success & np.all(np.isfinite(popt), axis=1)
 
-        # Create x and y indices
-        y_ind, x_ind = np.indices(star_seg.shape)
+        # Filter hot pixels by looking at the ratio between x and y sigmas (HPs are very narrow)
+        good &= ~(np.minimum(sigma_y/sigma_x, sigma_x/sigma_y) < roundness_threshold)
 
-        # Estimate saturation level from image type
-        saturation = (2**(8*star_seg.itemsize) - 1)*np.ones_like(y_ind)
+        # Reject the star candidate if it is too large 
+        good &= ~(4*sigma_x*sigma_y/segment_radius**2 > max_feature_ratio)
 
-        # Fit a PSF to the star
-        try:
-            # Fit the 2D Gaussian with the limited number of iterations - this reduces the processing time
-            # and most of the bad star candidates take more iterations to fit
-            popt, pcov = opt.curve_fit(twoDGaussian, (y_ind, x_ind, saturation), star_seg.ravel(), \
-                p0=initial_guess, maxfev=200)
-            # print(popt)
-        except RuntimeError:
-            # print('Fitting failed!')
 
-            # Skip stars that can't be fitted in 200 iterations
-            continue
+    # Compute the star intensity
+    intensity, crop_valid = _starIntensity(segments, seg_h, seg_w, yo, xo, sigma_y, sigma_x, offset, good, \
+        config.gamma)
 
-        # Unpack fitted gaussian parameters
-        amplitude, yo, xo, sigma_y, sigma_x, theta, offset = popt
+    # Skip the star if the shape is too small
+    good &= crop_valid
 
-        # Filter hot pixels by looking at the ratio between x and y sigmas (HPs are very narrow)
-        if min(sigma_y/sigma_x, sigma_x/sigma_y) < roundness_threshold:
-            # Skip if it is a hot pixel
-            continue
+    # Skip stars with zero intensity
+    good &= intensity > 0
 
-        # Reject the star candidate if it is too large 
-        if (4*sigma_x*sigma_y / segment_radius**2 > max_feature_ratio):
-            continue
 
+    return list(x_min[good] + xo[good]), list(y_min[good] + yo[good]), list(amplitude[good]), \
+        list(intensity[good]), list(sigma_y[good]), list(sigma_x[good])
 
-        ### If the fitting was successfull, compute the star intensity
 
-        # Crop the star segment to take 3 sigma portion around the star
-        crop_y_min = int(yo - 3*sigma_y) + 1
-        if crop_y_min < 0: crop_y_min = 0
-        
-        crop_y_max = int(yo + 3*sigma_y) + 1
-        if crop_y_max >= star_seg.shape[0]: crop_y_max = star_seg.shape[0] - 1
 
-        crop_x_min = int(xo - 3*sigma_x) + 1
-        if crop_x_min < 0: crop_x_min = 0
+def measureStarMoments(ff, x2, y2, config):
+    """ Measure the star candidates using image moments instead of a PSF fit. The centroids are the 
+        background subtracted, intensity weighted means of pixel positions, and the widths are computed 
+        from the second moments. This is much faster than fitting, but the widths are only approximate. 
+        The same roundness and size criteria as in fitPSF are applied, and the candidates where only one 
+        pixel is above the background noise are rejected as hot pixels.
 
-        crop_x_max = int(xo + 3*sigma_x) + 1
-        if crop_x_max >= star_seg.shape[1]: crop_x_max = star_seg.shape[1] - 1
+    Arguments:
+        ff: [ff bin struct] FF bin file loaded in the FF bin structure
+        x2: [list] a list of estimated star position (X axis)
+        xy: [list] a list of estimated star position (Y axis)
+        config: [config object] configuration object (loaded from the .config file)
 
-        # If the segment is too small, set a fixed size
-        if (y_max - y_min) < 3:
-            crop_y_min = int(yo - 2)
-            crop_y_max = int(yo + 2)
+    Return:
+        x, y, amplitude, intensity, sigma_y, sigma_x: [lists] Same as fitPSF, the amplitude is the peak value
+            above the background.
+    """
 
-        if (x_max - x_min) < 3:
-            crop_x_min = int(xo - 2)
-            crop_x_max = int(xo + 2)
+    segment_radius = config.segment_radius
 
+    # Skip the stars with NaN coordinates
+    x2, y2 = _validCandidates(x2, y2)
 
-        star_seg_crop = star_seg[crop_y_min:crop_y_max, crop_x_min:crop_x_max]
+    if not len(y2):
+        return [], [], [], [], [], []
 
-        # Skip the star if the shape is too small
-        if (star_seg_crop.shape[0] == 0) or (star_seg_crop.shape[1] == 0):
-            continue
 
-        # Gamma correct the star segment
-        star_seg_crop = Image.gammaCorrection(star_seg_crop.astype(np.float32), config.gamma)
+    # Extract image segments around all stars into one array
+    y_min, x_min, seg_h, seg_w, segments, weights = _starSegments(ff, x2, y2, segment_radius)
+    segments = segments.astype(np.float64)
 
-        # Correct the background for gamma
-        bg_corrected = Image.gammaCorrection(offset, config.gamma)
+    n_stars = len(segments)
+    y_ind, x_ind = np.indices(segments.shape[1:])
 
-        # Subtract the background from the star segment and compute the total intensity
-        intensity = np.sum(star_seg_crop - bg_corrected)
 
-        # Skip stars with zero intensity
-        if intensity <= 0:
-            continue
+    # Label the pixels on the edge of every segment, and the inner pixels of every segment
+    edge = np.zeros(segments.shape, dtype=bool)
+    edge[:, 0, :] = True
+    edge[:, :, 0] = True
+    edge[np.arange(n_stars), np.clip(seg_h - 1, 0, None), :] = True
+    edge[np.arange(n_stars), :, np.clip(seg_w - 1, 0, None)] = True
+    edge &= weights > 0
 
-        # print(intensity)
-        # plt.imshow(star_seg_crop - bg_corrected, cmap='gray', vmin=0, vmax=255)
-        # plt.show()
+    star_index = np.arange(1, n_stars + 1)
 
+    labels = star_index[:, np.newaxis, np.newaxis]*np.ones(segments.shape, dtype=np.int64)
+    labels[weights == 0] = 0
+    edge_labels = np.where(edge, labels, 0)
 
-        ###
 
-        # Calculate the intensity (as a volume under the 2D Gaussian) (OLD, before gamma correction)
-        # intensity = 2*np.pi*amplitude*sigma_x*sigma_y
+    # Estimate the background and its noise from the segment edges
+    background = np.array(ndimage.median(segments, edge_labels, star_index))
+    noise = np.array(ndimage.standard_deviation(segments, edge_labels, star_index))[:, np.newaxis, np.newaxis]
 
+    # Only take the pixels above the background noise
+    signal = segments - background[:, np.newaxis, np.newaxis]
+    signal[signal < noise] = 0
+    signal *= weights
 
+    signal_labels = labels.ravel()
+
+    # Compute the moments of every star
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        m0 = np.array(ndimage.sum(signal.ravel(), signal_labels, star_index))
+
+        yo = np.array(ndimage.sum((signal*y_ind).ravel(), signal_labels, star_index))/m0
+        xo = np.array(ndimage.sum((signal*x_ind).ravel(), signal_labels, star_index))/m0
+
+        dy = y_ind - yo[:, np.newaxis, np.newaxis]
+        dx = x_ind - xo[:, np.newaxis, np.newaxis]
+
+        myy = np.array(ndimage.sum((signal*dy**2).ravel(), signal_labels, star_index))/m0
+        mxx = np.array(ndimage.sum((signal*dx**2).ravel(), signal_labels, star_index))/m0
+        mxy = np.array(ndimage.sum((signal*dx*dy).ravel(), signal_labels, star_index))/m0
+
+        # Compute the widths along the principal axes
+        mean_var = (myy + mxx)/2
+        diff_var = np.sqrt(((myy - mxx)/2)**2 + mxy**2)
+        sigma_major = np.sqrt(mean_var + diff_var)
+        sigma_minor = np.sqrt(np.clip(mean_var - diff_var, 0, None))
+
+        sigma_y = np.sqrt(myy)
+        sigma_x = np.sqrt(mxx)
+
+        # Count the number of pixels significantly above the noise
+        n_pixels = np.array(ndimage.sum((signal > 3*noise).ravel(), signal_labels, star_index))
+
+        amplitude = np.array(ndimage.maximum(signal.ravel(), signal_labels, star_index))
+
+
+        good = (m0 > 0) & np.isfinite(yo) & np.isfinite(xo)
+
+        # Reject hot pixels, which are only one pixel significantly above the background
+        good &= n_pixels > 1
+
+        # Filter elongated features
+        good &= ~(sigma_minor/sigma_major < config.roundness_threshold)
+
+        # Reject the star candidate if it is too large 
+        good &= ~(4*sigma_x*sigma_y/segment_radius**2 > config.max_feature_ratio)
+
+
+    # Compute the star intensity
+    intensity, crop_valid = _starIntensity(segments, seg_h, seg_w, yo, xo, sigma_y, sigma_x, background, good, \
+        config.gamma)
+
+    # Skip the star if the shape is too small
+    good &= crop_valid
+
+    # Skip stars with zero intensity
+    good &= intensity > 0
 
-        # # Skip if the star intensity is below background level
-        # if intensity < offset:
-        #     continue
 
-        # Add stars to the final list
-        x_fitted.append(x_min + xo)
-        y_fitted.append(y_min + yo)
-        amplitude_fitted.append(amplitude)
-        intensity_fitted.append(intensity)
-        sigma_y_fitted.append(sigma_y)
-        sigma_x_fitted.append(sigma_x)
-
-        # # Plot fitted stars
-        # data_fitted = twoDGaussian((y_ind, x_ind), *popt) - offset
-
-        # fig, ax = plt.subplots(1, 1)
-        # ax.hold(True)
-        # plt.title('Center Y: '+str(y_min[0])+', X:'+str(x_min[0]))
-        # ax.imshow(star_seg.reshape(segment_radius*2, segment_radius*2), cmap=plt.cm.inferno, origin='bottom',
-        #     extent=(x_ind.min(), x_ind.max(), y_ind.min(), y_ind.max()))
-        # # ax.imshow(data_fitted.reshape(segment_radius*2, segment_radius*2), cmap=plt.cm.jet, origin='bottom')
-        # ax.contour(x_ind, y_ind, data_fitted.reshape(segment_radius*2, segment_radius*2), 8, colors='w')
-
-        # plt.show()
-        # plt.clf()
-        # plt.close()
-
-    return x_fitted, y_fitted, amplitude_fitted, intensity_fitted, sigma_y_fitted, sigma_x_fitted
+    return list(x_min[good] + xo[good]), list(y_min[good] + yo[good]), list(amplitude[good]), \
+        list(intensity[good]), list(sigma_y[good]), list(sigma_x[good])
 
 
 
@@ -18,6 +18,62 @@
 import os
 
 
+def writeCALSTARSHeader(star_file, ff_directory, cam_code, nrows, ncols):
+    """ Writes the header of the CAMS CALSTARS format to an open file.
+
+    @param star_file: [file handle] file opened for writing
+    @param ff_directory: [str] path to the directory with FF files
+    @param cam_code: [str] camera code
+    @param nrows: [int] number of rows in the image
+    @param ncols: [int] number of columns in the image
+
+    @return None
+    """
+
+    star_file.write("==========================================================================\n")
+    star_file.write("RMS star extractor" + "\n")
+    star_file.write("Cal time = FF header time plus 255/(2*framerate_Hz) seconds" + "\n")
+    star_file.write("Row  Column  Intensity-Backgnd  Amplitude  (integrated values)" + "\n")
+    star_file.write("==========================================================================\n")
+    star_file.write("FF folder = " + ff_directory + "\n")
+    star_file.write("Cam #  = " + str(cam_code) + "\n")
+    star_file.write("Nrows  = " + str(nrows) + "\n")
+    star_file.write("Ncols  = " + str(ncols) + "\n")
+    star_file.write("Nstars = -1" + "\n")
+
+
+
+def writeCALSTARSEntry(star_file, ff_name, star_data):
+    """ Writes the stars detected on one FF file to an open CALSTARS file.
+
+    @param star_file: [file handle] file opened for writing
+    @param ff_name: [str] name of the FF file
+    @param star_data: [list] list of star data, entries:
+            x, y, bg_level, level
+
+    @return None
+    """
+
+    # Write star header per image
+    star_file.write("==========================================================================\n")
+    star_file.write(ff_name + "\n")
+    star_file.write("Star area dim = -1" + "\n")
+    star_file.write("Integ pixels  = -1" + "\n")
+
+    # Write every star to file
+    for x, y, amplitude, level in list(star_data):
+        star_file.write("{:7.2f} {:7.2f} {:6d} {:6d}".format(round(y, 2), round(x, 2), 
+            int(level), int(amplitude)) + "\n")
+
+
+
+def writeCALSTARSEnd(star_file):
+    """ Writes the end separator of the CALSTARS file. """
+
+    star_file.write("##########################################################################\n")
+
+
+
 def writeCALSTARS(star_list, ff_directory, file_name, cam_code, nrows, ncols):
     """ Writes the star list into the CAMS CALSTARS format. 
 
@@ -38,16 +94,7 @@ def writeCALSTARS(star_list, ff_directory, file_name, cam_code, nrows, ncols):
     with open(os.path.join(ff_directory, file_name), 'w') as star_file:
 
         # Write the header
-        star_file.write("==========================================================================\n")
-        star_file.write("RMS star extractor" + "\n")
-        star_file.write("Cal time = FF header time plus 255/(2*framerate_Hz) seconds" + "\n")
-        star_file.write("Row  Column  Intensity-Backgnd  Amplitude  (integrated values)" + "\n")
-        star_file.write("==========================================================================\n")
-        star_file.write("FF folder = " + ff_directory + "\n")
-        star_file.write("Cam #  = " + str(cam_code) + "\n")
-        star_file.write("Nrows  = " + str(nrows) + "\n")
-        star_file.write("Ncols  = " + str(ncols) + "\n")
-        star_file.write("Nstars = -1" + "\n")
+        writeCALSTARSHeader(star_file, ff_directory, cam_code, nrows, ncols)
 
         # Write all stars in the CALSTARS file
         for star in star_list:
@@ -55,19 +102,10 @@ def writeCALSTARS(star_list, ff_directory, file_name, cam_code, nrows, ncols):
             # Unpack star data
             ff_name, star_data = star
 
-            # Write star header per image
-            star_file.write("==========================================================================\n")
-            star_file.write(ff_name + "\n")
-            star_file.write("Star area dim = -1" + "\n")
-            star_file.write("Integ pixels  = -1" + "\n")
-
-            # Write every star to file
-            for x, y, amplitude, level in list(star_data):
-                star_file.write("{:7.2f} {:7.2f} {:6d} {:6d}".format(round(y, 2), round(x, 2), 
-                    int(level), int(amplitude)) + "\n")
+            writeCALSTARSEntry(star_file, ff_name, star_data)
 
         # Write the end separator
-        star_file.write("##########################################################################\n")
+        writeCALSTARSEnd(star_file)
 
 
 
@@ -143,5 +181,10 @@ def readCALSTARS(file_path, file_name):
             # Save star data
             star_data.append([float(line[0]), float(line[1]), int(line[2]), int(line[3])])
 
+
+        # Add the last entry if the file has no end separator (e.g. it is still being written)
+        if star_data:
+            calibrationstars_list.append([ff_name, star_data])
+
     
     return calibrationstars_list
\ No newline at end of file
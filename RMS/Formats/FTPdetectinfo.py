@@ -23,6 +23,124 @@ import git
 import numpy as np
 
 
+def writeFTPdetectinfoHeader(ftpdetect_file, total_meteors, ff_directory, cal_directory):
+    """ Writes the header of the FTPdetectinfo file to an open file.
+
+    Arguments:
+        ftpdetect_file: [file handle] File opened for writing.
+        total_meteors: [int] Number of meteors in the file.
+        ff_directory: [str] Path to the directory with FF files.
+        cal_directory: [str] Path to the CAL directory.
+
+    Return:
+        None
+    """
+
+    try:
+        # Get latest version's commit hash and time of commit
+        repo = git.Repo(search_parent_directories=True)
+        commit_unix_time = repo.head.object.committed_date
+        sha = repo.head.object.hexsha
+        commit_time = datetime.datetime.fromtimestamp(commit_unix_time).strftime('%Y%m%d_%H%M%S')
+
+    except:
+        commit_time = ""
+        sha = ""
+
+    # Write the number of meteors on the beginning fo the file
+    ftpdetect_file.write("Meteor Count = " + str(total_meteors).zfill(6) + "\n")
+    ftpdetect_file.write("-----------------------------------------------------\n")
+    ftpdetect_file.write("Processed with RMS 1.0 " + commit_time + " " + str(sha) + " on " \
+        + str(datetime.datetime.utcnow()) + " UTC\n")
+    ftpdetect_file.write("-----------------------------------------------------\n")
+    ftpdetect_file.write("FF  folder = " + ff_directory + "\n")
+    ftpdetect_file.write("CAL folder = " + cal_directory + "\n")
+    ftpdetect_file.write("-----------------------------------------------------\n")
+    ftpdetect_file.write("FF  file processed\n")
+    ftpdetect_file.write("CAL file processed\n")
+    ftpdetect_file.write("Cam# Meteor# #Segments fps hnr mle bin Pix/fm Rho Phi\n")
+    
+    ftpdetect_file.write("Per segment:  Frame# Col Row RA Dec Azim Elev Inten Mag\n")
+
+
+
+def writeFTPdetectinfoMeteor(ftpdetect_file, meteor, cam_code, fps, calibration=None, 
+    celestial_coords_given=False):
+    """ Writes one meteor entry to an open FTPdetectinfo file. 
+
+    Arguments:
+        ftpdetect_file: [file handle] File opened for writing.
+        meteor: [list] Meteor data: ff_name, meteor_No, rho, theta, centroids
+        cam_code: [str] camera code
+        fps: [float] frames per second of the camera
+
+    Keyword arguments:
+        calibration: [str] See writeFTPdetectinfo.
+        celestial_coords_given: [bool] See writeFTPdetectinfo.
+
+    Return:
+        None
+    """
+
+    # Unpack the meteor data
+    ff_name, meteor_No, rho, theta, centroids = meteor
+
+    ftpdetect_file.write("-------------------------------------------------------\n")
+    ftpdetect_file.write(ff_name + "\n")
+    
+    if calibration is not None:
+        ftpdetect_file.write(calibration + "\n")
+    else:
+        ftpdetect_file.write("Uncalibrated" + "\n")
+
+    # Calculate meteor's angular velocity
+    first_centroid = centroids[0]
+    last_centroid  = centroids[-1]
+    frame1, x1, y1 = first_centroid[:3]
+    frame2, x2, y2 = last_centroid[:3]
+
+    ang_vel = np.sqrt((x2 - x1)**2 + (y2 - y1)**2)/float(frame2 - frame1)
+
+    # Write detection header
+    ftpdetect_file.write(str(cam_code).zfill(4) + " " + str(int(meteor_No)).zfill(4) + " " + 
+        str(int(len(centroids))).zfill(4) + " " + "{:07.2f}".format(round(float(fps), 2)) + 
+        " 000.0 000.0  00.0 " + str(round(ang_vel, 1)).zfill(5) + " " + 
+        "{:06.1f} {:06.1f}".format(round(rho, 1), round(theta, 1)) + "\n")
+
+    # Write individual detection points
+    for line in centroids:
+
+        if celestial_coords_given:
+
+            frame, x, y, ra, dec, azim, elev, level, mag = line
+
+            # If the coordinates or the magnitude are NaN, skip this centroid
+            if np.isnan(x) or np.isnan(y) or np.isnan(mag):
+                continue
+
+            detection_line_str = "{:06.4f} {:07.2f} {:07.2f} {:08.4f} {:+08.4f} {:08.4f} {:+08.4f} {:06d} {:.2f}"
+
+            ftpdetect_file.write(detection_line_str.format(round(frame, 4), round(x, 2), \
+                round(y, 2), round(ra, 4), round(dec, 4), round(azim, 4), round(elev, 4), \
+                int(level), round(mag, 2)) + "\n")
+
+        else:
+            if len(line) == 9:
+                frame, x, y, ra, dec, azim, elev, level, mag = line
+
+            else:
+                frame, x, y, level = line
+
+            # If the coordinates are NaN, skip this centroid
+            if np.isnan(x) or np.isnan(y):
+                continue
+
+            ftpdetect_file.write("{:06.4f} {:07.2f} {:07.2f}".format(round(frame, 4), round(x, 2), \
+                round(y, 2)) + " 000.00 000.00 000.00 000.00 " + "{:06d}".format(int(level)) \
+                + " 0.00\n")
+
+
+
 def writeFTPdetectinfo(meteor_list, ff_directory, file_name, cal_directory, cam_code, fps, calibration=None,
     celestial_coords_given=False):
     """ Writes a FTPdetectinfo file from the list of detected meteors. 
@@ -50,92 +168,13 @@ def writeFTPdetectinfo(meteor_list, ff_directory, file_name, cal_directory, cam_
     # Open a file
     with open(os.path.join(ff_directory, file_name), 'w') as ftpdetect_file:
 
-        try:
-            # Get latest version's commit hash and time of commit
-            repo = git.Repo(search_parent_directories=True)
-            commit_unix_time = repo.head.object.committed_date
-            sha = repo.head.object.hexsha
-            commit_time = datetime.datetime.fromtimestamp(commit_unix_time).strftime('%Y%m%d_%H%M%S')
-
-        except:
-            commit_time = ""
-            sha = ""
-
-        # Write the number of meteors on the beginning fo the file
-        total_meteors = len(meteor_list)
-        ftpdetect_file.write("Meteor Count = " + str(total_meteors).zfill(6) + "\n")
-        ftpdetect_file.write("-----------------------------------------------------\n")
-        ftpdetect_file.write("Processed with RMS 1.0 " + commit_time + " " + str(sha) + " on " \
-            + str(datetime.datetime.utcnow()) + " UTC\n")
-        ftpdetect_file.write("-----------------------------------------------------\n")
-        ftpdetect_file.write("FF  folder = " + ff_directory + "\n")
-        ftpdetect_file.write("CAL folder = " + cal_directory + "\n")
-        ftpdetect_file.write("-----------------------------------------------------\n")
-        ftpdetect_file.write("FF  file processed\n")
-        ftpdetect_file.write("CAL file processed\n")
-        ftpdetect_file.write("Cam# Meteor# #Segments fps hnr mle bin Pix/fm Rho Phi\n")
-        
-        ftpdetect_file.write("Per segment:  Frame# Col Row RA Dec Azim Elev Inten Mag\n")
+        # Write the header
+        writeFTPdetectinfoHeader(ftpdetect_file, len(meteor_list), ff_directory, cal_directory)
 
         # Write info for all meteors
         for meteor in meteor_list:
-
-            # Unpack the meteor data
-            ff_name, meteor_No, rho, theta, centroids = meteor
-
-            ftpdetect_file.write("-------------------------------------------------------\n")
-            ftpdetect_file.write(ff_name + "\n")
-            
-            if calibration is not None:
-                ftpdetect_file.write(calibration + "\n")
-            else:
-                ftpdetect_file.write("Uncalibrated" + "\n")
-
-            # Calculate meteor's angular velocity
-            first_centroid = centroids[0]
-            last_centroid  = centroids[-1]
-            frame1, x1, y1 = first_centroid[:3]
-            frame2, x2, y2 = last_centroid[:3]
-
-            ang_vel = np.sqrt((x2 - x1)**2 + (y2 - y1)**2)/float(frame2 - frame1)
-
-            # Write detection header
-            ftpdetect_file.write(str(cam_code).zfill(4) + " " + str(int(meteor_No)).zfill(4) + " " + 
-                str(int(len(centroids))).zfill(4) + " " + "{:07.2f}".format(round(float(fps), 2)) + 
-                " 000.0 000.0  00.0 " + str(round(ang_vel, 1)).zfill(5) + " " + 
-                "{:06.1f} {:06.1f}".format(round(rho, 1), round(theta, 1)) + "\n")
-
-            # Write individual detection points
-            for line in centroids:
-
-                if celestial_coords_given:
-
-                    frame, x, y, ra, dec, azim, elev, level, mag = line
-
-                    # If the coordinates or the magnitude are NaN, skip this centroid
-                    if np.isnan(x) or np.isnan(y) or np.isnan(mag):
-                        continue
-
-                    detection_line_str = "{:06.4f} {:07.2f} {:07.2f} {:08.4f} {:+08.4f} {:08.4f} {:+08.4f} {:06d} {:.2f}"
-
-                    ftpdetect_file.write(detection_line_str.format(round(frame, 4), round(x, 2), \
-                        round(y, 2), round(ra, 4), round(dec, 4), round(azim, 4), round(elev, 4), \
-                        int(level), round(mag, 2)) + "\n")
-
-                else:
-                    if len(line) == 9:
-                        frame, x, y, ra, dec, azim, elev, level, mag = line
-
-                    else:
-                        frame, x, y, level = line
-
-                    # If the coordinates are NaN, skip this centroid
-                    if np.isnan(x) or np.isnan(y):
-                        continue
-
-                    ftpdetect_file.write("{:06.4f} {:07.2f} {:07.2f}".format(round(frame, 4), round(x, 2), \
-                        round(y, 2)) + " 000.00 000.00 000.00 000.00 " + "{:06d}".format(int(level)) \
-                        + " 0.00\n")
+            writeFTPdetectinfoMeteor(ftpdetect_file, meteor, cam_code, fps, calibration=calibration, \
+                celestial_coords_given=celestial_coords_given)
 
 
 
@@ -127,6 +127,74 @@ def getPairedStarsSkyPositions(img_x, img_y, jd, platepar):
     return ra_array, dec_array
 
 
+class PlateparView(object):
+
+    # Platepar attributes used by the projection functions, the fitted parameters are kept in one array
+    __slots__ = ['params', 'lat', 'lon', 'elev', 'JD', 'Ho', 'X_res', 'Y_res', 'x_poly_fwd', 'y_poly_fwd', \
+        'x_poly_rev', 'y_poly_rev', 'distortion_type', 'refraction', 'equal_aspect', \
+        'force_distortion_centre', 'mag_lev', 'vignetting_coeff', 'extinction_scale']
+
+    def __init__(self, platepar):
+        """ A lightweight view of the platepar for fitting, which can be given to the projection functions
+            (raDecToXYPP, xyToRaDecPP) instead of the platepar. The reference RA, Dec, position angle and 
+            scale are kept in the params array, so an objective function can set them on a scratch view on 
+            every evaluation instead of deep copying the whole platepar. The distortion arrays are shared 
+            with the platepar, so they should only be replaced, not modified in place.
+
+        Arguments:
+            platepar: [Platepar] The platepar, it is not modified.
+        """
+
+        self.params = np.array([platepar.RA_d, platepar.dec_d, platepar.pos_angle_ref, platepar.F_scale], \
+            dtype=np.float64)
+
+        for attr in PlateparView.__slots__[1:]:
+            setattr(self, attr, getattr(platepar, attr))
+
+
+    def setParams(self, params):
+        """ Set the reference RA, Dec, position angle and scale, without allocating a new array. """
+
+        self.params[:] = params
+
+
+    @property
+    def RA_d(self):
+        return self.params[0]
+
+    @RA_d.setter
+    def RA_d(self, value):
+        self.params[0] = value
+
+
+    @property
+    def dec_d(self):
+        return self.params[1]
+
+    @dec_d.setter
+    def dec_d(self, value):
+        self.params[1] = value
+
+
+    @property
+    def pos_angle_ref(self):
+        return self.params[2]
+
+    @pos_angle_ref.setter
+    def pos_angle_ref(self, value):
+        self.params[2] = value
+
+
+    @property
+    def F_scale(self):
+        return self.params[3]
+
+    @F_scale.setter
+    def F_scale(self, value):
+        self.params[3] = value
+
+
+
 class Platepar(object):
     def __init__(self, distortion_type="poly3+radial"):
         """ Astrometric and photometric calibration plate parameters. Several distortion types are supported.
@@ -350,20 +418,13 @@ class Platepar(object):
                 coordinates with the given astrometrical solution.
             """
 
-            # Extract fitting parameters
-            ra_ref, dec_ref, pos_angle_ref, F_scale = params
-
             img_x, img_y, _ = img_stars.T
 
-            pp_copy = copy.deepcopy(platepar)
-
-            pp_copy.RA_d = ra_ref
-            pp_copy.dec_d = dec_ref
-            pp_copy.pos_angle_ref = pos_angle_ref
-            pp_copy.F_scale = F_scale
+            # Set the fitting parameters to the scratch platepar view
+            platepar.setParams(params)
 
             # Get image coordinates of catalog stars
-            catalog_x, catalog_y, catalog_mag = getCatalogStarsImagePositions(catalog_stars, jd, pp_copy)
+            catalog_x, catalog_y, catalog_mag = getCatalogStarsImagePositions(catalog_stars, jd, platepar)
 
             # Calculate the sum of squared distances between image stars and catalog stars
             dist_sum = np.sum((catalog_x - img_x)**2 + (catalog_y - img_y)**2)
@@ -376,20 +437,13 @@ class Platepar(object):
                 coordinates with the given astrometrical solution.
             """
 
-            # Extract fitting parameters
-            ra_ref, dec_ref, pos_angle_ref, F_scale = params
-
-            pp_copy = copy.deepcopy(platepar)
-
-            pp_copy.RA_d = ra_ref
-            pp_copy.dec_d = dec_ref
-            pp_copy.pos_angle_ref = pos_angle_ref
-            pp_copy.F_scale = F_scale
+            # Set the fitting parameters to the scratch platepar view
+            platepar.setParams(params)
 
             img_x, img_y, _ = img_stars.T
 
             # Get image coordinates of catalog stars
-            ra_array, dec_array = getPairedStarsSkyPositions(img_x, img_y, jd, pp_copy)
+            ra_array, dec_array = getPairedStarsSkyPositions(img_x, img_y, jd, platepar)
 
             ra_catalog, dec_catalog, _ = catalog_stars.T
 
@@ -410,23 +464,21 @@ class Platepar(object):
                 dimension: [str] 'x' for X polynomial fit, 'y' for Y polynomial fit
             """
 
-            # Set distortion parameters
-            pp_copy = copy.deepcopy(platepar)
-
+            # Set distortion parameters to the scratch platepar view
             if (dimension == 'x') or (dimension == 'radial'):
-                pp_copy.x_poly_rev = params
-                pp_copy.y_poly_rev = np.zeros(12)
+                platepar.x_poly_rev = params
+                platepar.y_poly_rev = np.zeros(12)
 
             else:
-                pp_copy.x_poly_rev = np.zeros(12)
-                pp_copy.y_poly_rev = params
+                platepar.x_poly_rev = np.zeros(12)
+                platepar.y_poly_rev = params
 
 
             img_x, img_y, _ = img_stars.T
 
 
             # Get image coordinates of catalog stars
-            catalog_x, catalog_y, catalog_mag = getCatalogStarsImagePositions(catalog_stars, jd, pp_copy)
+            catalog_x, catalog_y, catalog_mag = getCatalogStarsImagePositions(catalog_stars, jd, platepar)
 
 
             # Calculate the sum of squared distances between image stars and catalog stars, per every
@@ -454,19 +506,18 @@ class Platepar(object):
                 dimension: [str] 'x' for X polynomial fit, 'y' for Y polynomial fit
             """
 
-            pp_copy = copy.deepcopy(platepar)
-
+            # Set distortion parameters to the scratch platepar view
             if (dimension == 'x') or (dimension == 'radial'):
-                pp_copy.x_poly_fwd = params
+                platepar.x_poly_fwd = params
 
             else:
-                pp_copy.y_poly_fwd = params
+                platepar.y_poly_fwd = params
 
 
             img_x, img_y, _ = img_stars.T
 
             # Get image coordinates of catalog stars
-            ra_array, dec_array = getPairedStarsSkyPositions(img_x, img_y, jd, pp_copy)
+            ra_array, dec_array = getPairedStarsSkyPositions(img_x, img_y, jd, platepar)
 
             ra_catalog, dec_catalog, _ = catalog_stars.T
 
@@ -494,11 +545,11 @@ class Platepar(object):
 
         # Fit the astrometric parameters using the reverse transform for reference
         res = scipy.optimize.minimize(_calcImageResidualsAstro, p0, \
-            args=(self, jd, catalog_stars, img_stars), method='SLSQP')
+            args=(PlateparView(self), jd, catalog_stars, img_stars), method='SLSQP')
 
         # # Fit the astrometric parameters using the forward transform for reference
         #   WARNING: USING THIS MAKES THE FIT UNSTABLE
-        # res = scipy.optimize.minimize(_calcSkyResidualsAstro, p0, args=(self, jd, \
+        # res = scipy.optimize.minimize(_calcSkyResidualsAstro, p0, args=(PlateparView(self), jd, \
         #     catalog_stars, img_stars), method='Nelder-Mead')
 
         # Update fitted astrometric parameters
@@ -529,7 +580,7 @@ class Platepar(object):
 
                 # Fit distortion parameters in X direction, reverse mapping
                 res = scipy.optimize.minimize(_calcImageResidualsDistortion, self.x_poly_rev, \
-                    args=(self, jd, catalog_stars, img_stars, 'x'), method='Nelder-Mead', \
+                    args=(PlateparView(self), jd, catalog_stars, img_stars, 'x'), method='Nelder-Mead', \
                     options={'maxiter': 10000, 'adaptive': True})
 
                 # Exctact fitted X polynomial
@@ -537,7 +588,7 @@ class Platepar(object):
 
                 # Fit distortion parameters in Y direction, reverse mapping
                 res = scipy.optimize.minimize(_calcImageResidualsDistortion, self.y_poly_rev, \
-                    args=(self, jd, catalog_stars, img_stars, 'y'), method='Nelder-Mead', \
+                    args=(PlateparView(self), jd, catalog_stars, img_stars, 'y'), method='Nelder-Mead', \
                     options={'maxiter': 10000, 'adaptive': True})
 
                 # Extract fitted Y polynomial
@@ -549,7 +600,7 @@ class Platepar(object):
 
                 # Fit the radial distortion - the X polynomial is used to store the fit paramters
                 res = scipy.optimize.minimize(_calcImageResidualsDistortion, self.x_poly_rev, \
-                    args=(self, jd, catalog_stars, img_stars, 'radial'), method='Nelder-Mead', \
+                    args=(PlateparView(self), jd, catalog_stars, img_stars, 'radial'), method='Nelder-Mead', \
                     options={'maxiter': 10000, 'adaptive': True})
 
                 # IMPORTANT NOTE - the X polynomial is used to store the fit paramters
@@ -588,7 +639,7 @@ class Platepar(object):
 
                 # Fit distortion parameters in X direction, forward mapping
                 res = scipy.optimize.minimize(_calcSkyResidualsDistortion, self.x_poly_fwd, \
-                    args=(self, jd, catalog_stars, img_stars, 'x'), method='Nelder-Mead', \
+                    args=(PlateparView(self), jd, catalog_stars, img_stars, 'x'), method='Nelder-Mead', \
                     options={'maxiter': 10000, 'adaptive': True})
 
                 # Extract fitted X polynomial
@@ -597,7 +648,7 @@ class Platepar(object):
 
                 # Fit distortion parameters in Y direction, forward mapping
                 res = scipy.optimize.minimize(_calcSkyResidualsDistortion, self.y_poly_fwd, \
-                    args=(self, jd, catalog_stars, img_stars, 'y'), method='Nelder-Mead', \
+                    args=(PlateparView(self), jd, catalog_stars, img_stars, 'y'), method='Nelder-Mead', \
                     options={'maxiter': 10000, 'adaptive': True})
 
                 # IMPORTANT NOTE - the X polynomial is used to store the fit paramters
@@ -609,7 +660,7 @@ class Platepar(object):
 
                 # Fit the radial distortion - the X polynomial is used to store the fit paramters
                 res = scipy.optimize.minimize(_calcSkyResidualsDistortion, self.x_poly_fwd, \
-                    args=(self, jd, catalog_stars, img_stars, 'radial'), method='Nelder-Mead', \
+                    args=(PlateparView(self), jd, catalog_stars, img_stars, 'radial'), method='Nelder-Mead', \
                     options={'maxiter': 10000, 'adaptive': True})
 
                 # Extract fitted X polynomial
@@ -3,9 +3,24 @@
 from __future__ import print_function, division, absolute_import
 
 import os
+import copy
+import json
+
 import numpy as np
 
 
+# Star catalogs which were already read in this process, keyed by the catalog file and reading parameters.
+#   The cache is used only when it is enabled with setStarCatalogCache, e.g. when reprocessing many nights
+STAR_CATALOG_CACHE = {}
+STAR_CATALOG_CACHE_ENABLED = False
+
+# Maximum number of catalogs kept in the cache
+STAR_CATALOG_CACHE_SIZE = 4
+
+# Width of the declination bands in compiled catalogs (deg)
+COMPILED_CATALOG_BAND_WIDTH = 1.0
+
+
 def readBSC(file_path, file_name, years_from_J2000=0, lim_mag=None):
     """ Import the Bright Star Catalog in a numpy array. 
     
@@ -23,57 +38,38 @@ def readBSC(file_path, file_name, years_from_J2000=0, lim_mag=None):
         BSC_data: [ndarray] Array of (RA, dec, mag) parameters for each star in the BSC corrected for
             proper motion, coordinates are in degrees.
     """
-    # TODO: try making this faster
     bsc_path = os.path.join(file_path, file_name)
 
     # Check if the BSC file exits
     if not os.path.isfile(bsc_path):
         return False
 
-    with open(os.path.join(file_path, file_name), 'rb') as fid:
+    # Header entries, all 32-bit integers
+    header_dtype = np.dtype([('star_seq_offset', '<i4'), ('star_first', '<i4'), ('star_num', '<i4'), \
+        ('star_id_status', '<i4'), ('star_proper_motion', '<i4'), ('magnitudes', '<i4'), \
+        ('bytes_per_entry', '<i4')])
 
-        ## Define data types for reading the file
-        # 32-bit integer
-        int_32d = np.dtype('<i4')
-        # 8-bit integer
-        int_8d = np.dtype('<i2')
-        # 32-bit float
-        float_32d = np.dtype('<f4')
-        # 64-bit float
-        float_64d = np.dtype('<f8')
-        # 8-bit char
-        char_8d = np.dtype('<a2')
+    # Star entries
+    entry_dtype = np.dtype([('catalog_No', '<f4'), ('RA', '<f8'), ('dec', '<f8'), ('spectral', 'S2'), \
+        ('mag', '<i2'), ('RA_proper', '<f4'), ('dec_proper', '<f4')])
 
-        # Read the header
-        star_seq_offset = np.fromfile(fid, dtype=int_32d, count = 1)[0]
-        star_first = np.fromfile(fid, dtype=int_32d, count = 1)[0]
-        star_num = -np.fromfile(fid, dtype=int_32d, count = 1)[0]
-        star_id_status = np.fromfile(fid, dtype=int_32d, count = 1)[0]
-        star_proper_motion = np.fromfile(fid, dtype=int_32d, count = 1)[0]
-        magnitudes = np.fromfile(fid, dtype=int_32d, count = 1)[0]
-        bytes_per_entry = np.fromfile(fid, dtype=int_32d, count = 1)[0]
+    with open(bsc_path, 'rb') as fid:
 
-        # Make an array for storing the star vaues (RA, dec, mag)
-        BSC_data = np.zeros(shape=(star_num, 3), dtype=float_64d)
+        # Read the header
+        header = np.fromfile(fid, dtype=header_dtype, count=1)[0]
+        star_num = -int(header['star_num'])
 
-        # Read entries
-        for i in range(star_num):
+        # Read all entries at once
+        entries = np.fromfile(fid, dtype=entry_dtype, count=star_num)
 
-            # Read the entry for each star
-            catalog_No = np.fromfile(fid, dtype=float_32d, count=1)[0]
-            RA = np.fromfile(fid, dtype=float_64d, count=1)[0]
-            dec = np.fromfile(fid, dtype=float_64d, count=1)[0]
-            spectral = np.fromfile(fid, dtype=char_8d, count=1)[0]
-            mag = np.fromfile(fid, dtype=int_8d, count=1)[0].astype(np.float)/100
-            RA_proper = np.fromfile(fid, dtype=float_32d, count=1)[0]
-            dec_proper = np.fromfile(fid, dtype=float_32d, count=1)[0]
 
-            # print(catalog_No, RA, dec, spectral, mag, RA_proper, dec_proper)
+    # Make an array for storing the star vaues (RA, dec, mag)
+    BSC_data = np.zeros(shape=(star_num, 3), dtype=np.float64)
 
-            # Assign data to array and apply the proper motion correction
-            BSC_data[i][0] = np.degrees(RA + RA_proper*years_from_J2000)
-            BSC_data[i][1] = np.degrees(dec + dec_proper*years_from_J2000)
-            BSC_data[i][2] = mag
+    # Apply the proper motion correction
+    BSC_data[:, 0] = np.degrees(entries['RA'] + entries['RA_proper'].astype(np.float64)*years_from_J2000)
+    BSC_data[:, 1] = np.degrees(entries['dec'] + entries['dec_proper'].astype(np.float64)*years_from_J2000)
+    BSC_data[:, 2] = entries['mag'].astype(np.float64)/100
 
 
     # Filter out stars fainter than the limiting magnitude, if it was given
@@ -121,8 +117,190 @@ def loadGaiaCatalog(dir_path, file_name, lim_mag=None):
 
 
 
+def compiledCatalogName(file_name, mag_band_ratios=None):
+    """ Return the file name of the compiled catalog, without the extension. The magnitude band ratios are 
+        a part of the name for the SKY2000 catalog, as the magnitudes are precomputed for them. """
+
+    name = os.path.splitext(file_name)[0] + '_compiled'
+
+    if ('BSC' not in file_name) and ('gaia' not in file_name.lower()) and (mag_band_ratios is not None) \
+        and (len(mag_band_ratios) == 4):
+
+        name += '_B{:.2f}_V{:.2f}_R{:.2f}_I{:.2f}'.format(*mag_band_ratios)
+
+    return name
+
+
+
+def compileStarCatalog(dir_path, file_name, mag_band_ratios=None, out_dir=None):
+    """ Convert the star catalog into a binary .npy file which can be memory mapped, and a JSON file with 
+        its description. The stars in the compiled catalog are split into declination bands going from
+        +90 to -90 deg, and the stars inside every band are sorted by magnitude, so any limiting magnitude
+        can be applied by taking the beginning of every band. The magnitudes are computed for the given band
+        ratios.
+
+    Arguments:
+        dir_path: [str] Path to the directory where the catalog file is located.
+        file_name: [str] Name of the catalog file.
+
+    Keyword arguments:
+        mag_band_ratios: [list] A list of relative contributions of every photometric band (BVRI), see 
+            readStarCatalog.
+        out_dir: [str] Directory where the compiled catalog is saved. None by default, in which case it is 
+            saved next to the original catalog.
+
+    Return:
+        [str] Path to the compiled catalog .npy file, or None if the catalog could not be read.
+    """
+
+    if out_dir is None:
+        out_dir = dir_path
+
+    catalog = _readStarCatalogSource(dir_path, file_name, mag_band_ratios=mag_band_ratios)
+
+    if catalog is False:
+        return None
+
+    star_data, mag_band_string, catalog_band_ratios = catalog
+
+
+    # Sort the stars by declination band (from north to south), and by magnitude inside the bands
+    n_bands = int(np.ceil(180.0/COMPILED_CATALOG_BAND_WIDTH))
+    bands = np.clip(((90.0 - star_data[:, 1])/COMPILED_CATALOG_BAND_WIDTH).astype(np.int64), 0, n_bands - 1)
+
+    sort_indices = np.lexsort((star_data[:, 2], bands))
+    star_data = np.ascontiguousarray(star_data[sort_indices], dtype=np.float64)
+
+    # Indices of the first star in every band
+    band_offsets = np.searchsorted(bands[sort_indices], np.arange(n_bands + 1))
+
+
+    source_path = os.path.join(dir_path, file_name)
+
+    header = {
+        'source': file_name,
+        'source_mtime': os.path.getmtime(source_path),
+        'source_size': os.path.getsize(source_path),
+        'mag_band_string': mag_band_string,
+        'mag_band_ratios': list(map(float, catalog_band_ratios)),
+        'band_width': COMPILED_CATALOG_BAND_WIDTH,
+        # The BSC reader takes only stars strictly brighter than the limiting magnitude
+        'mag_limit_inclusive': 'BSC' not in file_name,
+        'band_offsets': list(map(int, band_offsets))
+        }
+
+
+    out_name = compiledCatalogName(file_name, mag_band_ratios)
+    out_path = os.path.join(out_dir, out_name)
+
+    # Write to temporary files first and rename them, so other processes never see partial files
+    np.save(out_path + '.tmp.npy', star_data)
+    with open(out_path + '.tmp.json', 'w') as f:
+        json.dump(header, f, indent=4)
+
+    os.rename(out_path + '.tmp.npy', out_path + '.npy')
+    os.rename(out_path + '.tmp.json', out_path + '.json')
+
+
+    return out_path + '.npy'
+
+
+
+def loadCompiledCatalog(dir_path, file_name, lim_mag=None, mag_band_ratios=None):
+    """ Load the star catalog compiled by compileStarCatalog, if it exists and the original catalog was not 
+        modified since it was compiled. The compiled catalog is memory mapped and only the stars brighter
+        than the limiting magnitude in every declination band are read.
+
+    Arguments:
+        dir_path: [str] Path to the directory where the original catalog file is located.
+        file_name: [str] Name of the original catalog file.
+
+    Keyword arguments:
+        lim_mag: [float] Limiting magnitude. None by default.
+        mag_band_ratios: [list] A list of relative contributions of every photometric band (BVRI), see 
+            readStarCatalog.
+
+    Return:
+        (star_data, mag_band_string, mag_band_ratios) or None if there is no valid compiled catalog. See 
+            readStarCatalog for details.
+    """
+
+    compiled_path = os.path.join(dir_path, compiledCatalogName(file_name, mag_band_ratios))
+    source_path = os.path.join(dir_path, file_name)
+
+    if not (os.path.isfile(compiled_path + '.npy') and os.path.isfile(compiled_path + '.json')):
+        return None
+
+    try:
+        with open(compiled_path + '.json') as f:
+            header = json.load(f)
+
+        # Check that the original catalog was not changed since it was compiled
+        if os.path.isfile(source_path):
+            if (header['source_mtime'] != os.path.getmtime(source_path)) \
+                or (header['source_size'] != os.path.getsize(source_path)):
+
+                return None
+
+        star_data = np.load(compiled_path + '.npy', mmap_mode='r', allow_pickle=False)
+
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+
+    band_offsets = header['band_offsets']
+
+    # Take the stars brighter than the limiting magnitude from every band
+    if lim_mag is not None:
+
+        if header.get('mag_limit_inclusive', True):
+            side = 'right'
+        else:
+            side = 'left'
+
+        band_data = []
+        for start, end in zip(band_offsets[:-1], band_offsets[1:]):
+
+            n_bright = np.searchsorted(star_data[start:end, 2], lim_mag, side=side)
+            band_data.append(star_data[start:start + n_bright])
+
+        star_data = np.concatenate(band_data)
+
+    else:
+        star_data = np.array(star_data)
+
+
+    # Sort stars by descending declination
+    star_data = star_data[star_data[:, 1].argsort()[::-1]]
+
+
+    return star_data, header['mag_band_string'], header['mag_band_ratios']
+
+
+
+def setStarCatalogCache(enabled):
+    """ Enable or disable the star catalog cache in this process. When it is enabled, the catalog is read 
+        from disk only once for the same parameters, at the cost of keeping up to STAR_CATALOG_CACHE_SIZE 
+        catalogs in memory. Disabling the cache frees the cached catalogs.
+
+    Arguments:
+        enabled: [bool] Whether readStarCatalog should cache the catalogs.
+    """
+
+    global STAR_CATALOG_CACHE_ENABLED
+
+    STAR_CATALOG_CACHE_ENABLED = enabled
+
+    if not enabled:
+        STAR_CATALOG_CACHE.clear()
+
+
+
 def readStarCatalog(dir_path, file_name, lim_mag=None, mag_band_ratios=None):
-    """ Import the star catalog into a numpy array.
+    """ Import the star catalog into a numpy array. If the cache is enabled with setStarCatalogCache, the 
+        catalog is read from disk only once per process for the same parameters, and later calls get a copy 
+        of the cached catalog, unless the catalog file was modified in the meantime. If the catalog was 
+        compiled with compileStarCatalog, the compiled catalog is used, which is much faster to load.
     
     Arguments:
         dir_path: [str] Path to the directory where the catalog file is located.
@@ -142,6 +320,71 @@ def readStarCatalog(dir_path, file_name, lim_mag=None, mag_band_ratios=None):
             mag_band_ratios: [list] A list of BVRI magnitude band ratios for the given catalog.
     """
 
+    if not STAR_CATALOG_CACHE_ENABLED:
+        return _readStarCatalog(dir_path, file_name, lim_mag=lim_mag, mag_band_ratios=mag_band_ratios)
+
+
+    file_path = os.path.join(dir_path, file_name)
+
+    if mag_band_ratios is not None:
+        mag_band_ratios_key = tuple(mag_band_ratios)
+    else:
+        mag_band_ratios_key = None
+
+    cache_key = (os.path.abspath(file_path), lim_mag, mag_band_ratios_key)
+
+    # Check that the catalog file was not changed since it was cached
+    try:
+        file_mtime = os.path.getmtime(file_path)
+    except OSError:
+        file_mtime = None
+
+
+    if cache_key in STAR_CATALOG_CACHE:
+
+        cached_mtime, catalog = STAR_CATALOG_CACHE[cache_key]
+
+        if cached_mtime == file_mtime:
+
+            # Return a copy, so the cached catalog cannot be modified by the caller
+            return copy.deepcopy(catalog)
+
+
+    catalog = _readStarCatalog(dir_path, file_name, lim_mag=lim_mag, mag_band_ratios=mag_band_ratios)
+
+    # Don't cache failed reads
+    if catalog is False:
+        return catalog
+
+
+    # Keep the cache small, as some catalogs are large
+    if len(STAR_CATALOG_CACHE) >= STAR_CATALOG_CACHE_SIZE:
+        STAR_CATALOG_CACHE.clear()
+
+    # Keep the catalog which was read in the cache and return a copy of it
+    STAR_CATALOG_CACHE[cache_key] = (file_mtime, catalog)
+
+    return copy.deepcopy(catalog)
+
+
+
+def _readStarCatalog(dir_path, file_name, lim_mag=None, mag_band_ratios=None):
+    """ Read the star catalog from disk. See readStarCatalog for the description of arguments. """
+
+    # Use the compiled catalog if it is available
+    compiled_catalog = loadCompiledCatalog(dir_path, file_name, lim_mag=lim_mag, \
+        mag_band_ratios=mag_band_ratios)
+
+    if compiled_catalog is not None:
+        return compiled_catalog
+
+    return _readStarCatalogSource(dir_path, file_name, lim_mag=lim_mag, mag_band_ratios=mag_band_ratios)
+
+
+
+def _readStarCatalogSource(dir_path, file_name, lim_mag=None, mag_band_ratios=None):
+    """ Read the original star catalog file. See readStarCatalog for the description of arguments. """
+
     # Use the BSC star catalog if BSC is given
     if 'BSC' in file_name:
         return readBSC(dir_path, file_name, lim_mag=lim_mag), 'BSC5 V band', [0.0, 1.0, 0.0, 0.0]
@@ -242,11 +485,30 @@ def readStarCatalog(dir_path, file_name, lim_mag=None, mag_band_ratios=None):
 
 if __name__ == "__main__":
 
+    import argparse
+
     import RMS.ConfigReader as cr
 
+    arg_parser = argparse.ArgumentParser(description="Read the star catalog given in the config file, or " \
+        "compile it into a binary file which is faster to load.")
+
+    arg_parser.add_argument('--compile', action="store_true", \
+        help="Compile the star catalog for the magnitude band ratios given in the config file.")
+
+    cml_args = arg_parser.parse_args()
+
     # Load the configuration file
     config = cr.parse(".config")
 
-    # Test open the file
-    print(readStarCatalog(config.star_catalog_path, config.star_catalog_file, \
-        mag_band_ratios=config.star_catalog_band_ratios))
\ No newline at end of file
+    if cml_args.compile:
+
+        compiled_path = compileStarCatalog(config.star_catalog_path, config.star_catalog_file, \
+            mag_band_ratios=config.star_catalog_band_ratios)
+
+        print('Compiled catalog:', compiled_path)
+
+    else:
+
+        # Test open the file
+        print(readStarCatalog(config.star_catalog_path, config.star_catalog_file, \
+            mag_band_ratios=config.star_catalog_band_ratios))
\ No newline at end of file
@@ -14,6 +14,14 @@ from RMS.Misc import randomCharacters, isListKeyInDict, listToTupleRecursive
 
 from errno import EPIPE
 
+# Python 3
+try:
+    import queue
+
+# Python 2
+except ImportError:
+    import Queue as queue
+
 # Python 3
 try:
     broken_pipe_exception = BrokenPipeError
@@ -57,6 +65,19 @@ class SafeValue(object):
                     self.val.value = self.minval
 
 
+    def incrementBelow(self, limit):
+        """ Increment the value only if it is below the given limit. Returns True if the value was 
+            incremented, False otherwise.
+        """
+
+        with self.lock:
+            if self.val.value < limit:
+                self.val.value += 1
+                return True
+
+            return False
+
+
     def set(self, n):
         with self.lock:
             self.val.value = n
@@ -68,6 +89,26 @@ class SafeValue(object):
 
 
 
+class IdleWorkers(object):
+    def __init__(self, cores, busy_workers):
+        """ Number of idle workers, derived from the current number of cores and the number of workers which 
+            are processing a job. It is not tracked as a separate counter, so it stays correct when the 
+            number of cores is changed while the workers are busy.
+
+        Arguments:
+            cores: [SafeValue] Number of cores used by the pool.
+            busy_workers: [SafeValue] Number of workers processing a job.
+        """
+
+        self.cores = cores
+        self.busy_workers = busy_workers
+
+
+    def value(self):
+        return max(self.cores.value() - self.busy_workers.value(), 0)
+
+
+
 class BackupContainer(object):
     def __init__(self, inputs, outputs):
         """ Container for storing the inputs and outputs of a certain worker function. This container is 
@@ -83,13 +124,18 @@ class BackupContainer(object):
 
 class QueuedPool(object):
     def __init__(self, func, cores=None, log=None, delay_start=0, worker_timeout=2000, backup_dir='.', \
-        low_priority=False):
+        low_priority=False, max_cores=None):
         """ Provides capability of creating a pool of workers which will process jobs in a given queue, and 
         the input queue can be updated in another thread. 
 
         The workers will process the queue until the pool is deliberately closed. All results are stored in an 
         output queue. It is also possible to change the number of workers in a pool during runtime.
 
+        If max_cores is given, the pool is started with max_cores worker processes, but only the number of
+        them given by cores will process jobs at any given time, while the rest are parked. This way the
+        number of used cores can be changed live (see updateCoreNumber and adaptCoreNumber) without
+        restarting the pool.
+
         The default worker timeout time is 1000 seconds.
 
         Arguments:
@@ -105,6 +151,9 @@ class QueuedPool(object):
             backup_dir: [str] Path to the directory where result backups will be held.
             low_priority: [bool] If True, the child processess will run with a lower priority, i.e. larger
                 'niceness' (available only on Unix).
+            max_cores: [int] Maximum number of cores the pool can be scaled to without restarting it. None by
+                default, in which case the pool will be restarted every time the number of cores is increased.
+                If negative, the total number of available cores minus the given number will be used.
         """
 
 
@@ -128,6 +177,17 @@ class QueuedPool(object):
         self.cores = SafeValue(cores, minval=1, maxval=multiprocessing.cpu_count())
         self.log = log
 
+
+        # Compute the maximum number of worker processes
+        if max_cores is not None:
+
+            if max_cores < 0:
+                max_cores = multiprocessing.cpu_count() + max_cores
+
+            max_cores = min(max(max_cores, 1), multiprocessing.cpu_count())
+
+        self.max_cores = max_cores
+
         self.start_time = time.time()
         self.delay_start = delay_start
         self.worker_timeout = worker_timeout
@@ -145,7 +205,9 @@ class QueuedPool(object):
         self.total_jobs = SafeValue(minval=0)
         self.results_counter = SafeValue(minval=0)
         self.active_workers = SafeValue(minval=0, maxval=multiprocessing.cpu_count())
-        self.available_workers = SafeValue(self.cores.value(), minval=0, maxval=multiprocessing.cpu_count())
+        self.running_workers = SafeValue(minval=0, maxval=multiprocessing.cpu_count())
+        self.busy_workers = SafeValue(minval=0, maxval=multiprocessing.cpu_count())
+        self.available_workers = IdleWorkers(self.cores, self.busy_workers)
         self.kill_workers = multiprocessing.Event()
 
 
@@ -270,11 +332,30 @@ class QueuedPool(object):
 
         while True:
 
-            # Get the function arguments (block until available, handle possible errors)
+            # Exit if exit is requested
+            if self.kill_workers.is_set():
+                self.printAndLog('Worker killed!')
+                break
+
+
+            # Park the worker if the number of running workers has reached the current number of cores
+            if not self.running_workers.incrementBelow(self.cores.value()):
+                time.sleep(0.5)
+                continue
+
+
+            # Get the function arguments (block until available, handle possible errors). The timeout is 
+            #   used so that the worker can be parked if the number of cores is reduced in the meantime
             try:
-                args = self.input_queue.get(True)
+                args = self.input_queue.get(True, 1.0)
+
+            except queue.Empty:
+                self.running_workers.decrement()
+                continue
             
             except:
+                self.running_workers.decrement()
+
                 tb = traceback.format_exc()
                 self.printAndLog('Failed retrieving inputs...')
                 self.printAndLog(tb)
@@ -290,9 +371,10 @@ class QueuedPool(object):
 
             # The 'poison pill' for killing the worker when closing is requested
             if args is None:
+                self.running_workers.decrement()
                 break
 
-            self.available_workers.decrement()
+            self.busy_workers.increment()
 
             # First do a lookup in the dictionary if this set of inputs have already been processed
             read_from_backup = False
@@ -331,18 +413,14 @@ class QueuedPool(object):
             # Save the results to an output queue
             self.output_queue.put(result)
             self.results_counter.increment()
-            self.available_workers.increment()
+            self.busy_workers.decrement()
+            self.running_workers.decrement()
             time.sleep(0.1)
 
             # Back up the result to disk, if it was not already in the backup
             if not read_from_backup:
                 self.saveBackupFile(args, result)
 
-            # Exit if exit is requested
-            if self.kill_workers.is_set():
-                self.printAndLog('Worker killed!')
-                break
-
         self.active_workers.decrement()
 
 
@@ -356,14 +434,27 @@ class QueuedPool(object):
 
         self.printAndLog('Using {:d} cores'.format(self.cores.value()))
 
+        # Start all worker processes which can be used without restarting the pool
+        pool_size = self.cores.value()
+        if self.max_cores is not None:
+            pool_size = max(pool_size, self.max_cores)
+
+            self.printAndLog('Pool can be scaled up to {:d} cores'.format(pool_size))
+
         # Initialize the pool of workers with the given number of worker cores
         # Comma in the argument list is a must!
-        self.pool = multiprocessing.Pool(self.cores.value(), self._workerFunc, (self.func, ))
+        self.pool = multiprocessing.Pool(pool_size, self._workerFunc, (self.func, ))
 
 
 
-    def closePool(self):
-        """ Wait until all jobs are done and close the pool. """
+    def closePool(self, result_callback=None):
+        """ Wait until all jobs are done and close the pool. 
+
+        Keyword arguments:
+            result_callback: [function] If given, the results will be taken from the output queue as soon as
+                they are available and passed to this function one by one, instead of being kept in the
+                output queue until getResults is called. None by default.
+        """
 
         if self.pool is not None:
 
@@ -384,12 +475,17 @@ class QueuedPool(object):
                     self.printAndLog('Active worker threads:', self.active_workers.value())
                     self.printAndLog('Idle worker threads:', self.available_workers.value())
                     self.printAndLog('Total jobs:', self.total_jobs.value())
-                    self.printAndLog('Finished jobs:', self.output_queue.qsize())
+                    self.printAndLog('Finished jobs:', self.results_counter.value())
 
 
-                # Keep track of the changes of the output queue size
-                if self.output_queue.qsize() != prev_output_qsize:
-                    prev_output_qsize = self.output_queue.qsize()
+                # Pass the finished results to the callback function
+                if result_callback is not None:
+                    self._passResults(result_callback)
+
+
+                # Keep track of the changes of the number of finished jobs
+                if self.results_counter.value() != prev_output_qsize:
+                    prev_output_qsize = self.results_counter.value()
                     output_qsize_last_change = time.time()
 
 
@@ -444,7 +540,7 @@ class QueuedPool(object):
 
                 
                 # If all jobs are done, close the pool
-                if self.output_queue.qsize() >= self.total_jobs.value():
+                if self.results_counter.value() >= self.total_jobs.value():
 
                     self.printAndLog('Inserting poison pills...')
 
@@ -488,15 +584,48 @@ class QueuedPool(object):
                     time.sleep(0.1)
 
 
+            # Pass the remaining results to the callback function
+            if result_callback is not None:
+                self._passResults(result_callback)
+
+
+
+    def _passResults(self, result_callback):
+        """ Take all results which are currently in the output queue and pass them to the given function. """
+
+        for result in self.getResults():
+            result_callback(result)
+
+
 
     def updateCoreNumber(self, cores=None):
-        """ Update the number of cores/workers used by the pool.
+        """ Update the number of cores/workers used by the pool. If the pool was started with enough worker 
+            processes (see max_cores), the number of cores is changed live, otherwise the pool is restarted.
 
         Arguments:
             cores: [int] Number of CPU cores to use. None by default.
 
         """
 
+        # If cores were not given, use all available cores
+        if cores is None:
+            cores = multiprocessing.cpu_count()
+
+        cores = min(max(cores, 1), multiprocessing.cpu_count())
+
+
+        # Change the number of cores without restarting the pool, if there are enough worker processes
+        if (self.pool is not None) and (self.max_cores is not None) and (cores <= self.max_cores):
+
+            self.printAndLog('Setting new number of cores to:', cores)
+
+            # The number of idle workers follows from the new number of cores, the busy workers finish their
+            #   jobs before they are parked
+            self.cores.set(cores)
+
+            return None
+
+
         # Kill the workers
         self.kill_workers.set()
 
@@ -520,12 +649,10 @@ class QueuedPool(object):
 
         self.kill_workers.clear()
 
-        # If cores were not given, use all available cores
-        if cores is None:
-            cores = multiprocessing.cpu_count()
-
         self.printAndLog('Setting new number of cores to:', cores)
         self.cores.set(cores)
+        self.busy_workers.set(0)
+        self.running_workers.set(0)
 
         # Init a new pool
         self.printAndLog('Starting new pool...')
@@ -533,6 +660,80 @@ class QueuedPool(object):
 
 
 
+    def adaptCoreNumber(self, cores_min=1, cores_max=None, compression_load=None, compression_load_max=0.6):
+        """ Grow or shrink the number of used cores by one, depending on the system load, the load of the
+            compression and the number of jobs waiting in the queue. The change is done live if the pool was
+            initialized with max_cores.
+
+        Keyword arguments:
+            cores_min: [int] Minimum number of cores to use. 1 by default.
+            cores_max: [int] Maximum number of cores to use. None by default, in which case max_cores will be
+                used, or the number of available cores if max_cores was not given.
+            compression_load: [float] Ratio of the time it took to compress the last block of frames and the
+                duration of the block. None by default, in which case it is not taken into account.
+            compression_load_max: [float] If the compression load is above this value, the number of cores
+                will be reduced to leave enough resources for capture and compression. 0.6 by default.
+
+        Return:
+            cores: [int] The new number of used cores.
+        """
+
+        if cores_max is None:
+            if self.max_cores is not None:
+                cores_max = self.max_cores
+            else:
+                cores_max = multiprocessing.cpu_count()
+
+        cores_max = max(cores_max, cores_min)
+
+        cores = self.cores.value()
+
+        # Get the number of jobs waiting to be processed
+        try:
+            backlog = self.input_queue.qsize()
+        except:
+            backlog = 0
+
+        # Compute the number of idle cores from the 1 minute system load (available only on Unix)
+        try:
+            idle_cores = multiprocessing.cpu_count() - os.getloadavg()[0]
+        except (AttributeError, OSError):
+            idle_cores = None
+
+
+        cores_new = cores
+
+        # Back off if the compression is in danger of not keeping up with the capture
+        if (compression_load is not None) and (compression_load > compression_load_max):
+            cores_new = cores - 1
+
+        # Use one more core if jobs are piling up and there is an idle core
+        elif backlog > cores:
+            if (idle_cores is None) or (idle_cores >= 1.0):
+                cores_new = cores + 1
+
+        # Release one core if there is nothing to do
+        elif backlog == 0:
+            cores_new = cores - 1
+
+
+        cores_new = min(max(cores_new, cores_min), cores_max)
+
+        if cores_new != cores:
+
+            load_str = "None" if idle_cores is None else "{:.2f}".format(multiprocessing.cpu_count() \
+                - idle_cores)
+            comp_str = "None" if compression_load is None else "{:.2f}".format(compression_load)
+
+            self.printAndLog('Adapting the number of cores from {:d} to {:d} (backlog = {:d}, system load = '\
+                '{:s}, compression load = {:s})'.format(cores, cores_new, backlog, load_str, comp_str))
+
+            self.updateCoreNumber(cores=cores_new)
+
+        return self.cores.value()
+
+
+
     def addJob(self, job, wait_time=0.1, repeated=False):
         """ Add a job to the input queue. Job can be a list of arguments for the worker function. If a list is
             not given, the arguments will be wrapped in the list.
@@ -580,7 +781,7 @@ class QueuedPool(object):
         """ If all jobs are done, return True.
         """
 
-        if self.output_queue.qsize() == self.total_jobs.value():
+        if self.results_counter.value() == self.total_jobs.value():
             return True
 
         else:
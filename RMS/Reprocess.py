@@ -6,21 +6,38 @@ from __future__ import print_function, division, absolute_import
 
 import os
 import sys
+import glob
+import time
+import datetime
 import traceback
 import argparse
 import logging
+import threading
 
-from RMS.ArchiveDetections import archiveDetections, archiveFieldsums
+try:
+    # Python 2
+    import Queue
+
+except:
+    # Python 3
+    import queue as Queue
+
+from RMS.ArchiveDetections import archiveDetections, archiveFieldsums, makeArchiveImages, selectFiles
 # from RMS.Astrometry.ApplyAstrometry import applyAstrometryFTPdetectinfo
 from RMS.Astrometry.ApplyRecalibrate import recalibrateIndividualFFsAndApplyAstrometry
 from RMS.Astrometry.CheckFit import autoCheckFit
 import RMS.ConfigReader as cr
 from RMS.DownloadPlatepar import downloadNewPlatepar
-from RMS.DetectStarsAndMeteors import detectStarsAndMeteorsDirectory, saveDetections
+from RMS.DetectStarsAndMeteors import detectStarsAndMeteorsDirectory, detectStarsAndMeteorsJob, saveDetections, \
+    DetectionWriter
 from RMS.Formats.CAL import writeCAL
+from RMS.Formats.FFfile import validFFName
 from RMS.Formats.FTPdetectinfo import readFTPdetectinfo, writeFTPdetectinfo
 from RMS.Formats.Platepar import Platepar
 from RMS.Formats import CALSTARS
+from RMS.Formats import StarCatalog
+from RMS.QueuedPool import QueuedPool
+from RMS.StageGraph import StageGraph, stageDigest, saveCheckpoint, loadCheckpoint
 from RMS.UploadManager import UploadManager
 from RMS.Routines.Image import saveImage
 from Utils.CalibrationReport import generateCalibrationReport
@@ -110,8 +127,217 @@ def getPlatepar(config, night_data_dir):
 
 
 
-def processNight(night_data_dir, config, detection_results=None, nodetect=False):
+def runAutoCheckFit(night_data_dir, config, platepar, platepar_path, platepar_fmt, calstars_name):
+    """ Run the astrometry check and refinement on the CALSTARS file and save the refined platepar. 
+
+    Return:
+        platepar: [Platepar instance] The refined platepar if the fit was successful, the old one otherwise.
+    """
+
+    # Read in the CALSTARS file
+    calstars_list = CALSTARS.readCALSTARS(night_data_dir, calstars_name)
+
+    # Keep the stars matched in the last run next to the default platepar, to quickly validate it next time
+    state_path = None
+    if config.acf_incremental:
+        state_path = os.path.join(os.path.dirname(os.path.abspath(platepar_path)), config.acf_state_name)
+
+    # Run astrometry check and refinement
+    platepar, fit_status = autoCheckFit(config, platepar, calstars_list, state_path=state_path)
+
+    # If the fit was sucessful, apply the astrometry to detected meteors
+    if fit_status:
+
+        log.info('Astrometric calibration SUCCESSFUL!')
+
+        # Save the refined platepar to the night directory and as default
+        platepar.write(os.path.join(night_data_dir, config.platepar_name), fmt=platepar_fmt)
+        platepar.write(platepar_path, fmt=platepar_fmt)
+
+    else:
+        log.info('Astrometric calibration FAILED!, Using old platepar for calibration...')
+
+
+    # If a flat is used, disable vignetting correction
+    if config.use_flat:
+        platepar.vignetting_coeff = 0.0
+
+    return platepar
+
+
+
+def runRecalibration(night_data_dir, config, platepar, calstars_name, ftpdetectinfo_name):
+    """ Recalibrate astrometry on every FF file with detections and apply it to the detections. """
+
+    # Read in the CALSTARS file
+    calstars_list = CALSTARS.readCALSTARS(night_data_dir, calstars_name)
+
+    log.info("Recalibrating astrometry on FF files with detections...")
+
+    # Recalibrate astrometry on every FF file and apply the calibration to detections
+    recalibrateIndividualFFsAndApplyAstrometry(night_data_dir, os.path.join(night_data_dir, \
+        ftpdetectinfo_name), calstars_list, config, platepar)
+
+
+
+def runUFOOrbitConversion(night_data_dir, ftpdetectinfo_name, platepar_path):
+    """ Convert the FTPdetectinfo into UFOOrbit input file. """
+
+    log.info("Converting RMS format to UFOOrbit format...")
+
+    FTPdetectinfo2UFOOrbitInput(night_data_dir, ftpdetectinfo_name, platepar_path)
+
+
+
+def runCalibrationReport(night_data_dir, config, platepar):
+    """ Generate a calibration report. """
+
+    log.info("Generating a calibration report...")
+    try:
+        generateCalibrationReport(config, night_data_dir, platepar=platepar)
+
+    except Exception as e:
+        log.debug('Generating calibration report failed with the message:\n' + repr(e))
+        log.debug(repr(traceback.format_exception(*sys.exc_info())))
+
+
+
+def runShowerAssociation(night_data_dir, config, ftpdetectinfo_name):
+    """ Perform single station shower association. """
+
+    log.info("Performing single station shower association...")
+    try:
+        showerAssociation(config, [os.path.join(night_data_dir, ftpdetectinfo_name)], \
+            save_plot=True, plot_activity=True)
+
+    except Exception as e:
+        log.debug('Shower association failed with the message:\n' + repr(e))
+        log.debug(repr(traceback.format_exception(*sys.exc_info())))
+
+
+
+def runPlotFieldsums(night_data_dir, config):
+    """ Plot field sums. """
+
+    log.info('Plotting field sums...')
+
+    try:
+        plotFieldsums(night_data_dir, config)
+
+    except Exception as e:
+        log.debug('Plotting field sums failed with message:\n' + repr(e))
+        log.debug(repr(traceback.format_exception(*sys.exc_info())))
+
+
+
+def runMakeFlat(night_data_dir, config):
+    """ Make a new flat field image and save it to the night directory. 
+
+    Return:
+        flat_path: [str] Path to the saved flat, None if making the flat failed.
+    """
+
+    log.info('Making a flat...')
+
+    # Make a new flat field image
+    try:
+        flat_img = makeFlat(night_data_dir, config)
+
+    except Exception as e:
+        log.debug('Making a flat failed with message:\n' + repr(e))
+        log.debug(repr(traceback.format_exception(*sys.exc_info())))
+        flat_img = None
+        
+
+    # If making flat was sucessfull, save it
+    if flat_img is not None:
+
+        # Save the flat in the night directory, to keep the operational flat updated
+        flat_path = os.path.join(night_data_dir, os.path.basename(config.flat_file))
+        saveImage(flat_path, flat_img)
+        log.info('Flat saved to: ' + flat_path)
+
+        return flat_path
+
+    else:
+        log.info('Making flat image FAILED!')
+
+        return None
+
+
+
+def runArchiveImages(night_data_dir, config, ff_detected):
+    """ Generate the thumbnails and the stack of detections which will be archived. """
+
+    makeArchiveImages(night_data_dir, selectFiles(night_data_dir, ff_detected), config)
+
+
+
+def runCAMSConversion(night_data_dir, config, platepar, ftpdetectinfo_name):
+    """ Make a CAL file and a special CAMS FTPdetectinfo if full CAMS compatibility is desired. """
+
+    log.info('Generating a CAMS FTPdetectinfo file...')
+
+    # Write the CAL file to disk
+    cal_file_name = writeCAL(night_data_dir, config, platepar)
+
+    # Check if the CAL file was successfully generated
+    if cal_file_name is not None:
+
+        cams_code_formatted = "{:06d}".format(int(config.cams_code))
+
+        # Load the FTPdetectinfo
+        _, fps, meteor_list = readFTPdetectinfo(night_data_dir, ftpdetectinfo_name, \
+            ret_input_format=True)
+
+        # Replace the camera code with the CAMS code
+        for met in meteor_list:
+
+            # Replace the station name and the FF file format
+            ff_name = met[0]
+            ff_name = ff_name.replace('.fits', '.bin')
+            ff_name = ff_name.replace(config.stationID, cams_code_formatted)
+            met[0] = ff_name
+
+
+        # Write the CAMS compatible FTPdetectinfo file
+        writeFTPdetectinfo(meteor_list, night_data_dir, \
+            ftpdetectinfo_name.replace(config.stationID, cams_code_formatted),\
+            night_data_dir, cams_code_formatted, fps, calibration=cal_file_name, \
+            celestial_coords_given=(platepar is not None))
+
+
+
+
+def detectionDigest(night_data_dir, config):
+    """ Compute the digest of the detection inputs of the given night, used to check if the detection was 
+        already done (see StageGraph checkpoints).
+
+    Arguments:
+        night_data_dir: [str] Path to the directory with FF files.
+        config: [Config obj]
+
+    Return:
+        [str] Digest of the detection inputs.
+    """
+
+    ff_list = sorted([file_name for file_name in os.listdir(night_data_dir) if validFFName(file_name)])
+
+    return stageDigest(['detection', [config, ff_list]], [])
+
+
+
+def processNight(night_data_dir, config, detection_results=None, nodetect=False, checkpoints=True, \
+    detection_output=None):
     """ Given the directory with FF files, run detection and archiving. 
+
+    After the detection, the post-processing stages are run as a dependency graph (see StageGraph), so
+    stages which do not depend on each other (e.g. astrometry, flat making, field sum plotting and thumbnail
+    generation) can run in parallel, depending on config.postprocessing_cores.
+
+    If checkpoints are used, a completion marker with the digest of the inputs is saved in the night 
+    directory after the detection and every post-processing stage. If the processing is interrupted and run
+    again, the finished stages whose inputs have not changed are not repeated.
     
     Arguments:
         night_data_dir: [str] Path to the directory with FF files.
@@ -121,6 +347,9 @@ def processNight(night_data_dir, config, detection_results=None, nodetect=False)
         detection_results: [list] An optional list of detection. If None (default), detection will be done
             on the the files in the folder.
         nodetect: [bool] True if detection should be skipped. False by default.
+        checkpoints: [bool] Skip the stages which were already done with the same inputs. True by default.
+        detection_output: [tuple] (calstars_name, ftpdetectinfo_name, ff_detected) of the detection which 
+            was already done and saved, e.g. by processNights. None by default.
 
     Return:
         night_archive_dir: [str] Path to the night directory in ArchivedFiles.
@@ -136,12 +365,44 @@ def processNight(night_data_dir, config, detection_results=None, nodetect=False)
     night_data_dir_name = os.path.basename(os.path.abspath(night_data_dir))
 
     platepar = None
+
+    # Keep the markers of finished stages in the night directory
+    checkpoint_dir = None
+    if checkpoints:
+        checkpoint_dir = night_data_dir
+
+
+    # Init the graph of post-processing stages
+    stages = StageGraph(cores=config.postprocessing_cores, checkpoint_dir=checkpoint_dir)
     
     # If the detection should be run
     if (not nodetect):
 
+        # Check if the detection was already done on the same FF files
+        detection_done = False
+        if detection_output is not None:
+            detection_done = True
+
+        elif checkpoint_dir is not None:
+
+            detection_digest = detectionDigest(night_data_dir, config)
+
+            detection_done, detection_output = loadCheckpoint(checkpoint_dir, 'detection', detection_digest)
+
+
+        if detection_done:
+
+            log.info('Detection was already done on these files, skipping...')
+
+            calstars_name, ftpdetectinfo_name, ff_detected = detection_output
+            detector = None
+
+            # Remove the detection backups which are not needed anymore
+            for bkup_file in glob.glob(os.path.join(night_data_dir, 'rms_queue_bkup_*.pickle')):
+                os.remove(bkup_file)
+
         # If no detection was performed, run it
-        if detection_results is None:
+        elif detection_results is None:
 
             # Run detection on the given directory
             calstars_name, ftpdetectinfo_name, ff_detected, \
@@ -158,6 +419,12 @@ def processNight(night_data_dir, config, detection_results=None, nodetect=False)
             detector = None
 
 
+        # Mark that the detection is done
+        if (checkpoint_dir is not None) and (not detection_done) and (calstars_name is not None):
+            saveCheckpoint(checkpoint_dir, 'detection', detection_digest, [calstars_name, ftpdetectinfo_name, \
+                ff_detected])
+
+
         # Get the platepar file
         platepar, platepar_path, platepar_fmt = getPlatepar(config, night_data_dir)
 
@@ -165,121 +432,83 @@ def processNight(night_data_dir, config, detection_results=None, nodetect=False)
         # Run calibration check and auto astrometry refinement
         if (platepar is not None) and (calstars_name is not None):
 
-            # Read in the CALSTARS file
-            calstars_list = CALSTARS.readCALSTARS(night_data_dir, calstars_name)
-
-            # Run astrometry check and refinement
-            platepar, fit_status = autoCheckFit(config, platepar, calstars_list)
-
-            # If the fit was sucessful, apply the astrometry to detected meteors
-            if fit_status:
-
-                log.info('Astrometric calibration SUCCESSFUL!')
-
-                # Save the refined platepar to the night directory and as default
-                platepar.write(os.path.join(night_data_dir, config.platepar_name), fmt=platepar_fmt)
-                platepar.write(platepar_path, fmt=platepar_fmt)
-
-            else:
-                log.info('Astrometric calibration FAILED!, Using old platepar for calibration...')
-
-
-            # # Calculate astrometry for meteor detections
-            # applyAstrometryFTPdetectinfo(night_data_dir, ftpdetectinfo_name, platepar_path)
-
-            # If a flat is used, disable vignetting correction
-            if config.use_flat:
-                platepar.vignetting_coeff = 0.0
+            calstars_path = os.path.join(night_data_dir, calstars_name)
+            ftpdetectinfo_path = os.path.join(night_data_dir, ftpdetectinfo_name)
 
-            log.info("Recalibrating astrometry on FF files with detections...")
+            # Run astrometry check and refinement. The platepar is overwritten by the stage, so it is 
+            #   checked as an input file and not as an argument
+            stages.addStage('autoCheckFit', runAutoCheckFit, args=[night_data_dir, config, platepar, \
+                platepar_path, platepar_fmt, calstars_name], inputs=[calstars_path, platepar_path], \
+                digest_values=[config, calstars_name])
 
             # Recalibrate astrometry on every FF file and apply the calibration to detections
-            recalibrateIndividualFFsAndApplyAstrometry(night_data_dir, os.path.join(night_data_dir, \
-                ftpdetectinfo_name), calstars_list, config, platepar)
-
-            
-
-            log.info("Converting RMS format to UFOOrbit format...")
+            stages.addStage('recalibrate', runRecalibration, args=[night_data_dir, config, \
+                stages.result('autoCheckFit'), calstars_name, ftpdetectinfo_name], \
+                inputs=[calstars_path, ftpdetectinfo_path])
 
             # Convert the FTPdetectinfo into UFOOrbit input file
-            FTPdetectinfo2UFOOrbitInput(night_data_dir, ftpdetectinfo_name, platepar_path)
-
-
+            stages.addStage('UFOOrbit', runUFOOrbitConversion, args=[night_data_dir, ftpdetectinfo_name, \
+                platepar_path], depends=['recalibrate'], inputs=[ftpdetectinfo_path, platepar_path])
 
             # Generate a calibration report
-            log.info("Generating a calibration report...")
-            try:
-                generateCalibrationReport(config, night_data_dir, platepar=platepar)
-
-            except Exception as e:
-                log.debug('Generating calibration report failed with the message:\n' + repr(e))
-                log.debug(repr(traceback.format_exception(*sys.exc_info())))
-
+            stages.addStage('calibrationReport', runCalibrationReport, args=[night_data_dir, config, \
+                stages.result('autoCheckFit')], depends=['recalibrate'], \
+                inputs=[os.path.join(night_data_dir, config.platepars_recalibrated_name), \
+                os.path.join(night_data_dir, config.matched_stars_name)])
 
             # Perform single station shower association
-            log.info("Performing single station shower association...")
-            try:
-                showerAssociation(config, [os.path.join(night_data_dir, ftpdetectinfo_name)], \
-                    save_plot=True, plot_activity=True)
+            stages.addStage('showerAssociation', runShowerAssociation, args=[night_data_dir, config, \
+                ftpdetectinfo_name], depends=['recalibrate'], inputs=[ftpdetectinfo_path])
 
-            except Exception as e:
-                log.debug('Shower association failed with the message:\n' + repr(e))
-                log.debug(repr(traceback.format_exception(*sys.exc_info())))
+            # Make a CAL file and a special CAMS FTPdetectinfo if full CAMS compatibility is desired
+            if config.cams_code > 0:
+                stages.addStage('CAMS', runCAMSConversion, args=[night_data_dir, config, \
+                    stages.result('autoCheckFit'), ftpdetectinfo_name], depends=['recalibrate'], \
+                    inputs=[ftpdetectinfo_path])
 
 
     else:
         ff_detected = []
         detector = None
+        calstars_name = None
 
 
+    # Plot field sums and archive all fieldsums to one archive
+    stages.addStage('plotFieldsums', runPlotFieldsums, args=[night_data_dir, config])
+    stages.addStage('archiveFieldsums', archiveFieldsums, args=[night_data_dir], depends=['plotFieldsums'])
 
-    log.info('Plotting field sums...')
+    # Make a new flat field image
+    flat_inputs = []
+    if calstars_name is not None:
+        flat_inputs.append(os.path.join(night_data_dir, calstars_name))
 
-    # Plot field sums
-    try:
-        plotFieldsums(night_data_dir, config)
+    stages.addStage('makeFlat', runMakeFlat, args=[night_data_dir, config], inputs=flat_inputs)
 
-    except Exception as e:
-        log.debug('Plotting field sums failed with message:\n' + repr(e))
-        log.debug(repr(traceback.format_exception(*sys.exc_info())))
+    # Generate thumbnails and the stack of detections (the stacking reads the flat from the night directory,
+    #   so it has to wait for the new flat to be saved)
+    stages.addStage('archiveImages', runArchiveImages, args=[night_data_dir, config, ff_detected], \
+        depends=['makeFlat'])
 
 
+    # Run all post-processing stages
+    stages.run()
 
-    # Archive all fieldsums to one archive
-    archiveFieldsums(night_data_dir)
+
+    # Get the refined platepar
+    if 'autoCheckFit' in stages.stage_dict:
+        if stages.stage_dict['autoCheckFit'].result is not None:
+            platepar = stages.stage_dict['autoCheckFit'].result
 
 
     # List for any extra files which will be copied to the night archive directory. Full paths have to be 
     #   given
     extra_files = []
 
-
-    log.info('Making a flat...')
-
-    # Make a new flat field image
-    try:
-        flat_img = makeFlat(night_data_dir, config)
-
-    except Exception as e:
-        log.debug('Making a flat failed with message:\n' + repr(e))
-        log.debug(repr(traceback.format_exception(*sys.exc_info())))
-        flat_img = None
-        
-
-    # If making flat was sucessfull, save it
-    if flat_img is not None:
-
-        # Save the flat in the night directory, to keep the operational flat updated
-        flat_path = os.path.join(night_data_dir, os.path.basename(config.flat_file))
-        saveImage(flat_path, flat_img)
-        log.info('Flat saved to: ' + flat_path)
-
-        # Copy the flat to the night's directory as well
+    # Copy the flat to the night's directory as well
+    flat_path = stages.stage_dict['makeFlat'].result
+    if flat_path is not None:
         extra_files.append(flat_path)
 
-    else:
-        log.info('Making flat image FAILED!')
-
 
     ### Add extra files to archive
 
@@ -305,62 +534,250 @@ def processNight(night_data_dir, config, detection_results=None, nodetect=False)
         if os.path.exists(recalibrated_platepars_path):
             extra_files.append(recalibrated_platepars_path)
 
+        # Add the stars matched during recalibration, so the calibration report can be made from the archive
+        matched_stars_path = os.path.join(night_data_dir, config.matched_stars_name)
+        if os.path.exists(matched_stars_path):
+            extra_files.append(matched_stars_path)
+
     ### ###
 
 
 
-    # If the detection should be run
-    if (not nodetect):
+    night_archive_dir = os.path.join(os.path.abspath(config.data_dir), config.archived_dir, 
+        night_data_dir_name)
 
-        # Make a CAL file and a special CAMS FTPdetectinfo if full CAMS compatibility is desired
-        if (config.cams_code > 0) and (platepar is not None):
 
-            log.info('Generating a CAMS FTPdetectinfo file...')
+    log.info('Archiving detections to ' + night_archive_dir)
+    
+    # Archive the detections (the images were already made in the post-processing stages)
+    archive_name = archiveDetections(night_data_dir, night_archive_dir, ff_detected, config, \
+        extra_files=extra_files, make_images=False)
 
-            # Write the CAL file to disk
-            cal_file_name = writeCAL(night_data_dir, config, platepar)
 
-            # Check if the CAL file was successfully generated
-            if cal_file_name is not None:
+    return night_archive_dir, archive_name, detector
 
-                cams_code_formatted = "{:06d}".format(int(config.cams_code))
 
-                # Load the FTPdetectinfo
-                _, fps, meteor_list = readFTPdetectinfo(night_data_dir, ftpdetectinfo_name, \
-                    ret_input_format=True)
 
-                # Replace the camera code with the CAMS code
-                for met in meteor_list:
 
-                    # Replace the station name and the FF file format
-                    ff_name = met[0]
-                    ff_name = ff_name.replace('.fits', '.bin')
-                    ff_name = ff_name.replace(config.stationID, cams_code_formatted)
-                    met[0] = ff_name
 
+def processNights(night_dirs, config, checkpoints=True, progress_period=30):
+    """ Reprocess many night directories in one go. The FF files from all nights are detected in a single 
+        long-lived pool of workers, and every night is post-processed and archived as soon as all its files 
+        are detected, while the detection of the other nights continues in the background. The progress, the 
+        throughput and the estimated time to finish the detection are periodically reported.
 
-                # Write the CAMS compatible FTPdetectinfo file
-                writeFTPdetectinfo(meteor_list, night_data_dir, \
-                    ftpdetectinfo_name.replace(config.stationID, cams_code_formatted),\
-                    night_data_dir, cams_code_formatted, fps, calibration=cal_file_name, \
-                    celestial_coords_given=(platepar is not None))
+    Arguments:
+        night_dirs: [list] A list of paths to night directories with FF files.
+        config: [Config obj]
 
+    Keyword arguments:
+        checkpoints: [bool] Skip the stages which were already done with the same inputs. True by default.
+        progress_period: [float] Period in seconds of progress reports. 30 by default.
 
+    Return:
+        archive_names: [list] Paths to the archives of all processed nights.
+    """
 
-    night_archive_dir = os.path.join(os.path.abspath(config.data_dir), config.archived_dir, 
-        night_data_dir_name)
+    night_dirs = [os.path.abspath(night_dir) for night_dir in night_dirs]
 
+    # Cache the star catalog only while the nights are processed, and load it once, so the post-processing 
+    #   of every night reuses it
+    StarCatalog.setStarCatalogCache(True)
 
-    log.info('Archiving detections to ' + night_archive_dir)
-    
-    # Archive the detections
-    archive_name = archiveDetections(night_data_dir, night_archive_dir, ff_detected, config, \
-        extra_files=extra_files)
+    try:
+        return _processNights(night_dirs, config, checkpoints, progress_period)
 
+    finally:
+        StarCatalog.setStarCatalogCache(False)
 
-    return night_archive_dir, archive_name, detector
 
 
+def _processNights(night_dirs, config, checkpoints, progress_period):
+    """ Reprocess many night directories with the star catalog cache enabled. See processNights for the 
+        description of arguments.
+    """
+
+    try:
+        StarCatalog.readStarCatalog(config.star_catalog_path, config.star_catalog_file, \
+            lim_mag=config.catalog_mag_limit, mag_band_ratios=config.star_catalog_band_ratios)
+
+    except Exception as e:
+        log.warning('The star catalog could not be loaded: ' + repr(e))
+
+
+    # Find the nights which need detection and the files that have to be processed
+    detection_outputs = {}
+    detection_writers = {}
+    detection_jobs = {}
+    for night_dir in night_dirs:
+
+        if checkpoints:
+            detection_done, detection_output = loadCheckpoint(night_dir, 'detection', \
+                detectionDigest(night_dir, config))
+
+            if detection_done:
+                log.info('Detection was already done in {:s}, skipping...'.format(night_dir))
+                detection_outputs[night_dir] = detection_output
+                continue
+
+
+        ff_list = [ff_name for ff_name in sorted(os.listdir(night_dir)) if validFFName(ff_name)]
+
+        if not ff_list:
+            log.info('No FF files found in {:s}!'.format(night_dir))
+            detection_outputs[night_dir] = (None, None, [])
+            continue
+
+        detection_jobs[night_dir] = ff_list
+        detection_writers[night_dir] = DetectionWriter(night_dir, config)
+
+
+    archive_names = []
+
+    def _postprocessNight(night_dir):
+        """ Save the detection checkpoint of the night and run the rest of the processing. """
+
+        log.info('Processing night {:s}...'.format(night_dir))
+
+        if checkpoints and (night_dir in detection_writers) and (detection_outputs[night_dir][0] is not None):
+            saveCheckpoint(night_dir, 'detection', detectionDigest(night_dir, config), \
+                list(detection_outputs[night_dir]))
+
+        try:
+            _, archive_name, _ = processNight(night_dir, config, checkpoints=checkpoints, \
+                detection_output=detection_outputs[night_dir])
+
+            archive_names.append(archive_name)
+
+        except:
+            log.error('Processing of {:s} failed!'.format(night_dir))
+            log.error(traceback.format_exc())
+
+
+    # Process the nights which don't need detection right away
+    for night_dir in night_dirs:
+        if night_dir in detection_outputs:
+            _postprocessNight(night_dir)
+
+
+    if not detection_jobs:
+        return archive_names
+
+
+    ### Detect all FF files in one pool ###
+
+    total_files = sum([len(ff_list) for ff_list in detection_jobs.values()])
+    log.info('Detecting {:d} FF files from {:d} nights...'.format(total_files, len(detection_jobs)))
+
+    # The backups of the detection results are kept in the parent directory of the nights
+    backup_dir = os.path.dirname(os.path.commonprefix([night_dir + os.sep for night_dir in detection_jobs]))
+
+    detector = QueuedPool(detectStarsAndMeteorsJob, cores=-1, log=log, backup_dir=backup_dir)
+    detector.startPool()
+
+    # All jobs are given to the pool right away, so the workers have work while the finished nights are 
+    #   being post-processed
+    for night_dir in night_dirs:
+        for ff_name in detection_jobs.get(night_dir, []):
+            detector.addJob([night_dir, ff_name, config], wait_time=0)
+
+
+    # The finished nights are post-processed in a separate thread, so the pool keeps collecting the results 
+    #   of the other nights in the meantime
+    postprocess_queue = Queue.Queue()
+
+    def _postprocessWorker():
+
+        while True:
+
+            night_dir = postprocess_queue.get()
+
+            # None is a signal that there are no more nights to process
+            if night_dir is None:
+                break
+
+            _postprocessNight(night_dir)
+
+
+    postprocess_thread = threading.Thread(target=_postprocessWorker)
+    postprocess_thread.daemon = True
+    postprocess_thread.start()
+
+
+    remaining_files = {night_dir: len(ff_list) for night_dir, ff_list in detection_jobs.items()}
+    detection_start = time.time()
+    last_progress = [detection_start, 0]
+
+    def _addResult(job_result):
+        """ Add the result to the writer of its night, and process the night if it was the last file. """
+
+        # The pool returns None only if the worker function itself failed, which should not happen
+        if job_result is None:
+            return
+
+        night_dir, ff_name, result = job_result
+
+        detection_writers[night_dir].addResult(result)
+        remaining_files[night_dir] -= 1
+
+
+        # Report the progress
+        done_files = total_files - sum(remaining_files.values())
+        if (time.time() - last_progress[0] > progress_period) or (done_files == total_files):
+
+            elapsed = time.time() - detection_start
+            rate = done_files/elapsed if elapsed > 0 else 0
+
+            if rate > 0:
+                eta = str(datetime.timedelta(seconds=int((total_files - done_files)/rate)))
+            else:
+                eta = 'unknown'
+
+            log.info('Detection progress: {:d}/{:d} FF files ({:.1f}%), {:.2f} files/s, ETA {:s}'.format(\
+                done_files, total_files, 100*done_files/total_files, rate, eta))
+
+            last_progress[0] = time.time()
+
+
+        # Save the detections of the night and process it if all of its files are done
+        if remaining_files[night_dir] == 0:
+
+            log.info('Detection finished in {:s}'.format(night_dir))
+
+            detection_outputs[night_dir] = detection_writers[night_dir].finish()
+            postprocess_queue.put(night_dir)
+
+
+    try:
+
+        # Process the results as they come in, and close the pool when all of them are done
+        detector.closePool(result_callback=_addResult)
+
+        # Process the nights which did not receive all results (e.g. if a worker got stuck)
+        for night_dir in night_dirs:
+            if (night_dir in remaining_files) and (remaining_files[night_dir] > 0):
+
+                log.warning('{:d} files in {:s} were not detected!'.format(remaining_files[night_dir], \
+                    night_dir))
+
+                detection_outputs[night_dir] = detection_writers[night_dir].finish()
+                postprocess_queue.put(night_dir)
+
+    finally:
+
+        # Wait for the post-processing of all nights to finish
+        postprocess_queue.put(None)
+        postprocess_thread.join()
+
+
+    detector.deleteBackupFiles()
+
+    log.info('Detection of {:d} FF files finished in {:s}'.format(total_files, \
+        str(datetime.timedelta(seconds=int(time.time() - detection_start)))))
+
+
+    return archive_names
+
 
 
 if __name__ == "__main__":
@@ -370,19 +787,34 @@ if __name__ == "__main__":
     # Init the command line arguments parser
     arg_parser = argparse.ArgumentParser(description="Reprocess the given folder, perform detection, archiving and server upload.")
 
-    arg_parser.add_argument('dir_path', nargs=1, metavar='DIR_PATH', type=str, \
-        help='Path to the folder with FF files.')
+    arg_parser.add_argument('dir_path', nargs='+', metavar='DIR_PATH', type=str, \
+        help='Path to the folder with FF files. Several folders or a glob pattern (e.g. "CapturedFiles/XX0001_2021*") can be given to reprocess many nights in one batch.')
 
     arg_parser.add_argument('-c', '--config', nargs=1, metavar='CONFIG_PATH', type=str, \
         help="Path to a config file which will be used instead of the default one.")
 
+    arg_parser.add_argument('-f', '--force', action="store_true", \
+        help="Run all processing stages, even the ones which were already done with the same inputs.")
+
     # Parse the command line arguments
     cml_args = arg_parser.parse_args()
 
     #########################
 
+    # Expand the glob patterns, if any
+    night_dirs = []
+    for dir_path in cml_args.dir_path:
+        for night_dir in sorted(glob.glob(dir_path)):
+            if os.path.isdir(night_dir) and (night_dir not in night_dirs):
+                night_dirs.append(night_dir)
+
+    if not night_dirs:
+        print('No directories to process found!')
+        sys.exit()
+
+
     # Load the config file
-    config = cr.loadConfigFromDirectory(cml_args.config, cml_args.dir_path)
+    config = cr.loadConfigFromDirectory(cml_args.config, night_dirs[0])
 
     
     ### Init the logger
@@ -395,11 +827,18 @@ if __name__ == "__main__":
     ######
 
 
-    # Process the night
-    _, archive_name, detector = processNight(cml_args.dir_path[0], config)
+    # Process a single night
+    if len(night_dirs) == 1:
+        _, archive_name, detector = processNight(night_dirs[0], config, checkpoints=(not cml_args.force))
+        archive_names = [archive_name]
+
+    # Process all nights in one batch
+    else:
+        archive_names = processNights(night_dirs, config, checkpoints=(not cml_args.force))
+        detector = None
 
 
-    # Upload the archive, if upload is enabled
+    # Upload the archives, if upload is enabled
     if config.upload_enabled:
 
         # Init the upload manager
@@ -408,9 +847,10 @@ if __name__ == "__main__":
         upload_manager = UploadManager(config)
         upload_manager.start()
 
-        # Add file for upload
-        print('Adding file to upload list: ' + archive_name)
-        upload_manager.addFiles([archive_name])
+        # Add files for upload
+        for archive_name in archive_names:
+            print('Adding file to upload list: ' + archive_name)
+            upload_manager.addFiles([archive_name])
 
         # Stop the upload manager
         if upload_manager.is_alive():
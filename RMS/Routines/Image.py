@@ -177,6 +177,27 @@ def thresholdFF(ff, k1, j1, mask=None, mask_ave_bright=False):
 
 
 
+def gammaCorrectionArray(intensity, gamma, bp=0, wp=255):
+    """ Correct the given array of intensities for gamma. Vectorized version of gammaCorrection. 
+        
+    Arguments:
+        intensity: [ndarray] Pixel intensities.
+        gamma: [float] Gamma.
+
+    Keyword arguments:
+        bp: [int] Black point.
+        wp: [int] White point.
+
+    Return:
+        [ndarray] Gamma corrected image intensities.
+    """
+
+    x = (np.maximum(intensity, 0) - bp)/(wp - bp)
+
+    return np.where(x > 0, bp + (wp - bp)*np.abs(x)**(1.0/gamma), bp)
+
+
+
 @np.vectorize
 def gammaCorrection(intensity, gamma, bp=0, wp=255):
     """ Correct the given intensity for gamma. 
@@ -0,0 +1,476 @@
+""" Run processing stages which depend on each other, with independent stages running in parallel. """
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import time
+import pickle
+import hashlib
+import logging
+import traceback
+import multiprocessing
+
+# Python 3
+try:
+    import queue
+
+# Python 2
+except ImportError:
+    import Queue as queue
+
+
+from RMS.Pickling import savePickle, loadPickle
+
+
+# Get the logger from the main module
+log = logging.getLogger("logger")
+
+
+# Prefix and extension of the files which mark that a stage was done
+CHECKPOINT_FILE_PREFIX = 'rms_stage_done_'
+CHECKPOINT_FILE_EXTENSION = '.pickle'
+
+
+
+def fileDigest(file_path):
+    """ Compute the MD5 digest of the file contents. Returns None if the file does not exist. """
+
+    if not os.path.isfile(file_path):
+        return None
+
+    md5 = hashlib.md5()
+
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            md5.update(chunk)
+
+    return md5.hexdigest()
+
+
+
+def stageDigest(values, input_files):
+    """ Compute the digest of stage inputs.
+
+    Arguments:
+        values: [list] Picklable values the stage depends on (e.g. its arguments).
+        input_files: [list] Paths to files the stage reads.
+
+    Return:
+        [str] MD5 digest of the inputs.
+    """
+
+    md5 = hashlib.md5()
+    md5.update(pickle.dumps(values, protocol=2))
+
+    for file_path in input_files:
+        md5.update(str((os.path.basename(file_path), fileDigest(file_path))).encode('utf-8'))
+
+    return md5.hexdigest()
+
+
+
+def saveCheckpoint(checkpoint_dir, name, digest, result):
+    """ Save the marker which records that the stage with the given name was done with the given inputs.
+
+    Arguments:
+        checkpoint_dir: [str] Directory where the marker files are kept.
+        name: [str] Name of the stage.
+        digest: [str] Digest of the stage inputs (see stageDigest).
+        result: [object] Picklable result of the stage.
+    """
+
+    savePickle({'digest': digest, 'result': result}, checkpoint_dir, CHECKPOINT_FILE_PREFIX + name \
+        + CHECKPOINT_FILE_EXTENSION)
+
+
+
+def loadCheckpoint(checkpoint_dir, name, digest):
+    """ Check if the stage was already done with the same inputs.
+
+    Arguments:
+        checkpoint_dir: [str] Directory where the marker files are kept.
+        name: [str] Name of the stage.
+        digest: [str] Digest of the current stage inputs (see stageDigest).
+
+    Return:
+        (status, result):
+            status: [bool] True if the stage was done with the same inputs, False otherwise.
+            result: [object] The saved result of the stage, None if it was not done.
+    """
+
+    checkpoint_file = CHECKPOINT_FILE_PREFIX + name + CHECKPOINT_FILE_EXTENSION
+
+    if not os.path.isfile(os.path.join(checkpoint_dir, checkpoint_file)):
+        return False, None
+
+    try:
+        checkpoint = loadPickle(checkpoint_dir, checkpoint_file)
+
+    except Exception:
+        checkpoint = None
+
+    if (checkpoint is None) or (checkpoint.get('digest') != digest):
+        return False, None
+
+    return True, checkpoint['result']
+
+
+
+class StageResult(object):
+    def __init__(self, name):
+        """ Placeholder for the result of a stage. When given as an argument to another stage, it will be
+            replaced with the return value of the stage with the given name before that stage is run, and
+            the stage will depend on it.
+
+        Arguments:
+            name: [str] Name of the stage.
+        """
+
+        self.name = name
+
+
+
+class Stage(object):
+    def __init__(self, name, func, args, kwargs, depends, inputs, digest_values):
+        """ Container for one processing stage. See StageGraph.addStage for the description of arguments. """
+
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.depends = depends
+        self.inputs = inputs
+        self.digest_values = digest_values
+
+        # Pickled digest values at the time the stage was started, as the stage might change them
+        self.values = None
+
+        # Status of the stage: None (not run), 'done', 'failed' or 'skipped'
+        self.status = None
+        self.result = None
+        self.wall_time = None
+
+
+
+def stageWorker(func, args, kwargs, result_queue=None):
+    """ Run the stage function and catch all errors.
+
+    Arguments:
+        func: [function] Stage function.
+        args: [list] Positional arguments.
+        kwargs: [dict] Keyword arguments.
+
+    Keyword arguments:
+        result_queue: [multiprocessing.Queue] If given, the results will be put into the queue, otherwise
+            they are returned. None by default.
+
+    Return:
+        (result, error, wall_time):
+            result: [object] The return value of the function, None if it failed.
+            error: [str] Traceback if the function failed, None otherwise.
+            wall_time: [float] Time in seconds it took to run the function.
+    """
+
+    t1 = time.time()
+
+    try:
+        result = func(*args, **kwargs)
+        error = None
+
+    except:
+        result = None
+        error = traceback.format_exc()
+
+    output = (result, error, time.time() - t1)
+
+    if result_queue is not None:
+        result_queue.put(output)
+
+    else:
+        return output
+
+
+
+class StageGraph(object):
+    def __init__(self, cores=1, checkpoint_dir=None):
+        """ A graph of processing stages. Stages are run as soon as all stages they depend on are done, with
+            up to the given number of stages running at the same time, each in its own process. If a stage
+            fails, all stages which depend on it are skipped. The wall time of every stage is recorded.
+
+        If the checkpoint directory is given, a marker with the digest of the stage inputs and the stage
+        result is saved there after every successful stage. When the graph is run again, stages whose inputs
+        did not change are not run, but their saved results are used. The input file digests are computed
+        after the stage is done, so stages which modify their input files in place are not rerun either.
+
+        Keyword arguments:
+            cores: [int] Maximum number of stages which will run in parallel. If 1 (default), the stages are
+                run one after another in the calling process. If negative, the number of available cores
+                minus the given number will be used.
+            checkpoint_dir: [str] Directory where the stage completion markers are kept. None by default, 
+                in which case all stages are always run.
+        """
+
+        if cores < 0:
+            cores = max(multiprocessing.cpu_count() + cores, 1)
+
+        self.cores = max(cores, 1)
+        self.checkpoint_dir = checkpoint_dir
+
+        # Stages in the order in which they were added
+        self.stages = []
+        self.stage_dict = {}
+
+
+    def result(self, name):
+        """ Return a placeholder for the result of the stage with the given name. """
+
+        return StageResult(name)
+
+
+    def addStage(self, name, func, args=None, kwargs=None, depends=None, inputs=None, digest_values=None):
+        """ Add a stage to the graph.
+
+        Arguments:
+            name: [str] Unique name of the stage.
+            func: [function] Function which will be called. When running in parallel, it has to be a
+                module-level function and its arguments and results have to be picklable.
+
+        Keyword arguments:
+            args: [list] Positional arguments of the function. StageResult placeholders will be replaced
+                with results of the corresponding stages.
+            kwargs: [dict] Keyword arguments of the function, StageResult placeholders can also be given.
+            depends: [list] Names of stages which have to be done before this stage runs, in addition to
+                the ones given through StageResult placeholders.
+            inputs: [list] Paths to files the stage reads. Their contents are a part of the input digest
+                used for checkpointing.
+            digest_values: [list] Values which are a part of the input digest used for checkpointing. 
+                StageResult placeholders can be given. None by default, in which case all arguments are
+                used. This should be given if the stage changes one of its arguments outside the graph, e.g.
+                by overwriting the file it was loaded from.
+
+        """
+
+        if args is None:
+            args = []
+
+        if kwargs is None:
+            kwargs = {}
+
+        if depends is None:
+            depends = []
+
+        if inputs is None:
+            inputs = []
+
+        if name in self.stage_dict:
+            raise ValueError("Stage '{:s}' already exists!".format(name))
+
+        # Add the stages whose results are used as arguments to the dependencies
+        depends = list(depends)
+        for arg in list(args) + list(kwargs.values()):
+            if isinstance(arg, StageResult) and (arg.name not in depends):
+                depends.append(arg.name)
+
+        # The dependencies have to be added first, which also guarantees that there are no cycles
+        for dep_name in depends:
+            if dep_name not in self.stage_dict:
+                raise ValueError("Stage '{:s}' depends on an unknown stage '{:s}'!".format(name, dep_name))
+
+        stage = Stage(name, func, list(args), dict(kwargs), depends, list(inputs), digest_values)
+
+        self.stages.append(stage)
+        self.stage_dict[name] = stage
+
+
+    def _resolve(self, arg):
+        """ Replace the result placeholder with the actual result. """
+
+        if isinstance(arg, StageResult):
+            return self.stage_dict[arg.name].result
+
+        return arg
+
+
+    def _resolveArgs(self, stage):
+        """ Replace the result placeholders in stage arguments with the actual results. """
+
+        args = [self._resolve(arg) for arg in stage.args]
+        kwargs = {key: self._resolve(stage.kwargs[key]) for key in stage.kwargs}
+
+        return args, kwargs
+
+
+    def _stageValues(self, stage):
+        """ Return the pickled values of the stage which are a part of the input digest. """
+
+        if stage.digest_values is None:
+            args, kwargs = self._resolveArgs(stage)
+            values = [args, sorted(kwargs.items())]
+
+        else:
+            values = [self._resolve(value) for value in stage.digest_values]
+
+        return pickle.dumps([stage.name, values], protocol=2)
+
+
+    def _checkDependencies(self, stage):
+        """ Return True if the stage can be run, False if it has to wait, and None if it should be skipped
+            because one of its dependencies failed.
+        """
+
+        for dep_name in stage.depends:
+
+            dep_status = self.stage_dict[dep_name].status
+
+            if dep_status in ['failed', 'skipped']:
+                return None
+
+            if dep_status != 'done':
+                return False
+
+        return True
+
+
+    def _finishStage(self, stage, result, error, wall_time):
+        """ Store the results of a finished stage. """
+
+        stage.result = result
+        stage.wall_time = wall_time
+
+        if error is None:
+            stage.status = 'done'
+            log.info("Stage '{:s}' done in {:.1f} s".format(stage.name, wall_time))
+
+            # Mark that the stage is done
+            if self.checkpoint_dir is not None:
+                try:
+                    saveCheckpoint(self.checkpoint_dir, stage.name, stageDigest(stage.values, stage.inputs), \
+                        result)
+
+                except Exception as e:
+                    log.warning("Saving the checkpoint for stage '{:s}' failed: {:s}".format(stage.name, \
+                        repr(e)))
+
+        else:
+            stage.status = 'failed'
+            log.error("Stage '{:s}' failed after {:.1f} s with error:\n{:s}".format(stage.name, wall_time, \
+                error))
+
+
+    def run(self):
+        """ Run all stages in the graph.
+
+        Return:
+            wall_times: [dict] Wall time in seconds for every stage which was run, by stage name.
+        """
+
+        t1 = time.time()
+
+        pending = list(self.stages)
+        running = {}
+
+        while pending or running:
+
+            # Start all stages which have their dependencies done
+            for stage in list(pending):
+
+                if len(running) >= self.cores:
+                    break
+
+                dep_status = self._checkDependencies(stage)
+
+                if dep_status is None:
+                    log.info("Stage '{:s}' skipped because one of its dependencies failed!".format(stage.name))
+                    stage.status = 'skipped'
+                    pending.remove(stage)
+                    continue
+
+                if not dep_status:
+                    continue
+
+                pending.remove(stage)
+
+                # Skip the stage if it was already done with the same inputs
+                if self.checkpoint_dir is not None:
+
+                    stage.values = self._stageValues(stage)
+
+                    checkpoint_status, result = loadCheckpoint(self.checkpoint_dir, stage.name, \
+                        stageDigest(stage.values, stage.inputs))
+
+                    if checkpoint_status:
+                        log.info("Stage '{:s}' was already done with the same inputs, skipping...".format(\
+                            stage.name))
+                        stage.status = 'done'
+                        stage.result = result
+                        continue
+
+                args, kwargs = self._resolveArgs(stage)
+
+                log.info("Starting stage '{:s}'...".format(stage.name))
+
+                # Run the stage in this process
+                if self.cores == 1:
+                    self._finishStage(stage, *stageWorker(stage.func, args, kwargs))
+
+                # Run the stage in a separate process. Processes are used instead of a pool as stages can
+                #   start their own worker processes, which daemonic pool workers are not allowed to do
+                else:
+                    result_queue = multiprocessing.Queue()
+                    proc = multiprocessing.Process(target=stageWorker, args=(stage.func, args, kwargs, \
+                        result_queue))
+                    proc.start()
+
+                    running[stage.name] = (proc, result_queue, time.time())
+
+
+            # Collect the stages which are done
+            for name in list(running.keys()):
+
+                proc, result_queue, t_start = running[name]
+
+                try:
+                    output = result_queue.get_nowait()
+
+                except queue.Empty:
+
+                    # Check if the process died without returning the results
+                    if proc.is_alive():
+                        continue
+
+                    try:
+                        output = result_queue.get(True, 1.0)
+
+                    except queue.Empty:
+                        output = (None, "The stage process exited with code {:s}!".format(str(proc.exitcode)),
+                            None)
+
+                proc.join()
+                del running[name]
+
+                # Use the wall time measured here if the stage process died
+                result, error, wall_time = output
+                if wall_time is None:
+                    wall_time = time.time() - t_start
+
+                self._finishStage(self.stage_dict[name], result, error, wall_time)
+
+
+            if running:
+                time.sleep(0.1)
+
+            # Make sure that the loop does not go on forever if nothing can be run
+            elif pending and all(self._checkDependencies(stage) is False for stage in pending):
+                raise RuntimeError("Stages {:s} cannot be run!".format(str([stage.name for stage in pending])))
+
+
+        wall_times = {stage.name: stage.wall_time for stage in self.stages if stage.wall_time is not None}
+
+        # Log the summary of stage times
+        log.info("Processing stages finished in {:.1f} s:".format(time.time() - t1))
+        for stage in self.stages:
+            wall_time_str = "{:8.1f} s".format(stage.wall_time) if (stage.wall_time is not None) else \
+                "       -  "
+            log.info("    {:30s} {:s} {:s}".format(stage.name, wall_time_str, str(stage.status)))
+
+        return wall_times
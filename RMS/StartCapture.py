@@ -79,11 +79,16 @@ def resetSIGINT():
 
 
 
-def wait(duration, compressor):
+def wait(duration, compressor, detector=None, config=None):
     """ The function will wait for the specified time, or it will stop when Enter is pressed. If no time was
         given (in seconds), it will wait until Enter is pressed. 
     Arguments:
         duration: [float] Time in seconds to wait
+        compressor: [Compressor object] Handle to the running compressor.
+    Keyword arguments:
+        detector: [QueuedPool object] Handle to the detector. If given together with the config, the number
+            of detection cores will be periodically adapted to the load during capture. None by default.
+        config: [config object] Configuration read from the .config file. None by default.
     """
 
     global STOP_CAPTURE
@@ -94,6 +99,9 @@ def wait(duration, compressor):
     # Get the time of capture start
     time_start = datetime.datetime.utcnow()
 
+    # Time of the last update of the number of detection cores
+    last_core_update = time.time()
+
 
     while True:
 
@@ -107,6 +115,17 @@ def wait(duration, compressor):
             break
 
 
+        # Adapt the number of detection cores to the system and compression load
+        if (detector is not None) and (config is not None) and config.detection_adaptive_cores:
+
+            if (time.time() - last_core_update) >= config.detection_cores_update_period:
+
+                detector.adaptCoreNumber(compression_load=compressor.compressionLoad(), \
+                    compression_load_max=config.detection_compression_load_max)
+
+                last_core_update = time.time()
+
+
         # If some wait time was given, check if it passed
         if duration is not None:
 
@@ -246,9 +265,15 @@ def runCapture(config, duration=None, video_file=None, nodetect=False, detect_en
             # Delay the detection for 2 minutes after capture start
             delay_detection = 120
 
+        # If the number of detection cores is adapted during capture, start enough worker processes so the
+        #   pool can be scaled to all cores used at the end of the night without restarting it
+        max_cores = None
+        if config.detection_adaptive_cores:
+            max_cores = max(multiprocessing.cpu_count() - 2, 1)
+
         # Initialize the detector
         detector = QueuedPool(detectStarsAndMeteors, cores=1, log=log, delay_start=delay_detection, \
-            backup_dir=night_data_dir)
+            backup_dir=night_data_dir, max_cores=max_cores)
         detector.startPool()
 
 
@@ -292,7 +317,7 @@ def runCapture(config, duration=None, video_file=None, nodetect=False, detect_en
 
 
     # Capture until Ctrl+C is pressed
-    wait(duration, compressor)
+    wait(duration, compressor, detector=detector, config=config)
 
     # If capture was manually stopped, end capture
     if STOP_CAPTURE:
@@ -915,4 +940,4 @@ if __name__ == "__main__":
         if upload_manager.is_alive():
             log.debug('Closing upload manager...')
             upload_manager.stop()
-            del upload_manager
\ No newline at end of file
+            del upload_manager
\ No newline at end of file
@@ -0,0 +1,160 @@
+""" Compare the convergence, speed and accuracy of the Nelder-Mead and the least squares astrometry
+    refinement, starting from a perturbed platepar. A night directory with a CALSTARS file and a platepar can be
+    given, otherwise the stars are simulated.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import copy
+import time
+import argparse
+
+import numpy as np
+
+import RMS.ConfigReader as cr
+from RMS.Astrometry import CheckFit
+from RMS.Astrometry.ApplyAstrometry import raDecToXYPP
+from RMS.Astrometry.Conversions import date2JD
+from RMS.Formats import CALSTARS
+from RMS.Formats import Platepar
+from RMS.Formats import StarCatalog
+from RMS.Math import angularSeparation
+
+
+
+def simulateStarDict(config, platepar, catalog_stars, n_images=20, sigma=0.1, seed=0):
+    """ Project the catalog stars to the image with the given platepar and add noise to their positions. """
+
+    np.random.seed(seed)
+
+    star_dict = {}
+
+    for i in range(n_images):
+
+        jd = platepar.JD + i*10.24/86400
+
+        # Project the stars
+        ra_catalog, dec_catalog, mag_catalog = catalog_stars.T
+        x, y = raDecToXYPP(ra_catalog, dec_catalog, jd, platepar)
+
+        # Take only the stars on the image
+        filt = (x > 0) & (x < platepar.X_res) & (y > 0) & (y < platepar.Y_res) \
+            & (mag_catalog < config.catalog_mag_limit)
+
+        intens = 10**(-0.4*(mag_catalog[filt] - 10))
+
+        star_dict[jd] = np.c_[y[filt] + np.random.normal(0, sigma, np.count_nonzero(filt)), \
+            x[filt] + np.random.normal(0, sigma, np.count_nonzero(filt)), intens, intens]
+
+
+    return star_dict
+
+
+
+def refine(config, platepar, catalog_stars, star_dict):
+    """ Refine the platepar with decreasing match radii as autoCheckFit does, and count the evaluations. """
+
+    platepar = copy.deepcopy(platepar)
+    context = CheckFit.MatchStarsContext(catalog_stars)
+
+    nfev = 0
+    for match_radius in [10, 5, 3, 1.5, 0.5]:
+
+        res = CheckFit.refineAstrometry(config, platepar, catalog_stars, star_dict, match_radius, \
+            context=context)
+
+        nfev += res.nfev
+
+        if not res.success:
+            break
+
+        platepar.RA_d, platepar.dec_d, platepar.pos_angle_ref, platepar.F_scale = res.x
+
+
+    return platepar, nfev
+
+
+
+if __name__ == "__main__":
+
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+
+    arg_parser.add_argument('dir_path', nargs='?', metavar='DIR_PATH', type=str, \
+        help='Path to a night directory with a CALSTARS file and a platepar. If not given, simulated stars ' \
+        'will be used.')
+
+    arg_parser.add_argument('-o', '--offset', metavar='OFFSET', type=float, default=3.0, \
+        help='Offset of the initial platepar in pixels. 3 by default.')
+
+    cml_args = arg_parser.parse_args()
+
+
+    config = cr.parse(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, ".config"))
+
+    # Load catalog stars
+    catalog_stars, _, config.star_catalog_band_ratios = StarCatalog.readStarCatalog(config.star_catalog_path, \
+        config.star_catalog_file, lim_mag=config.catalog_mag_limit, \
+        mag_band_ratios=config.star_catalog_band_ratios)
+
+
+    # Load the night data
+    if cml_args.dir_path is not None:
+
+        dir_path = os.path.abspath(cml_args.dir_path)
+
+        platepar = Platepar.Platepar()
+        platepar.read(os.path.join(dir_path, config.platepar_name))
+
+        calstars_file = [file_name for file_name in sorted(os.listdir(dir_path)) \
+            if ('CALSTARS' in file_name) and file_name.endswith('.txt')][0]
+        calstars_list = CALSTARS.readCALSTARS(dir_path, calstars_file)
+
+        star_dict = CheckFit.starListToDict(config, calstars_list, max_ffs=config.calstars_files_N)
+
+    # Simulate the stars
+    else:
+
+        platepar = Platepar.Platepar()
+        platepar.lat, platepar.lon = 45.0, 15.0
+        platepar.X_res, platepar.Y_res = 1280, 720
+        platepar.F_scale = platepar.X_res/60.0
+        platepar.JD = date2JD(2020, 1, 1, 22, 0, 0)
+        platepar.RA_d, platepar.dec_d, platepar.pos_angle_ref = 100.0, 40.0, 10.0
+
+        star_dict = simulateStarDict(config, platepar, catalog_stars)
+
+
+    print('Images: {:d}, stars: {:d}'.format(len(star_dict), sum([len(star_dict[jd]) for jd in star_dict])))
+
+
+    # Perturb the platepar
+    offset_deg = cml_args.offset/platepar.F_scale
+    platepar_initial = copy.deepcopy(platepar)
+    platepar_initial.RA_d += offset_deg/np.cos(np.radians(platepar.dec_d))
+    platepar_initial.dec_d -= offset_deg
+    platepar_initial.pos_angle_ref += np.degrees(cml_args.offset/platepar.X_res)
+    platepar_initial.F_scale *= 1.0 + cml_args.offset/platepar.X_res
+
+
+    print()
+    print('{:>14s} {:>7s} {:>8s} {:>8s} {:>10s} {:>12s}'.format('Method', 'Evals', 'Time (s)', 'Matched', \
+        'Resid (px)', 'Diff (arcsec)'))
+
+    for method in ['nelder-mead', 'least-squares']:
+
+        config.astrometry_fit_method = method
+
+        t1 = time.time()
+        platepar_fit, nfev = refine(config, platepar_initial, catalog_stars, star_dict)
+        t_fit = time.time() - t1
+
+        n_matched, avg_dist, _, _ = CheckFit.matchStarsResiduals(config, platepar_fit, catalog_stars, \
+            star_dict, 0.5, ret_nmatch=True)
+
+        # Difference of the pointing from the reference platepar
+        ang_diff = np.degrees(angularSeparation(np.radians(platepar.RA_d), np.radians(platepar.dec_d), \
+            np.radians(platepar_fit.RA_d), np.radians(platepar_fit.dec_d)))
+
+        print('{:>14s} {:7d} {:8.2f} {:8d} {:10.3f} {:12.2f}'.format(method, nfev, t_fit, n_matched, \
+            avg_dist, 3600*ang_diff))
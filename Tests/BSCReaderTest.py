@@ -0,0 +1,101 @@
+""" Check that the vectorized BSC reader gives exactly the same results as the original reader, which read
+    the catalog star by star.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import timeit
+
+import numpy as np
+
+from RMS.Formats.StarCatalog import readBSC
+
+
+
+def readBSCLoop(file_path, file_name, years_from_J2000=0, lim_mag=None):
+    """ The original BSC reader, which reads the entries one by one. """
+
+    bsc_path = os.path.join(file_path, file_name)
+
+    with open(bsc_path, 'rb') as fid:
+
+        int_32d = np.dtype('<i4')
+        int_8d = np.dtype('<i2')
+        float_32d = np.dtype('<f4')
+        float_64d = np.dtype('<f8')
+        char_8d = np.dtype('<a2')
+
+        # Read the header (star sequence offset, first star, number of stars, star ID status, proper motion,
+        #   number of magnitudes, bytes per entry), only the number of stars is used
+        _ = np.fromfile(fid, dtype=int_32d, count = 2)
+        star_num = -np.fromfile(fid, dtype=int_32d, count = 1)[0]
+        _ = np.fromfile(fid, dtype=int_32d, count = 4)
+
+        BSC_data = np.zeros(shape=(star_num, 3), dtype=float_64d)
+
+        for i in range(star_num):
+
+            # Catalog number
+            _ = np.fromfile(fid, dtype=float_32d, count=1)[0]
+            RA = np.fromfile(fid, dtype=float_64d, count=1)[0]
+            dec = np.fromfile(fid, dtype=float_64d, count=1)[0]
+
+            # Spectral type
+            _ = np.fromfile(fid, dtype=char_8d, count=1)[0]
+            mag = np.fromfile(fid, dtype=int_8d, count=1)[0].astype(np.float64)/100
+            RA_proper = np.fromfile(fid, dtype=float_32d, count=1)[0]
+            dec_proper = np.fromfile(fid, dtype=float_32d, count=1)[0]
+
+            BSC_data[i][0] = np.degrees(RA + RA_proper*years_from_J2000)
+            BSC_data[i][1] = np.degrees(dec + dec_proper*years_from_J2000)
+            BSC_data[i][2] = mag
+
+
+    if lim_mag is not None:
+        BSC_data = BSC_data[BSC_data[:, 2] < lim_mag]
+
+    BSC_data = BSC_data[BSC_data[:,1].argsort()[::-1]]
+
+    return BSC_data
+
+
+
+if __name__ == "__main__":
+
+    catalog_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Catalogs")
+
+    all_identical = True
+
+    for lim_mag in [None, 3.0, 5.5, 7.0]:
+
+        bsc_loop = readBSCLoop(catalog_dir, 'BSC5', lim_mag=lim_mag)
+        bsc_vect = readBSC(catalog_dir, 'BSC5', lim_mag=lim_mag)
+
+        identical = (bsc_loop.shape == bsc_vect.shape) and np.array_equal(bsc_loop, bsc_vect)
+        all_identical &= identical
+
+        print('Limiting magnitude {:>4s}: {:5d} stars, identical: {:s}'.format(str(lim_mag), len(bsc_vect), \
+            str(identical)))
+
+
+    # Check the proper motion correction, with a tolerance as the proper motion is stored in single precision
+    bsc_loop = readBSCLoop(catalog_dir, 'BSC5', years_from_J2000=20.5)
+    bsc_vect = readBSC(catalog_dir, 'BSC5', years_from_J2000=20.5)
+    max_diff = np.max(np.abs(bsc_loop - bsc_vect))
+    all_identical &= max_diff < 1e-9
+
+    print('Proper motion correction for 20.5 years, max difference: {:.2e} deg'.format(max_diff))
+
+
+    n_runs = 3
+    t_loop = timeit.timeit(lambda: readBSCLoop(catalog_dir, 'BSC5'), number=n_runs)/n_runs
+    t_vect = timeit.timeit(lambda: readBSC(catalog_dir, 'BSC5'), number=n_runs)/n_runs
+
+    print('Loop reader: {:.1f} ms, vectorized reader: {:.2f} ms'.format(1000*t_loop, 1000*t_vect))
+
+    if all_identical:
+        print('PASSED')
+
+    else:
+        print('FAILED')
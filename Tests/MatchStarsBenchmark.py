@@ -0,0 +1,70 @@
+""" Check that the grid matching of image and catalog stars gives the same results as the brute force
+    matching, and compare their speed on dense wide-field star lists.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import timeit
+
+import numpy as np
+
+# Cython init
+import pyximport
+pyximport.install(setup_args={'include_dirs':[np.get_include()]})
+from RMS.Astrometry.CyFunctions import matchStars, matchStarsBruteForce
+
+
+
+def simulateStarLists(n_image, n_catalog, x_res=1920, y_res=1080, sigma=1.0, seed=0):
+    """ Simulate catalog star positions and image stars which are noisy detections of a part of them. """
+
+    np.random.seed(seed)
+
+    # Catalog stars are generated slightly outside the image too
+    cat_x_array = np.random.uniform(-50, x_res + 50, n_catalog)
+    cat_y_array = np.random.uniform(-50, y_res + 50, n_catalog)
+
+    # Put a few stars on the same position to check that the ties are resolved in the same way
+    cat_x_array[1::50] = cat_x_array[::50][:len(cat_x_array[1::50])]
+    cat_y_array[1::50] = cat_y_array[::50][:len(cat_y_array[1::50])]
+
+    # Take only the stars inside the image
+    cat_good_indices = np.where((cat_x_array >= 0) & (cat_x_array < x_res) & (cat_y_array >= 0) \
+        & (cat_y_array < y_res))[0].astype(np.uint32)
+
+    # Image stars are the detections of catalog stars with some noise, and some false detections
+    detected = np.random.choice(cat_good_indices, min(n_image, len(cat_good_indices)), replace=False)
+    im_x = cat_x_array[detected] + np.random.normal(0, sigma, len(detected))
+    im_y = cat_y_array[detected] + np.random.normal(0, sigma, len(detected))
+
+    n_false = n_image//10
+    im_x = np.append(im_x, np.random.uniform(0, x_res, n_false))
+    im_y = np.append(im_y, np.random.uniform(0, y_res, n_false))
+
+    stars_list = np.c_[im_y, im_x, np.ones_like(im_x), np.ones_like(im_x)]
+
+    return stars_list, cat_x_array, cat_y_array, cat_good_indices
+
+
+
+if __name__ == "__main__":
+
+    print('{:>7s} {:>8s} {:>7s} {:>11s} {:>11s} {:>8s} {:>10s}'.format('Image', 'Catalog', 'Radius', \
+        'Brute (ms)', 'Grid (ms)', 'Speedup', 'Identical'))
+
+    for n_image, n_catalog in [(50, 200), (200, 1000), (500, 5000), (1000, 20000)]:
+        for match_radius in [1.0, 5.0, 20.0]:
+
+            args = list(simulateStarLists(n_image, n_catalog)) + [match_radius]
+
+            brute = matchStarsBruteForce(*args)
+            grid = matchStars(*args)
+
+            identical = (brute.shape == grid.shape) and np.all(brute == grid)
+
+            n_runs = 10
+            t_brute = timeit.timeit(lambda: matchStarsBruteForce(*args), number=n_runs)/n_runs
+            t_grid = timeit.timeit(lambda: matchStars(*args), number=n_runs)/n_runs
+
+            print('{:7d} {:8d} {:7.1f} {:11.3f} {:11.3f} {:8.1f} {:>10s}'.format(n_image, n_catalog, \
+                match_radius, 1000*t_brute, 1000*t_grid, t_brute/t_grid, str(identical)))
@@ -0,0 +1,120 @@
+""" Check that the blind plate solver finds the pointing of synthetic star fields, and that it fails without
+    errors when there are too few catalog stars (a narrow FOV with a bright catalog limit).
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import copy
+
+import numpy as np
+
+from RMS.Astrometry.ApplyAstrometry import raDecToXYPP
+from RMS.Astrometry.Conversions import date2JD, JD2HourAngle
+from RMS.Astrometry.PlateSolve import plateSolvePlatepar
+import RMS.ConfigReader as cr
+from RMS.Formats.Platepar import Platepar
+from RMS.Formats import StarCatalog
+
+
+
+def syntheticStars(platepar, catalog_stars, jd, seed=0):
+    """ Project catalog stars to the image, add noise and return them in the CALSTARS format. """
+
+    np.random.seed(seed)
+
+    x, y = raDecToXYPP(catalog_stars[:, 0], catalog_stars[:, 1], jd, platepar)
+    inside = (x > 0) & (x < platepar.X_res) & (y > 0) & (y < platepar.Y_res)
+
+    n_stars = np.count_nonzero(inside)
+    intensity = 10**(-0.4*(catalog_stars[inside, 2] + np.random.normal(0, 0.3, n_stars)))*1e6
+
+    return np.c_[y[inside] + np.random.normal(0, 0.3, n_stars), x[inside] + np.random.normal(0, 0.3, n_stars), \
+        intensity, np.ones(n_stars)]
+
+
+
+def solveFields(config, catalog_stars, image_stars, fov_w, n_fields=5):
+    """ Plate solve random fields and return the number of fields solved correctly and the number of fields
+        with a wrong solution.
+    """
+
+    calstars_time = (2020, 1, 1, 22, 0, 5, 120)
+    jd = date2JD(*calstars_time)
+
+    platepar = Platepar()
+    platepar.lat, platepar.lon, platepar.elev = 45.0, 15.0, 100
+    platepar.X_res, platepar.Y_res = 1280, 720
+    platepar.F_scale = platepar.X_res/fov_w
+    platepar.JD = jd
+    platepar.Ho = JD2HourAngle(jd)%360
+
+    config.fov_w = fov_w
+
+    n_solved = 0
+    n_wrong = 0
+    for i in range(n_fields):
+
+        np.random.seed(i)
+
+        platepar_true = copy.deepcopy(platepar)
+        platepar_true.RA_d = np.random.uniform(0, 360)
+        platepar_true.dec_d = np.degrees(np.arcsin(np.random.uniform(-0.9, 0.9)))
+        platepar_true.pos_angle_ref = np.random.uniform(0, 360)
+
+        star_data = syntheticStars(platepar_true, image_stars, jd, seed=i)
+
+        platepar_solved = plateSolvePlatepar(config, platepar, calstars_time, star_data, catalog_stars, \
+            verbose=False)
+
+        if platepar_solved is None:
+            continue
+
+        # Compare the predicted positions of the stars on the image
+        x_true, y_true = raDecToXYPP(image_stars[:, 0], image_stars[:, 1], jd, platepar_true)
+        x_solved, y_solved = raDecToXYPP(image_stars[:, 0], image_stars[:, 1], jd, platepar_solved)
+        inside = (x_true > 0) & (x_true < platepar.X_res) & (y_true > 0) & (y_true < platepar.Y_res)
+
+        if np.median(np.hypot(x_true - x_solved, y_true - y_solved)[inside]) < 1.0:
+            n_solved += 1
+        else:
+            n_wrong += 1
+
+
+    return n_solved, n_wrong
+
+
+
+if __name__ == "__main__":
+
+    config = cr.parse(".config")
+    config.star_catalog_file = 'STARS9TH_VBVRI.txt'
+    config.star_catalog_band_ratios = [0.1, 0.32, 0.23, 0.35]
+
+    def _loadCatalog(lim_mag):
+        return StarCatalog.readStarCatalog(config.star_catalog_path, config.star_catalog_file, \
+            lim_mag=lim_mag, mag_band_ratios=config.star_catalog_band_ratios)[0]
+
+    passed = True
+
+    # FOV width, catalog limiting magnitude, image limiting magnitude, whether the fields should be solved
+    for fov_w, cat_lim_mag, img_lim_mag, solvable in [
+            (60, 5.0, 5.5, True),
+            (90, 4.5, 5.0, True),
+            (22, 4.5, 6.0, False),
+            (10, 3.0, 6.0, False),
+        ]:
+
+        n_solved, n_wrong = solveFields(config, _loadCatalog(cat_lim_mag), _loadCatalog(img_lim_mag), fov_w)
+
+        ok = (n_wrong == 0) and ((n_solved > 0) or not solvable)
+        passed &= ok
+
+        print('FOV {:3d} deg, catalog mag {:.1f}: solved {:d}, wrong {:d} - {:s}'.format(fov_w, cat_lim_mag, \
+            n_solved, n_wrong, 'OK' if ok else 'FAILED'))
+
+
+    if passed:
+        print('PASSED')
+
+    else:
+        print('FAILED')
@@ -0,0 +1,117 @@
+""" Check that the parallel (nogil) conversions between image and sky coordinates give bit for bit the same
+    results as the single core conversions, and compare their speed for different numbers of points.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import timeit
+
+import numpy as np
+
+# Cython init
+import pyximport
+pyximport.install(setup_args={'include_dirs':[np.get_include()]})
+from RMS.Astrometry.CyFunctions import cyraDecToXY, cyXYToRADec
+
+
+
+def randomDistortion(dist_type, seed=0):
+    """ Generate random forward and reverse distortion parameters of the given type. """
+
+    np.random.seed(seed)
+
+    x_poly = np.random.normal(0, 1e-3, 12)
+    y_poly = np.random.normal(0, 1e-3, 12)
+
+    # Distortion centre offsets and the aspect ratio
+    x_poly[:3] = np.random.normal(0, 0.05, 3)
+
+    if dist_type.startswith('radial'):
+        x_poly[3:7] = np.random.normal(0, 0.05, 4)
+
+    return x_poly, y_poly
+
+
+
+def projectionArgs(dist_type, n_points, seed=0):
+    """ Return the arguments of cyraDecToXY and cyXYToRADec for random points on a 1280x720 image. """
+
+    x_poly, y_poly = randomDistortion(dist_type, seed=seed)
+
+    # Station, image size, reference hour angle, pointing, rotation and scale
+    lat, lon, x_res, y_res = 45.0, 15.0, 1280.0, 720.0
+    h0, ra_ref, dec_ref, pos_angle_ref, pix_scale = 10.0, 100.0, 40.0, 20.0, 21.3
+
+    jd = 2459000.3
+    ra_data = np.random.uniform(80, 120, n_points)
+    dec_data = np.random.uniform(20, 60, n_points)
+
+    jd_data = jd + np.random.uniform(0, 0.01, n_points)
+    x_data = np.random.uniform(0, x_res, n_points)
+    y_data = np.random.uniform(0, y_res, n_points)
+
+    radec_args = (ra_data, dec_data, jd, lat, lon, x_res, y_res, h0, ra_ref, dec_ref, pos_angle_ref, \
+        pix_scale, x_poly, y_poly, dist_type)
+
+    xy_args = (jd_data, x_data, y_data, lat, lon, x_res, y_res, h0, ra_ref, dec_ref, pos_angle_ref, \
+        pix_scale, x_poly, y_poly, dist_type)
+
+    return radec_args, xy_args
+
+
+
+def identical(res1, res2):
+    """ Check that two tuples of arrays are bit for bit identical. """
+
+    return all(np.array_equal(a, b, equal_nan=True) for a, b in zip(res1, res2))
+
+
+
+if __name__ == "__main__":
+
+    all_identical = True
+
+    # Check that the results are identical for all distortion types and options
+    for dist_type in ['poly3+radial', 'radial3', 'radial4', 'radial5']:
+        for refraction in [True, False]:
+            for option in [False, True]:
+
+                radec_args, xy_args = projectionArgs(dist_type, 20000)
+
+                kwargs = dict(refraction=refraction, force_distortion_centre=option, apparent=option)
+                same_radec = identical(cyraDecToXY(*radec_args, parallel=False, **kwargs), \
+                    cyraDecToXY(*radec_args, parallel=True, **kwargs))
+
+                kwargs = dict(refraction=refraction, equal_aspect=option)
+                same_xy = identical(cyXYToRADec(*xy_args, parallel=False, **kwargs), \
+                    cyXYToRADec(*xy_args, parallel=True, **kwargs))
+
+                all_identical &= same_radec and same_xy
+
+                print('{:>12s}, refraction: {:5s}, option: {:5s}, identical: {:5s} {:5s}'.format(dist_type, \
+                    str(refraction), str(option), str(same_radec), str(same_xy)))
+
+
+    print()
+    print('{:>8s} {:>13s} {:>13s} {:>13s} {:>13s}'.format('Points', 'raDecToXY 1c', 'raDecToXY par', \
+        'XYToRADec 1c', 'XYToRADec par'))
+
+    for n_points in [1000, 10000, 100000, 1000000]:
+
+        radec_args, xy_args = projectionArgs('radial5', n_points)
+
+        n_runs = max(1, 100000//n_points)
+        timings = []
+        for func, args in [(cyraDecToXY, radec_args), (cyXYToRADec, xy_args)]:
+            for parallel in [False, True]:
+                timings.append(timeit.timeit(lambda: func(*args, parallel=parallel), number=n_runs)/n_runs)
+
+        print('{:8d} {:>10.2f} ms {:>10.2f} ms {:>10.2f} ms {:>10.2f} ms'.format(n_points, \
+            *[1000*t for t in timings]))
+
+
+    if all_identical:
+        print('PASSED')
+
+    else:
+        print('FAILED')
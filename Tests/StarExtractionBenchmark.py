@@ -0,0 +1,170 @@
+""" Compare the speed and the centroid agreement of the PSF fit and the image moments star extraction
+    methods, either on simulated star fields or on FF files in the given directory.
+"""
+
+from __future__ import print_function, division, absolute_import
+
+import os
+import time
+import copy
+import argparse
+
+import numpy as np
+
+import RMS.ConfigReader as cr
+from RMS.ExtractStars import extractStars
+from RMS.Formats import FFfile
+from RMS.Formats.FFStruct import FFStruct
+
+
+
+def simulateStarField(dir_path, file_name, nrows=720, ncols=1280, n_stars=300, n_hot_pixels=60, seed=0):
+    """ Save an FF file with simulated Gaussian stars and hot pixels, and return the true star positions. """
+
+    np.random.seed(seed)
+
+    img = np.random.normal(40, 3, (nrows, ncols))
+    y_ind, x_ind = np.indices((nrows, ncols))
+
+    stars = []
+    for _ in range(n_stars):
+
+        y0 = np.random.uniform(20, nrows - 20)
+        x0 = np.random.uniform(20, ncols - 20)
+        sigma = np.random.uniform(0.8, 2.0)
+        amplitude = np.random.uniform(10, 200)
+
+        seg = (slice(int(y0) - 8, int(y0) + 9), slice(int(x0) - 8, int(x0) + 9))
+        img[seg] += amplitude*np.exp(-((y_ind[seg] - y0)**2 + (x_ind[seg] - x0)**2)/(2*sigma**2))
+
+        stars.append([x0, y0])
+
+
+    # Add hot pixels
+    for _ in range(n_hot_pixels):
+        img[np.random.randint(20, nrows - 20), np.random.randint(20, ncols - 20)] += \
+            np.random.uniform(30, 200)
+
+
+    ff = FFStruct()
+    ff.nrows = nrows
+    ff.ncols = ncols
+    ff.nframes = 256
+    ff.first = 0
+    ff.camno = 1
+    ff.fps = 25.0
+    ff.avepixel = np.clip(img, 0, 255).astype(np.uint8)
+    ff.maxpixel = ff.avepixel
+    ff.stdpixel = np.ones_like(ff.avepixel)
+    ff.maxframe = np.zeros_like(ff.avepixel)
+    ff.array = np.stack([ff.maxpixel, ff.maxframe, ff.avepixel, ff.stdpixel])
+
+    FFfile.write(ff, dir_path, file_name, fmt='fits')
+
+    return np.array(stars)
+
+
+
+def matchStars(x1, y1, x2, y2, max_dist=1.0):
+    """ Return the distances between the nearest stars of two lists, only for pairs closer than max_dist. """
+
+    if (not len(x1)) or (not len(x2)):
+        return np.array([])
+
+    dist = np.hypot(np.array(x1)[:, np.newaxis] - np.array(x2), np.array(y1)[:, np.newaxis] - np.array(y2))
+    dist = np.min(dist, axis=1)
+
+    return dist[dist < max_dist]
+
+
+
+if __name__ == "__main__":
+
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+
+    arg_parser.add_argument('dir_path', nargs='?', metavar='DIR_PATH', type=str, \
+        help='Path to a directory with FF files. If not given, simulated FF files will be used.')
+
+    arg_parser.add_argument('-n', '--nfiles', metavar='NFILES', type=int, default=5, \
+        help='Number of simulated FF files. 5 by default.')
+
+    cml_args = arg_parser.parse_args()
+
+
+    config = cr.parse(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, ".config"))
+
+    true_stars = {}
+
+    # Simulate FF files
+    if cml_args.dir_path is None:
+
+        ff_dir = os.path.abspath('star_extraction_benchmark')
+        if not os.path.exists(ff_dir):
+            os.makedirs(ff_dir)
+
+        for i in range(cml_args.nfiles):
+            ff_name = 'FF_XX0001_20200101_000000_000_{:07d}.fits'.format(i*256)
+            true_stars[ff_name] = simulateStarField(ff_dir, ff_name, seed=i)
+
+    else:
+        ff_dir = os.path.abspath(cml_args.dir_path)
+
+
+    ff_list = sorted([ff_name for ff_name in os.listdir(ff_dir) if FFfile.validFFName(ff_name)])
+
+
+    # Run both extraction methods on all files
+    results = {}
+    timings = {}
+    for method in ['psf', 'moments']:
+
+        config_method = copy.deepcopy(config)
+        config_method.star_extraction_method = method
+
+        results[method] = {}
+        t1 = time.time()
+
+        for ff_name in ff_list:
+            results[method][ff_name] = extractStars(ff_dir, ff_name, config=config_method)
+
+        timings[method] = time.time() - t1
+
+
+    print()
+    print('Files: {:d}'.format(len(ff_list)))
+    for method in ['psf', 'moments']:
+
+        n_stars = sum([len(results[method][ff_name][1]) for ff_name in ff_list])
+
+        print('{:8s}: {:7.3f} s per file, {:5d} stars extracted'.format(method, timings[method]/len(ff_list), \
+            n_stars))
+
+    print('Speedup: {:.1f}x'.format(timings['psf']/timings['moments']))
+
+
+    # Compare the centroids of both methods and the true positions, if known
+    dist_methods = []
+    dist_true = {'psf': [], 'moments': []}
+    for ff_name in ff_list:
+
+        _, x_psf, y_psf = results['psf'][ff_name][:3]
+        _, x_mom, y_mom = results['moments'][ff_name][:3]
+
+        dist_methods.append(matchStars(x_mom, y_mom, x_psf, y_psf))
+
+        if ff_name in true_stars:
+            x_true, y_true = true_stars[ff_name].T
+            dist_true['psf'].append(matchStars(x_psf, y_psf, x_true, y_true))
+            dist_true['moments'].append(matchStars(x_mom, y_mom, x_true, y_true))
+
+
+    dist_methods = np.concatenate(dist_methods)
+    print()
+    print('Moments vs. PSF centroids: {:d} matched, median {:.3f} px, 95th percentile {:.3f} px'.format(\
+        len(dist_methods), np.median(dist_methods), np.percentile(dist_methods, 95)))
+
+    if true_stars:
+        for method in ['psf', 'moments']:
+            dist = np.concatenate(dist_true[method])
+            print('{:8s} vs. true positions: {:d} matched, median {:.3f} px, 95th percentile {:.3f} px'.format(\
+                method, len(dist), np.median(dist), np.percentile(dist, 95)))
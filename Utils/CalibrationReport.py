@@ -11,6 +11,7 @@ import matplotlib.pyplot as plt
 
 from RMS.Astrometry.ApplyAstrometry import computeFOVSize, xyToRaDecPP, raDecToXYPP, \
     photometryFitRobust, correctVignetting, photomLine, rotationWrtHorizon, extinctionCorrectionTrueToApparent
+from RMS.Astrometry.ApplyRecalibrate import catalogStarsOnImage, loadMatchedStars, thumbnailImage
 from RMS.Astrometry.CheckFit import matchStarsResiduals
 from RMS.Astrometry.Conversions import date2JD, jd2Date, raDec2AltAz
 from RMS.Formats.CALSTARS import readCALSTARS
@@ -21,26 +22,11 @@ from RMS.Formats import StarCatalog
 from RMS.Routines import Image
 from RMS.Routines.AddCelestialGrid import addEquatorialGrid
 
-# Import Cython functions
-import pyximport
-pyximport.install(setup_args={'include_dirs':[np.get_include()]})
-from RMS.Astrometry.CyFunctions import subsetCatalog
 
-
-def generateCalibrationReport(config, night_dir_path, match_radius=2.0, platepar=None, show_graphs=False):
-    """ Given the folder of the night, find the Calstars file, check the star fit and generate a report
-        with the quality of the calibration. The report contains information about both the astrometry and
-        the photometry calibration. Graphs will be saved in the given directory of the night.
-
-    Arguments:
-        config: [Config instance]
-        night_dir_path: [str] Full path to the directory of the night.
-    Keyword arguments:
-        match_radius: [float] Match radius for star matching between image and catalog stars (px).
-        platepar: [Platepar instance] Use this platepar instead of finding one in the folder.
-        show_graphs: [bool] Show the graphs on the screen. False by default.
-    Return:
-        None
+def _reportDataFromFiles(config, night_dir_path, match_radius, platepar):
+    """ Load the CALSTARS file, the platepars and the catalog from the night directory and match the stars
+        for the calibration report. See _reportDataFromMatchedStars for the returned values. None is
+        returned if the report cannot be made.
     """
 
     # Find the CALSTARS file in the given folder
@@ -103,9 +89,6 @@ def generateCalibrationReport(config, night_dir_path, match_radius=2.0, platepar
     ### ###
 
 
-    night_name = os.path.split(night_dir_path.strip(os.sep))[1]
-
-
     # Go one mag deeper than in the config
     lim_mag = config.catalog_mag_limit + 1
 
@@ -240,26 +223,161 @@ def generateCalibrationReport(config, night_dir_path, match_radius=2.0, platepar
     # Take the FF file with the largest number of matched stars
     ff_name = ff_dict[max_jd]
 
-    # Load the FF file
-    ff = readFF(night_dir_path, ff_name)
-    img_h, img_w = ff.avepixel.shape
+    if max_matched_stars > 2:
+
+        # Take the solution with the largest number of matched stars
+        image_stars, matched_catalog_stars, distances = matched_stars[max_jd]
+
+        # Find the faintest magnitude among matched stars
+        faintest_mag = np.max(matched_catalog_stars[:, 2]) + 1
+
+    else:
+        image_stars, matched_catalog_stars, distances = None, None, [np.inf]
+
+        # If there are no matched stars, use the limiting magnitude from config
+        faintest_mag = config.catalog_mag_limit + 1
+
+
+    # Compute image positions of catalog stars on the image
+    catalog_image = catalogStarsOnImage(catalog_stars, platepar, max_jd, faintest_mag)
+
+
+    # Load the FF file, or use an empty image if the FF file is not available anymore
+    if os.path.isfile(os.path.join(night_dir_path, ff_name)):
+        ff = readFF(night_dir_path, ff_name)
+        img = ff.avepixel
+
+    else:
+        img = np.zeros((platepar.Y_res, platepar.X_res))
+
+
+    return ff_name, max_jd, platepar, star_dict[max_jd], match_radius, max_matched_stars, image_stars, \
+        matched_catalog_stars, distances, catalog_image, faintest_mag, mag_band_str, lim_mag, img, 1
+
+
+
+def _reportDataFromMatchedStars(config, matched_data):
+    """ Take the data for the calibration report from the stars matched during recalibration (see
+        collectMatchedStars).
+
+    Arguments:
+        config: [Config instance]
+        matched_data: [dict] Output of collectMatchedStars.
+    Return:
+        (ff_name, jd, platepar, star_list, match_radius, n_matched, image_stars, matched_catalog_stars, 
+            distances, catalog_image, faintest_mag, mag_band_str, lim_mag, img, bin_factor):
+            ff_name: [str] Name of the FF file shown in the report.
+            jd: [float] Julian date of the FF file.
+            platepar: [Platepar instance] Platepar of the FF file.
+            star_list: [ndarray] Stars detected on the FF file (y, x, intens, amplitude).
+            match_radius: [float] Radius used for star matching (px).
+            n_matched: [int] Number of matched stars.
+            image_stars: [ndarray] Matched image stars, None if there are 2 or fewer matched stars.
+            matched_catalog_stars: [ndarray] Matched catalog stars (ra, dec, mag), None if there are 2 or 
+                fewer matched stars.
+            distances: [list] Distances between the matched stars (px).
+            catalog_image: [ndarray] Catalog stars on the image (x, y, mag).
+            faintest_mag: [float] Limiting magnitude of the plotted catalog stars.
+            mag_band_str: [str] Description of the catalog magnitude band.
+            lim_mag: [float] Limiting magnitude of catalog stars used for matching.
+            img: [ndarray] Avepixel of the FF file, binned by bin_factor.
+            bin_factor: [int] Binning factor of the image.
+    """
+
+    ff_name = matched_data['ff_name']
+    report_matched = matched_data['matched'][ff_name]
+
+    platepar = Platepar()
+    platepar.loadFromDict(matched_data['platepar'], use_flat=config.use_flat)
+
+    distances = report_matched['distances']
+    n_matched = len(distances)
+
+    if n_matched > 2:
+        image_stars = np.array(report_matched['image_stars'])
+        matched_catalog_stars = np.array(report_matched['catalog_stars'])
+
+    else:
+        image_stars, matched_catalog_stars, distances = None, None, [np.inf]
+
+
+    catalog_image = np.array(matched_data['catalog_image']).reshape(-1, 3)
+
+
+    # Use the stored thumbnail of the FF file, or an empty image if the FF file was not available
+    if matched_data['thumbnail'] is not None:
+        img = thumbnailImage(matched_data['thumbnail'])
+        bin_factor = matched_data['thumbnail']['bin_factor']
+
+    else:
+        img = np.zeros((platepar.Y_res, platepar.X_res))
+        bin_factor = 1
+
+
+    return ff_name, report_matched['jd'], platepar, np.array(matched_data['star_list']), \
+        report_matched['match_radius'], n_matched, image_stars, matched_catalog_stars, distances, \
+        catalog_image, matched_data['faintest_mag'], matched_data['mag_band_str'], matched_data['lim_mag'], \
+        img, bin_factor
 
-    dpi = 200
-    plt.figure(figsize=(ff.avepixel.shape[1]/dpi, ff.avepixel.shape[0]/dpi), dpi=dpi)
 
-    # Take the average pixel
-    img = ff.avepixel
+
+def generateCalibrationReport(config, night_dir_path, match_radius=2.0, platepar=None, show_graphs=False):
+    """ Given the folder of the night, find the Calstars file, check the star fit and generate a report
+        with the quality of the calibration. The report contains information about both the astrometry and
+        the photometry calibration. Graphs will be saved in the given directory of the night. If the 
+        recalibration saved the matched stars (see collectMatchedStars), the report is made only from them, 
+        using the match radius of the recalibration.
+
+    Arguments:
+        config: [Config instance]
+        night_dir_path: [str] Full path to the directory of the night.
+    Keyword arguments:
+        match_radius: [float] Match radius for star matching between image and catalog stars (px).
+        platepar: [Platepar instance] Use this platepar instead of finding one in the folder.
+        show_graphs: [bool] Show the graphs on the screen. False by default.
+    Return:
+        None
+    """
+
+    # Use the stars matched during recalibration if they are available, otherwise load everything and match
+    #   the stars again
+    matched_data = loadMatchedStars(night_dir_path, config.matched_stars_name)
+
+    if (matched_data is not None) and (matched_data['ff_name'] is not None):
+
+        print('Using the matched stars from the recalibration for the calibration report...')
+        report_data = _reportDataFromMatchedStars(config, matched_data)
+
+    else:
+        report_data = _reportDataFromFiles(config, night_dir_path, match_radius, platepar)
+
+    if report_data is None:
+        return None
+
+    ff_name, max_jd, platepar, star_list, matched_radius, max_matched_stars, image_stars, \
+        matched_catalog_stars, distances, catalog_image, faintest_mag, mag_band_str, lim_mag, img, \
+        bin_factor = report_data
+
+
+    night_name = os.path.split(night_dir_path.strip(os.sep))[1]
+
+    # Size of the full resolution image
+    img_h, img_w = img.shape[0]*bin_factor, img.shape[1]*bin_factor
+
+    dpi = 200
+    plt.figure(figsize=(img_w/dpi, img_h/dpi), dpi=dpi)
 
     # Slightly adjust the levels
     img = Image.adjustLevels(img, np.percentile(img, 1.0), 1.3, np.percentile(img, 99.99))
 
-    plt.imshow(img, cmap='gray', interpolation='nearest')
+    # Show the (binned) image in the full resolution image coordinates
+    plt.imshow(img, cmap='gray', interpolation='nearest', extent=(-0.5, img_w - 0.5, img_h - 0.5, -0.5))
 
     legend_handles = []
 
 
     # Plot detected stars
-    for img_star in star_dict[max_jd]:
+    for img_star in star_list:
 
         y, x, _, _ = img_star
 
@@ -276,9 +394,6 @@ def generateCalibrationReport(config, night_dir_path, match_radius=2.0, platepar
     # If there are matched stars, plot them
     if max_matched_stars > 2:
 
-        # Take the solution with the largest number of matched stars
-        image_stars, matched_catalog_stars, distances = matched_stars[max_jd]
-
         # Plot matched stars
         for img_star in image_stars:
             x, y, _, _ = img_star
@@ -326,8 +441,6 @@ def generateCalibrationReport(config, night_dir_path, match_radius=2.0, platepar
 
     else:
 
-        distances = [np.inf]
-
         # If there are no matched stars, plot large text in the middle of the screen
         plt.text(img_w/2, img_h/2, "NO MATCHED STARS!", color='r', alpha=0.5, fontsize=20, ha='center',
             va='center')
@@ -335,39 +448,7 @@ def generateCalibrationReport(config, night_dir_path, match_radius=2.0, platepar
 
     ### Plot positions of catalog stars to the limiting magnitude of the faintest matched star + 1 mag ###
 
-    # Find the faintest magnitude among matched stars
-    if max_matched_stars > 2:
-        faintest_mag = np.max(matched_catalog_stars[:, 2]) + 1
-
-    else:
-        # If there are no matched stars, use the limiting magnitude from config
-        faintest_mag = config.catalog_mag_limit + 1
-
-
-    # Estimate RA,dec of the centre of the FOV
-    _, RA_c, dec_c, _ = xyToRaDecPP([jd2Date(max_jd)], [platepar.X_res/2], [platepar.Y_res/2], [1],
-        platepar)
-
-    RA_c = RA_c[0]
-    dec_c = dec_c[0]
-
-    fov_radius = np.hypot(*computeFOVSize(platepar))
-
-    # Get stars from the catalog around the defined center in a given radius
-    _, extracted_catalog = subsetCatalog(catalog_stars, RA_c, dec_c, max_jd, platepar.lat, platepar.lon, \
-        fov_radius, faintest_mag)
-    ra_catalog, dec_catalog, mag_catalog = extracted_catalog.T
-
-    # Compute image positions of all catalog stars that should be on the image
-    x_catalog, y_catalog = raDecToXYPP(ra_catalog, dec_catalog, max_jd, platepar)
-
-    # Filter all catalog stars outside the image
-    temp_arr = np.c_[x_catalog, y_catalog, mag_catalog]
-    temp_arr = temp_arr[temp_arr[:, 0] >= 0]
-    temp_arr = temp_arr[temp_arr[:, 0] <= ff.avepixel.shape[1]]
-    temp_arr = temp_arr[temp_arr[:, 1] >= 0]
-    temp_arr = temp_arr[temp_arr[:, 1] <= ff.avepixel.shape[0]]
-    x_catalog, y_catalog, mag_catalog = temp_arr.T
+    x_catalog, y_catalog, mag_catalog = catalog_image.T
 
     # Plot catalog stars on the image
     cat_stars_handle = plt.scatter(x_catalog, y_catalog, c='none', marker='D', lw=1.0, alpha=0.4, \
@@ -379,9 +460,9 @@ def generateCalibrationReport(config, night_dir_path, match_radius=2.0, platepar
 
 
     # Add info text in the corner
-    info_text = ff_dict[max_jd] + '\n' \
-        + "Matched stars within {:.1f} px radius: {:d}/{:d} \n".format(match_radius, max_matched_stars, \
-            len(star_dict[max_jd])) \
+    info_text = ff_name + '\n' \
+        + "Matched stars within {:.1f} px radius: {:d}/{:d} \n".format(matched_radius, max_matched_stars, \
+            len(star_list)) \
         + "Median distance = {:.2f} px\n".format(np.median(distances)) \
         + "Catalog lim mag = {:.1f}".format(lim_mag)
 
@@ -401,6 +482,13 @@ def generateCalibrationReport(config, night_dir_path, match_radius=2.0, platepar
     # Mark FOV centre
     plt.scatter(platepar.X_res/2, platepar.Y_res/2, marker='+', s=20, c='r', zorder=4)
 
+    # Estimate RA,dec of the centre of the FOV
+    _, RA_c, dec_c, _ = xyToRaDecPP([jd2Date(max_jd)], [platepar.X_res/2], [platepar.Y_res/2], [1],
+        platepar)
+
+    RA_c = RA_c[0]
+    dec_c = dec_c[0]
+
     # Compute FOV centre alt/az
     azim_centre, alt_centre = raDec2AltAz(RA_c, dec_c, max_jd, platepar.lat, platepar.lon)
 
@@ -433,8 +521,8 @@ def generateCalibrationReport(config, night_dir_path, match_radius=2.0, platepar
     plt.gca().get_xaxis().set_visible(False)
     plt.gca().get_yaxis().set_visible(False)
 
-    plt.xlim([0, ff.avepixel.shape[1]])
-    plt.ylim([ff.avepixel.shape[0], 0])
+    plt.xlim([0, img_w])
+    plt.ylim([img_h, 0])
 
     # Remove the margins
     plt.subplots_adjust(left=0, bottom=0, right=1, top=1, wspace=0, hspace=0)
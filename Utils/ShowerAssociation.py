@@ -6,15 +6,14 @@ from __future__ import print_function, division, absolute_import
 import sys
 import os
 import glob
-import datetime
 import copy
 
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 
-from RMS.Astrometry.Conversions import raDec2Vector, vector2RaDec, datetime2JD, jd2Date, raDec2AltAz, \
-    raDec2AltAz_vect, geocentricToApparentRadiantAndVelocity, EARTH_CONSTANTS
+from RMS.Astrometry.Conversions import raDec2Vector, vector2RaDec, datetimeOffsets2JD, jd2Date, \
+    raDec2AltAz, raDec2AltAz_vect, geocentricToApparentRadiantAndVelocity, EARTH_CONSTANTS
 from RMS.Formats.FFfile import filenameToDatetime
 from RMS.Formats.FTPdetectinfo import readFTPdetectinfo
 from RMS.Formats.Showers import loadShowers, generateActivityDiagram
@@ -411,14 +410,15 @@ def showerAssociation(config, ftpdetectinfo_list, shower_code=None, show_plot=Fa
         # Init container for meteor observation
         meteor_obj = MeteorSingleStation(cam_code, config.latitude, config.longitude)
 
+        # Compute the Julian dates of all points
+        frame_n_data = np.array([entry[1] for entry in meteor_meas], dtype=np.float64)
+        jd_data = datetimeOffsets2JD(filenameToDatetime(ff_name), frame_n_data/fps)
+
         # Infill the meteor structure
-        for entry in meteor_meas:
+        for jd, entry in zip(jd_data, meteor_meas):
             
             calib_status, frame_n, x, y, ra, dec, azim, elev, inten, mag = entry
 
-            # Compute the Julian data of every point
-            jd = datetime2JD(filenameToDatetime(ff_name) + datetime.timedelta(seconds=float(frame_n)/fps))
-
             meteor_obj.addPoint(jd, ra, dec, mag)
 
             
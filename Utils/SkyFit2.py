@@ -28,6 +28,7 @@ from RMS.Astrometry.ApplyAstrometry import xyToRaDecPP, raDecToXYPP, \
 from RMS.Astrometry.Conversions import date2JD, JD2HourAngle, trueRaDec2ApparentAltAz, \
     apparentAltAz2TrueRADec, jd2Date, datetime2JD
 from RMS.Astrometry.AstrometryNetNova import novaAstrometryNetSolve
+from RMS.Astrometry.PlateSolve import plateSolvePlatepar
 import RMS.ConfigReader as cr
 import RMS.Formats.CALSTARS as CALSTARS
 from RMS.Formats.Platepar import Platepar, getCatalogStarsImagePositions
@@ -913,6 +914,7 @@ class PlateTool(QtWidgets.QMainWindow):
             text_str += 'CTRL + F - Load flat\n'
             text_str += 'CTRL + X - astrometry.net img upload\n'
             text_str += 'CTRL + SHIFT + X - astrometry.net XY only\n'
+            text_str += 'ALT + X - Local plate solve (offline)\n'
             text_str += 'CTRL + R - Pick stars\n'
             text_str += 'SHIFT + Z - Show zoomed window\n'
             text_str += 'CTRL + N - New platepar\n'
@@ -2057,6 +2059,17 @@ class PlateTool(QtWidgets.QMainWindow):
                     self.updateLeftLabels()
                     self.updateStars()
 
+            # Get initial parameters by plate solving the detected stars locally
+            elif event.key() == QtCore.Qt.Key_X and modifiers == QtCore.Qt.AltModifier:
+                print("Solving with the local plate solver")
+
+                self.getInitialParamsLocalSolve()
+
+                self.updateDistortion()
+                self.updateLeftLabels()
+                self.updateStars()
+                self.tab.param_manager.updatePlatepar()
+
             # Get initial parameters from astrometry.net
             elif event.key() == QtCore.Qt.Key_X:
                 print("Solving with astrometry.net")
@@ -2456,6 +2469,59 @@ class PlateTool(QtWidgets.QMainWindow):
         print(' Pos angle   = {:.2f} deg'.format(pos_angle_ref))
         print(' Scale = {:.2f} arcmin/px'.format(60/self.platepar.F_scale))
 
+    def getInitialParamsLocalSolve(self):
+        """ Get the estimate of the initial astrometric parameters by plate solving the stars detected on the
+            current image with the star catalog, without contacting astrometry.net.
+        """
+
+        platepar_solved = None
+
+        # Check if the given FF files is in the calstars list
+        if self.img_handle.name() in self.calstars:
+
+            # Get the stars detected on this FF file
+            star_data = self.calstars[self.img_handle.name()]
+
+            # Make sure that there are at least 10 stars
+            if len(star_data) < 10:
+                print('Less than 10 stars on the image!')
+
+            else:
+                platepar_solved = plateSolvePlatepar(self.config, self.platepar, self.img_handle.currentTime(),
+                                                     star_data, self.catalog_stars)
+
+        else:
+            print('No stars were detected on the image!')
+
+        if platepar_solved is None:
+            messagebox.showerror(title='Plate solving error',
+                                 message='The local plate solver failed to find a solution!')
+
+            return None
+
+        # Set parameters to platepar, the reference time is moved to the time of the image
+        self.platepar.JD = platepar_solved.JD
+        self.platepar.Ho = platepar_solved.Ho
+        self.platepar.RA_d = platepar_solved.RA_d
+        self.platepar.dec_d = platepar_solved.dec_d
+        self.platepar.pos_angle_ref = platepar_solved.pos_angle_ref
+        self.platepar.F_scale = platepar_solved.F_scale
+        self.platepar.az_centre = platepar_solved.az_centre
+        self.platepar.alt_centre = platepar_solved.alt_centre
+        self.platepar.rotation_from_horiz = platepar_solved.rotation_from_horiz
+
+        # Print estimated parameters
+        print()
+        print('Local plate solution:')
+        print('---------------------')
+        print(' RA    = {:.2f} deg'.format(self.platepar.RA_d))
+        print(' Dec   = {:.2f} deg'.format(self.platepar.dec_d))
+        print(' Azim  = {:.2f} deg'.format(self.platepar.az_centre))
+        print(' Alt   = {:.2f} deg'.format(self.platepar.alt_centre))
+        print(' Rot horiz   = {:.2f} deg'.format(self.platepar.rotation_from_horiz))
+        print(' Pos angle   = {:.2f} deg'.format(self.platepar.pos_angle_ref))
+        print(' Scale = {:.2f} arcmin/px'.format(60/self.platepar.F_scale))
+
     def getFOVcentre(self):
         """ Asks the user to input the centre of the FOV in altitude and azimuth. """
 
@@ -55,10 +55,21 @@ if onvif_str in reqs_stripped:
 ### ###
 
 
+# Enable OpenMP for the parallel loops in CyFunctions (without it, they are run on one core)
+openmp_compile_args = []
+openmp_link_args = []
+if sys.platform.startswith('linux'):
+    openmp_compile_args = ['-fopenmp']
+    openmp_link_args = ['-fopenmp']
+elif sys.platform == 'win32':
+    openmp_compile_args = ['/openmp']
+
+
 # Cython modules which will be compiled on setup
 cython_modules = [
     Extension('RMS.Astrometry.CyFunctions', sources=['RMS/Astrometry/CyFunctions.pyx'], \
-        include_dirs=[numpy.get_include()]),
+        include_dirs=[numpy.get_include()], extra_compile_args=openmp_compile_args, \
+        extra_link_args=openmp_link_args),
     Extension('RMS.Routines.BinImageCy', sources=['RMS/Routines/BinImageCy.pyx'], \
         include_dirs=[numpy.get_include()]),
     Extension('RMS.Routines.DynamicFTPCompressionCy', sources=['RMS/Routines/DynamicFTPCompressionCy.pyx'], \
@@ -84,7 +95,8 @@ setup (name = "RMS",
         setup_requires=["numpy", 
         # Setuptools 18.0 properly handles Cython extensions.
             'setuptools>=18.0',
-            'cython'],
+        # Cython 0.29.31 is the first version which supports noexcept functions.
+            'cython>=0.29.31'],
         install_requires=requirements,
         data_files=[(os.path.join('Catalogs'), catalog_files)],
         ext_modules = [kht_module] + cythonize(cython_modules),